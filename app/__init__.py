@@ -30,6 +30,7 @@ from app.clients.email.aws_ses_stub import AwsSesStubClient
 from app.clients.sms.firetext import FiretextClient
 from app.clients.sms.mmg import MMGClient
 from app.clients.performance_platform.performance_platform_client import PerformancePlatformClient
+from app.notifications.simulated_recipients import SimulatedRecipients
 
 
 class SQLAlchemy(_SQLAlchemy):
@@ -59,6 +60,7 @@ redis_store = RedisClient()
 performance_platform_client = PerformancePlatformClient()
 cbc_proxy_client = CBCProxyClient()
 document_download_client = DocumentDownloadClient()
+simulated_recipients = SimulatedRecipients()
 metrics = GDSMetrics()
 
 notification_provider_clients = NotificationProviderClients()
@@ -94,7 +96,12 @@ def create_app(application):
     firetext_client.init_app(application, statsd_client=statsd_client)
     mmg_client.init_app(application, statsd_client=statsd_client)
 
-    aws_ses_client.init_app(application.config['AWS_REGION'], statsd_client=statsd_client)
+    aws_ses_client.init_app(
+        application.config['AWS_REGION'],
+        statsd_client=statsd_client,
+        redis_client=redis_store,
+        max_send_rate=application.config['AWS_SES_MAX_SEND_RATE'],
+    )
     aws_ses_stub_client.init_app(
         application.config['AWS_REGION'],
         statsd_client=statsd_client,
@@ -109,6 +116,7 @@ def create_app(application):
     redis_store.init_app(application)
     performance_platform_client.init_app(application)
     document_download_client.init_app(application)
+    simulated_recipients.init_app(application)
 
     cbc_proxy_client.init_app(application)
 
@@ -287,7 +295,10 @@ def init_app(app):
 
     @app.after_request
     def after_request(response):
+        from app.daily_limit import release_daily_limit_for_failed_request
+
         CONCURRENT_REQUESTS.dec()
+        release_daily_limit_for_failed_request(response)
 
         response.headers.add('Access-Control-Allow-Origin', '*')
         response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
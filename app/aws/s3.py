@@ -1,3 +1,7 @@
+import codecs
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
 from flask import current_app
 
 from boto3 import client, resource
@@ -5,6 +9,9 @@ import botocore
 
 FILE_LOCATION_STRUCTURE = 'service-{}-notify/{}.csv'
 
+# the most keys S3 will delete in one DeleteObjects request
+MAX_KEYS_PER_DELETE = 1000
+
 
 def get_s3_file(bucket_name, file_location):
     s3_file = get_s3_object(bucket_name, file_location)
@@ -48,8 +55,17 @@ def get_contact_list_location(service_id, contact_list_id):
 
 
 def get_job_and_metadata_from_s3(service_id, job_id):
-    obj = get_s3_object(*get_job_location(service_id, job_id))
-    return obj.get()['Body'].read().decode('utf-8'), obj.get()['Metadata']
+    response = get_s3_object(*get_job_location(service_id, job_id)).get()
+    return response['Body'].read().decode('utf-8'), response['Metadata']
+
+
+def get_job_stream_and_metadata_from_s3(service_id, job_id):
+    """
+    Returns the job's CSV as a text stream that is decoded as it is read, rather than downloading the whole file
+    into memory, along with the metadata from the same GET request.
+    """
+    response = get_s3_object(*get_job_location(service_id, job_id)).get()
+    return codecs.getreader('utf-8')(response['Body']), response['Metadata']
 
 
 def get_job_from_s3(service_id, job_id):
@@ -58,8 +74,7 @@ def get_job_from_s3(service_id, job_id):
 
 
 def get_job_metadata_from_s3(service_id, job_id):
-    obj = get_s3_object(*get_job_location(service_id, job_id))
-    return obj.get()['Metadata']
+    return head_s3_object(*get_job_location(service_id, job_id))['Metadata']
 
 
 def remove_job_from_s3(service_id, job_id):
@@ -91,6 +106,60 @@ def remove_s3_object(bucket_name, object_key):
     return obj.delete()
 
 
+def remove_s3_objects_by_prefix(bucket_name, prefixes, max_workers=10):
+    """
+    Deletes every object in the bucket whose key starts with one of `prefixes`, which can be any iterable.
+
+    Prefixes are listed `max_workers` at a time and the keys found are deleted MAX_KEYS_PER_DELETE at a time.
+
+    Returns a list of (key or prefix, error message) for anything that couldn't be listed or deleted.
+    """
+    # clients can be shared between threads, but creating them can't
+    boto_client = client('s3', current_app.config['AWS_REGION'])
+    failures = []
+    keys_to_delete = []
+
+    def list_keys(prefix):
+        try:
+            return prefix, [
+                obj['Key']
+                for page in boto_client.get_paginator('list_objects_v2').paginate(Bucket=bucket_name, Prefix=prefix)
+                for obj in page.get('Contents', [])
+            ], None
+        except botocore.exceptions.ClientError as e:
+            return prefix, [], str(e)
+
+    def delete_keys(keys):
+        try:
+            response = boto_client.delete_objects(
+                Bucket=bucket_name,
+                Delete={'Objects': [{'Key': key} for key in keys], 'Quiet': True}
+            )
+        except botocore.exceptions.ClientError as e:
+            failures.extend((key, str(e)) for key in keys)
+        else:
+            failures.extend(
+                (error['Key'], error.get('Message', error.get('Code'))) for error in response.get('Errors', [])
+            )
+
+    prefixes = iter(prefixes)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # take the prefixes a chunk at a time so a long iterable isn't all queued up at once
+        for chunk in iter(lambda: list(islice(prefixes, MAX_KEYS_PER_DELETE)), []):
+            for prefix, keys, error in executor.map(list_keys, chunk):
+                if error:
+                    failures.append((prefix, error))
+                keys_to_delete.extend(keys)
+                while len(keys_to_delete) >= MAX_KEYS_PER_DELETE:
+                    delete_keys(keys_to_delete[:MAX_KEYS_PER_DELETE])
+                    del keys_to_delete[:MAX_KEYS_PER_DELETE]
+
+    if keys_to_delete:
+        delete_keys(keys_to_delete)
+
+    return failures
+
+
 def get_list_of_files_by_suffix(bucket_name, subfolder='', suffix='', last_modified=None):
     s3_client = client('s3', current_app.config['AWS_REGION'])
     paginator = s3_client.get_paginator('list_objects_v2')
@@ -1,3 +1,4 @@
+from collections import defaultdict
 from datetime import datetime, timedelta
 
 import iso8601
@@ -6,23 +7,33 @@ from flask import current_app, json
 from notifications_utils.statsd_decorators import statsd
 from sqlalchemy.orm.exc import NoResultFound
 
-from app import notify_celery, statsd_client
+from app import notify_celery, receipt_buffer, statsd_client
 from app.config import QueueNames
 from app.clients.email.aws_ses import get_aws_responses
 from app.dao import notifications_dao
 from app.models import NOTIFICATION_SENDING, NOTIFICATION_PENDING
+from app.notification_counts import record_notification_status_change, record_notification_status_changes
 
 from app.notifications.notifications_ses_callback import (
     determine_notification_bounce_type,
     handle_complaint,
     _check_and_queue_complaint_callback_task,
     _check_and_queue_callback_task,
+    _check_and_queue_callback_tasks,
 )
 
+SES_RESULTS_BUFFER_KEY = 'ses-results'
+# how long one run of process-buffered-ses-results keeps taking results off the buffer. A little under the task's
+# schedule, so runs don't often overlap
+BUFFERED_RESULTS_TIME_BUDGET_SECONDS = 8
+
 
 @notify_celery.task(bind=True, name="process-ses-result", max_retries=5, default_retry_delay=300)
 @statsd(namespace="tasks")
 def process_ses_results(self, response):
+    if _buffers_ses_results() and _add_to_ses_results_buffer(response):
+        return True
+
     try:
         ses_message = json.loads(response['Message'])
         notification_type = ses_message['notificationType']
@@ -31,7 +42,9 @@ def process_ses_results(self, response):
         if notification_type == 'Bounce':
             notification_type, bounce_message = determine_notification_bounce_type(notification_type, ses_message)
         elif notification_type == 'Complaint':
-            _check_and_queue_complaint_callback_task(*handle_complaint(ses_message))
+            complaint_details = handle_complaint(ses_message)
+            if complaint_details:
+                _check_and_queue_complaint_callback_task(*complaint_details)
             return True
 
         aws_response_dict = get_aws_responses(notification_type)
@@ -65,10 +78,12 @@ def process_ses_results(self, response):
             )
             return
         else:
+            previous_status = notification.status
             notifications_dao.dao_update_notifications_by_reference(
                 references=[reference],
                 update_dict={'status': notification_status}
             )
+            record_notification_status_change(notification, previous_status, notification_status)
 
         statsd_client.incr('callback.ses.{}'.format(notification_status))
 
@@ -85,3 +100,152 @@ def process_ses_results(self, response):
     except Exception as e:
         current_app.logger.exception('Error processing SES results: {}'.format(type(e)))
         self.retry(queue=QueueNames.RETRY)
+
+
+@notify_celery.task(name="process-buffered-ses-results")
+@statsd(namespace="tasks")
+def process_buffered_ses_results():
+    if not _buffers_ses_results():
+        return
+
+    receipt_buffer.drain(
+        SES_RESULTS_BUFFER_KEY,
+        current_app.config['SES_CALLBACK_BUFFER_BATCH_SIZE'],
+        BUFFERED_RESULTS_TIME_BUDGET_SECONDS,
+        lambda responses: process_ses_results_batch.apply_async(
+            [[json.loads(response) for response in responses]], queue=QueueNames.NOTIFY
+        ),
+    )
+
+
+def _buffers_ses_results():
+    return current_app.config['SES_CALLBACK_BUFFER_ENABLED'] and current_app.config['REDIS_ENABLED']
+
+
+def _add_to_ses_results_buffer(response):
+    try:
+        receipt_buffer.push(SES_RESULTS_BUFFER_KEY, json.dumps(response))
+    except Exception:
+        current_app.logger.exception('Could not buffer SES result, processing it on its own')
+        return False
+    return True
+
+
+@notify_celery.task(bind=True, name="process-ses-results-batch", max_retries=5, default_retry_delay=300)
+@statsd(namespace="tasks")
+def process_ses_results_batch(self, responses):
+    """
+    Process many SES notifications at once, as handed out by process-buffered-ses-results. Works like process_ses_results, but looks up all the references in
+    one query and updates all their statuses in one transaction rather than one per message. Complaints are handled
+    first, one at a time, and aren't retried once recorded. Messages for notifications we can't find yet are retried
+    on their own.
+    """
+    handled_complaints = set()
+    try:
+        receipts = {}
+        complaints = []
+        for index, response in enumerate(responses):
+            ses_message = json.loads(response['Message'])
+            notification_type = ses_message['notificationType']
+            bounce_message = None
+
+            if notification_type == 'Bounce':
+                notification_type, bounce_message = determine_notification_bounce_type(notification_type, ses_message)
+            elif notification_type == 'Complaint':
+                complaints.append((index, ses_message))
+                continue
+
+            reference = ses_message['mail']['messageId']
+            notification_status = get_aws_responses(notification_type)['notification_status']
+            if reference in receipts:
+                # only the first result for a notification can update it, so later ones are duplicates
+                current_app.logger.info(
+                    f"Duplicate SES result for reference: {reference} (update to {notification_status}) in batch"
+                )
+                continue
+            receipts[reference] = {
+                'response': response,
+                'notification_status': notification_status,
+                'bounce_message': bounce_message,
+                'timestamp': ses_message['mail']['timestamp'],
+            }
+
+        for index, ses_message in complaints:
+            complaint_details = handle_complaint(ses_message)
+            if complaint_details:
+                _check_and_queue_complaint_callback_task(*complaint_details)
+            handled_complaints.add(index)
+
+        if not receipts:
+            return True
+
+        notifications = notifications_dao.dao_get_notifications_or_history_by_references(list(receipts))
+        found_references = {notification.reference for notification in notifications}
+
+        responses_to_retry = []
+        for reference, receipt in receipts.items():
+            if reference in found_references:
+                continue
+            message_time = iso8601.parse_date(receipt['timestamp']).replace(tzinfo=None)
+            if datetime.utcnow() - message_time < timedelta(minutes=5):
+                current_app.logger.info(
+                    f"notification not found for reference: {reference} "
+                    f"(update to {receipt['notification_status']}). "
+                    f"Callback may have arrived before notification was persisted to the DB. Adding task to retry queue"
+                )
+                responses_to_retry.append(receipt['response'])
+            else:
+                current_app.logger.warning(
+                    f"notification not found for reference: {reference} (update to {receipt['notification_status']})"
+                )
+
+        references_by_status = defaultdict(list)
+        for notification in notifications:
+            receipt = receipts[notification.reference]
+            if receipt['bounce_message']:
+                current_app.logger.info(
+                    f"SES bounce for notification ID {notification.id}: {receipt['bounce_message']}"
+                )
+            if notification.status not in [NOTIFICATION_SENDING, NOTIFICATION_PENDING]:
+                notifications_dao._duplicate_update_warning(
+                    notification=notification,
+                    status=receipt['notification_status']
+                )
+                continue
+            references_by_status[receipt['notification_status']].append(notification.reference)
+
+        if references_by_status:
+            previous_statuses = {notification.reference: notification.status for notification in notifications}
+            notifications_dao.dao_update_notification_statuses_by_reference(references_by_status)
+
+            for notification_status, references in references_by_status.items():
+                statsd_client.incr('callback.ses.{}'.format(notification_status), count=len(references))
+
+            # reload the updated notifications (the update has expired them) with their new statuses in one go
+            updated_notifications = notifications_dao.dao_get_notifications_or_history_by_references(
+                [reference for references in references_by_status.values() for reference in references]
+            )
+            for notification in updated_notifications:
+                if notification.sent_at:
+                    statsd_client.timing_with_dates(
+                        'callback.ses.elapsed-time', datetime.utcnow(), notification.sent_at
+                    )
+            record_notification_status_changes(
+                (notification, previous_statuses[notification.reference]) for notification in updated_notifications
+            )
+            _check_and_queue_callback_tasks(updated_notifications)
+
+        if responses_to_retry:
+            self.retry(args=[responses_to_retry], queue=QueueNames.RETRY)
+
+        return True
+
+    except Retry:
+        raise
+
+    except Exception as e:
+        current_app.logger.exception('Error processing SES results batch: {}'.format(type(e)))
+        self.retry(
+            args=[[response for index, response in enumerate(responses) if index not in handled_complaints]],
+            queue=QueueNames.RETRY
+        )
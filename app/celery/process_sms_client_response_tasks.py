@@ -1,11 +1,13 @@
+import json
 import uuid
+from collections import Counter
 from datetime import datetime
 
 from flask import current_app
 from notifications_utils.statsd_decorators import statsd
 from notifications_utils.template import SMSMessageTemplate
 
-from app import notify_celery, statsd_client
+from app import notify_celery, receipt_buffer, statsd_client
 from app.clients import ClientException
 from app.clients.sms.firetext import get_firetext_responses
 from app.clients.sms.mmg import get_mmg_responses
@@ -16,6 +18,11 @@ from app.dao.service_callback_api_dao import get_service_delivery_status_callbac
 from app.dao.templates_dao import dao_get_template_by_id
 from app.models import NOTIFICATION_PENDING
 
+SMS_CLIENT_RESPONSE_BUFFER_KEY = 'sms-client-responses'
+# how long one run of process-buffered-sms-client-responses keeps taking receipts off the buffer. A little under the
+# task's schedule, so runs don't often overlap and a worker isn't held for ever while receipts keep arriving
+BUFFERED_RESPONSES_TIME_BUDGET_SECONDS = 8
+
 sms_response_mapper = {
     'MMG': get_mmg_responses,
     'Firetext': get_firetext_responses
@@ -68,6 +75,10 @@ def _process_for_status(notification_status, client_name, provider_reference, de
     if not notification:
         return
 
+    _process_updated_notification(notification, notification_status, client_name)
+
+
+def _process_updated_notification(notification, notification_status, client_name, service_callback_apis=None):
     statsd_client.incr('callback.{}.{}'.format(client_name.lower(), notification_status))
 
     if notification.sent_at:
@@ -91,9 +102,111 @@ def _process_for_status(notification_status, client_name, provider_reference, de
         notifications_dao.dao_update_notification(notification)
 
     if notification_status != NOTIFICATION_PENDING:
-        service_callback_api = get_service_delivery_status_callback_api_for_service(service_id=notification.service_id)
+        # service_callback_apis lets a batch of receipts look up each service's callback api only once
+        if service_callback_apis is None:
+            service_callback_api = get_service_delivery_status_callback_api_for_service(
+                service_id=notification.service_id
+            )
+        else:
+            if notification.service_id not in service_callback_apis:
+                service_callback_apis[notification.service_id] = get_service_delivery_status_callback_api_for_service(
+                    service_id=notification.service_id
+                )
+            service_callback_api = service_callback_apis[notification.service_id]
         # queue callback task only if the service_callback_api exists
         if service_callback_api:
             encrypted_notification = create_delivery_status_callback_data(notification, service_callback_api)
             send_delivery_status_to_service.apply_async([str(notification.id), encrypted_notification],
                                                         queue=QueueNames.CALLBACKS)
+
+
+def buffer_sms_client_response(status, provider_reference, client_name, detailed_status_code=None):
+    receipt_buffer.push(SMS_CLIENT_RESPONSE_BUFFER_KEY, json.dumps({
+        'status': status,
+        'provider_reference': provider_reference,
+        'client_name': client_name,
+        'detailed_status_code': detailed_status_code,
+    }))
+
+
+@notify_celery.task(name="process-buffered-sms-client-responses")
+@statsd(namespace="tasks")
+def process_buffered_sms_client_responses():
+    if not (current_app.config['SMS_CALLBACK_BUFFER_ENABLED'] and current_app.config['REDIS_ENABLED']):
+        return
+
+    # receipts that get applied twice, because their batch was put back, are ignored second time round as their
+    # notifications are no longer in an updatable state
+    receipt_buffer.drain(
+        SMS_CLIENT_RESPONSE_BUFFER_KEY,
+        current_app.config['SMS_CALLBACK_BUFFER_BATCH_SIZE'],
+        BUFFERED_RESPONSES_TIME_BUDGET_SECONDS,
+        lambda responses: process_sms_client_responses([json.loads(response) for response in responses]),
+    )
+
+
+def process_sms_client_responses(responses):
+    """
+    Apply a batch of delivery receipts, each a dict of the process_sms_client_response arguments.
+
+    Receipts are grouped into rounds that each hold at most one receipt per notification, so a notification
+    that got (for example) pending then delivered is updated in the order the receipts arrived.
+    """
+    rounds = []
+    receipts_seen = Counter()
+    for response in responses:
+        receipt = _parse_sms_client_response(**response)
+        if not receipt:
+            continue
+        round_number = receipts_seen[receipt['provider_reference']]
+        receipts_seen[receipt['provider_reference']] += 1
+        if round_number == len(rounds):
+            rounds.append([])
+        rounds[round_number].append(receipt)
+
+    service_callback_apis = {}
+    for receipts in rounds:
+        receipts_by_id = {receipt['provider_reference']: receipt for receipt in receipts}
+        notifications = notifications_dao.dao_update_notification_statuses_by_id([
+            (
+                receipt['provider_reference'],
+                receipt['notification_status'],
+                receipt['client_name'].lower(),
+                receipt['detailed_status_code'],
+            )
+            for receipt in receipts
+        ])
+        for notification in notifications:
+            receipt = receipts_by_id[str(notification.id)]
+            _process_updated_notification(
+                notification,
+                receipt['notification_status'],
+                receipt['client_name'],
+                service_callback_apis=service_callback_apis,
+            )
+
+
+def _parse_sms_client_response(status, provider_reference, client_name, detailed_status_code=None):
+    try:
+        provider_reference = str(uuid.UUID(provider_reference, version=4))
+    except ValueError:
+        current_app.logger.exception(f'{client_name} callback with invalid reference {provider_reference}')
+        return None
+
+    response_parser = sms_response_mapper[client_name]
+    try:
+        notification_status, detailed_status = response_parser(status, detailed_status_code)
+        current_app.logger.info(
+            f'{client_name} callback returned status of {notification_status}'
+            f'({status}): {detailed_status}({detailed_status_code}) for reference: {provider_reference}'
+        )
+    except KeyError:
+        current_app.logger.exception(f'{client_name} callback failed: status {status} not found.')
+        notification_status, detailed_status_code = 'technical-failure', None
+
+    return {
+        'provider_reference': provider_reference,
+        'notification_status': notification_status,
+        'client_name': client_name,
+        'detailed_status_code': detailed_status_code,
+    }
@@ -77,3 +77,49 @@ def deliver_email(self, notification_id):
                       "Notification has been updated to technical-failure".format(notification_id)
             update_notification_status_by_id(notification_id, NOTIFICATION_TECHNICAL_FAILURE)
             raise NotificationTechnicalFailureException(message)
+
+
+@notify_celery.task(name="deliver-sms-batch")
+@statsd(namespace="tasks")
+def deliver_sms_batch(notification_ids):
+    _deliver_batch(notification_ids, send_to_providers.send_sms_batch_to_provider, deliver_sms)
+
+
+@notify_celery.task(name="deliver-email-batch")
+@statsd(namespace="tasks")
+def deliver_email_batch(notification_ids):
+    _deliver_batch(notification_ids, send_to_providers.send_email_batch_to_provider, deliver_email)
+
+
+def _deliver_batch(notification_ids, send_batch, deliver_task):
+    """
+    Notifications in the batch that couldn't be sent are put on the retry queue one at a time, where deliver_sms and
+    deliver_email take care of retrying them and of marking them as technical failures if they never go.
+
+    `send_batch` reports each notification it couldn't send or save, so the whole batch is only put on the retry queue
+    if the batch fails before any of it has been handed to a provider.
+    """
+    current_app.logger.info("Start sending batch of {} notifications".format(len(notification_ids)))
+    try:
+        notifications = notifications_dao.dao_get_notifications_by_ids(notification_ids)
+        failures = send_batch(notifications)
+    except Exception:
+        current_app.logger.exception(
+            "Batch delivery failed for notifications {}, sending them one at a time".format(notification_ids)
+        )
+        retry_ids = list(notification_ids)
+    else:
+        found_ids = {str(notification.id) for notification in notifications}
+        retry_ids = [notification_id for notification_id in notification_ids if notification_id not in found_ids]
+        for notification, exception in failures:
+            if isinstance(exception, EmailClientNonRetryableException):
+                current_app.logger.error(f"Email notification {notification.id} failed: {exception}")
+                update_notification_status_by_id(notification.id, NOTIFICATION_TECHNICAL_FAILURE)
+            else:
+                current_app.logger.warning(
+                    f"RETRY: {notification.notification_type} notification {notification.id} failed: {exception}"
+                )
+                retry_ids.append(str(notification.id))
+
+    for notification_id in retry_ids:
+        deliver_task.apply_async([notification_id], queue=QueueNames.RETRY)
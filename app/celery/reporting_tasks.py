@@ -9,9 +9,9 @@ from app.config import QueueNames
 from app.cronitor import cronitor
 from app.dao.fact_billing_dao import (
     fetch_billing_data_for_day,
-    update_fact_billing
+    update_fact_billing_for_day
 )
-from app.dao.fact_notification_status_dao import fetch_notification_status_for_day, update_fact_notification_status
+from app.dao.fact_notification_status_dao import rebuild_fact_notification_status_for_day
 from app.models import (
     SMS_TYPE,
     EMAIL_TYPE,
@@ -59,8 +59,7 @@ def create_nightly_billing_for_day(process_day):
         f'create-nightly-billing-for-day task for {process_day}: data fetched in {(end - start).seconds} seconds'
     )
 
-    for data in transit_data:
-        update_fact_billing(data, process_day)
+    update_fact_billing_for_day(transit_data, process_day)
 
     current_app.logger.info(
         f"create-nightly-billing-for-day task for {process_day}: "
@@ -109,16 +108,12 @@ def create_nightly_notification_status_for_day(process_day, notification_type):
     )
 
     start = datetime.utcnow()
-    transit_data = fetch_notification_status_for_day(process_day=process_day, notification_type=notification_type)
-    end = datetime.utcnow()
-    current_app.logger.info(
-        f'create-nightly-notification-status-for-day task for {process_day} type {notification_type}: '
-        f'data fetched in {(end - start).seconds} seconds'
+    rows_inserted = rebuild_fact_notification_status_for_day(
+        process_day=process_day, notification_type=notification_type
     )
-
-    update_fact_notification_status(transit_data, process_day, notification_type)
+    end = datetime.utcnow()
 
     current_app.logger.info(
         f'create-nightly-notification-status-for-day task for {process_day} type {notification_type}: '
-        f'task complete - {len(transit_data)} rows updated'
+        f'task complete in {(end - start).seconds} seconds - {rows_inserted} rows updated'
     )
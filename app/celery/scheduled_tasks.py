@@ -7,6 +7,7 @@ from datetime import (
 
 from flask import current_app
 from notifications_utils.statsd_decorators import statsd
+from notifications_utils.timezones import convert_utc_to_bst
 from sqlalchemy import and_
 from sqlalchemy.exc import SQLAlchemyError
 
@@ -19,6 +20,7 @@ from app.celery.tasks import (
 from app.celery.letters_pdf_tasks import get_pdf_for_templated_letter
 from app.celery.broadcast_message_tasks import trigger_link_test
 from app.config import QueueNames
+from app.dao.fact_notification_status_dao import fetch_notification_counts_for_today
 from app.dao.invited_org_user_dao import delete_org_invitations_created_more_than_two_days_ago
 from app.dao.invited_user_dao import delete_invitations_created_more_than_two_days_ago
 from app.dao.jobs_dao import (
@@ -47,6 +49,7 @@ from app.models import (
     SMS_TYPE,
     EMAIL_TYPE,
 )
+from app.notification_counts import set_notification_counts_for_day
 from app.notifications.process_notifications import send_notification_to_queue
 
 
@@ -310,3 +313,14 @@ def trigger_link_tests():
     if current_app.config['CBC_PROXY_ENABLED']:
         for cbc_name in current_app.config['ENABLED_CBCS']:
             trigger_link_test.apply_async(kwargs={'provider': cbc_name}, queue=QueueNames.BROADCASTS)
+
+
+@notify_celery.task(name="reconcile-notification-counts")
+@statsd(namespace="tasks")
+def reconcile_notification_counts():
+    if not current_app.config['REDIS_ENABLED']:
+        return
+    today = convert_utc_to_bst(datetime.utcnow()).date()
+    counts = fetch_notification_counts_for_today()
+    set_notification_counts_for_day(today, counts)
+    current_app.logger.info(f"Reconciled notification counts for {today}: {len(counts)} counts")
@@ -1,47 +1,54 @@
-import json
-
 from flask import current_app
 from notifications_utils.statsd_decorators import statsd
-from requests import (
-    HTTPError,
-    request,
-    RequestException
-)
+from requests import RequestException
 
-from app import encryption, notify_celery
+from app import encryption, notify_celery, redis_store
 from app.config import QueueNames
+from app.service_callback_dispatcher import (
+    CallbackDeferred,
+    callback_dispatcher,
+    counts_as_failure,
+)
 from app.utils import DATETIME_FORMAT
 
+MAX_DELIVERY_STATUS_BATCHES_PER_RUN = 10
+# how many times a callback can be put back on the queue without being attempted before it starts using up its retries
+MAX_CALLBACK_DEFERRALS = 120
+
+
+def delivery_status_batch_key(service_id):
+    return 'service-callback-batch-{}'.format(service_id)
+
 
 @notify_celery.task(bind=True, name="send-delivery-status", max_retries=5, default_retry_delay=300)
 @statsd(namespace="tasks")
 def send_delivery_status_to_service(
-    self, notification_id, encrypted_status_update
+    self, notification_id, encrypted_status_update, deferrals=0
 ):
     status_update = encryption.decrypt(encrypted_status_update)
+    # status updates queued before service_id was added to them don't have it
+    service_id = status_update.get('service_id')
+
+    if _sends_delivery_statuses_in_batches(service_id) and _add_to_delivery_status_batch(
+        service_id, encrypted_status_update
+    ):
+        return
 
-    data = {
-        "id": str(notification_id),
-        "reference": status_update['notification_client_reference'],
-        "to": status_update['notification_to'],
-        "status": status_update['notification_status'],
-        "created_at": status_update['notification_created_at'],
-        "completed_at": status_update['notification_updated_at'],
-        "sent_at": status_update['notification_sent_at'],
-        "notification_type": status_update['notification_type']
-    }
     _send_data_to_service_callback_api(
         self,
-        data,
+        _delivery_status_data(notification_id, status_update),
         status_update['service_callback_api_url'],
         status_update['service_callback_api_bearer_token'],
-        'send_delivery_status_to_service'
+        'send_delivery_status_to_service',
+        service_id=service_id,
+        task_args=[notification_id, encrypted_status_update],
+        deferrals=deferrals,
     )
 
 
 @notify_celery.task(bind=True, name="send-complaint", max_retries=5, default_retry_delay=300)
 @statsd(namespace="tasks")
-def send_complaint_to_service(self, complaint_data):
+def send_complaint_to_service(self, complaint_data, deferrals=0):
     complaint = encryption.decrypt(complaint_data)
 
     data = {
@@ -57,30 +64,138 @@ def send_complaint_to_service(self, complaint_data):
         data,
         complaint['service_callback_api_url'],
         complaint['service_callback_api_bearer_token'],
-        'send_complaint_to_service'
+        'send_complaint_to_service',
+        service_id=complaint.get('service_id'),
+        task_args=[complaint_data],
+        deferrals=deferrals,
     )
 
 
-def _send_data_to_service_callback_api(self, data, service_callback_url, token, function_name):
-    notification_id = (data["notification_id"] if "notification_id" in data else data["id"])
+@notify_celery.task(name="send-batched-delivery-statuses")
+@statsd(namespace="tasks")
+def send_batched_delivery_statuses():
+    if not current_app.config['REDIS_ENABLED']:
+        return
+
+    for service_id in current_app.config['SERVICE_CALLBACK_BATCH_SERVICES']:
+        try:
+            _send_batched_delivery_statuses_for_service(service_id)
+        except Exception:
+            current_app.logger.exception(
+                'Failed to send batched delivery statuses for service {}'.format(service_id)
+            )
+
+
+def _send_batched_delivery_statuses_for_service(service_id):
+    key = delivery_status_batch_key(service_id)
+    batch_size = current_app.config['SERVICE_CALLBACK_BATCH_SIZE']
+    for _ in range(MAX_DELIVERY_STATUS_BATCHES_PER_RUN):
+        encrypted_status_updates = _pop_delivery_status_batch(key, batch_size)
+        if not encrypted_status_updates:
+            return
+
+        status_updates = [encryption.decrypt(update) for update in encrypted_status_updates]
+        # if the service changed its callback api while updates were waiting, they all go to the new one
+        latest = status_updates[-1]
+        try:
+            callback_dispatcher.send(
+                service_id,
+                latest['service_callback_api_url'],
+                latest['service_callback_api_bearer_token'],
+                [_delivery_status_data(update['notification_id'], update) for update in status_updates],
+            )
+        except (CallbackDeferred, RequestException) as e:
+            if isinstance(e, CallbackDeferred) or counts_as_failure(e):
+                # back on the front of the list, so they're still sent in the order they happened
+                redis_store.redis_store.lpush(key, *reversed(encrypted_status_updates))
+                current_app.logger.warning(
+                    'Batch of {} delivery statuses for service {} will be retried. exception: {}'.format(
+                        len(encrypted_status_updates), service_id, e
+                    )
+                )
+            else:
+                current_app.logger.warning(
+                    'Batch of {} delivery statuses for service {} is not being retried. exception: {}'.format(
+                        len(encrypted_status_updates), service_id, e
+                    )
+                )
+            return
+
+        current_app.logger.info('Sent batch of {} delivery statuses to service {}'.format(
+            len(encrypted_status_updates), service_id
+        ))
+        if len(encrypted_status_updates) < batch_size:
+            return
+
+
+def _pop_delivery_status_batch(key, count):
+    pipe = redis_store.redis_store.pipeline()
+    pipe.lrange(key, 0, count - 1)
+    pipe.ltrim(key, count, -1)
+    status_updates, _ = pipe.execute()
+    return status_updates
+
+
+def _sends_delivery_statuses_in_batches(service_id):
+    return (
+        current_app.config['REDIS_ENABLED']
+        and service_id is not None
+        and service_id in current_app.config['SERVICE_CALLBACK_BATCH_SERVICES']
+    )
+
+
+def _add_to_delivery_status_batch(service_id, encrypted_status_update):
     try:
-        response = request(
-            method="POST",
-            url=service_callback_url,
-            data=json.dumps(data),
-            headers={
-                'Content-Type': 'application/json',
-                'Authorization': 'Bearer {}'.format(token)
-            },
-            timeout=60
+        redis_store.redis_store.rpush(delivery_status_batch_key(service_id), encrypted_status_update)
+    except Exception:
+        current_app.logger.exception(
+            'Could not batch delivery status for service {}, sending it on its own'.format(service_id)
         )
+        return False
+    return True
+
+
+def _delivery_status_data(notification_id, status_update):
+    return {
+        "id": str(notification_id),
+        "reference": status_update['notification_client_reference'],
+        "to": status_update['notification_to'],
+        "status": status_update['notification_status'],
+        "created_at": status_update['notification_created_at'],
+        "completed_at": status_update['notification_updated_at'],
+        "sent_at": status_update['notification_sent_at'],
+        "notification_type": status_update['notification_type']
+    }
+
+
+def _send_data_to_service_callback_api(
+    self, data, service_callback_url, token, function_name, service_id=None, task_args=(), deferrals=0
+):
+    notification_id = (data["notification_id"] if "notification_id" in data else data["id"])
+    try:
+        response = callback_dispatcher.send(service_id or service_callback_url, service_callback_url, token, data)
         current_app.logger.info('{} sending {} to {}, response {}'.format(
             function_name,
             notification_id,
             service_callback_url,
             response.status_code
         ))
-        response.raise_for_status()
+    except CallbackDeferred as e:
+        current_app.logger.info(
+            "{} deferred for notification_id: {} and url: {}. {}".format(
+                function_name,
+                notification_id,
+                service_callback_url,
+                e
+            )
+        )
+        if deferrals < MAX_CALLBACK_DEFERRALS:
+            self.apply_async(
+                task_args, {'deferrals': deferrals + 1}, queue=QueueNames.CALLBACKS, countdown=e.countdown
+            )
+        else:
+            # it's been held back for a long time, so start counting it against the callback's retries
+            _retry(self, function_name, service_callback_url, notification_id, countdown=e.countdown)
     except RequestException as e:
         current_app.logger.warning(
             "{} request failed for notification_id: {} and url: {}. exception: {}".format(
@@ -90,17 +205,8 @@ def _send_data_to_service_callback_api(self, data, service_callback_url, token,
                 e
             )
         )
-        if not isinstance(e, HTTPError) or e.response.status_code >= 500:
-            try:
-                self.retry(queue=QueueNames.RETRY)
-            except self.MaxRetriesExceededError:
-                current_app.logger.warning(
-                    "Retry: {} has retried the max num of times for callback url {} and notification_id: {}".format(
-                        function_name,
-                        service_callback_url,
-                        notification_id
-                    )
-                )
+        if counts_as_failure(e):
+            _retry(self, function_name, service_callback_url, notification_id)
         else:
             current_app.logger.warning(
                 "{} callback is not being retried for notification_id: {} and url: {}. exception: {}".format(
@@ -112,6 +218,19 @@ def _send_data_to_service_callback_api(self, data, service_callback_url, token,
             )
 
 
+def _retry(self, function_name, service_callback_url, notification_id, countdown=None):
+    try:
+        self.retry(queue=QueueNames.RETRY, countdown=countdown)
+    except self.MaxRetriesExceededError:
+        current_app.logger.warning(
+            "Retry: {} has retried the max num of times for callback url {} and notification_id: {}".format(
+                function_name,
+                service_callback_url,
+                notification_id
+            )
+        )
+
+
 def create_delivery_status_callback_data(notification, service_callback_api):
     data = {
         "notification_id": str(notification.id),
@@ -125,6 +244,7 @@ def create_delivery_status_callback_data(notification, service_callback_api):
         "notification_type": notification.notification_type,
         "service_callback_api_url": service_callback_api.url,
         "service_callback_api_bearer_token": service_callback_api.bearer_token,
+        "service_id": str(service_callback_api.service_id),
     }
     return encryption.encrypt(data)
 
@@ -138,5 +258,6 @@ def create_complaint_callback_data(complaint, notification, service_callback_api
         "complaint_date": complaint.complaint_date.strftime(DATETIME_FORMAT),
         "service_callback_api_url": service_callback_api.url,
         "service_callback_api_bearer_token": service_callback_api.bearer_token,
+        "service_id": str(service_callback_api.service_id),
     }
     return encryption.encrypt(data)
@@ -1,4 +1,7 @@
+import csv
+import itertools
 import json
+import math
 from datetime import datetime
 from collections import namedtuple, defaultdict
 
@@ -24,16 +27,19 @@ from app import (
 from app.aws import s3
 from app.celery import provider_tasks, letters_pdf_tasks, research_mode_tasks
 from app.config import QueueNames
+from app.daily_limit import reserve_daily_limit
 from app.dao.daily_sorted_letter_dao import dao_create_or_update_daily_sorted_letter
 from app.dao.inbound_sms_dao import dao_get_inbound_sms_by_id
 from app.dao.jobs_dao import (
     dao_update_job,
     dao_get_job_by_id,
+    dao_record_job_shard_completed,
 )
 from app.dao.notifications_dao import (
     get_notification_by_id,
     dao_update_notifications_by_reference,
     dao_get_last_notification_added_for_job_id,
+    dao_get_last_row_number_added_for_job_rows,
     update_notification_status_by_reference,
     dao_get_notification_or_history_by_reference,
 )
@@ -63,7 +69,11 @@ from app.models import (
     SMS_TYPE,
     DailySortedLetter,
 )
-from app.notifications.process_notifications import persist_notification
+from app.notifications.process_notifications import (
+    build_notification,
+    persist_notification,
+    persist_notifications,
+)
 from app.service.utils import service_allowed_to_send_to
 from app.serialised_models import SerialisedService, SerialisedTemplate
 from app.utils import DATETIME_FORMAT
@@ -95,16 +105,75 @@ def process_job(job_id, sender_id=None):
     job.processing_started = start
     dao_update_job(job)
 
-    recipient_csv, template, sender_id = get_recipient_csv_and_template_and_sender_id(job)
+    shard_count = get_job_shard_count(job)
+    if shard_count > 1:
+        start_job_shards(job, shard_count)
+        return
+
+    recipient_rows, template, sender_id = get_recipient_rows_and_template_and_sender_id(job)
 
     current_app.logger.info("Starting job {} processing {} notifications".format(job_id, job.notification_count))
 
-    for row in recipient_csv.get_rows():
-        process_row(row, template, job, service, sender_id=sender_id)
+    process_rows(recipient_rows, template, job, service, sender_id=sender_id)
 
     job_complete(job, start=start)
 
 
+def get_job_shard_count(job):
+    rows_per_shard = current_app.config['JOB_ROWS_PER_SHARD']
+    if not rows_per_shard or job.notification_count <= rows_per_shard:
+        return 1
+    return math.ceil(job.notification_count / rows_per_shard)
+
+
+def get_job_shard_row_range(job, shard_number):
+    rows_per_shard = math.ceil(job.notification_count / job.shard_count)
+    start_row = shard_number * rows_per_shard
+    # the last shard is left open ended so no rows are missed if the file has more than notification_count
+    end_row = start_row + rows_per_shard if shard_number < job.shard_count - 1 else None
+    return start_row, end_row
+
+
+def start_job_shards(job, shard_count):
+    job.shard_count = shard_count
+    job.completed_shards = []
+    dao_update_job(job)
+
+    current_app.logger.info("Starting job {} processing {} notifications in {} shards".format(
+        job.id, job.notification_count, shard_count
+    ))
+
+    for shard_number in range(shard_count):
+        process_job_shard.apply_async([str(job.id), shard_number], queue=QueueNames.JOBS)
+
+
+@notify_celery.task(name="process-job-shard")
+@statsd(namespace="tasks")
+def process_job_shard(job_id, shard_number, resume_from_row=None):
+    job = dao_get_job_by_id(job_id)
+
+    if job.job_status != JOB_STATUS_IN_PROGRESS:
+        current_app.logger.info("Not processing shard {} of job {} with status: {}".format(
+            shard_number, job_id, job.job_status
+        ))
+        return
+
+    start_row, end_row = get_job_shard_row_range(job, shard_number)
+    if resume_from_row is not None:
+        start_row = resume_from_row + 1
+
+    current_app.logger.info("Starting shard {} of job {} from row {} to {}".format(
+        shard_number, job_id, start_row, end_row
+    ))
+
+    shard_rows, template, sender_id = get_recipient_rows_and_template_and_sender_id(job, start_row, end_row)
+
+    process_rows(shard_rows, template, job, job.service, sender_id=sender_id)
+
+    if dao_record_job_shard_completed(job.id, shard_number) == job.shard_count:
+        job_complete(job, resumed=resume_from_row is not None, start=job.processing_started)
+
+
 def job_complete(job, resumed=False, start=None):
     job.job_status = JOB_STATUS_FINISHED
 
@@ -132,6 +201,70 @@ def get_recipient_csv_and_template_and_sender_id(job):
     return recipient_csv, template, meta_data.get("sender_id")
 
 
+def get_recipient_rows_and_template_and_sender_id(job, start_row=0, end_row=None):
+    db_template = dao_get_template_by_id(job.template_id, job.template_version)
+    template = db_template._as_utils_template()
+
+    csv_stream, meta_data = s3.get_job_stream_and_metadata_from_s3(service_id=str(job.service_id), job_id=str(job.id))
+
+    return (
+        stream_recipient_rows(csv_stream, template, start_row=start_row, end_row=end_row),
+        template,
+        meta_data.get("sender_id"),
+    )
+
+
+def stream_recipient_rows(csv_stream, template, rows_per_chunk=1000, start_row=0, end_row=None):
+    """
+    Yields the rows of a job's CSV file without holding the whole file in memory. The file is read
+    `rows_per_chunk` rows at a time and each chunk's raw text is given its own RecipientCSV, with row
+    indexes carrying on from the previous chunks so they match those of the whole file.
+
+    Only rows from `start_row` up to (but not including) `end_row` are given. The lines before
+    `start_row` are skipped without being parsed into rows, and the file isn't read past `end_row`.
+    """
+    records = _csv_records(csv_stream)
+    column_headers = next((record for record in records if record.strip()), None)
+    if column_headers is None:
+        return
+
+    records = itertools.islice(records, start_row, end_row)
+    rows_so_far = start_row
+    while True:
+        lines = list(itertools.islice(records, rows_per_chunk))
+        if not lines:
+            return
+
+        # RecipientCSV strips trailing blank lines, so only let a chunk end on one where the file does
+        while not lines[-1].strip():
+            record = next(records, None)
+            if record is None:
+                break
+            lines.append(record)
+
+        for row in RecipientCSV(column_headers.lstrip() + ''.join(lines), template=template).get_rows():
+            row.index += rows_so_far
+            yield row
+        rows_so_far += len(lines)
+
+
+def _csv_records(csv_stream):
+    """
+    Yields the raw text of each record in a CSV file, unchanged. A record is usually one line, but a
+    quoted value can carry on over several.
+    """
+    lines = []
+
+    def read_lines():
+        for line in csv_stream:
+            lines.append(line)
+            yield line
+
+    for _ in csv.reader(read_lines(), quoting=csv.QUOTE_MINIMAL, skipinitialspace=True):
+        yield ''.join(lines)
+        lines.clear()
+
+
 def process_row(row, template, job, service, sender_id=None):
     template_type = template.template_type
     encrypted = encryption.encrypt({
@@ -168,10 +301,63 @@ def process_row(row, template, job, service, sender_id=None):
     return notification_id
 
 
+def process_rows(rows, template, job, service, sender_id=None):
+    batch_size = current_app.config['SAVE_NOTIFICATIONS_BATCH_SIZE']
+
+    if batch_size <= 1 or template.template_type == LETTER_TYPE:
+        for row in rows:
+            process_row(row, template, job, service, sender_id=sender_id)
+        return
+
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            process_row_batch(batch, template, job, service, sender_id=sender_id)
+            batch = []
+
+    if batch:
+        process_row_batch(batch, template, job, service, sender_id=sender_id)
+
+
+def process_row_batch(rows, template, job, service, sender_id=None):
+    encrypted = encryption.encrypt({
+        'template': str(template.id),
+        'template_version': job.template_version,
+        'job': str(job.id),
+        'notification_type': template.template_type,
+        'rows': [
+            {
+                'id': create_uuid(),
+                'to': row.recipient,
+                'row_number': row.index,
+                'personalisation': dict(row.personalisation)
+            }
+            for row in rows
+        ]
+    })
+
+    task_kwargs = {}
+    if sender_id:
+        task_kwargs['sender_id'] = sender_id
+
+    save_notifications_batch.apply_async(
+        (
+            str(service.id),
+            encrypted,
+        ),
+        task_kwargs,
+        queue=QueueNames.DATABASE if not service.research_mode else QueueNames.RESEARCH_MODE
+    )
+
+
 def __sending_limits_for_job_exceeded(service, job, job_id):
-    total_sent = fetch_todays_total_message_count(service.id)
+    # reserve the whole job in one go so that messages sent while it's processing can't take it over the limit
+    reserved, _ = reserve_daily_limit(service, job.notification_count)
+    if reserved is None:
+        reserved = fetch_todays_total_message_count(service.id) + job.notification_count <= service.message_limit
 
-    if total_sent + job.notification_count > service.message_limit:
+    if not reserved:
         job.job_status = 'sending limits exceeded'
         job.processing_finished = datetime.utcnow()
         dao_update_job(job)
@@ -294,6 +480,89 @@ def save_email(self,
         handle_exception(self, notification, notification_id, e)
 
 
+@notify_celery.task(bind=True, name="save-notifications-batch", max_retries=5, default_retry_delay=300)
+@statsd(namespace="tasks")
+def save_notifications_batch(self, service_id, encrypted_batch, sender_id=None):
+    batch = encryption.decrypt(encrypted_batch)
+    notification_type = batch['notification_type']
+
+    service = SerialisedService.from_id(service_id)
+    template = SerialisedTemplate.from_id_and_service_id(
+        batch['template'],
+        service_id=service.id,
+        version=batch['template_version'],
+    )
+
+    if notification_type == SMS_TYPE:
+        reply_to_text = dao_get_service_sms_senders_by_id(service_id, sender_id).sms_sender if sender_id \
+            else template.reply_to_text
+        provider_task = provider_tasks.deliver_sms
+        provider_batch_task = provider_tasks.deliver_sms_batch
+        queue = QueueNames.SEND_SMS
+    else:
+        reply_to_text = dao_get_reply_to_by_id(service_id, sender_id).email_address if sender_id \
+            else template.reply_to_text
+        provider_task = provider_tasks.deliver_email
+        provider_batch_task = provider_tasks.deliver_email_batch
+        queue = QueueNames.SEND_EMAIL
+
+    created_at = datetime.utcnow()
+    notifications = []
+    for row in batch['rows']:
+        if not service_allowed_to_send_to(row['to'], service, KEY_TYPE_NORMAL):
+            current_app.logger.info(
+                "{} {} failed as restricted service".format(notification_type, row['id'])
+            )
+            continue
+
+        notifications.append(build_notification(
+            template_id=batch['template'],
+            template_version=batch['template_version'],
+            recipient=row['to'],
+            service=service,
+            personalisation=row.get('personalisation'),
+            notification_type=notification_type,
+            api_key_id=None,
+            key_type=KEY_TYPE_NORMAL,
+            created_at=created_at,
+            job_id=batch['job'],
+            job_row_number=row['row_number'],
+            notification_id=row['id'],
+            reply_to_text=reply_to_text
+        ))
+
+    try:
+        inserted_ids = persist_notifications(notifications, service)
+    except SQLAlchemyError as e:
+        retry_msg = 'save-notifications-batch for job {} rows {} to {}'.format(
+            batch['job'], batch['rows'][0]['row_number'], batch['rows'][-1]['row_number']
+        )
+        current_app.logger.exception('Retry ' + retry_msg)
+        try:
+            self.retry(queue=QueueNames.RETRY, exc=e)
+        except self.MaxRetriesExceededError:
+            current_app.logger.error('Max retry failed ' + retry_msg)
+        return
+
+    queue = queue if not service.research_mode else QueueNames.RESEARCH_MODE
+    delivery_batch_size = current_app.config['DELIVERY_BATCH_SIZE']
+    if delivery_batch_size > 1:
+        for start in range(0, len(inserted_ids), delivery_batch_size):
+            provider_batch_task.apply_async(
+                [[str(notification_id) for notification_id in inserted_ids[start:start + delivery_batch_size]]],
+                queue=queue
+            )
+    else:
+        for notification_id in inserted_ids:
+            provider_task.apply_async([str(notification_id)], queue=queue)
+
+    current_app.logger.debug(
+        "{} {} notifications created at {} for job {}".format(
+            len(inserted_ids), notification_type, created_at, batch['job']
+        )
+    )
+
+
 @notify_celery.task(bind=True, name="save-api-email", max_retries=5, default_retry_delay=300)
 @statsd(namespace="tasks")
 def save_api_email(self, encrypted_notification):
@@ -646,6 +915,9 @@ def process_incomplete_jobs(job_ids):
 def process_incomplete_job(job_id):
     job = dao_get_job_by_id(job_id)
 
+    if job.shard_count:
+        return process_incomplete_job_shards(job)
+
     last_notification_added = dao_get_last_notification_added_for_job_id(job_id)
 
     if last_notification_added:
@@ -655,15 +927,48 @@ def process_incomplete_job(job_id):
 
     current_app.logger.info("Resuming job {} from row {}".format(job_id, resume_from_row))
 
-    recipient_csv, template, sender_id = get_recipient_csv_and_template_and_sender_id(job)
+    recipient_rows, template, sender_id = get_recipient_rows_and_template_and_sender_id(
+        job, start_row=resume_from_row + 1
+    )
 
-    for row in recipient_csv.get_rows():
-        if row.index > resume_from_row:
-            process_row(row, template, job, job.service, sender_id=sender_id)
+    process_rows(recipient_rows, template, job, job.service, sender_id=sender_id)
 
     job_complete(job, resumed=True)
 
 
+def process_incomplete_job_shards(job):
+    # Shards record themselves as finished by number, so a shard resumed here while it's in fact still running
+    # can't be counted twice or complete the job early
+    if len(job.completed_shards) == job.shard_count:
+        # the last shard stopped between recording that it had finished and completing the job
+        job_complete(job, resumed=True)
+        return
+
+    unfinished_shards = []
+    for shard_number in range(job.shard_count):
+        if shard_number in job.completed_shards:
+            continue
+
+        start_row, end_row = get_job_shard_row_range(job, shard_number)
+        expected_last_row = (end_row if end_row is not None else job.notification_count) - 1
+        last_row_added = dao_get_last_row_number_added_for_job_rows(job.id, start_row, end_row)
+
+        if start_row <= expected_last_row and (last_row_added is None or last_row_added < expected_last_row):
+            # The first row in the csv with a number is row 0, so start_row - 1 means nothing was added yet
+            unfinished_shards.append((shard_number, start_row - 1 if last_row_added is None else last_row_added))
+        elif dao_record_job_shard_completed(job.id, shard_number) == job.shard_count:
+            # all of the shard's rows were added, it just stopped before recording that it had finished
+            job_complete(job, resumed=True)
+
+    for shard_number, resume_from_row in unfinished_shards:
+        current_app.logger.info("Resuming shard {} of job {} from row {}".format(shard_number, job.id, resume_from_row))
+        process_job_shard.apply_async(
+            [str(job.id), shard_number],
+            {'resume_from_row': resume_from_row},
+            queue=QueueNames.JOBS
+        )
+
+
 @notify_celery.task(name='process-returned-letters-list')
 @statsd(namespace="tasks")
 def process_returned_letters_list(notification_references):
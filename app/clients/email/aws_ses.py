@@ -1,3 +1,6 @@
+import json
+import threading
+
 import boto3
 import botocore
 from flask import current_app
@@ -6,6 +9,7 @@ from notifications_utils.recipients import InvalidEmailError
 
 from app.clients import STATISTICS_DELIVERED, STATISTICS_FAILURE
 from app.clients.email import EmailClient, EmailClientException, EmailClientNonRetryableException
+from app.clients.email.send_rate_limiter import SendRateExceeded, SendRateLimiter
 
 ses_response_map = {
     'Permanent': {
@@ -52,11 +56,36 @@ class AwsSesClient(EmailClient):
     Amazon SES email client.
     '''
 
-    def init_app(self, region, statsd_client, *args, **kwargs):
+    # SendBulkTemplatedEmail takes at most 50 destinations
+    MAX_BULK_DESTINATIONS = 50
+    # each email's content is sent as template data, and SES limits the size of that JSON rather than of the content
+    MAX_BULK_TEMPLATE_DATA_SIZE = 256 * 1024
+    # a fixed pair of SES templates that only fill in the content they're given, so no template is ever made per
+    # email and there's nothing to clean up. Triple braces stop handlebars HTML escaping the content
+    BULK_TEMPLATES = {
+        False: {
+            'TemplateName': 'notify-bulk-email',
+            'SubjectPart': '{{{subject}}}',
+            'TextPart': '{{{body}}}',
+        },
+        True: {
+            'TemplateName': 'notify-bulk-email-html',
+            'SubjectPart': '{{{subject}}}',
+            'TextPart': '{{{body}}}',
+            'HtmlPart': '{{{html_body}}}',
+        },
+    }
+
+    def init_app(self, region, statsd_client, *args, redis_client=None, max_send_rate=0, **kwargs):
         self._client = boto3.client('ses', region_name=region)
         super(AwsSesClient, self).__init__(*args, **kwargs)
         self.name = 'ses'
         self.statsd_client = statsd_client
+        self.send_rate_limiter = SendRateLimiter(redis_client, 'ses-send-rate', max_send_rate)
+        self._bulk_templates = set()
+        self._bulk_templates_lock = threading.Lock()
+        # emails are sent from several threads at once by deliver-email-batch
+        self._timing = threading.local()
 
         # events are generally undocumented, but some that might be of interest are:
         # before-call, after-call, after-call-error, request-created, response-received
@@ -66,13 +95,13 @@ class AwsSesClient(EmailClient):
     def ses_request_created_hook(self, **kwargs):
         # request created may be called multiple times if the request auto-retries. We want to count all these as the
         # same request for timing purposes, so only reset the start time if it was cleared completely
-        if self.ses_start_time == 0:
-            self.ses_start_time = monotonic()
+        if self._timing.ses_start_time == 0:
+            self._timing.ses_start_time = monotonic()
 
     def ses_response_received_hook(self, **kwargs):
         # response received may be called multiple times if the request auto-retries, however, we want to count the last
         # time it triggers for timing purposes, so always reset the elapsed time
-        self.ses_elapsed_time = monotonic() - self.ses_start_time
+        self._timing.ses_elapsed_time = monotonic() - self._timing.ses_start_time
 
     def get_name(self):
         return self.name
@@ -84,8 +113,8 @@ class AwsSesClient(EmailClient):
                    body,
                    html_body='',
                    reply_to_address=None):
-        self.ses_elapsed_time = 0
-        self.ses_start_time = 0
+        self._timing.ses_elapsed_time = 0
+        self._timing.ses_start_time = 0
         try:
             if isinstance(to_addresses, str):
                 to_addresses = [to_addresses]
@@ -101,6 +130,7 @@ class AwsSesClient(EmailClient):
                     'Html': {'Data': html_body}
                 })
 
+            self.send_rate_limiter.take()
             start_time = monotonic()
             response = self._client.send_email(
                 Source=source,
@@ -117,6 +147,9 @@ class AwsSesClient(EmailClient):
                 },
                 ReplyToAddresses=[punycode_encode_email(addr) for addr in reply_to_addresses]
             )
+        except SendRateExceeded as e:
+            self.statsd_client.incr("clients.ses.error")
+            raise AwsSesClientThrottlingSendRateException(str(e))
         except botocore.exceptions.ClientError as e:
             self.statsd_client.incr("clients.ses.error")
 
@@ -138,11 +171,104 @@ class AwsSesClient(EmailClient):
             elapsed_time = monotonic() - start_time
             current_app.logger.info("AWS SES request finished in {}".format(elapsed_time))
             self.statsd_client.timing("clients.ses.request-time", elapsed_time)
-            if self.ses_elapsed_time != 0:
-                self.statsd_client.timing("clients.ses.raw-request-time", self.ses_elapsed_time)
+            if self._timing.ses_elapsed_time != 0:
+                self.statsd_client.timing("clients.ses.raw-request-time", self._timing.ses_elapsed_time)
             self.statsd_client.incr("clients.ses.success")
             return response['MessageId']
 
+    def can_send_bulk_email(self, subject, body, html_body=''):
+        return len(self._bulk_template_data(subject, body, html_body)) <= self.MAX_BULK_TEMPLATE_DATA_SIZE
+
+    def send_bulk_email(self,
+                        source,
+                        to_addresses,
+                        subject,
+                        body,
+                        html_body='',
+                        reply_to_address=None):
+        """
+        Send the same email to up to MAX_BULK_DESTINATIONS addresses in one SendBulkTemplatedEmail call. Each
+        address gets its own copy of the email with its own message id.
+
+        :return: a message id, or the exception it failed with, for each address in the same order
+        """
+        try:
+            template_name = self._get_bulk_template(bool(html_body))
+            template_data = self._bulk_template_data(subject, body, html_body)
+            self.send_rate_limiter.take(len(to_addresses))
+            start_time = monotonic()
+            response = self._client.send_bulk_templated_email(
+                Source=source,
+                Template=template_name,
+                DefaultTemplateData=template_data,
+                Destinations=[
+                    {
+                        'Destination': {'ToAddresses': [punycode_encode_email(address)]},
+                        'ReplacementTemplateData': '{}',
+                    }
+                    for address in to_addresses
+                ],
+                ReplyToAddresses=[punycode_encode_email(reply_to_address)] if reply_to_address else []
+            )
+        except SendRateExceeded as e:
+            self.statsd_client.incr("clients.ses.error")
+            raise AwsSesClientThrottlingSendRateException(str(e))
+        except botocore.exceptions.ClientError as e:
+            self.statsd_client.incr("clients.ses.error")
+            raise self._bulk_status_exception(e.response['Error']['Code'], e.response['Error']['Message'])
+        except Exception as e:
+            self.statsd_client.incr("clients.ses.error")
+            raise AwsSesClientException(str(e))
+
+        elapsed_time = monotonic() - start_time
+        current_app.logger.info("AWS SES bulk request for {} emails finished in {}".format(
+            len(to_addresses), elapsed_time
+        ))
+        self.statsd_client.timing("clients.ses.bulk-request-time", elapsed_time)
+
+        results = []
+        for status in response['Status']:
+            if status['Status'] == 'Success':
+                self.statsd_client.incr("clients.ses.success")
+                results.append(status['MessageId'])
+            else:
+                self.statsd_client.incr("clients.ses.error")
+                results.append(self._bulk_status_exception(status['Status'], status.get('Error', '')))
+        return results
+
+    @staticmethod
+    def _bulk_template_data(subject, body, html_body):
+        template_data = {'subject': subject, 'body': body}
+        if html_body:
+            template_data['html_body'] = html_body
+        return json.dumps(template_data)
+
+    def _get_bulk_template(self, html):
+        template = self.BULK_TEMPLATES[html]
+        template_name = template['TemplateName']
+
+        with self._bulk_templates_lock:
+            if template_name in self._bulk_templates:
+                return template_name
+
+        try:
+            self._client.create_template(Template=template)
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] != 'AlreadyExists':
+                raise
+
+        with self._bulk_templates_lock:
+            self._bulk_templates.add(template_name)
+        return template_name
+
+    @staticmethod
+    def _bulk_status_exception(code, message):
+        if code == 'InvalidParameterValue':
+            return EmailClientNonRetryableException(message)
+        if code == 'AccountThrottled' or (code == 'Throttling' and message == 'Maximum sending rate exceeded.'):
+            return AwsSesClientThrottlingSendRateException('{}: {}'.format(code, message))
+        return AwsSesClientException('{}: {}'.format(code, message))
+
 
 def punycode_encode_email(email_address):
     # only the hostname should ever be punycode encoded.
@@ -0,0 +1,84 @@
+"""
+A token bucket, kept in redis and shared by every worker, that paces our calls to SES to the account's maximum send
+rate - so we wait a moment before sending rather than being throttled by SES and retrying the email minutes later.
+
+Tokens are taken before they've been earned if need be, and the caller sleeps until they would have been, so workers
+are served in the order they asked. If the wait would be too long the tokens aren't taken and the caller is told the
+send rate has been exceeded, as SES itself would have done.
+"""
+from time import sleep, time
+
+from flask import current_app
+
+# how long a sender will wait for its turn before giving up
+MAX_WAIT_SECONDS = 5
+
+# KEYS[1]: the bucket
+# ARGV[1]: tokens earned per second
+# ARGV[2]: how many tokens the bucket holds when full
+# ARGV[3]: how many tokens to take
+# ARGV[4]: the time now, in seconds
+# ARGV[5]: the longest the caller is prepared to wait
+# Returns how many seconds to wait before sending, or -1 if that would be longer than the caller is prepared to wait
+TAKE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local now = tonumber(ARGV[4])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(bucket[1]) or capacity
+local updated_at = tonumber(bucket[2]) or now
+
+tokens = math.min(capacity, tokens + math.max(0, now - updated_at) * rate) - tonumber(ARGV[3])
+local wait = 0
+if tokens < 0 then
+    wait = -tokens / rate
+end
+if wait > tonumber(ARGV[5]) then
+    return '-1'
+end
+
+redis.call('HMSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 60)
+return tostring(wait)
+"""
+
+
+class SendRateExceeded(Exception):
+    pass
+
+
+class SendRateLimiter:
+
+    def __init__(self, redis_client, key, max_send_rate):
+        """
+        :param redis_client: a notifications_utils RedisClient
+        :param max_send_rate: tokens earned per second, and how many the bucket holds. 0 turns the limiter off
+        """
+        self.redis_client = redis_client
+        self.key = key
+        self.max_send_rate = max_send_rate
+
+    def take(self, count=1):
+        """
+        Blocks until `count` sends are allowed.
+
+        :raises SendRateExceeded: if they wouldn't be allowed for more than MAX_WAIT_SECONDS
+        """
+        if not self.max_send_rate or self.redis_client is None or not self.redis_client.active:
+            return
+
+        try:
+            take = self.redis_client.redis_store.register_script(TAKE_SCRIPT)
+            wait = float(take(
+                keys=[self.key],
+                # a bulk send bigger than the bucket would never fit, so let it through at the full rate
+                args=[self.max_send_rate, max(self.max_send_rate, count), count, time(), MAX_WAIT_SECONDS],
+            ))
+        except Exception:
+            current_app.logger.exception('Could not check send rate for {}'.format(self.key))
+            return
+
+        if wait < 0:
+            raise SendRateExceeded('{} send rate exceeded'.format(self.key))
+        if wait > 0:
+            sleep(wait)
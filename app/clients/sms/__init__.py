@@ -1,3 +1,10 @@
+import os
+from time import monotonic
+
+from requests import Session
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
 from app.clients import (Client, ClientException)
 
 
@@ -18,6 +25,56 @@ class SmsClient(Client):
     Base Sms client for sending smss.
     '''
 
+    def init_http_session(self, config):
+        self.pool_size = config['SMS_PROVIDER_POOL_SIZE']
+        self.timeout = (config['SMS_PROVIDER_CONNECT_TIMEOUT'], config['SMS_PROVIDER_READ_TIMEOUT'])
+        self.connect_retries = config['SMS_PROVIDER_CONNECT_RETRIES']
+        self._session = None
+        self._session_pid = None
+
+    @property
+    def session(self):
+        # connections can't be shared with forked processes, so each celery or gunicorn worker has its own session
+        if self._session is None or self._session_pid != os.getpid():
+            adapter = HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=self.pool_size,
+                max_retries=Retry(total=self.connect_retries, connect=self.connect_retries, read=0, redirect=0,
+                                  status=0),
+            )
+            session = Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            self._session, self._session_pid = session, os.getpid()
+        return self._session
+
+    def post(self, url, **kwargs):
+        """
+        POST to the provider over a kept-alive connection, timing requests that had to open a new connection (and do
+        a TLS handshake) separately from ones that reused a connection
+        """
+        pool = self._connection_pool(url)
+        connections_before = pool.num_connections if pool else None
+        start_time = monotonic()
+        try:
+            return self.session.post(url, timeout=self.timeout, **kwargs)
+        finally:
+            if pool is not None:
+                self.statsd_client.timing(
+                    "clients.{}.request-time.{}".format(
+                        self.name,
+                        'new-connection' if pool.num_connections > connections_before else 'reused-connection'
+                    ),
+                    monotonic() - start_time
+                )
+
+    def _connection_pool(self, url):
+        adapter = self.session.get_adapter(url)
+        if not isinstance(adapter, HTTPAdapter):
+            # for example when requests are mocked in tests
+            return None
+        return adapter.poolmanager.connection_from_url(url)
+
     def send_sms(self, *args, **kwargs):
         raise NotImplementedError('TODO Need to implement.')
 
@@ -2,7 +2,7 @@ import json
 import logging
 
 from time import monotonic
-from requests import request, RequestException
+from requests import RequestException
 
 from app.clients.sms import (SmsClient, SmsClientResponseException)
 
@@ -69,6 +69,7 @@ class FiretextClient(SmsClient):
         self.name = 'firetext'
         self.url = current_app.config.get('FIRETEXT_URL')
         self.statsd_client = statsd_client
+        self.init_http_session(current_app.config)
 
     def get_name(self):
         return self.name
@@ -103,11 +104,9 @@ class FiretextClient(SmsClient):
         response = None
         start_time = monotonic()
         try:
-            response = request(
-                "POST",
+            response = self.post(
                 self.url,
                 data=data,
-                timeout=60
             )
             response.raise_for_status()
             try:
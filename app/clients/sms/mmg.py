@@ -1,6 +1,6 @@
 import json
 from time import monotonic
-from requests import (request, RequestException)
+from requests import RequestException
 from app.clients.sms import (SmsClient, SmsClientResponseException)
 
 mmg_response_map = {
@@ -74,6 +74,7 @@ class MMGClient(SmsClient):
         self.from_number = current_app.config.get('FROM_NUMBER')
         self.name = 'mmg'
         self.statsd_client = statsd_client
+        self.init_http_session(current_app.config)
         self.mmg_url = current_app.config.get('MMG_URL')
 
     def record_outcome(self, success, response):
@@ -108,15 +109,13 @@ class MMGClient(SmsClient):
         response = None
         start_time = monotonic()
         try:
-            response = request(
-                "POST",
+            response = self.post(
                 self.mmg_url,
                 data=json.dumps(data),
                 headers={
                     'Content-Type': 'application/json',
                     'Authorization': 'Basic {}'.format(self.api_key)
                 },
-                timeout=60
             )
 
             response.raise_for_status()
@@ -28,7 +28,7 @@ from app.dao.fact_billing_dao import (
     delete_billing_data_for_service_for_day,
     fetch_billing_data_for_day,
     get_service_ids_that_need_billing_populated,
-    update_fact_billing,
+    update_fact_billing_for_day,
 )
 from app.dao.jobs_dao import dao_get_job_by_id
 from app.dao.organisation_dao import dao_get_organisation_by_email_address, dao_add_service_to_organisation
@@ -485,9 +485,7 @@ def rebuild_ft_billing_for_day(service_id, day):
         ))
         transit_data = fetch_billing_data_for_day(process_day=process_day, service_id=service)
         # transit_data = every row that should exist
-        for data in transit_data:
-            # upsert existing rows
-            update_fact_billing(data, process_day)
+        update_fact_billing_for_day(transit_data, process_day)
         current_app.logger.info('added/updated {} billing rows for {} on {}'.format(
             len(transit_data),
             service,
@@ -146,6 +146,32 @@ class Config(object):
     ONE_OFF_MESSAGE_FILENAME = 'Report'
     MAX_VERIFY_CODE_COUNT = 10
 
+    # number of job rows packed into a single save-notifications-batch task. 1 sends each row in its own
+    # save-sms/save-email task. Letters are always saved one row at a time.
+    SAVE_NOTIFICATIONS_BATCH_SIZE = int(os.getenv('SAVE_NOTIFICATIONS_BATCH_SIZE', 1))
+
+    # jobs with more rows than this are split into process-job-shard tasks of this many rows, so several job
+    # workers can share one big send. 0 processes every job in a single task.
+    JOB_ROWS_PER_SHARD = int(os.getenv('JOB_ROWS_PER_SHARD', 0))
+
+    # notifications saved by save-notifications-batch are sent to the providers in deliver-sms-batch and
+    # deliver-email-batch tasks of this many, each making up to DELIVERY_BATCH_CONCURRENCY provider calls at once.
+    # 1 sends each notification in its own deliver_sms or deliver_email task.
+    DELIVERY_BATCH_SIZE = int(os.getenv('DELIVERY_BATCH_SIZE', 1))
+    DELIVERY_BATCH_CONCURRENCY = int(os.getenv('DELIVERY_BATCH_CONCURRENCY', 10))
+
+    # how many letters' PDFs the nightly retention task looks for in S3 at once before deleting them
+    LETTER_S3_DELETE_CONCURRENCY = int(os.getenv('LETTER_S3_DELETE_CONCURRENCY', 10))
+
+    # when set (and redis is enabled) SMS delivery receipts are pushed onto a redis list by the callback
+    # endpoints and applied in bulk by process-buffered-sms-client-responses, rather than one task each
+    SMS_CALLBACK_BUFFER_ENABLED = os.getenv('SMS_CALLBACK_BUFFER_ENABLED') == '1'
+    SMS_CALLBACK_BUFFER_BATCH_SIZE = int(os.getenv('SMS_CALLBACK_BUFFER_BATCH_SIZE', 1000))
+    # likewise SES results are pushed onto a redis list by process-ses-result and handed out in batches to
+    # process-ses-results-batch tasks by process-buffered-ses-results
+    SES_CALLBACK_BUFFER_ENABLED = os.getenv('SES_CALLBACK_BUFFER_ENABLED') == '1'
+    SES_CALLBACK_BUFFER_BATCH_SIZE = int(os.getenv('SES_CALLBACK_BUFFER_BATCH_SIZE', 100))
+
     # be careful increasing this size without being sure that we won't see slowness in pysftp
     MAX_LETTER_PDF_ZIP_FILESIZE = 40 * 1024 * 1024  # 40mb
     MAX_LETTER_PDF_COUNT_PER_ZIP = 500
@@ -321,11 +347,34 @@ class Config(object):
             'schedule': timedelta(minutes=5),
             'options': {'queue': QueueNames.PERIODIC}
         },
+        'reconcile-notification-counts': {
+            'task': 'reconcile-notification-counts',
+            'schedule': timedelta(minutes=5),
+            'options': {'queue': QueueNames.PERIODIC}
+        },
         'trigger-link-tests': {
             'task': 'trigger-link-tests',
             'schedule': timedelta(minutes=15),
             'options': {'queue': QueueNames.PERIODIC}
         },
+        # app/celery/process_sms_client_response_tasks.py
+        'process-buffered-sms-client-responses': {
+            'task': 'process-buffered-sms-client-responses',
+            'schedule': timedelta(seconds=10),
+            'options': {'queue': QueueNames.SMS_CALLBACKS}
+        },
+        # app/celery/process_ses_receipts_tasks.py
+        'process-buffered-ses-results': {
+            'task': 'process-buffered-ses-results',
+            'schedule': timedelta(seconds=10),
+            'options': {'queue': QueueNames.NOTIFY}
+        },
+        # app/celery/service_callback_tasks.py
+        'send-batched-delivery-statuses': {
+            'task': 'send-batched-delivery-statuses',
+            'schedule': timedelta(seconds=10),
+            'options': {'queue': QueueNames.CALLBACKS}
+        },
     }
     CELERY_QUEUES = []
 
@@ -371,8 +420,35 @@ class Config(object):
     FIRETEXT_URL = os.environ.get("FIRETEXT_URL", "https://www.firetext.co.uk/api/sendsms/json")
     SES_STUB_URL = os.environ.get("SES_STUB_URL")
 
+    # HTTP connections each worker process keeps open to the SMS providers
+    SMS_PROVIDER_POOL_SIZE = int(os.environ.get("SMS_PROVIDER_POOL_SIZE", 10))
+    SMS_PROVIDER_CONNECT_TIMEOUT = float(os.environ.get("SMS_PROVIDER_CONNECT_TIMEOUT", 5))
+    SMS_PROVIDER_READ_TIMEOUT = float(os.environ.get("SMS_PROVIDER_READ_TIMEOUT", 60))
+    # only failures to connect are retried - retrying once the message has been sent could send it twice
+    SMS_PROVIDER_CONNECT_RETRIES = int(os.environ.get("SMS_PROVIDER_CONNECT_RETRIES", 2))
+
+    # service callbacks. Each worker process keeps up to SERVICE_CALLBACK_POOL_SIZE connections open to each of
+    # SERVICE_CALLBACK_POOL_HOSTS callback hosts
+    SERVICE_CALLBACK_POOL_HOSTS = int(os.environ.get("SERVICE_CALLBACK_POOL_HOSTS", 100))
+    SERVICE_CALLBACK_POOL_SIZE = int(os.environ.get("SERVICE_CALLBACK_POOL_SIZE", 4))
+    SERVICE_CALLBACK_CONNECT_TIMEOUT = float(os.environ.get("SERVICE_CALLBACK_CONNECT_TIMEOUT", 2))
+    SERVICE_CALLBACK_READ_TIMEOUT = float(os.environ.get("SERVICE_CALLBACK_READ_TIMEOUT", 5))
+    # how many callbacks each service can have in flight at once, across all workers
+    SERVICE_CALLBACK_MAX_IN_FLIGHT = int(os.environ.get("SERVICE_CALLBACK_MAX_IN_FLIGHT", 10))
+    # this many failed callbacks to a service within the window stops its callbacks being sent for a while
+    SERVICE_CALLBACK_FAILURE_THRESHOLD = int(os.environ.get("SERVICE_CALLBACK_FAILURE_THRESHOLD", 10))
+    SERVICE_CALLBACK_FAILURE_WINDOW_SECONDS = int(os.environ.get("SERVICE_CALLBACK_FAILURE_WINDOW_SECONDS", 60))
+    SERVICE_CALLBACK_CIRCUIT_OPEN_SECONDS = int(os.environ.get("SERVICE_CALLBACK_CIRCUIT_OPEN_SECONDS", 60))
+    # services that have asked for their delivery receipts to be sent in batches, as a JSON list of updates
+    SERVICE_CALLBACK_BATCH_SERVICES = json.loads(os.environ.get("SERVICE_CALLBACK_BATCH_SERVICES", "[]"))
+    SERVICE_CALLBACK_BATCH_SIZE = int(os.environ.get("SERVICE_CALLBACK_BATCH_SIZE", 100))
+
     AWS_REGION = 'eu-west-1'
 
+    # our SES account's maximum send rate, in emails per second. Sends are paced to stay under it across all
+    # workers, using redis. 0 leaves them unpaced
+    AWS_SES_MAX_SEND_RATE = float(os.environ.get("AWS_SES_MAX_SEND_RATE", 0))
+
     # CBC Proxy
     # if the access keys are empty then noop client is used
     CBC_PROXY_AWS_ACCESS_KEY_ID = os.environ.get('CBC_PROXY_AWS_ACCESS_KEY_ID', '')
@@ -0,0 +1,129 @@
+"""
+An atomic count of the messages each service has sent today, used to enforce the daily message limit without
+counting today's rows in the notifications table on every request.
+
+Messages are reserved before they're sent: a single Lua script checks that the reservation fits under the service's
+limit and increments the count in one step, so concurrent requests can't both squeeze under the limit, and a job can
+reserve all of its rows at once. A reservation that doesn't turn into notifications (for example because the request
+fails validation afterwards) can be released again.
+
+The count lives until midnight BST. If it isn't there yet it's rebuilt from today's notification counts in redis, and
+only from the notifications table if those aren't available.
+"""
+from datetime import datetime, timedelta
+
+from flask import current_app, g
+from notifications_utils.timezones import convert_utc_to_bst
+
+from app import redis_store
+from app.dao import services_dao
+from app.models import KEY_TYPE_TEST
+from app.notification_counts import get_todays_notification_counts_for_service
+from app.utils import get_london_midnight_in_utc
+
+NOT_SEEDED = -1
+
+# KEYS[1]: the counter
+# ARGV[1]: how many messages to reserve
+# ARGV[2]: the service's daily limit
+# ARGV[3]: unix time the counter should expire at
+# ARGV[4]: what to start the counter at if it doesn't exist yet, or an empty string to report that it doesn't
+# Returns {1, count} if the messages were reserved, {0, count} if they would go over the limit, or {-1, 0} if the
+# counter doesn't exist and no starting value was given.
+RESERVE_SCRIPT = """
+local current = redis.call('GET', KEYS[1])
+if current then
+    current = tonumber(current)
+elseif ARGV[4] ~= '' then
+    current = tonumber(ARGV[4])
+    redis.call('SET', KEYS[1], current)
+    redis.call('EXPIREAT', KEYS[1], ARGV[3])
+else
+    return {-1, 0}
+end
+if current + tonumber(ARGV[1]) > tonumber(ARGV[2]) then
+    return {0, current}
+end
+return {1, redis.call('INCRBY', KEYS[1], ARGV[1])}
+"""
+
+# only give reservations back to a counter that still exists, otherwise we'd start tomorrow's count below zero
+RELEASE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return redis.call('DECRBY', KEYS[1], ARGV[1])
+end
+return 0
+"""
+
+
+def daily_limit_key(service_id, bst_date):
+    return 'daily-limit-{}-{}'.format(service_id, bst_date.isoformat())
+
+
+def reserve_daily_limit(service, count=1):
+    """
+    Reserve `count` messages against the service's daily limit. Either all of them are reserved or none are.
+
+    :return: (reserved, sent_today) - sent_today includes the new reservation if it was made. Returns (None, None) if
+        the counter couldn't be used, in which case the caller should decide for itself.
+    """
+    if not current_app.config['REDIS_ENABLED']:
+        return None, None
+
+    bst_date = _todays_bst_date()
+    key = daily_limit_key(service.id, bst_date)
+    expire_at = int((get_london_midnight_in_utc(bst_date + timedelta(days=1)) - datetime(1970, 1, 1)).total_seconds())
+
+    try:
+        reserve = redis_store.redis_store.register_script(RESERVE_SCRIPT)
+        reserved, sent_today = reserve(keys=[key], args=[count, service.message_limit, expire_at, ''])
+        if reserved == NOT_SEEDED:
+            reserved, sent_today = reserve(
+                keys=[key], args=[count, service.message_limit, expire_at, _count_messages_sent_today(service.id)]
+            )
+    except Exception:
+        current_app.logger.exception('Could not reserve daily limit for service {}'.format(service.id))
+        return None, None
+
+    return bool(reserved), int(sent_today)
+
+
+def release_daily_limit(service_id, count=1):
+    if not current_app.config['REDIS_ENABLED']:
+        return
+
+    try:
+        release = redis_store.redis_store.register_script(RELEASE_SCRIPT)
+        release(keys=[daily_limit_key(service_id, _todays_bst_date())], args=[count])
+    except Exception:
+        current_app.logger.exception('Could not release daily limit for service {}'.format(service_id))
+
+
+def reserve_daily_limit_for_request(service, count=1):
+    """
+    As `reserve_daily_limit`, but the reservation is released again by `release_daily_limit_for_failed_request` if
+    the request doesn't succeed.
+    """
+    reserved, sent_today = reserve_daily_limit(service, count)
+    if reserved:
+        g.daily_limit_reservations = g.get('daily_limit_reservations', []) + [(service.id, count)]
+    return reserved, sent_today
+
+
+def release_daily_limit_for_failed_request(response):
+    if response.status_code >= 400:
+        for service_id, count in g.get('daily_limit_reservations', []):
+            release_daily_limit(service_id, count)
+    g.daily_limit_reservations = []
+    return response
+
+
+def _count_messages_sent_today(service_id):
+    counts = get_todays_notification_counts_for_service(service_id)
+    if counts is None:
+        return services_dao.fetch_todays_total_message_count(service_id)
+    return sum(count.count for count in counts if count.key_type != KEY_TYPE_TEST)
+
+
+def _todays_bst_date():
+    return convert_utc_to_bst(datetime.utcnow()).date()
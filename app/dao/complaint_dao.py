@@ -14,6 +14,10 @@ def save_complaint(complaint):
     db.session.add(complaint)
 
 
+def fetch_complaint_by_ses_feedback_id(notification_id, ses_feedback_id):
+    return Complaint.query.filter_by(notification_id=notification_id, ses_feedback_id=ses_feedback_id).first()
+
+
 def fetch_paginated_complaints(page=1):
     return Complaint.query.order_by(
         desc(Complaint.created_at)
@@ -15,7 +15,9 @@ from app.dao.organisation_dao import dao_get_organisation_live_services
 
 from app.models import (
     FactBilling,
+    Notification,
     Service,
+    ServicePermission,
     KEY_TYPE_TEST,
     LETTER_TYPE,
     SMS_TYPE,
@@ -30,7 +32,7 @@ from app.models import (
     Organisation,
     INTERNATIONAL_POSTAGE_TYPES,
 )
-from app.utils import get_london_midnight_in_utc, get_notification_table_to_use
+from app.utils import get_london_midnight_in_utc, get_services_using_notification_table
 
 
 def fetch_sms_free_allowance_remainder(start_date):
@@ -247,8 +249,7 @@ def fetch_monthly_billing_for_year(service_id, year):
     # if year end date is less than today, we are calculating for data in the past and have no need for deltas.
     if year_end_date >= today:
         data = fetch_billing_data_for_day(process_day=today, service_id=service_id, check_permissions=True)
-        for d in data:
-            update_fact_billing(data=d, process_day=today)
+        update_fact_billing_for_day(data, process_day=today)
 
     email_and_letters = db.session.query(
         func.date_trunc('month', FactBilling.bst_date).cast(Date).label("month"),
@@ -314,34 +315,38 @@ def fetch_billing_data_for_day(process_day, service_id=None, check_permissions=F
     end_date = convert_bst_to_utc(datetime.combine(process_day + timedelta(days=1), time.min))
     current_app.logger.info("Populate ft_billing for {} to {}".format(start_date, end_date))
     transit_data = []
-    if not service_id:
-        services = Service.query.all()
-    else:
-        services = [Service.query.get(service_id)]
-
-    for service in services:
-        for notification_type in (SMS_TYPE, EMAIL_TYPE, LETTER_TYPE):
-            if (not check_permissions) or service.has_permission(notification_type):
-                table = get_notification_table_to_use(service, notification_type, process_day,
-                                                      has_delete_task_run=False)
-                results = _query_for_billing_data(
-                    table=table,
-                    notification_type=notification_type,
-                    start_date=start_date,
-                    end_date=end_date,
-                    service=service
-                )
-                transit_data += results
+    # one query per notification type and table across all services, rather than one per service
+    for notification_type in (SMS_TYPE, EMAIL_TYPE, LETTER_TYPE):
+        for table in (Notification, NotificationHistory):
+            services = _services_to_bill_from_table(
+                table, notification_type, process_day, service_id, check_permissions
+            )
+            transit_data += _query_for_billing_data(
+                table=table,
+                notification_type=notification_type,
+                start_date=start_date,
+                end_date=end_date,
+                services=services
+            )
 
     return transit_data
 
 
-def _query_for_billing_data(table, notification_type, start_date, end_date, service):
+def _services_to_bill_from_table(table, notification_type, process_day, service_id, check_permissions):
+    query = get_services_using_notification_table(table, notification_type, process_day, has_delete_task_run=False)
+    if service_id:
+        query = query.filter(Service.id == service_id)
+    if check_permissions:
+        query = query.filter(Service.permissions.any(ServicePermission.permission == notification_type))
+    return query.subquery()
+
+
+def _query_for_billing_data(table, notification_type, start_date, end_date, services):
     def _email_query():
         return db.session.query(
             table.template_id,
-            literal(service.crown).label('crown'),
-            literal(service.id).label('service_id'),
+            services.c.crown,
+            table.service_id,
             literal(notification_type).label('notification_type'),
             literal('ses').label('sent_by'),
             literal(0).label('rate_multiplier'),
@@ -350,15 +355,18 @@ def _query_for_billing_data(table, notification_type, start_date, end_date, serv
             literal('none').label('postage'),
             literal(0).label('billable_units'),
             func.count().label('notifications_sent'),
+        ).join(
+            services, services.c.id == table.service_id
         ).filter(
             table.status.in_(NOTIFICATION_STATUS_TYPES_SENT_EMAILS),
             table.key_type != KEY_TYPE_TEST,
             table.created_at >= start_date,
             table.created_at < end_date,
             table.notification_type == notification_type,
-            table.service_id == service.id
         ).group_by(
             table.template_id,
+            services.c.crown,
+            table.service_id,
         )
 
     def _sms_query():
@@ -367,8 +375,8 @@ def _query_for_billing_data(table, notification_type, start_date, end_date, serv
         international = func.coalesce(table.international, False)
         return db.session.query(
             table.template_id,
-            literal(service.crown).label('crown'),
-            literal(service.id).label('service_id'),
+            services.c.crown,
+            table.service_id,
             literal(notification_type).label('notification_type'),
             sent_by.label('sent_by'),
             rate_multiplier.label('rate_multiplier'),
@@ -377,15 +385,18 @@ def _query_for_billing_data(table, notification_type, start_date, end_date, serv
             literal('none').label('postage'),
             func.sum(table.billable_units).label('billable_units'),
             func.count().label('notifications_sent'),
+        ).join(
+            services, services.c.id == table.service_id
         ).filter(
             table.status.in_(NOTIFICATION_STATUS_TYPES_BILLABLE_SMS),
             table.key_type != KEY_TYPE_TEST,
             table.created_at >= start_date,
             table.created_at < end_date,
             table.notification_type == notification_type,
-            table.service_id == service.id
         ).group_by(
             table.template_id,
+            services.c.crown,
+            table.service_id,
             sent_by,
             rate_multiplier,
             international,
@@ -396,8 +407,8 @@ def _query_for_billing_data(table, notification_type, start_date, end_date, serv
         postage = func.coalesce(table.postage, 'none')
         return db.session.query(
             table.template_id,
-            literal(service.crown).label('crown'),
-            literal(service.id).label('service_id'),
+            services.c.crown,
+            table.service_id,
             literal(notification_type).label('notification_type'),
             literal('dvla').label('sent_by'),
             rate_multiplier.label('rate_multiplier'),
@@ -406,15 +417,18 @@ def _query_for_billing_data(table, notification_type, start_date, end_date, serv
             postage.label('postage'),
             func.sum(table.billable_units).label('billable_units'),
             func.count().label('notifications_sent'),
+        ).join(
+            services, services.c.id == table.service_id
         ).filter(
             table.status.in_(NOTIFICATION_STATUS_TYPES_BILLABLE_FOR_LETTERS),
             table.key_type != KEY_TYPE_TEST,
             table.created_at >= start_date,
             table.created_at < end_date,
             table.notification_type == notification_type,
-            table.service_id == service.id
         ).group_by(
             table.template_id,
+            services.c.crown,
+            table.service_id,
             rate_multiplier,
             table.billable_units,
             postage,
@@ -477,38 +491,54 @@ def get_rate(
         return 0
 
 
-def update_fact_billing(data, process_day):
+def update_fact_billing_for_day(transit_data, process_day):
+    """
+    Upsert all of a day's billing data in one INSERT ... ON CONFLICT statement. Rates are fetched once and
+    looked up once per distinct (notification type, crown, page count, postage) rather than once per row.
+    """
+    if not transit_data:
+        return
+
     non_letter_rates, letter_rates = get_rates_for_billing()
-    rate = get_rate(non_letter_rates,
-                    letter_rates,
-                    data.notification_type,
-                    process_day,
-                    data.crown,
-                    data.letter_page_count,
-                    data.postage)
-    billing_record = create_billing_record(data, rate, process_day)
+    rates = {}
+    billing_rows = {}
+    for data in transit_data:
+        rate_key = (data.notification_type, data.crown, data.letter_page_count, data.postage)
+        if rate_key not in rates:
+            rates[rate_key] = get_rate(non_letter_rates,
+                                       letter_rates,
+                                       data.notification_type,
+                                       process_day,
+                                       data.crown,
+                                       data.letter_page_count,
+                                       data.postage)
+        row = {
+            'bst_date': process_day,
+            'template_id': data.template_id,
+            'service_id': data.service_id,
+            'notification_type': data.notification_type,
+            'provider': data.sent_by,
+            'rate_multiplier': data.rate_multiplier,
+            'international': data.international,
+            'rate': rates[rate_key],
+            'postage': data.postage,
+        }
+        # letters with different page counts can share a rate, and so a row in ft_billing. A row can only be
+        # upserted once per statement, so combine them here
+        key = tuple(row.values())
+        if key in billing_rows:
+            billing_rows[key]['billable_units'] += data.billable_units
+            billing_rows[key]['notifications_sent'] += data.notifications_sent
+        else:
+            billing_rows[key] = dict(
+                row,
+                billable_units=data.billable_units,
+                notifications_sent=data.notifications_sent,
+                created_at=datetime.utcnow(),
+            )
 
     table = FactBilling.__table__
-    '''
-       This uses the Postgres upsert to avoid race conditions when two threads try to insert
-       at the same row. The excluded object refers to values that we tried to insert but were
-       rejected.
-       http://docs.sqlalchemy.org/en/latest/dialects/postgresql.html#insert-on-conflict-upsert
-    '''
-    stmt = insert(table).values(
-        bst_date=billing_record.bst_date,
-        template_id=billing_record.template_id,
-        service_id=billing_record.service_id,
-        provider=billing_record.provider,
-        rate_multiplier=billing_record.rate_multiplier,
-        notification_type=billing_record.notification_type,
-        international=billing_record.international,
-        billable_units=billing_record.billable_units,
-        notifications_sent=billing_record.notifications_sent,
-        rate=billing_record.rate,
-        postage=billing_record.postage,
-    )
-
+    stmt = insert(table).values(list(billing_rows.values()))
     stmt = stmt.on_conflict_do_update(
         constraint="ft_billing_pkey",
         set_={"notifications_sent": stmt.excluded.notifications_sent,
@@ -520,23 +550,6 @@ def update_fact_billing(data, process_day):
     db.session.commit()
 
 
-def create_billing_record(data, rate, process_day):
-    billing_record = FactBilling(
-        bst_date=process_day,
-        template_id=data.template_id,
-        service_id=data.service_id,
-        notification_type=data.notification_type,
-        provider=data.sent_by,
-        rate_multiplier=data.rate_multiplier,
-        international=data.international,
-        billable_units=data.billable_units,
-        notifications_sent=data.notifications_sent,
-        rate=rate,
-        postage=data.postage,
-    )
-    return billing_record
-
-
 def fetch_letter_costs_for_organisation(organisation_id, start_date, end_date):
     query = db.session.query(
         Service.name.label("service_name"),
@@ -645,8 +658,7 @@ def fetch_usage_year_for_organisation(organisation_id, year):
     if year_end_date >= today:
         for service in services:
             data = fetch_billing_data_for_day(process_day=today, service_id=service.id)
-            for d in data:
-                update_fact_billing(data=d, process_day=today)
+            update_fact_billing_for_day(data, process_day=today)
     service_with_usage = {}
     # initialise results
     for service in services:
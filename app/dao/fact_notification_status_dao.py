@@ -1,17 +1,20 @@
+import uuid
+from collections import Counter, namedtuple
 from datetime import datetime, timedelta, time
 
-from flask import current_app
 from notifications_utils.timezones import convert_bst_to_utc
-from sqlalchemy import case, func, Date
+from sqlalchemy import case, func, union_all, Date
 from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.sql.expression import literal, extract
 from sqlalchemy.types import DateTime, Integer
 
 from app import db
+from app.notification_counts import get_todays_notification_counts_for_service, get_todays_notification_totals
 from app.models import (
     FactNotificationStatus,
     KEY_TYPE_TEST,
     Notification,
+    NotificationHistory,
     NOTIFICATION_CANCELLED,
     NOTIFICATION_CREATED,
     NOTIFICATION_DELIVERED,
@@ -30,48 +33,34 @@ from app.utils import (
     get_london_midnight_in_utc,
     midnight_n_days_ago,
     get_london_month_from_utc_column,
-    get_notification_table_to_use,
+    get_services_using_notification_table,
 )
 
-
-def fetch_notification_status_for_day(process_day, notification_type):
-    start_date = convert_bst_to_utc(datetime.combine(process_day, time.min))
-    end_date = convert_bst_to_utc(datetime.combine(process_day + timedelta(days=1), time.min))
-
-    current_app.logger.info("Fetch ft_notification_status for {} to {}".format(start_date, end_date))
-
-    all_data_for_process_day = []
-    services = Service.query.all()
-    # for each service query notifications or notification_history for the day, depending on their data retention
-    for service in services:
-        table = get_notification_table_to_use(service, notification_type, process_day, has_delete_task_run=False)
-
-        data_for_service_and_type = query_for_fact_status_data(
-            table=table,
-            start_date=start_date,
-            end_date=end_date,
-            notification_type=notification_type,
-            service_id=service.id
-        )
-
-        all_data_for_process_day += data_for_service_and_type
-
-    return all_data_for_process_day
+NotificationStatusCount = namedtuple('NotificationStatusCount', ['notification_type', 'status', 'count'])
+TemplateNotificationStatusCount = namedtuple(
+    'TemplateNotificationStatusCount',
+    ['template_name', 'is_precompiled_letter', 'template_id', 'notification_type', 'status', 'count']
+)
+NotificationStatusTotal = namedtuple('NotificationStatusTotal', ['notification_type', 'status', 'key_type', 'count'])
 
 
-def query_for_fact_status_data(table, start_date, end_date, notification_type, service_id):
-    query = db.session.query(
+def query_for_fact_status_data(table, start_date, end_date, notification_type, process_day):
+    services = get_services_using_notification_table(
+        table, notification_type, process_day, has_delete_task_run=False
+    ).subquery()
+    return db.session.query(
         table.template_id,
         table.service_id,
         func.coalesce(table.job_id, '00000000-0000-0000-0000-000000000000').label('job_id'),
         table.key_type,
         table.status,
         func.count().label('notification_count')
+    ).join(
+        services, services.c.id == table.service_id
     ).filter(
         table.created_at >= start_date,
         table.created_at < end_date,
         table.notification_type == notification_type,
-        table.service_id == service_id,
         table.key_type != KEY_TYPE_TEST
     ).group_by(
         table.template_id,
@@ -80,29 +69,44 @@ def query_for_fact_status_data(table, start_date, end_date, notification_type, s
         table.key_type,
         table.status
     )
-    return query.all()
 
 
 @transactional
-def update_fact_notification_status(data, process_day, notification_type):
-    table = FactNotificationStatus.__table__
+def rebuild_fact_notification_status_for_day(process_day, notification_type):
+    """
+    Replace the day's ft_notification_status rows with a single INSERT ... SELECT, so the aggregated data never
+    leaves the database. Returns the number of rows inserted.
+    """
+    start_date = convert_bst_to_utc(datetime.combine(process_day, time.min))
+    end_date = convert_bst_to_utc(datetime.combine(process_day + timedelta(days=1), time.min))
+
     FactNotificationStatus.query.filter(
         FactNotificationStatus.bst_date == process_day,
         FactNotificationStatus.notification_type == notification_type
     ).delete()
 
-    for row in data:
-        stmt = insert(table).values(
-            bst_date=process_day,
-            template_id=row.template_id,
-            service_id=row.service_id,
-            job_id=row.job_id,
+    selects = []
+    for table in (Notification, NotificationHistory):
+        query = query_for_fact_status_data(
+            table=table,
+            start_date=start_date,
+            end_date=end_date,
             notification_type=notification_type,
-            key_type=row.key_type,
-            notification_status=row.status,
-            notification_count=row.notification_count,
+            process_day=process_day,
         )
-        db.session.connection().execute(stmt)
+        selects.append(query.add_columns(
+            literal(process_day, type_=Date).label('bst_date'),
+            literal(notification_type).label('notification_type'),
+            literal(datetime.utcnow(), type_=DateTime).label('created_at'),
+        ).statement)
+
+    table = FactNotificationStatus.__table__
+    columns = [
+        'template_id', 'service_id', 'job_id', 'key_type', 'notification_status', 'notification_count',
+        'bst_date', 'notification_type', 'created_at',
+    ]
+    stmt = insert(table).from_select(columns, union_all(*selects), include_defaults=False)
+    return db.session.connection().execute(stmt).rowcount
 
 
 def fetch_notification_status_for_service_by_month(start_date, end_date, service_id):
@@ -155,6 +159,16 @@ def fetch_notification_status_for_service_for_today_and_7_previous_days(service_
         FactNotificationStatus.key_type != KEY_TYPE_TEST
     )
 
+    todays_counts = get_todays_notification_counts_for_service(service_id)
+    if todays_counts is not None:
+        # today's counts are already to hand, so add them to the previous days' totals here rather than sending them
+        # back to the database
+        return _add_todays_counts(
+            _sum_notification_status_stats(stats_for_7_days.subquery(), by_template),
+            [row for row in todays_counts if row.key_type != KEY_TYPE_TEST],
+            by_template,
+        )
+
     stats_for_today = db.session.query(
         Notification.notification_type.cast(db.Text),
         Notification.status,
@@ -170,8 +184,10 @@ def fetch_notification_status_for_service_for_today_and_7_previous_days(service_
         Notification.status
     )
 
-    all_stats_table = stats_for_7_days.union_all(stats_for_today).subquery()
+    return _sum_notification_status_stats(stats_for_7_days.union_all(stats_for_today).subquery(), by_template)
 
+
+def _sum_notification_status_stats(all_stats_table, by_template):
     query = db.session.query(
         *([
             Template.name.label("template_name"),
@@ -193,6 +209,63 @@ def fetch_notification_status_for_service_for_today_and_7_previous_days(service_
     ).all()
 
 
+def _add_todays_counts(stats, todays_counts, by_template):
+    counts = Counter()
+    templates = {}
+    for row in stats:
+        if by_template:
+            templates[row.template_id] = (row.template_name, row.is_precompiled_letter)
+            counts[(row.template_id, row.notification_type, row.status)] += row.count
+        else:
+            counts[(row.notification_type, row.status)] += row.count
+
+    if not by_template:
+        for row in todays_counts:
+            counts[(row.notification_type, row.status)] += row.count
+        return [
+            NotificationStatusCount(notification_type, status, count)
+            for (notification_type, status), count in counts.items()
+        ]
+
+    todays_template_ids = {uuid.UUID(row.template_id) for row in todays_counts}
+    new_template_ids = todays_template_ids - templates.keys()
+    if new_template_ids:
+        templates.update(
+            (template.id, (template.name, template.is_precompiled_letter))
+            for template in Template.query.filter(Template.id.in_(new_template_ids))
+        )
+
+    for row in todays_counts:
+        template_id = uuid.UUID(row.template_id)
+        # the database query only returns templates that still exist, so leave out any that don't
+        if template_id in templates:
+            counts[(template_id, row.notification_type, row.status)] += row.count
+
+    return [
+        TemplateNotificationStatusCount(*templates[template_id], template_id, notification_type, status, count)
+        for (template_id, notification_type, status), count in counts.items()
+    ]
+
+
+def fetch_notification_counts_for_today():
+    return db.session.query(
+        Notification.service_id,
+        Notification.notification_type.cast(db.Text).label('notification_type'),
+        Notification.status,
+        Notification.template_id,
+        Notification.key_type,
+        func.count().label('count')
+    ).filter(
+        Notification.created_at >= get_london_midnight_in_utc(datetime.utcnow())
+    ).group_by(
+        Notification.service_id,
+        Notification.notification_type,
+        Notification.status,
+        Notification.template_id,
+        Notification.key_type,
+    ).all()
+
+
 def fetch_notification_status_totals_for_all_services(start_date, end_date):
     stats = db.session.query(
         FactNotificationStatus.notification_type.label('notification_type'),
@@ -209,6 +282,20 @@ def fetch_notification_status_totals_for_all_services(start_date, end_date):
     )
     today = get_london_midnight_in_utc(datetime.utcnow())
     if start_date <= datetime.utcnow().date() <= end_date:
+        todays_totals = get_todays_notification_totals()
+        if todays_totals is not None:
+            # add today's totals from redis to the ft_notification_status totals here rather than in the database
+            counts = Counter()
+            for row in stats.all() + todays_totals:
+                counts[(row.notification_type, row.status, row.key_type)] += row.count
+            return sorted(
+                (
+                    NotificationStatusTotal(notification_type, status, key_type, count)
+                    for (notification_type, status, key_type), count in counts.items()
+                ),
+                key=lambda row: row.notification_type
+            )
+
         stats_for_today = db.session.query(
             Notification.notification_type.cast(db.Text).label('notification_type'),
             Notification.status,
@@ -7,7 +7,8 @@ from sqlalchemy import (
     asc,
     desc,
     func,
-    and_
+    and_,
+    not_,
 )
 
 from app import db
@@ -155,6 +156,24 @@ def dao_update_job(job):
     db.session.commit()
 
 
+@transactional
+def dao_record_job_shard_completed(job_id, shard_number):
+    """
+    Atomically record that one of a job's shards has finished, returning how many different shards
+    have now finished so that only the shard that finishes last goes on to complete the job. A shard
+    that was already recorded (say one resumed while it was still running) isn't counted again, and
+    gets None back.
+    """
+    return db.session.execute(
+        Job.__table__.update().where(
+            Job.id == job_id,
+            not_(Job.completed_shards.any(shard_number)),
+        ).values(
+            completed_shards=func.array_append(Job.completed_shards, shard_number)
+        ).returning(func.cardinality(Job.completed_shards))
+    ).scalar()
+
+
 def dao_get_jobs_older_than_data_retention(notification_types):
     flexible_data_retention = ServiceDataRetention.query.filter(
         ServiceDataRetention.notification_type.in_(notification_types)
@@ -1,4 +1,5 @@
 import functools
+from collections import defaultdict
 from itertools import groupby
 from operator import attrgetter
 from datetime import (
@@ -6,8 +7,8 @@ from datetime import (
     timedelta,
 )
 
-from botocore.exceptions import ClientError
 from flask import current_app
+from flask_sqlalchemy import Pagination
 from notifications_utils.international_billing_rates import INTERNATIONAL_BILLING_RATES
 from notifications_utils.recipients import (
     validate_and_format_email_address,
@@ -15,17 +16,19 @@ from notifications_utils.recipients import (
     try_validate_and_format_phone_number
 )
 from notifications_utils.timezones import convert_bst_to_utc, convert_utc_to_bst
-from sqlalchemy import (desc, func, asc, and_, or_)
+from sqlalchemy import (desc, func, asc, and_, or_, tuple_)
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import joinedload
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.sql import functions
 from sqlalchemy.sql.expression import case
 from werkzeug.datastructures import MultiDict
 
-from app import db, create_uuid
-from app.aws.s3 import remove_s3_object, get_s3_bucket_objects
+from app import db, create_uuid, redis_store
+from app.aws.s3 import remove_s3_objects_by_prefix
 from app.dao.dao_utils import transactional
 from app.letters.utils import get_letter_pdf_filename
+from app.notification_counts import record_notification_status_changes
 from app.models import (
     FactNotificationStatus,
     Notification,
@@ -48,11 +51,32 @@ from app.models import (
     EMAIL_TYPE,
     ServiceDataRetention,
     Service,
+    User,
 )
 from app.utils import get_london_midnight_in_utc
 from app.utils import midnight_n_days_ago, escape_special_characters
 from app.clients.sms.firetext import get_message_status_and_reason_from_firetext_code
 
+# how much of the notifications table the nightly purge works through at a time
+PURGE_WINDOW = timedelta(hours=1)
+PURGE_CURSOR_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+# what's needed to list a notification without loading it, see app.notifications.notification_list
+NOTIFICATION_LIST_COLUMNS = (
+    Notification.id,
+    Notification.to,
+    Notification.client_reference,
+    Notification.notification_type,
+    Notification.status,
+    Notification.template_id,
+    Notification.template_version,
+    Notification._personalisation,
+    Notification.created_at,
+    Notification.sent_at,
+    Notification.updated_at,
+    Notification.postage,
+)
+
 
 def dao_get_last_date_template_was_used(template_id, service_id):
     last_date_from_notifications = db.session.query(
@@ -87,19 +111,62 @@ def dao_create_notification(notification):
     db.session.add(notification)
 
 
-def _decide_permanent_temporary_failure(status, notification, detailed_status_code=None):
-    # If we get failure status from Firetext, we want to know if this is temporary or permanent failure.
-    # So we check the failure code to learn that.
-    # If there is no failure code, or we do not recognise the failure code, we do the following:
-    # if notifitcation goes form status pending to status failure, we mark it as temporary failure;
-    # if notification goes straight to status failure, we mark it as permanent failure.
+@transactional
+def dao_create_notifications(notifications):
+    """
+    Insert many notifications with one multi-row INSERT rather than flushing each ORM object separately.
+    Notifications whose id already exists are ignored. Returns the ids that were inserted.
+    """
+    if not notifications:
+        return []
+
+    table = Notification.__table__
+    stmt = insert(table).values(
+        [_notification_insert_values(notification) for notification in notifications]
+    ).on_conflict_do_nothing(
+        index_elements=[table.c.id]
+    ).returning(table.c.id)
+
+    return [row.id for row in db.session.connection().execute(stmt)]
+
+
+def _notification_insert_values(notification):
+    if not notification.id:
+        notification.id = create_uuid()
+    if not notification.status:
+        notification.status = NOTIFICATION_CREATED
+
+    values = {}
+    for column in Notification.__table__.columns:
+        value = getattr(notification, column.key)
+        # the ORM leaves out unset attributes so that column defaults apply, a multi-row INSERT has to fill them in
+        if value is None and column.default is not None and column.default.is_scalar:
+            value = column.default.arg
+        values[column.key] = value
+    return values
+
+
+def _get_status_from_failure_code(status, notification_id, detailed_status_code=None):
+    # Returns the status for a failure code Firetext told us about, or None if there isn't a code we recognise
     if status == NOTIFICATION_PERMANENT_FAILURE and detailed_status_code not in [None, '000']:
         try:
             status, reason = get_message_status_and_reason_from_firetext_code(detailed_status_code)
-            current_app.logger.info(f'Updating notification id {notification.id} to status {status}, reason: {reason}')
+            current_app.logger.info(f'Updating notification id {notification_id} to status {status}, reason: {reason}')
             return status
         except KeyError:
             current_app.logger.warning(f'Failure code {detailed_status_code} from Firetext not recognised')
+    return None
+
+
+def _decide_permanent_temporary_failure(status, notification, detailed_status_code=None):
+    # If we get failure status from Firetext, we want to know if this is temporary or permanent failure.
+    # So we check the failure code to learn that.
+    # If there is no failure code, or we do not recognise the failure code, we do the following:
+    # if notifitcation goes form status pending to status failure, we mark it as temporary failure;
+    # if notification goes straight to status failure, we mark it as permanent failure.
+    status_from_failure_code = _get_status_from_failure_code(status, notification.id, detailed_status_code)
+    if status_from_failure_code:
+        return status_from_failure_code
     # fallback option:
     if notification.status == NOTIFICATION_PENDING and status == NOTIFICATION_PERMANENT_FAILURE:
         status = NOTIFICATION_TEMPORARY_FAILURE
@@ -115,8 +182,10 @@ def _update_notification_status(notification, status, detailed_status_code=None)
     status = _decide_permanent_temporary_failure(
         status=status, notification=notification, detailed_status_code=detailed_status_code
     )
+    previous_status = notification.status
     notification.status = status
     dao_update_notification(notification)
+    record_notification_status_changes([(notification, previous_status)])
     return notification
 
 
@@ -156,6 +225,93 @@ def update_notification_status_by_id(notification_id, status, sent_by=None, deta
     )
 
 
+def dao_update_notification_statuses_by_id(status_updates):
+    """
+    Apply many delivery receipts with one UPDATE ... FROM (VALUES ...) instead of locking and committing
+    each notification in turn. Follows the same rules as `update_notification_status_by_id`. Each
+    notification should appear at most once in `status_updates`.
+
+    :param status_updates: list of (notification_id, status, sent_by, detailed_status_code) tuples
+    :return: the notifications that were updated
+    """
+    previous_statuses = _update_notification_statuses_by_id(status_updates)
+    if not previous_statuses:
+        return []
+    notifications = Notification.query.filter(Notification.id.in_(previous_statuses)).all()
+    record_notification_status_changes(
+        (notification, previous_statuses[str(notification.id)]) for notification in notifications
+    )
+    return notifications
+
+
+@transactional
+def _update_notification_statuses_by_id(status_updates):
+    if not status_updates:
+        return []
+
+    values = []
+    params = {
+        'updated_at': datetime.utcnow(),
+        'updatable_statuses': [
+            NOTIFICATION_CREATED,
+            NOTIFICATION_SENDING,
+            NOTIFICATION_PENDING,
+            NOTIFICATION_SENT,
+            NOTIFICATION_PENDING_VIRUS_CHECK,
+        ],
+        'prefixes_without_delivery_receipts': [
+            prefix for prefix in INTERNATIONAL_BILLING_RATES if not country_records_delivery(prefix)
+        ],
+        'permanent_failure': NOTIFICATION_PERMANENT_FAILURE,
+        'temporary_failure': NOTIFICATION_TEMPORARY_FAILURE,
+        'pending': NOTIFICATION_PENDING,
+    }
+    for i, (notification_id, status, sent_by, detailed_status_code) in enumerate(status_updates):
+        status_from_failure_code = _get_status_from_failure_code(status, notification_id, detailed_status_code)
+        values.append(f'(CAST(:id_{i} AS uuid), :status_{i}, :sent_by_{i}, :use_fallback_{i})')
+        params.update({
+            f'id_{i}': str(notification_id),
+            f'status_{i}': status_from_failure_code or status,
+            f'sent_by_{i}': sent_by,
+            f'use_fallback_{i}': status_from_failure_code is None,
+        })
+
+    # the CASE is the fallback from _decide_permanent_temporary_failure for failures without a recognised code
+    query = """
+        UPDATE notifications
+        SET notification_status = CASE
+                WHEN receipts.use_fallback
+                    AND notifications.notification_status = :pending
+                    AND receipts.status = :permanent_failure
+                THEN :temporary_failure
+                ELSE receipts.status
+            END,
+            sent_by = COALESCE(notifications.sent_by, receipts.sent_by),
+            updated_at = :updated_at
+        FROM (VALUES {}) AS receipts (id, status, sent_by, use_fallback), notifications AS previous
+        WHERE notifications.id = receipts.id
+          AND previous.id = notifications.id
+          AND notifications.notification_status = ANY(:updatable_statuses)
+          AND NOT (
+            notifications.notification_type = 'sms'
+            AND notifications.international
+            AND notifications.phone_prefix = ANY(:prefixes_without_delivery_receipts)
+          )
+        RETURNING notifications.id, previous.notification_status AS previous_status
+    """.format(', '.join(values))
+
+    # `previous` is read from before the update, so gives each notification's old status
+    previous_statuses = {str(row.id): row.previous_status for row in db.session.execute(query, params)}
+
+    if len(previous_statuses) != len(status_updates):
+        current_app.logger.info('{} of {} status updates were not applied (notification not found, {}'.format(
+            len(status_updates) - len(previous_statuses),
+            len(status_updates),
+            'already in a final state or international with no delivery receipts)'
+        ))
+    return previous_statuses
+
+
 @transactional
 def update_notification_status_by_reference(reference, status):
     # this is used to update letters and emails
@@ -184,6 +340,14 @@ def dao_update_notification(notification):
     db.session.add(notification)
 
 
+@transactional
+def dao_update_notifications(notifications):
+    updated_at = datetime.utcnow()
+    for notification in notifications:
+        notification.updated_at = updated_at
+        db.session.add(notification)
+
+
 def get_notification_for_job(service_id, job_id, notification_id):
     return Notification.query.filter_by(service_id=service_id, job_id=job_id, id=notification_id).one()
 
@@ -239,20 +403,134 @@ def get_notifications_for_service(
         include_from_test_key=False,
         older_than=None,
         client_reference=None,
-        include_one_off=True
+        include_one_off=True,
+        with_relationships=False
 ):
+    """
+    :param with_relationships: load each notification's template, job, api key and creator in the same query, for
+        when they'll all be serialised
+    """
     if page_size is None:
         page_size = current_app.config['PAGE_SIZE']
 
-    filters = [Notification.service_id == service_id]
-
-    if limit_days is not None:
-        filters.append(Notification.created_at >= midnight_n_days_ago(limit_days))
+    query = _notifications_for_service_query(
+        service_id,
+        filter_dict=filter_dict,
+        limit_days=limit_days,
+        key_type=key_type,
+        personalisation=personalisation,
+        include_jobs=include_jobs,
+        include_from_test_key=include_from_test_key,
+        client_reference=client_reference,
+        include_one_off=include_one_off,
+    )
 
     if older_than is not None:
         older_than_created_at = db.session.query(
             Notification.created_at).filter(Notification.id == older_than).as_scalar()
-        filters.append(Notification.created_at < older_than_created_at)
+        query = query.filter(Notification.created_at < older_than_created_at)
+
+    if with_relationships:
+        query = query.options(
+            joinedload('template'),
+            joinedload('job'),
+            joinedload('api_key'),
+            joinedload('created_by'),
+        )
+
+    return query.order_by(desc(Notification.created_at)).paginate(
+        page=page,
+        per_page=page_size,
+        count=count_pages
+    )
+
+
+def get_notifications_for_service_before(
+        service_id,
+        page_size,
+        before_created_at=None,
+        before_id=None,
+        filter_dict=None,
+        key_type=None,
+        personalisation=False,
+        include_jobs=False,
+        client_reference=None,
+):
+    """
+    Get a page of a service's notifications, newest first, using the (created_at, id) of the last notification on the
+    previous page rather than an offset. There's no count query and each page costs the same however far back it is.
+
+    If only `before_id` is given, the created_at of that notification is looked up. Returns a list of notifications.
+    """
+    query = _notifications_for_service_query(
+        service_id,
+        filter_dict=filter_dict,
+        key_type=key_type,
+        personalisation=personalisation,
+        include_jobs=include_jobs,
+        client_reference=client_reference,
+    )
+    return _page_before(query, page_size, before_created_at, before_id).all()
+
+
+def get_notification_rows_for_service_before(
+        service_id,
+        page_size,
+        before_created_at=None,
+        before_id=None,
+        filter_dict=None,
+        key_type=None,
+        include_jobs=False,
+        client_reference=None,
+):
+    """
+    The same page of notifications as `get_notifications_for_service_before`, but only the columns needed to list
+    them - see NOTIFICATION_LIST_COLUMNS - along with the name of whoever sent each one, all in a single query.
+    Returns a list of rows rather than Notification objects.
+    """
+    query = _notifications_for_service_query(
+        service_id,
+        filter_dict=filter_dict,
+        key_type=key_type,
+        include_jobs=include_jobs,
+        client_reference=client_reference,
+    ).outerjoin(
+        User, User.id == Notification.created_by_id
+    ).with_entities(
+        *NOTIFICATION_LIST_COLUMNS, User.name.label('created_by_name')
+    )
+    return _page_before(query, page_size, before_created_at, before_id).all()
+
+
+def _page_before(query, page_size, before_created_at, before_id):
+    if before_id is not None:
+        if before_created_at is None:
+            before_created_at = db.session.query(
+                Notification.created_at).filter(Notification.id == before_id).as_scalar()
+        query = query.filter(
+            tuple_(Notification.created_at, Notification.id) < tuple_(before_created_at, str(before_id))
+        )
+
+    return query.order_by(
+        desc(Notification.created_at), desc(Notification.id)
+    ).limit(page_size)
+
+
+def _notifications_for_service_query(
+        service_id,
+        filter_dict=None,
+        limit_days=None,
+        key_type=None,
+        personalisation=False,
+        include_jobs=False,
+        include_from_test_key=False,
+        client_reference=None,
+        include_one_off=True
+):
+    filters = [Notification.service_id == service_id]
+
+    if limit_days is not None:
+        filters.append(Notification.created_at >= midnight_n_days_ago(limit_days))
 
     if not include_jobs:
         filters.append(Notification.job_id == None)  # noqa
@@ -274,12 +552,7 @@ def get_notifications_for_service(
         query = query.options(
             joinedload('template')
         )
-
-    return query.order_by(desc(Notification.created_at)).paginate(
-        page=page,
-        per_page=page_size,
-        count=count_pages
-    )
+    return query
 
 
 def _filter_query(query, filter_dict=None):
@@ -303,142 +576,193 @@ def _filter_query(query, filter_dict=None):
 
 
 def delete_notifications_older_than_retention_by_type(notification_type, qry_limit=50000):
-    current_app.logger.info(
-        'Deleting {} notifications for services with flexible data retention'.format(notification_type))
+    """
+    Moves a type of notification that's past its service's data retention to notification_history, and returns how
+    many were moved. Notifications with test keys are deleted rather than moved.
 
+    Services are purged together, a group for each length of retention, rather than one at a time.
+    """
     flexible_data_retention = ServiceDataRetention.query.filter(
         ServiceDataRetention.notification_type == notification_type
     ).all()
-    deleted = 0
+    services_by_days_of_retention = defaultdict(list)
     for f in flexible_data_retention:
-        current_app.logger.info(
-            "Deleting {} notifications for service id: {}".format(notification_type, f.service_id))
-
-        day_to_delete_backwards_from = get_london_midnight_in_utc(
-            convert_utc_to_bst(datetime.utcnow()).date()) - timedelta(days=f.days_of_retention)
+        services_by_days_of_retention[f.days_of_retention].append(str(f.service_id))
 
-        deleted += _move_notifications_to_notification_history(
-            notification_type, f.service_id, day_to_delete_backwards_from, qry_limit)
+    today = get_london_midnight_in_utc(convert_utc_to_bst(datetime.utcnow()).date())
+    deleted = 0
+    for days_of_retention, service_ids in sorted(services_by_days_of_retention.items()):
+        current_app.logger.info('Deleting {} notifications for {} services with {} days of retention'.format(
+            notification_type, len(service_ids), days_of_retention))
+
+        deleted += _purge_notifications(
+            notification_type,
+            today - timedelta(days=days_of_retention),
+            qry_limit,
+            group='{}-days'.format(days_of_retention),
+            service_filter='service_id = ANY(CAST(:service_ids AS uuid[]))',
+            service_ids=service_ids,
+        )
 
     current_app.logger.info(
         'Deleting {} notifications for services without flexible data retention'.format(notification_type))
 
-    seven_days_ago = get_london_midnight_in_utc(convert_utc_to_bst(datetime.utcnow()).date()) - timedelta(days=7)
-    services_with_data_retention = [x.service_id for x in flexible_data_retention]
-    service_ids_to_purge = db.session.query(Service.id).filter(Service.id.notin_(services_with_data_retention)).all()
-
-    for service_id in service_ids_to_purge:
-        deleted += _move_notifications_to_notification_history(
-            notification_type, service_id, seven_days_ago, qry_limit)
+    deleted += _purge_notifications(
+        notification_type,
+        today - timedelta(days=7),
+        qry_limit,
+        group='default',
+        service_filter="""NOT EXISTS (
+            SELECT 1 FROM service_data_retention
+             WHERE service_data_retention.service_id = notifications.service_id
+               AND service_data_retention.notification_type = :notification_type
+        )""",
+    )
 
     current_app.logger.info('Finished deleting {} notifications'.format(notification_type))
 
     return deleted
 
 
-@transactional
-def insert_notification_history_delete_notifications(
-    notification_type, service_id, timestamp_to_delete_backwards_from, qry_limit=50000
-):
-    # Setting default query limit to 50,000 which take about 48 seconds on current table size
-    # 10, 000 took 11s and 100,000 took 1 min 30 seconds.
-    drop_table_if_exists = """
-        DROP TABLE if exists NOTIFICATION_ARCHIVE
-        """
-    select_into_temp_table = """
-         CREATE TEMP TABLE NOTIFICATION_ARCHIVE AS
-         SELECT id, job_id, job_row_number, service_id, template_id, template_version, api_key_id,
-             key_type, notification_type, created_at, sent_at, sent_by, updated_at, reference, billable_units,
-             client_reference, international, phone_prefix, rate_multiplier, notification_status,
-              created_by_id, postage, document_download_count
-          FROM notifications
-        WHERE service_id = :service_id
-          AND notification_type = :notification_type
-          AND created_at < :timestamp_to_delete_backwards_from
-          AND key_type in ('normal', 'team')
-        limit :qry_limit
-        """
-    select_into_temp_table_for_letters = """
-         CREATE TEMP TABLE NOTIFICATION_ARCHIVE AS
-         SELECT id, job_id, job_row_number, service_id, template_id, template_version, api_key_id,
-             key_type, notification_type, created_at, sent_at, sent_by, updated_at, reference, billable_units,
-             client_reference, international, phone_prefix, rate_multiplier, notification_status,
-              created_by_id, postage, document_download_count
-          FROM notifications
-        WHERE service_id = :service_id
-          AND notification_type = :notification_type
-          AND created_at < :timestamp_to_delete_backwards_from
-          AND notification_status NOT IN ('pending-virus-check', 'created', 'sending')
-          AND key_type in ('normal', 'team')
-        limit :qry_limit
-        """
-    # Insert into NotificationHistory if the row already exists do nothing.
-    insert_query = """
-        insert into notification_history
-         SELECT * from NOTIFICATION_ARCHIVE
-          ON CONFLICT ON CONSTRAINT notification_history_pkey
-          DO NOTHING
+def _purge_notifications(notification_type, delete_before, qry_limit, group, service_filter, **params):
     """
-    delete_query = """
-        DELETE FROM notifications
-        where id in (select id from NOTIFICATION_ARCHIVE)
+    Moves the notifications picked out by `service_filter` (some SQL, with its `params`) that were created before
+    `delete_before`, a window of PURGE_WINDOW at a time working forwards from the oldest.
+
+    After each window the cursor is saved to redis under `group`, so if the purge stops part way it can start again
+    from there rather than from the oldest notification. Anything before the cursor that hasn't been moved has been
+    left deliberately, like letters that haven't finished yet, so starting again from the oldest is only slower.
     """
-    input_params = {
-        "service_id": service_id,
-        "notification_type": notification_type,
-        "timestamp_to_delete_backwards_from": timestamp_to_delete_backwards_from,
-        "qry_limit": qry_limit
-    }
+    cursor_key = 'notification-purge-cursor-{}-{}-{}'.format(
+        notification_type, group, delete_before.strftime(PURGE_CURSOR_FORMAT))
+    params = dict(params, notification_type=notification_type)
 
-    db.session.execute(drop_table_if_exists)
+    if notification_type == LETTER_TYPE:
+        for service_id in _get_services_with_letters_to_delete_from_s3(delete_before, service_filter, params):
+            _delete_letters_from_s3(notification_type, service_id, delete_before)
 
-    select_to_use = select_into_temp_table_for_letters if notification_type == 'letter' else select_into_temp_table
-    db.session.execute(select_to_use, input_params)
+    saved_cursor = redis_store.get(cursor_key)
+    cursor = datetime.strptime(saved_cursor.decode('utf-8'), PURGE_CURSOR_FORMAT) if saved_cursor else datetime.min
 
-    result = db.session.execute("select * from NOTIFICATION_ARCHIVE")
+    deleted = 0
+    while True:
+        # skip straight past any stretch without notifications for these services, rather than checking it a window
+        # at a time
+        cursor = db.session.execute("""
+            SELECT min(created_at)
+              FROM notifications
+             WHERE {service_filter}
+               AND notification_type = :notification_type
+               AND created_at >= :cursor
+               AND created_at < :delete_before
+        """.format(service_filter=service_filter), dict(
+            params,
+            cursor=cursor,
+            delete_before=delete_before,
+        )).scalar()
+        if cursor is None:
+            break
+
+        window_end = min(cursor + PURGE_WINDOW, delete_before)
+        while True:
+            total, moved = move_notifications_to_notification_history(
+                notification_type, cursor, window_end, service_filter, params, qry_limit
+            )
+            deleted += moved
+            if not total:
+                break
+
+        cursor = window_end
+        redis_store.set(cursor_key, cursor.strftime(PURGE_CURSOR_FORMAT), ex=int(timedelta(days=1).total_seconds()))
 
-    db.session.execute(insert_query)
+    return deleted
 
-    db.session.execute(delete_query)
 
-    db.session.execute("DROP TABLE NOTIFICATION_ARCHIVE")
-    return result.rowcount
+def _get_services_with_letters_to_delete_from_s3(delete_before, service_filter, params):
+    return [row.service_id for row in db.session.execute("""
+        SELECT DISTINCT service_id
+          FROM notifications
+         WHERE {service_filter}
+           AND notification_type = :notification_type
+           AND created_at < :delete_before
+           AND notification_status = ANY(:statuses)
+    """.format(service_filter=service_filter), dict(
+        params,
+        delete_before=delete_before,
+        statuses=NOTIFICATION_STATUS_TYPES_COMPLETED,
+    ))]
 
 
-def _move_notifications_to_notification_history(notification_type, service_id, day_to_delete_backwards_from, qry_limit):
-    deleted = 0
-    if notification_type == LETTER_TYPE:
-        _delete_letters_from_s3(
-            notification_type, service_id, day_to_delete_backwards_from, qry_limit
-        )
-    delete_count_per_call = 1
-    while delete_count_per_call > 0:
-        delete_count_per_call = insert_notification_history_delete_notifications(
-            notification_type=notification_type,
-            service_id=service_id,
-            timestamp_to_delete_backwards_from=day_to_delete_backwards_from,
-            qry_limit=qry_limit
+@transactional
+def move_notifications_to_notification_history(
+    notification_type, created_from, created_before, service_filter, params, qry_limit=50000
+):
+    """
+    Deletes up to `qry_limit` notifications of a type that were created in [created_from, created_before) from
+    notifications, copying them to notification_history unless they were sent with a test key. `service_filter` is
+    some SQL, with its `params`, saying which services' notifications to delete.
+
+    Letters that haven't finished yet are left alone.
+
+    Returns how many notifications were deleted, and how many of those were copied.
+    """
+    letter_status_filter = """
+        AND (key_type = 'test' OR notification_status NOT IN ('pending-virus-check', 'created', 'sending'))
+    """
+    # if the row is already in notification_history do nothing, but still delete it from notifications
+    move_query = """
+        WITH moved AS (
+            DELETE FROM notifications
+            WHERE id IN (
+                SELECT id
+                  FROM notifications
+                 WHERE {service_filter}
+                   AND notification_type = :notification_type
+                   AND created_at >= :created_from
+                   AND created_at < :created_before
+                   {letter_status_filter}
+                 LIMIT :qry_limit
+            )
+            RETURNING {columns}
+        ), inserted AS (
+            INSERT INTO notification_history ({columns})
+            SELECT {columns} FROM moved WHERE key_type != 'test'
+            ON CONFLICT ON CONSTRAINT notification_history_pkey
+            DO NOTHING
         )
-        deleted += delete_count_per_call
+        SELECT count(*), count(*) FILTER (WHERE key_type != 'test') FROM moved
+    """.format(
+        service_filter=service_filter,
+        columns=NOTIFICATION_HISTORY_COLUMNS,
+        letter_status_filter=letter_status_filter if notification_type == LETTER_TYPE else '',
+    )
 
-    # Deleting test Notifications, test notifications are not persisted to NotificationHistory
-    Notification.query.filter(
-        Notification.notification_type == notification_type,
-        Notification.service_id == service_id,
-        Notification.created_at < day_to_delete_backwards_from,
-        Notification.key_type == KEY_TYPE_TEST
-    ).delete(synchronize_session=False)
-    db.session.commit()
+    return tuple(db.session.execute(move_query, dict(
+        params,
+        notification_type=notification_type,
+        created_from=created_from,
+        created_before=created_before,
+        qry_limit=qry_limit,
+    )).first())
 
-    return deleted
 
+NOTIFICATION_HISTORY_COLUMNS = """
+    id, job_id, job_row_number, service_id, template_id, template_version, api_key_id, key_type, notification_type,
+    created_at, sent_at, sent_by, updated_at, reference, billable_units, client_reference, international, phone_prefix,
+    rate_multiplier, notification_status, created_by_id, postage, document_download_count
+"""
 
-def _delete_letters_from_s3(
-        notification_type, service_id, date_to_delete_from, query_limit
-):
+
+def _delete_letters_from_s3(notification_type, service_id, date_to_delete_from):
     bucket_name = current_app.config['LETTERS_PDF_BUCKET_NAME']
     letters_to_delete_from_s3 = db.session.query(
-        Notification
+        Notification.reference,
+        Notification.created_at,
+        Notification.key_type,
+        Notification.postage,
+        Service.crown,
+    ).join(
+        Notification.service
     ).filter(
         Notification.notification_type == notification_type,
         Notification.created_at < date_to_delete_from,
@@ -447,20 +771,20 @@ def _delete_letters_from_s3(
         # production-letters-pdf bucket as they never made it that far so we do not try and delete
         # them from it
         Notification.status.in_(NOTIFICATION_STATUS_TYPES_COMPLETED)
-    ).limit(query_limit).all()
-    for letter in letters_to_delete_from_s3:
-        prefix = get_letter_pdf_filename(reference=letter.reference,
-                                         crown=letter.service.crown,
-                                         created_at=letter.created_at,
-                                         ignore_folder=letter.key_type == KEY_TYPE_TEST,
-                                         postage=letter.postage)
-        s3_objects = get_s3_bucket_objects(bucket_name=bucket_name, subfolder=prefix)
-        for s3_object in s3_objects:
-            try:
-                remove_s3_object(bucket_name, s3_object['Key'])
-            except ClientError:
-                current_app.logger.exception(
-                    "Could not delete S3 object with filename: {}".format(s3_object['Key']))
+    ).yield_per(1000)
+    prefixes = (
+        get_letter_pdf_filename(reference=letter.reference,
+                                crown=letter.crown,
+                                created_at=letter.created_at,
+                                ignore_folder=letter.key_type == KEY_TYPE_TEST,
+                                postage=letter.postage)
+        for letter in letters_to_delete_from_s3
+    )
+    failures = remove_s3_objects_by_prefix(
+        bucket_name, prefixes, max_workers=current_app.config['LETTER_S3_DELETE_CONCURRENCY']
+    )
+    for key, error in failures:
+        current_app.logger.error("Could not delete S3 object with filename: {}: {}".format(key, error))
 
 
 @transactional
@@ -601,7 +925,18 @@ def dao_get_notifications_by_recipient_or_reference(
     statuses=None,
     page=1,
     page_size=None,
+    limit_days=None,
 ):
+    """
+    Search a service's notifications for ones whose recipient or reference contain `search_term`. The matching is
+    done by the trigram indexes on normalised_to and client_reference, narrowed down to the service's notifications
+    from the last `limit_days` days if given.
+
+    The matches aren't counted. Instead one more notification than fits on the page is fetched to tell whether there's
+    a next page, so the pagination's total is only a lower bound - enough for its next and previous pages.
+    """
+    if page_size is None:
+        page_size = current_app.config['PAGE_SIZE']
 
     if notification_type == SMS_TYPE:
         normalised = try_validate_and_format_phone_number(search_term)
@@ -647,12 +982,12 @@ def dao_get_notifications_by_recipient_or_reference(
         filters.append(Notification.status.in_(statuses))
     if notification_type:
         filters.append(Notification.notification_type == notification_type)
+    if limit_days is not None:
+        filters.append(Notification.created_at >= midnight_n_days_ago(limit_days))
 
-    results = db.session.query(Notification)\
-        .filter(*filters)\
-        .order_by(desc(Notification.created_at))\
-        .paginate(page=page, per_page=page_size)
-    return results
+    query = db.session.query(Notification).filter(*filters).order_by(desc(Notification.created_at))
+    items = query.offset((page - 1) * page_size).limit(page_size + 1).all()
+    return Pagination(query, page, page_size, (page - 1) * page_size + len(items), items[:page_size])
 
 
 def dao_get_notification_by_reference(reference):
@@ -674,12 +1009,65 @@ def dao_get_notification_or_history_by_reference(reference):
         ).one()
 
 
+def dao_get_notifications_or_history_by_references(references):
+    # as with dao_get_notification_or_history_by_reference, only look in notification_history for references
+    # that aren't in notifications
+    notifications = Notification.query.filter(
+        Notification.reference.in_(references)
+    ).all()
+    missing_references = set(references) - {notification.reference for notification in notifications}
+    if missing_references:
+        notifications += NotificationHistory.query.filter(
+            NotificationHistory.reference.in_(missing_references)
+        ).all()
+    return notifications
+
+
+@transactional
+def dao_update_notification_statuses_by_reference(references_by_status):
+    """
+    Set each notification's status to the one its reference is listed under, in a single UPDATE (plus one against
+    notification_history if some weren't in notifications) committed together.
+    """
+    status_by_reference = {
+        reference: status
+        for status, references in references_by_status.items()
+        for reference in references
+    }
+
+    updated_count = Notification.query.filter(
+        Notification.reference.in_(list(status_by_reference))
+    ).update(
+        {'status': case(status_by_reference, value=Notification.reference)},
+        synchronize_session=False
+    )
+
+    updated_history_count = 0
+    if updated_count != len(status_by_reference):
+        updated_history_count = NotificationHistory.query.filter(
+            NotificationHistory.reference.in_(list(status_by_reference))
+        ).update(
+            {'status': case(status_by_reference, value=NotificationHistory.reference)},
+            synchronize_session=False
+        )
+
+    return updated_count, updated_history_count
+
+
 def dao_get_notifications_by_references(references):
     return Notification.query.filter(
         Notification.reference.in_(references)
     ).all()
 
 
+def dao_get_notifications_by_ids(notification_ids):
+    return Notification.query.filter(
+        Notification.id.in_(notification_ids)
+    ).options(
+        joinedload('service')
+    ).all()
+
+
 def dao_get_total_notifications_sent_per_day_for_performance_platform(start_date, end_date):
     """
     SELECT
@@ -725,6 +1113,21 @@ def dao_get_last_notification_added_for_job_id(job_id):
     return last_notification_added
 
 
+def dao_get_last_row_number_added_for_job_rows(job_id, start_row, end_row=None):
+    filters = [
+        Notification.job_id == job_id,
+        Notification.job_row_number >= start_row,
+    ]
+    if end_row is not None:
+        filters.append(Notification.job_row_number < end_row)
+
+    return db.session.query(
+        func.max(Notification.job_row_number)
+    ).filter(
+        *filters
+    ).scalar()
+
+
 def notifications_not_yet_sent(should_be_sending_after_seconds, notification_type):
     older_than_date = datetime.utcnow() - timedelta(seconds=should_be_sending_after_seconds)
 
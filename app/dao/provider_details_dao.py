@@ -1,3 +1,4 @@
+import functools
 from datetime import datetime, timedelta
 
 from notifications_utils.timezones import convert_utc_to_bst
@@ -6,7 +7,26 @@ from flask import current_app
 
 from app.dao.dao_utils import transactional
 from app.models import FactBilling, ProviderDetails, ProviderDetailsHistory, SMS_TYPE, User
-from app import db
+from app import db, redis_store
+
+PROVIDER_DETAILS_UPDATED_CHANNEL = 'provider-details-updated'
+
+
+def publishes_provider_details_update(func):
+    """
+    Tell every process to reload its provider routing table once the wrapped function (and its transaction) is done
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        result = func(*args, **kwargs)
+        if current_app.config['REDIS_ENABLED']:
+            try:
+                redis_store.redis_store.publish(PROVIDER_DETAILS_UPDATED_CHANNEL, func.__name__)
+            except Exception:
+                # routing tables also expire on their own, so this only delays the change
+                current_app.logger.exception('Could not publish provider details update')
+        return result
+    return wrapper
 
 
 def get_provider_details_by_id(provider_details_id):
@@ -69,6 +89,7 @@ def _get_sms_providers_for_update(time_threshold):
     return q
 
 
+@publishes_provider_details_update
 @transactional
 def dao_reduce_sms_provider_priority(identifier, *, time_threshold):
     """
@@ -95,6 +116,7 @@ def dao_reduce_sms_provider_priority(identifier, *, time_threshold):
     _adjust_provider_priority(increased_provider, increased_provider_priority)
 
 
+@publishes_provider_details_update
 @transactional
 def dao_adjust_provider_priority_back_to_resting_points():
     """
@@ -129,6 +151,7 @@ def get_provider_details_by_notification_type(notification_type, supports_intern
     return ProviderDetails.query.filter(*filters).order_by(asc(ProviderDetails.priority)).all()
 
 
+@publishes_provider_details_update
 @transactional
 def dao_update_provider_details(provider_details):
     _update_provider_details_without_commit(provider_details)
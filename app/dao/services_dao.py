@@ -1,10 +1,12 @@
 import uuid
+from collections import Counter, namedtuple
 from datetime import date, datetime, timedelta
 
 from sqlalchemy.sql.expression import asc, case, and_, func
 from sqlalchemy.orm import joinedload
 from sqlalchemy import cast, Float
 from flask import current_app
+from notifications_utils.timezones import convert_utc_to_bst
 
 from app import db
 from app.dao.date_util import get_current_financial_year
@@ -19,6 +21,7 @@ from app.dao.organisation_dao import dao_get_organisation_by_email_address
 from app.dao.service_sms_sender_dao import insert_service_sms_sender
 from app.dao.service_user_dao import dao_get_service_user
 from app.dao.template_folder_dao import dao_get_valid_template_folders_by_id
+from app.notification_counts import get_todays_notification_counts_for_services
 from app.models import (
     AnnualBilling,
     ApiKey,
@@ -354,6 +357,7 @@ def dao_add_user_to_service(service, user, permissions=None, folder_permissions=
 
     try:
         from app.dao.permissions_dao import permission_dao
+        from app.serialised_models import SerialisedAllowedRecipients
         service.users.append(user)
         permission_dao.set_user_service_permission(user, service, permissions, _commit=False)
         db.session.add(service)
@@ -368,11 +372,13 @@ def dao_add_user_to_service(service, user, permissions=None, folder_permissions=
         raise e
     else:
         db.session.commit()
+        SerialisedAllowedRecipients.remove_from_cache(service.id)
 
 
 def dao_remove_user_from_service(service, user):
     try:
         from app.dao.permissions_dao import permission_dao
+        from app.serialised_models import SerialisedAllowedRecipients
         permission_dao.remove_user_service_permissions(user, service)
 
         service_user = dao_get_service_user(user.id, service.id)
@@ -382,6 +388,7 @@ def dao_remove_user_from_service(service, user):
         raise e
     else:
         db.session.commit()
+        SerialisedAllowedRecipients.remove_from_cache(service.id)
 
 
 def delete_service_and_all_associated_db_objects(service):
@@ -439,17 +446,15 @@ def dao_fetch_todays_stats_for_service(service_id):
 
 
 def fetch_todays_total_message_count(service_id):
-    result = db.session.query(
-        func.count(Notification.id).label('count')
+    today = convert_utc_to_bst(datetime.utcnow()).date()
+    return db.session.query(
+        func.count(Notification.id)
     ).filter(
         Notification.service_id == service_id,
         Notification.key_type != KEY_TYPE_TEST,
-        func.date(Notification.created_at) == date.today()
-    ).group_by(
-        Notification.notification_type,
-        Notification.status,
-    ).first()
-    return 0 if result is None else result.count
+        Notification.created_at >= get_london_midnight_in_utc(today),
+        Notification.created_at < get_london_midnight_in_utc(today + timedelta(days=1)),
+    ).scalar()
 
 
 def _stats_for_service_query(service_id):
@@ -466,7 +471,16 @@ def _stats_for_service_query(service_id):
     )
 
 
+TodaysStatsForService = namedtuple('TodaysStatsForService', [
+    'service_id', 'name', 'restricted', 'research_mode', 'active', 'created_at', 'notification_type', 'status', 'count'
+])
+
+
 def dao_fetch_todays_stats_for_all_services(include_from_test_key=True, only_active=True):
+    todays_stats = _fetch_todays_stats_for_all_services_from_counts(include_from_test_key, only_active)
+    if todays_stats is not None:
+        return todays_stats
+
     today = date.today()
     start_date = get_london_midnight_in_utc(today)
     end_date = get_london_midnight_in_utc(today + timedelta(days=1))
@@ -511,6 +525,42 @@ def dao_fetch_todays_stats_for_all_services(include_from_test_key=True, only_act
     return query.all()
 
 
+def _fetch_todays_stats_for_all_services_from_counts(include_from_test_key, only_active):
+    # the same rows as dao_fetch_todays_stats_for_all_services, from the counts in redis rather than notifications
+    if not current_app.config['REDIS_ENABLED']:
+        return None
+
+    query = db.session.query(
+        Service.id.label('service_id'),
+        Service.name,
+        Service.restricted,
+        Service.research_mode,
+        Service.active,
+        Service.created_at,
+    ).order_by(Service.id)
+    if only_active:
+        query = query.filter(Service.active)
+    services = query.all()
+
+    counts_by_service = get_todays_notification_counts_for_services([service.service_id for service in services])
+    if counts_by_service is None:
+        return None
+
+    rows = []
+    for service in services:
+        counts = Counter()
+        for row in counts_by_service[service.service_id]:
+            if include_from_test_key or row.key_type != KEY_TYPE_TEST:
+                counts[(row.notification_type, row.status)] += row.count
+        if not counts:
+            rows.append(TodaysStatsForService(*service, notification_type=None, status=None, count=None))
+        for (notification_type, status), count in sorted(counts.items()):
+            rows.append(TodaysStatsForService(
+                *service, notification_type=notification_type, status=status, count=count
+            ))
+    return rows
+
+
 @transactional
 @version_class(
     VersionOptions(ApiKey, must_write_history=False),
@@ -26,6 +26,7 @@ def create_secret_code():
 def save_user_attribute(usr, update_dict=None):
     db.session.query(User).filter_by(id=usr.id).update(update_dict or {})
     db.session.commit()
+    _remove_services_allowed_recipients_from_cache(usr)
 
 
 def save_model_user(user, update_dict=None, password=None, validated_email_access=False):
@@ -40,6 +41,13 @@ def save_model_user(user, update_dict=None, password=None, validated_email_acces
     else:
         db.session.add(user)
     db.session.commit()
+    _remove_services_allowed_recipients_from_cache(user)
+
+
+def _remove_services_allowed_recipients_from_cache(user):
+    # a team member's phone number or email address may have changed
+    from app.serialised_models import SerialisedAllowedRecipients
+    SerialisedAllowedRecipients.remove_from_cache(*(service.id for service in user.services))
 
 
 def create_user_code(user, code, code_type):
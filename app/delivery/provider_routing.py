@@ -0,0 +1,129 @@
+"""
+Choose which provider sends each notification without querying provider_details on the send path.
+
+Each process keeps a routing table per notification type: the active providers and an alias table built from their
+priorities, so every notification gets its own weighted draw in constant time. Tables are dropped when a
+provider-details-updated message arrives over redis pub/sub (see `publishes_provider_details_update`), and also
+expire on their own in case a message is missed or redis is disabled.
+"""
+import os
+import random
+from threading import Lock
+from time import monotonic
+
+from flask import current_app
+
+from app import redis_store
+from app.dao.provider_details_dao import (
+    PROVIDER_DETAILS_UPDATED_CHANNEL,
+    get_provider_details_by_notification_type,
+)
+
+# how long a routing table is used for when we can't rely on pub/sub to tell us it has changed
+UNSUBSCRIBED_MAX_AGE_SECONDS = 10
+SUBSCRIBED_MAX_AGE_SECONDS = 300
+RESUBSCRIBE_AFTER_SECONDS = 30
+
+
+class AliasTable:
+    """
+    Walker's alias method: O(n) to build, then each weighted choice costs one random index and one comparison.
+
+    If every weight is zero the items are chosen with equal probability.
+    """
+
+    def __init__(self, items, weights):
+        if not items:
+            raise ValueError('AliasTable needs at least one item')
+
+        self.items = list(items)
+        count = len(self.items)
+        total = sum(weights)
+        scaled = [weight * count / total for weight in weights] if total else [1] * count
+
+        self.probabilities = [1.0] * count
+        self.aliases = list(range(count))
+
+        small = [index for index, value in enumerate(scaled) if value < 1]
+        large = [index for index, value in enumerate(scaled) if value >= 1]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.probabilities[less] = scaled[less]
+            self.aliases[less] = more
+            scaled[more] = scaled[more] + scaled[less] - 1
+            (small if scaled[more] < 1 else large).append(more)
+
+    def choose(self, rng=random):
+        index = rng.randrange(len(self.items))
+        if rng.random() < self.probabilities[index]:
+            return self.items[index]
+        return self.items[self.aliases[index]]
+
+
+class ProviderRoutingTable:
+
+    def __init__(self):
+        self._tables = {}
+        self._lock = Lock()
+        self._listener = None
+        self._listener_pid = None
+        self._next_subscribe_attempt = 0
+
+    def choose_provider(self, notification_type, international=False):
+        """
+        Returns the identifier of an active provider, chosen at random weighted by priority
+        """
+        self._ensure_subscribed()
+
+        key = (notification_type, international)
+        entry = self._tables.get(key)
+        if entry is None or entry[1] < monotonic():
+            entry = self._load(notification_type, international)
+            self._tables[key] = entry
+        return entry[0].choose()
+
+    def clear(self, *_message):
+        self._tables = {}
+
+    def _load(self, notification_type, international):
+        active_providers = [
+            p for p in get_provider_details_by_notification_type(notification_type, international) if p.active
+        ]
+
+        if not active_providers:
+            current_app.logger.error(
+                "{} failed as no active providers".format(notification_type)
+            )
+            raise Exception("No active {} providers".format(notification_type))
+
+        max_age = SUBSCRIBED_MAX_AGE_SECONDS if self._listening() else UNSUBSCRIBED_MAX_AGE_SECONDS
+        return (
+            AliasTable([p.identifier for p in active_providers], [p.priority for p in active_providers]),
+            monotonic() + max_age,
+        )
+
+    def _listening(self):
+        return self._listener is not None and self._listener_pid == os.getpid() and self._listener.is_alive()
+
+    def _ensure_subscribed(self):
+        # celery and gunicorn fork after the app is created, so each process needs its own listener thread
+        if not current_app.config['REDIS_ENABLED'] or self._listening() or monotonic() < self._next_subscribe_attempt:
+            return
+
+        with self._lock:
+            if self._listening():
+                return
+            self._next_subscribe_attempt = monotonic() + RESUBSCRIBE_AFTER_SECONDS
+            try:
+                pubsub = redis_store.redis_store.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(**{PROVIDER_DETAILS_UPDATED_CHANNEL: self.clear})
+                self._listener = pubsub.run_in_thread(sleep_time=1, daemon=True)
+                self._listener_pid = os.getpid()
+            except Exception:
+                current_app.logger.exception('Could not subscribe to provider details updates')
+                self._listener = None
+            # we may have missed updates while we weren't listening
+            self.clear()
+
+
+routing_table = ProviderRoutingTable()
@@ -1,4 +1,5 @@
-import random
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from urllib import parse
 from datetime import datetime, timedelta
 from cachetools import TTLCache, cached
@@ -7,19 +8,19 @@ from notifications_utils.recipients import (
     validate_and_format_phone_number,
     validate_and_format_email_address
 )
-from notifications_utils.template import HTMLEmailTemplate, PlainTextEmailTemplate, SMSMessageTemplate
+from notifications_utils.template import SMSMessageTemplate
 
 from app import notification_provider_clients, statsd_client, create_uuid
 from app.dao.notifications_dao import (
-    dao_update_notification
-)
-from app.dao.provider_details_dao import (
-    get_provider_details_by_notification_type,
-    dao_reduce_sms_provider_priority
+    dao_update_notification,
+    dao_update_notifications,
 )
+from app.dao.provider_details_dao import dao_reduce_sms_provider_priority
 from app.celery.research_mode_tasks import send_sms_response, send_email_response
-from app.dao.templates_dao import dao_get_template_by_id
+from app.delivery import provider_routing
+from app.delivery.template_cache import get_template_dict, render_email
 from app.exceptions import NotificationTechnicalFailureException
+from app.notification_counts import record_notification_status_changes
 from app.models import (
     SMS_TYPE,
     KEY_TYPE_TEST,
@@ -43,10 +44,10 @@ def send_sms_to_provider(notification):
     if notification.status == 'created':
         provider = provider_to_use(SMS_TYPE, notification.international)
 
-        template_model = dao_get_template_by_id(notification.template_id, notification.template_version)
+        template_dict = get_template_dict(notification.template_id, notification.template_version)
 
         template = SMSMessageTemplate(
-            template_model.__dict__,
+            template_dict,
             values=notification.personalisation,
             prefix=service.name,
             show_prefix=service.prefix_sms,
@@ -59,7 +60,7 @@ def send_sms_to_provider(notification):
         else:
             try:
                 provider.send_sms(
-                    to=validate_and_format_phone_number(notification.to, international=notification.international),
+                    to=_formatted_phone_number(notification),
                     content=str(template),
                     reference=str(notification.id),
                     sender=notification.reply_to_text
@@ -73,17 +74,7 @@ def send_sms_to_provider(notification):
                 notification.billable_units = template.fragment_count
                 update_notification_to_sending(notification, provider)
 
-        delta_seconds = (datetime.utcnow() - notification.created_at).total_seconds()
-        statsd_client.timing("sms.total-time", delta_seconds)
-
-        if notification.key_type == KEY_TYPE_TEST:
-            statsd_client.timing("sms.test-key.total-time", delta_seconds)
-        else:
-            statsd_client.timing("sms.live-key.total-time", delta_seconds)
-            if str(service.id) in current_app.config.get('HIGH_VOLUME_SERVICE'):
-                statsd_client.timing("sms.live-key.high-volume.total-time", delta_seconds)
-            else:
-                statsd_client.timing("sms.live-key.not-high-volume.total-time", delta_seconds)
+        _record_total_time(notification)
 
 
 def send_email_to_provider(notification):
@@ -94,17 +85,12 @@ def send_email_to_provider(notification):
     if notification.status == 'created':
         provider = provider_to_use(EMAIL_TYPE)
 
-        template_dict = dao_get_template_by_id(notification.template_id, notification.template_version).__dict__
+        template_dict = get_template_dict(notification.template_id, notification.template_version)
 
-        html_email = HTMLEmailTemplate(
+        email = render_email(
             template_dict,
             values=notification.personalisation,
-            **get_html_email_options(service)
-        )
-
-        plain_text_email = PlainTextEmailTemplate(
-            template_dict,
-            values=notification.personalisation
+            html_email_options=get_cached_html_email_options(service)
         )
 
         if service.research_mode or notification.key_type == KEY_TYPE_TEST:
@@ -120,52 +106,287 @@ def send_email_to_provider(notification):
             reference = provider.send_email(
                 from_address,
                 validate_and_format_email_address(notification.to),
-                plain_text_email.subject,
-                body=str(plain_text_email),
-                html_body=str(html_email),
+                email.subject,
+                body=email.plain_text_body,
+                html_body=email.html_body,
                 reply_to_address=validate_and_format_email_address(email_reply_to) if email_reply_to else None,
             )
             notification.reference = reference
             update_notification_to_sending(notification, provider)
 
-        delta_seconds = (datetime.utcnow() - notification.created_at).total_seconds()
+        _record_total_time(notification)
+
+
+def send_sms_batch_to_provider(notifications):
+    """
+    Send a batch of SMS, making up to DELIVERY_BATCH_CONCURRENCY provider calls at once and saving the notifications
+    that were sent in a single transaction. Notifications that don't need a provider call (for example because
+    they're from a test key) are handled one at a time by `send_sms_to_provider`.
+
+    :return: a list of (notification, exception) for each notification that couldn't be sent or saved. Other
+        exceptions are only raised before any notification is handed to a provider.
+    """
+    prepared, failures = _prepare_batch(notifications, _prepare_sms, send_sms_to_provider)
+    results = _call_providers([send for _, _, send in prepared])
 
-        if notification.key_type == KEY_TYPE_TEST:
-            statsd_client.timing("email.test-key.total-time", delta_seconds)
+    sent = []
+    not_sent = []
+    failed_providers = set()
+    for (notification, provider, _), (_, exception) in zip(prepared, results):
+        if exception is None:
+            sent.append((notification, provider))
+        else:
+            not_sent.append(notification)
+            failures.append((notification, exception))
+            failed_providers.add(provider.get_name())
+
+    failures += _save_sent(sent)
+    try:
+        if not_sent:
+            # to save their billable units
+            dao_update_notifications(not_sent)
+        for provider_name in failed_providers:
+            dao_reduce_sms_provider_priority(provider_name, time_threshold=timedelta(minutes=1))
+    except Exception:
+        # these notifications are already reported as failures, so they'll be tried again whatever happens here
+        current_app.logger.exception("Failed to record SMS that could not be sent")
+    return failures
+
+
+def send_email_batch_to_provider(notifications):
+    """
+    As `send_sms_batch_to_provider`, for emails. Emails with exactly the same sender, reply-to address and content -
+    usually everyone a job sends a template without placeholders to - go to the provider in bulk calls if it can take
+    them, and each other email in a call of its own.
+
+    :return: a list of (notification, exception) for each notification that couldn't be sent or saved
+    """
+    prepared, failures = _prepare_batch(notifications, _prepare_email, send_email_to_provider)
+    sends = _group_email_sends(prepared)
+    results = _call_providers([send for _, send in sends])
+
+    sent = []
+    for (emails, _), (references, exception) in zip(sends, results):
+        for index, (notification, provider, _) in enumerate(emails):
+            reference = exception or references[index]
+            if isinstance(reference, Exception):
+                failures.append((notification, reference))
+            else:
+                notification.reference = reference
+                sent.append((notification, provider))
+
+    failures += _save_sent(sent)
+    return failures
+
+
+def _save_sent(sent):
+    """
+    Save the notifications the providers accepted in a single transaction or, if that fails, one at a time as
+    `send_sms_to_provider` and `send_email_to_provider` would. Nothing here raises, as the notifications have already
+    been sent and only the ones that couldn't be saved should be sent again.
+
+    :return: a list of (notification, exception) for each notification that couldn't be saved
+    """
+    # a failed save is rolled back, which loses what the send set on the notifications
+    sent_values = [(notification.reference, notification.billable_units) for notification, _ in sent]
+    try:
+        update_notifications_to_sending(sent)
+    except Exception:
+        current_app.logger.exception("Failed to save batch of {} sent notifications".format(len(sent)))
+    else:
+        for notification, _ in sent:
+            _record_total_time(notification)
+        return []
+
+    failures = []
+    for (notification, provider), (reference, billable_units) in zip(sent, sent_values):
+        try:
+            notification.reference = reference
+            notification.billable_units = billable_units
+            update_notification_to_sending(notification, provider)
+        except Exception as e:
+            failures.append((notification, e))
+        else:
+            _record_total_time(notification)
+    return failures
+
+
+def _group_email_sends(prepared):
+    """
+    :return: a list of (emails, send) where send returns a reference, or the exception it failed with, for each email
+    """
+    groups = {}
+    for email in prepared:
+        _, provider, send = email
+        from_address, _, subject = send.args
+        key = (provider.get_name(), from_address, subject, tuple(sorted(send.keywords.items())))
+        groups.setdefault(key, []).append(email)
+
+    sends = []
+    for emails in groups.values():
+        _, provider, send = emails[0]
+        from_address, _, subject = send.args
+        if len(emails) > 1 and hasattr(provider, 'send_bulk_email') and provider.can_send_bulk_email(
+            subject, send.keywords['body'], send.keywords['html_body']
+        ):
+            for start in range(0, len(emails), provider.MAX_BULK_DESTINATIONS):
+                chunk = emails[start:start + provider.MAX_BULK_DESTINATIONS]
+                sends.append((chunk, partial(
+                    provider.send_bulk_email,
+                    from_address,
+                    [email_send.args[1] for _, _, email_send in chunk],
+                    subject,
+                    **send.keywords
+                )))
         else:
-            statsd_client.timing("email.live-key.total-time", delta_seconds)
-            if str(service.id) in current_app.config.get('HIGH_VOLUME_SERVICE'):
-                statsd_client.timing("email.live-key.high-volume.total-time", delta_seconds)
+            sends.extend(([email], partial(_send_one, email[2])) for email in emails)
+    return sends
+
+
+def _send_one(send):
+    return [send()]
+
+
+def _prepare_batch(notifications, prepare, send_one):
+    prepared = []
+    failures = []
+    for notification in notifications:
+        try:
+            service = notification.service
+            if (
+                service.active
+                and notification.status == 'created'
+                and not service.research_mode
+                and notification.key_type != KEY_TYPE_TEST
+            ):
+                prepared.append(prepare(notification))
             else:
-                statsd_client.timing("email.live-key.not-high-volume.total-time", delta_seconds)
+                send_one(notification)
+        except Exception as e:
+            failures.append((notification, e))
+    return prepared, failures
+
+
+def _prepare_sms(notification):
+    service = notification.service
+    provider = provider_to_use(SMS_TYPE, notification.international)
+
+    template = SMSMessageTemplate(
+        get_template_dict(notification.template_id, notification.template_version),
+        values=notification.personalisation,
+        prefix=service.name,
+        show_prefix=service.prefix_sms,
+    )
+    notification.billable_units = template.fragment_count
+
+    return notification, provider, partial(
+        provider.send_sms,
+        to=_formatted_phone_number(notification),
+        content=str(template),
+        reference=str(notification.id),
+        sender=notification.reply_to_text,
+    )
+
+
+def _formatted_phone_number(notification):
+    # normalised_to is formatted when the notification is created, so the number doesn't need parsing again
+    return notification.normalised_to or validate_and_format_phone_number(
+        notification.to, international=notification.international
+    )
+
+
+def _prepare_email(notification):
+    service = notification.service
+    provider = provider_to_use(EMAIL_TYPE)
+
+    email = render_email(
+        get_template_dict(notification.template_id, notification.template_version),
+        values=notification.personalisation,
+        html_email_options=get_cached_html_email_options(service)
+    )
+    from_address = '"{}" <{}@{}>'.format(service.name, service.email_from, current_app.config['NOTIFY_EMAIL_DOMAIN'])
+    email_reply_to = notification.reply_to_text
+
+    return notification, provider, partial(
+        provider.send_email,
+        from_address,
+        validate_and_format_email_address(notification.to),
+        email.subject,
+        body=email.plain_text_body,
+        html_body=email.html_body,
+        reply_to_address=validate_and_format_email_address(email_reply_to) if email_reply_to else None,
+    )
+
+
+def _call_providers(sends):
+    """
+    Make each provider call on a thread of its own, up to DELIVERY_BATCH_CONCURRENCY at once. The calls only talk to
+    the providers - anything that needs the database is done before and after, on the calling thread.
+
+    :return: a (result, exception) for each call, in the same order as `sends`
+    """
+    if not sends:
+        return []
+
+    app = current_app._get_current_object()
+
+    def call(send):
+        with app.app_context():
+            try:
+                return send(), None
+            except Exception as e:
+                return None, e
+
+    with ThreadPoolExecutor(max_workers=min(len(sends), app.config['DELIVERY_BATCH_CONCURRENCY'])) as executor:
+        return list(executor.map(call, sends))
+
+
+def _record_total_time(notification):
+    delta_seconds = (datetime.utcnow() - notification.created_at).total_seconds()
+    prefix = notification.notification_type
+    if notification.notification_type == SMS_TYPE:
+        statsd_client.timing("sms.total-time", delta_seconds)
+
+    if notification.key_type == KEY_TYPE_TEST:
+        statsd_client.timing("{}.test-key.total-time".format(prefix), delta_seconds)
+    else:
+        statsd_client.timing("{}.live-key.total-time".format(prefix), delta_seconds)
+        if str(notification.service_id) in current_app.config.get('HIGH_VOLUME_SERVICE'):
+            statsd_client.timing("{}.live-key.high-volume.total-time".format(prefix), delta_seconds)
+        else:
+            statsd_client.timing("{}.live-key.not-high-volume.total-time".format(prefix), delta_seconds)
+
+
+def update_notifications_to_sending(notifications_and_providers):
+    if not notifications_and_providers:
+        return
+
+    sent_at = datetime.utcnow()
+    status_changes = []
+    for notification, provider in notifications_and_providers:
+        notification.sent_at = sent_at
+        notification.sent_by = provider.get_name()
+        previous_status = notification.status
+        if notification.status not in NOTIFICATION_STATUS_TYPES_COMPLETED:
+            notification.status = NOTIFICATION_SENT if notification.international else NOTIFICATION_SENDING
+        status_changes.append((notification, previous_status))
+    dao_update_notifications([notification for notification, _ in notifications_and_providers])
+    record_notification_status_changes(status_changes)
 
 
 def update_notification_to_sending(notification, provider):
     notification.sent_at = datetime.utcnow()
     notification.sent_by = provider.get_name()
+    previous_status = notification.status
     if notification.status not in NOTIFICATION_STATUS_TYPES_COMPLETED:
         notification.status = NOTIFICATION_SENT if notification.international else NOTIFICATION_SENDING
     dao_update_notification(notification)
+    record_notification_status_changes([(notification, previous_status)])
 
 
-provider_cache = TTLCache(maxsize=8, ttl=10)
-
-
-@cached(cache=provider_cache)
 def provider_to_use(notification_type, international=False):
-    active_providers = [
-        p for p in get_provider_details_by_notification_type(notification_type, international) if p.active
-    ]
-
-    if not active_providers:
-        current_app.logger.error(
-            "{} failed as no active providers".format(notification_type)
-        )
-        raise Exception("No active {} providers".format(notification_type))
-
-    chosen_provider = random.choices(active_providers, weights=[p.priority for p in active_providers])[0]
-
-    return notification_provider_clients.get_client_by_name_and_type(chosen_provider.identifier, notification_type)
+    identifier = provider_routing.routing_table.choose_provider(notification_type, international)
+    return notification_provider_clients.get_client_by_name_and_type(identifier, notification_type)
 
 
 def get_logo_url(base_url, logo_file):
@@ -189,6 +410,14 @@ def get_logo_url(base_url, logo_file):
     return parse.urlunparse(logo_url)
 
 
+html_email_options_cache = TTLCache(maxsize=1024, ttl=10)
+
+
+@cached(cache=html_email_options_cache, key=lambda service: service.id)
+def get_cached_html_email_options(service):
+    return get_html_email_options(service)
+
+
 def get_html_email_options(service):
 
     if service.email_branding is None:
@@ -213,8 +442,10 @@ def get_html_email_options(service):
 
 
 def technical_failure(notification):
+    previous_status = notification.status
     notification.status = NOTIFICATION_TECHNICAL_FAILURE
     dao_update_notification(notification)
+    record_notification_status_changes([(notification, previous_status)])
     raise NotificationTechnicalFailureException(
         "Send {} for notification id {} to provider is not allowed: service {} is inactive".format(
             notification.notification_type,
@@ -0,0 +1,115 @@
+"""
+Caches for building the content of each notification in deliver_sms and deliver_email, and when listing notifications.
+
+A version of a template never changes once it's been saved, so template versions are kept for as long as there's room
+for them. Personalisation has to be substituted before markdown is rendered, so most emails still need rendering for
+each recipient - but an email from a template without placeholders comes out the same for everyone it's sent to, so
+its rendered subject and bodies are kept too, keyed by the branding it was rendered with. The same goes for the
+content and subject shown when listing notifications.
+"""
+from collections import namedtuple
+from threading import Lock
+
+from cachetools import LRUCache, cached
+from notifications_utils.template import (
+    HTMLEmailTemplate,
+    LetterPrintTemplate,
+    PlainTextEmailTemplate,
+    SMSMessageTemplate,
+)
+from sqlalchemy import inspect
+
+from app.dao.templates_dao import dao_get_template_by_id
+from app.models import EMAIL_TYPE, LETTER_TYPE, SMS_TYPE
+
+template_version_cache = LRUCache(maxsize=1024)
+rendered_email_cache = LRUCache(maxsize=256)
+rendered_email_lock = Lock()
+rendered_content_cache = LRUCache(maxsize=1024)
+rendered_content_lock = Lock()
+
+RenderedEmail = namedtuple('RenderedEmail', ['subject', 'plain_text_body', 'html_body'])
+RenderedContent = namedtuple('RenderedContent', ['content', 'subject'])
+
+CONTENT_TEMPLATE_CLASSES = {
+    EMAIL_TYPE: PlainTextEmailTemplate,
+    SMS_TYPE: SMSMessageTemplate,
+    LETTER_TYPE: LetterPrintTemplate,
+}
+
+
+def get_template_dict(template_id, version):
+    if version is None:
+        return _serialise_template(dao_get_template_by_id(template_id))
+    return _get_template_version_dict(str(template_id), version)
+
+
+@cached(cache=template_version_cache, lock=Lock())
+def _get_template_version_dict(template_id, version):
+    return _serialise_template(dao_get_template_by_id(template_id, version))
+
+
+def render_email(template_dict, values, html_email_options):
+    """
+    :param template_dict: a template from `get_template_dict`
+    :param html_email_options: the branding options from `get_html_email_options`
+    :return: a RenderedEmail
+    """
+    plain_text_email = PlainTextEmailTemplate(template_dict, values=values)
+    if plain_text_email.placeholders or template_dict.get('version') is None:
+        return _render_email(plain_text_email, template_dict, values, html_email_options)
+
+    key = (str(template_dict['id']), template_dict['version'], tuple(sorted(html_email_options.items())))
+    with rendered_email_lock:
+        rendered = rendered_email_cache.get(key)
+    if rendered is None:
+        rendered = _render_email(plain_text_email, template_dict, values, html_email_options)
+        with rendered_email_lock:
+            rendered_email_cache[key] = rendered
+    return rendered
+
+
+def render_content(template_dict, values):
+    """
+    The content and subject of a notification with its placeholders filled in, as `Notification.content` and
+    `Notification.subject` give them.
+
+    :param template_dict: a template from `get_template_dict`
+    :return: a RenderedContent
+    """
+    template = CONTENT_TEMPLATE_CLASSES[template_dict['template_type']](template_dict, values=values)
+    if template.placeholders or template_dict.get('version') is None:
+        return _render_content(template)
+
+    key = (str(template_dict['id']), template_dict['version'])
+    with rendered_content_lock:
+        rendered = rendered_content_cache.get(key)
+    if rendered is None:
+        rendered = _render_content(template)
+        with rendered_content_lock:
+            rendered_content_cache[key] = rendered
+    return rendered
+
+
+def _render_content(template):
+    return RenderedContent(
+        content=template.content_with_placeholders_filled_in,
+        subject=getattr(template, 'subject', None),
+    )
+
+
+def _render_email(plain_text_email, template_dict, values, html_email_options):
+    html_email = HTMLEmailTemplate(template_dict, values=values, **html_email_options)
+    return RenderedEmail(
+        subject=plain_text_email.subject,
+        plain_text_body=str(plain_text_email),
+        html_body=str(html_email),
+    )
+
+
+def _serialise_template(template_model):
+    # only the columns, so that nothing cached is tied to a database session
+    return {
+        attribute.key: getattr(template_model, attribute.key)
+        for attribute in inspect(template_model).mapper.column_attrs
+    }
@@ -8,6 +8,7 @@ from sqlalchemy.ext.associationproxy import association_proxy
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.schema import Sequence
 from sqlalchemy.dialects.postgresql import (
+    ARRAY,
     UUID,
     JSON,
     JSONB,
@@ -1235,6 +1236,9 @@ class Job(db.Model):
     )
     archived = db.Column(db.Boolean, nullable=False, default=False)
     contact_list_id = db.Column(UUID(as_uuid=True), db.ForeignKey('service_contact_list.id'), nullable=True)
+    # only set for large jobs whose rows are split across several process-job-shard tasks
+    shard_count = db.Column(db.Integer, nullable=True)
+    completed_shards = db.Column(ARRAY(db.Integer), nullable=True)
 
 
 VERIFY_CODE_TYPES = [EMAIL_TYPE, SMS_TYPE]
@@ -1465,13 +1469,27 @@ class Notification(db.Model):
 
     @property
     def personalisation(self):
-        if self._personalisation:
-            return encryption.decrypt(self._personalisation)
-        return {}
+        # decrypting is expensive and serialising a notification needs the personalisation several times, so
+        # remember it for as long as the encrypted value it came from doesn't change
+        cached = getattr(self, '_decrypted_personalisation', None)
+        if cached is None or cached[0] != self._personalisation:
+            decrypted = encryption.decrypt(self._personalisation) if self._personalisation else {}
+            cached = self._decrypted_personalisation = (self._personalisation, decrypted)
+        return cached[1]
 
     @personalisation.setter
     def personalisation(self, personalisation):
         self._personalisation = encryption.encrypt(personalisation or {})
+        self._decrypted_personalisation = None
+        self._template_with_personalisation = None
+
+    def _as_utils_template_with_personalisation(self):
+        key = (self.template_id, self.template_version, self._personalisation)
+        cached = getattr(self, '_template_with_personalisation', None)
+        if cached is None or cached[0] != key:
+            template = self.template._as_utils_template_with_personalisation(self.personalisation)
+            cached = self._template_with_personalisation = (key, template)
+        return cached[1]
 
     def completed_at(self):
         if self.status in NOTIFICATION_STATUS_TYPES_COMPLETED:
@@ -1529,16 +1547,11 @@ class Notification(db.Model):
 
     @property
     def content(self):
-        return self.template._as_utils_template_with_personalisation(
-            self.personalisation
-        ).content_with_placeholders_filled_in
+        return self._as_utils_template_with_personalisation().content_with_placeholders_filled_in
 
     @property
     def subject(self):
-        template_object = self.template._as_utils_template_with_personalisation(
-            self.personalisation
-        )
-        return getattr(template_object, 'subject', None)
+        return getattr(self._as_utils_template_with_personalisation(), 'subject', None)
 
     @property
     def formatted_status(self):
@@ -1583,13 +1596,17 @@ class Notification(db.Model):
         # get the two code flows mixed up at all
         assert self.notification_type == LETTER_TYPE
 
-        if self.status in [NOTIFICATION_CREATED, NOTIFICATION_SENDING]:
+        return self.substitute_letter_status(self.status)
+
+    @staticmethod
+    def substitute_letter_status(status):
+        if status in [NOTIFICATION_CREATED, NOTIFICATION_SENDING]:
             return NOTIFICATION_STATUS_LETTER_ACCEPTED
-        elif self.status in [NOTIFICATION_DELIVERED, NOTIFICATION_RETURNED_LETTER]:
+        elif status in [NOTIFICATION_DELIVERED, NOTIFICATION_RETURNED_LETTER]:
             return NOTIFICATION_STATUS_LETTER_RECEIVED
         else:
             # Currently can only be technical-failure OR pending-virus-check OR validation-failed
-            return self.status
+            return status
 
     def get_created_by_name(self):
         if self.created_by:
@@ -0,0 +1,194 @@
+"""
+Counts of notifications by service, notification type, status, template and key type for each day, kept in redis so
+that "today" statistics don't have to count today's rows in the notifications table on every request.
+
+Counts are moved as notifications are created and change status. Some status changes (bulk updates, timeouts,
+cancelled jobs) aren't tracked, so the reconcile-notification-counts task rebuilds the day's counts from the database
+every few minutes. Counts are only read once they have been rebuilt at least once that day - until then, and whenever
+redis is disabled or unavailable, callers should fall back to querying the database.
+"""
+from collections import namedtuple, defaultdict
+from datetime import datetime
+
+from flask import current_app
+from notifications_utils.timezones import convert_utc_to_bst
+
+from app import redis_store
+
+NOTIFICATION_COUNTS_EXPIRY_SECONDS = 60 * 60 * 48
+
+NotificationCount = namedtuple(
+    'NotificationCount', ['notification_type', 'status', 'template_id', 'key_type', 'count']
+)
+NotificationTotal = namedtuple('NotificationTotal', ['notification_type', 'status', 'key_type', 'count'])
+
+
+def service_notification_counts_key(service_id, bst_date):
+    return 'notification-counts-{}-{}'.format(service_id, bst_date.isoformat())
+
+
+def all_notification_counts_key(bst_date):
+    return 'notification-counts-all-{}'.format(bst_date.isoformat())
+
+
+def notification_counts_synced_key(bst_date):
+    return 'notification-counts-synced-{}'.format(bst_date.isoformat())
+
+
+def increment_notification_counts(notifications):
+    _update_counts((notification, None, notification.status) for notification in notifications)
+
+
+def record_notification_status_changes(changes):
+    """
+    :param changes: iterable of (notification, previous_status). The notification should have its new status.
+    """
+    _update_counts(
+        (notification, previous_status, notification.status)
+        for notification, previous_status in changes
+        if previous_status != notification.status
+    )
+
+
+def record_notification_status_change(notification, previous_status, status):
+    """
+    Like record_notification_status_changes, for one notification whose new status is given separately - for when it
+    was set by a bulk update and isn't on the object.
+    """
+    if previous_status != status:
+        _update_counts([(notification, previous_status, status)])
+
+
+def get_todays_notification_counts_for_service(service_id):
+    """
+    Returns a list of NotificationCount, or None if counts aren't available
+    """
+    counts = get_todays_notification_counts_for_services([service_id])
+    return None if counts is None else counts[service_id]
+
+
+def get_todays_notification_counts_for_services(service_ids):
+    """
+    Returns a dict of service_id to a list of NotificationCount, or None if counts aren't available
+    """
+    today = _todays_bst_date()
+    try:
+        if not _counts_available(today):
+            return None
+        pipe = redis_store.redis_store.pipeline(transaction=False)
+        for service_id in service_ids:
+            pipe.hgetall(service_notification_counts_key(service_id, today))
+        results = pipe.execute()
+    except Exception:
+        current_app.logger.exception('Could not get notification counts from redis')
+        return None
+
+    return {
+        service_id: [
+            NotificationCount(*_decode(field).split(':'), count=int(count))
+            for field, count in result.items() if int(count) > 0
+        ]
+        for service_id, result in zip(service_ids, results)
+    }
+
+
+def get_todays_notification_totals():
+    """
+    Returns a list of NotificationTotal across all services, or None if counts aren't available
+    """
+    today = _todays_bst_date()
+    try:
+        if not _counts_available(today):
+            return None
+        result = redis_store.redis_store.hgetall(all_notification_counts_key(today))
+    except Exception:
+        current_app.logger.exception('Could not get notification totals from redis')
+        return None
+
+    return [
+        NotificationTotal(*_decode(field).split(':'), count=int(count))
+        for field, count in result.items() if int(count) > 0
+    ]
+
+
+def set_notification_counts_for_day(bst_date, rows):
+    """
+    Replace all of the counts for a day.
+
+    :param rows: iterable of objects with service_id, notification_type, status, template_id, key_type and count
+    """
+    counts_by_service = defaultdict(dict)
+    totals = defaultdict(int)
+    for row in rows:
+        counts_by_service[str(row.service_id)][
+            _service_field(row.notification_type, row.status, row.template_id, row.key_type)
+        ] = row.count
+        totals[_all_field(row.notification_type, row.status, row.key_type)] += row.count
+
+    client = redis_store.redis_store
+    stale_keys = set(client.scan_iter(match=service_notification_counts_key('*', bst_date), count=1000))
+
+    pipe = client.pipeline(transaction=True)
+    for key in stale_keys:
+        pipe.delete(key)
+    pipe.delete(all_notification_counts_key(bst_date))
+    for service_id, counts in counts_by_service.items():
+        key = service_notification_counts_key(service_id, bst_date)
+        pipe.hset(key, mapping=counts)
+        pipe.expire(key, NOTIFICATION_COUNTS_EXPIRY_SECONDS)
+    if totals:
+        pipe.hset(all_notification_counts_key(bst_date), mapping=totals)
+        pipe.expire(all_notification_counts_key(bst_date), NOTIFICATION_COUNTS_EXPIRY_SECONDS)
+    pipe.set(notification_counts_synced_key(bst_date), 1, ex=NOTIFICATION_COUNTS_EXPIRY_SECONDS)
+    pipe.execute()
+
+
+def _update_counts(changes):
+    if not current_app.config['REDIS_ENABLED']:
+        return
+
+    try:
+        pipe = redis_store.redis_store.pipeline(transaction=False)
+        for notification, previous_status, status in changes:
+            bst_date = convert_utc_to_bst(notification.created_at).date()
+            service_key = service_notification_counts_key(notification.service_id, bst_date)
+            all_key = all_notification_counts_key(bst_date)
+            for field_status, amount in ((previous_status, -1), (status, 1)):
+                if field_status is None:
+                    continue
+                pipe.hincrby(
+                    service_key,
+                    _service_field(notification.notification_type, field_status, notification.template_id,
+                                   notification.key_type),
+                    amount
+                )
+                pipe.hincrby(all_key, _all_field(notification.notification_type, field_status, notification.key_type),
+                             amount)
+            pipe.expire(service_key, NOTIFICATION_COUNTS_EXPIRY_SECONDS)
+            pipe.expire(all_key, NOTIFICATION_COUNTS_EXPIRY_SECONDS)
+        pipe.execute()
+    except Exception:
+        # counts are rebuilt by reconcile-notification-counts, so never fail the caller over them
+        current_app.logger.exception('Could not update notification counts in redis')
+
+
+def _counts_available(bst_date):
+    return current_app.config['REDIS_ENABLED'] and redis_store.redis_store.exists(
+        notification_counts_synced_key(bst_date)
+    )
+
+
+def _service_field(notification_type, status, template_id, key_type):
+    return '{}:{}:{}:{}'.format(notification_type, status, template_id, key_type)
+
+
+def _all_field(notification_type, status, key_type):
+    return '{}:{}:{}'.format(notification_type, status, key_type)
+
+
+def _decode(value):
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+def _todays_bst_date():
+    return convert_utc_to_bst(datetime.utcnow()).date()
@@ -0,0 +1,97 @@
+"""
+Serialises pages of notifications from the rows `get_notification_rows_for_service_before` returns, giving the same
+JSON as `Notification.serialize` without loading each notification, its template and whoever sent it.
+
+Each template version on the page is fetched and linked to once, and content is rendered through the template cache.
+"""
+from flask import url_for
+from notifications_utils.columns import Columns
+from notifications_utils.letter_timings import get_letter_timings
+
+from app import encryption
+from app.delivery.template_cache import get_template_dict, render_content
+from app.models import (
+    EMAIL_TYPE,
+    LETTER_TYPE,
+    NOTIFICATION_STATUS_TYPES_COMPLETED,
+    SMS_TYPE,
+    Notification,
+)
+from app.utils import DATETIME_FORMAT, get_dt_string_or_none
+
+LETTER_ADDRESS_FIELDS = (
+    ('line_1', 'address_line_1'),
+    ('line_2', 'address_line_2'),
+    ('line_3', 'address_line_3'),
+    ('line_4', 'address_line_4'),
+    ('line_5', 'address_line_5'),
+    ('line_6', 'address_line_6'),
+    ('postcode', 'postcode'),
+)
+
+
+def serialize_notification_rows(rows):
+    templates = {}
+    return [_serialize_row(row, templates) for row in rows]
+
+
+def _serialize_row(row, templates):
+    template_key = (row.template_id, row.template_version)
+    if template_key not in templates:
+        templates[template_key] = (
+            get_template_dict(row.template_id, row.template_version),
+            url_for(
+                'v2_template.get_template_by_id',
+                template_id=row.template_id,
+                version=row.template_version,
+                _external=True
+            ),
+        )
+    template_dict, template_link = templates[template_key]
+
+    personalisation = encryption.decrypt(row._personalisation) if row._personalisation else {}
+    rendered = render_content(template_dict, personalisation)
+
+    serialized = {
+        "id": row.id,
+        "reference": row.client_reference,
+        "email_address": row.to if row.notification_type == EMAIL_TYPE else None,
+        "phone_number": row.to if row.notification_type == SMS_TYPE else None,
+        "line_1": None,
+        "line_2": None,
+        "line_3": None,
+        "line_4": None,
+        "line_5": None,
+        "line_6": None,
+        "postcode": None,
+        "type": row.notification_type,
+        "status": (
+            Notification.substitute_letter_status(row.status)
+            if row.notification_type == LETTER_TYPE else row.status
+        ),
+        "template": {
+            'version': row.template_version,
+            'id': row.template_id,
+            'uri': template_link
+        },
+        "body": rendered.content,
+        "subject": rendered.subject,
+        "created_at": row.created_at.strftime(DATETIME_FORMAT),
+        "created_by_name": row.created_by_name,
+        "sent_at": get_dt_string_or_none(row.sent_at),
+        "completed_at": (
+            row.updated_at.strftime(DATETIME_FORMAT) if row.status in NOTIFICATION_STATUS_TYPES_COMPLETED else None
+        ),
+        "scheduled_for": None,
+        "postage": row.postage
+    }
+
+    if row.notification_type == LETTER_TYPE:
+        col = Columns(personalisation)
+        for key, column in LETTER_ADDRESS_FIELDS:
+            serialized[key] = col.get(column)
+        serialized['estimated_delivery'] = get_letter_timings(
+            serialized['created_at'], postage=row.postage
+        ).earliest_delivery.strftime(DATETIME_FORMAT)
+
+    return serialized
@@ -1,6 +1,6 @@
 from flask import current_app
 
-from app.dao.complaint_dao import save_complaint
+from app.dao.complaint_dao import fetch_complaint_by_ses_feedback_id, save_complaint
 from app.dao.notifications_dao import dao_get_notification_or_history_by_reference
 from app.dao.service_callback_api_dao import (
     get_service_delivery_status_callback_api_for_service, get_service_complaint_callback_api_for_service
@@ -35,10 +35,16 @@ def handle_complaint(ses_message):
     notification = dao_get_notification_or_history_by_reference(reference)
     ses_complaint = ses_message.get('complaint', None)
 
+    ses_feedback_id = ses_complaint.get('feedbackId', None) if ses_complaint else None
+    if ses_feedback_id and fetch_complaint_by_ses_feedback_id(notification.id, ses_feedback_id):
+        # SES results are retried, so we may have already recorded this complaint
+        current_app.logger.info(f"Complaint {ses_feedback_id} for notification {notification.id} already recorded")
+        return
+
     complaint = Complaint(
         notification_id=notification.id,
         service_id=notification.service_id,
-        ses_feedback_id=ses_complaint.get('feedbackId', None) if ses_complaint else None,
+        ses_feedback_id=ses_feedback_id,
         complaint_type=ses_complaint.get('complaintFeedbackType', None) if ses_complaint else None,
         complaint_date=ses_complaint.get('timestamp', None) if ses_complaint else None
     )
@@ -74,6 +80,21 @@ def _check_and_queue_callback_task(notification):
                                                     queue=QueueNames.CALLBACKS)
 
 
+def _check_and_queue_callback_tasks(notifications):
+    # as _check_and_queue_callback_task, but looks up each service's callback api once
+    service_callback_apis = {}
+    for notification in notifications:
+        if notification.service_id not in service_callback_apis:
+            service_callback_apis[notification.service_id] = get_service_delivery_status_callback_api_for_service(
+                service_id=notification.service_id
+            )
+        service_callback_api = service_callback_apis[notification.service_id]
+        if service_callback_api:
+            notification_data = create_delivery_status_callback_data(notification, service_callback_api)
+            send_delivery_status_to_service.apply_async([str(notification.id), notification_data],
+                                                        queue=QueueNames.CALLBACKS)
+
+
 def _check_and_queue_complaint_callback_task(complaint, notification, recipient):
     # queue callback task only if the service_callback_api exists
     service_callback_api = get_service_complaint_callback_api_for_service(service_id=notification.service_id)
@@ -3,7 +3,10 @@ from flask import current_app
 from flask import json
 from flask import request, jsonify
 
-from app.celery.process_sms_client_response_tasks import process_sms_client_response
+from app.celery.process_sms_client_response_tasks import (
+    buffer_sms_client_response,
+    process_sms_client_response,
+)
 from app.config import QueueNames
 from app.errors import InvalidRequest, register_errors
 
@@ -26,10 +29,7 @@ def process_mmg_response():
 
     provider_reference = data.get('CID')
 
-    process_sms_client_response.apply_async(
-        [status, provider_reference, client_name, detailed_status_code],
-        queue=QueueNames.SMS_CALLBACKS,
-    )
+    queue_sms_client_response(status, provider_reference, client_name, detailed_status_code)
 
     safe_to_log = data.copy()
     safe_to_log.pop("MSISDN")
@@ -59,14 +59,21 @@ def process_firetext_response():
         f"Full delivery response from {client_name} for notification: {provider_reference}\n{safe_to_log}"
     )
 
-    process_sms_client_response.apply_async(
-        [status, provider_reference, client_name, detailed_status_code],
-        queue=QueueNames.SMS_CALLBACKS,
-    )
+    queue_sms_client_response(status, provider_reference, client_name, detailed_status_code)
 
     return jsonify(result='success'), 200
 
 
+def queue_sms_client_response(status, provider_reference, client_name, detailed_status_code):
+    if current_app.config['SMS_CALLBACK_BUFFER_ENABLED'] and current_app.config['REDIS_ENABLED']:
+        buffer_sms_client_response(status, provider_reference, client_name, detailed_status_code)
+    else:
+        process_sms_client_response.apply_async(
+            [status, provider_reference, client_name, detailed_status_code],
+            queue=QueueNames.SMS_CALLBACKS,
+        )
+
+
 def validate_callback_data(data, fields, client_name):
     errors = []
     for f in fields:
@@ -3,22 +3,19 @@ from datetime import datetime
 
 from flask import current_app
 
-from notifications_utils.clients import redis
-from notifications_utils.recipients import (
-    get_international_phone_info,
-    validate_and_format_phone_number,
-    format_email_address
-)
+from notifications_utils.recipients import format_email_address
 from notifications_utils.template import (
     PlainTextEmailTemplate,
     SMSMessageTemplate,
     LetterPrintTemplate,
 )
 
-from app import redis_store
+from app import simulated_recipients
 from app.celery import provider_tasks
 from app.celery.letters_pdf_tasks import get_pdf_for_templated_letter
 from app.config import QueueNames
+from app.notification_counts import increment_notification_counts
+from app.notifications.recipients import NormalisedRecipient
 
 from app.models import (
     EMAIL_TYPE,
@@ -30,6 +27,7 @@ from app.models import (
     INTERNATIONAL_POSTAGE_TYPES)
 from app.dao.notifications_dao import (
     dao_create_notification,
+    dao_create_notifications,
     dao_delete_notifications_by_id,
 )
 
@@ -85,7 +83,7 @@ def check_placeholders(template_object):
         raise BadRequestError(fields=[{'template': message}], message=message)
 
 
-def persist_notification(
+def build_notification(
     *,
     template_id,
     template_version,
@@ -101,14 +99,14 @@ def persist_notification(
     reference=None,
     client_reference=None,
     notification_id=None,
-    simulated=False,
     created_by_id=None,
     status=NOTIFICATION_CREATED,
     reply_to_text=None,
     billable_units=None,
     postage=None,
     document_download_count=None,
-    updated_at=None
+    updated_at=None,
+    normalised_recipient=None,
 ):
     notification_created_at = created_at or datetime.utcnow()
     if not notification_id:
@@ -136,34 +134,107 @@ def persist_notification(
         updated_at=updated_at
     )
 
+    # the recipient has usually been normalised already, by validate_and_normalise_recipient
     if notification_type == SMS_TYPE:
-        formatted_recipient = validate_and_format_phone_number(recipient, international=True)
-        recipient_info = get_international_phone_info(formatted_recipient)
-        notification.normalised_to = formatted_recipient
-        notification.international = recipient_info.international
-        notification.phone_prefix = recipient_info.country_prefix
-        notification.rate_multiplier = recipient_info.billable_units
+        normalised_recipient = normalised_recipient or NormalisedRecipient.from_phone_number(recipient)
+        notification.normalised_to = normalised_recipient.normalised_to
+        notification.international = normalised_recipient.international
+        notification.phone_prefix = normalised_recipient.phone_prefix
+        notification.rate_multiplier = normalised_recipient.rate_multiplier
     elif notification_type == EMAIL_TYPE:
-        notification.normalised_to = format_email_address(notification.to)
+        if normalised_recipient:
+            notification.normalised_to = normalised_recipient.normalised_to
+        else:
+            notification.normalised_to = format_email_address(notification.to)
     elif notification_type == LETTER_TYPE:
         notification.postage = postage
         notification.international = postage in INTERNATIONAL_POSTAGE_TYPES
         notification.normalised_to = ''.join(notification.to.split()).lower()
 
+    return notification
+
+
+def persist_notification(
+    *,
+    template_id,
+    template_version,
+    recipient,
+    service,
+    personalisation,
+    notification_type,
+    api_key_id,
+    key_type,
+    created_at=None,
+    job_id=None,
+    job_row_number=None,
+    reference=None,
+    client_reference=None,
+    notification_id=None,
+    simulated=False,
+    created_by_id=None,
+    status=NOTIFICATION_CREATED,
+    reply_to_text=None,
+    billable_units=None,
+    postage=None,
+    document_download_count=None,
+    updated_at=None,
+    normalised_recipient=None,
+):
+    notification = build_notification(
+        template_id=template_id,
+        template_version=template_version,
+        recipient=recipient,
+        service=service,
+        personalisation=personalisation,
+        notification_type=notification_type,
+        api_key_id=api_key_id,
+        key_type=key_type,
+        created_at=created_at,
+        job_id=job_id,
+        job_row_number=job_row_number,
+        reference=reference,
+        client_reference=client_reference,
+        notification_id=notification_id,
+        created_by_id=created_by_id,
+        status=status,
+        reply_to_text=reply_to_text,
+        billable_units=billable_units,
+        postage=postage,
+        document_download_count=document_download_count,
+        updated_at=updated_at,
+        normalised_recipient=normalised_recipient,
+    )
+
     # if simulated create a Notification model to return but do not persist the Notification to the dB
     if not simulated:
         dao_create_notification(notification)
-        # Only keep track of the daily limit for trial mode services.
-        if service.restricted and key_type != KEY_TYPE_TEST:
-            if redis_store.get(redis.daily_limit_cache_key(service.id)):
-                redis_store.incr(redis.daily_limit_cache_key(service.id))
+        increment_notification_counts([notification])
 
         current_app.logger.info(
-            "{} {} created at {}".format(notification_type, notification_id, notification_created_at)
+            "{} {} created at {}".format(notification_type, notification.id, notification.created_at)
         )
     return notification
 
 
+def persist_notifications(notifications, service):
+    """
+    Insert several notifications built by `build_notification` with a single multi-row INSERT.
+
+    Rows that already exist (for example because SQS delivered the same batch twice) are skipped.
+    Returns the ids of the notifications that were actually inserted.
+    """
+    inserted_ids = dao_create_notifications(notifications)
+    inserted = {str(notification_id) for notification_id in inserted_ids}
+    increment_notification_counts(
+        notification for notification in notifications if str(notification.id) in inserted
+    )
+
+    current_app.logger.info(
+        "{} of {} notifications created for service {}".format(len(inserted_ids), len(notifications), service.id)
+    )
+    return inserted_ids
+
+
 def send_notification_to_queue_detached(
     key_type, notification_type, notification_id, research_mode, queue=None
 ):
@@ -203,9 +274,6 @@ def send_notification_to_queue(notification, research_mode, queue=None):
 
 def simulated_recipient(to_address, notification_type):
     if notification_type == SMS_TYPE:
-        formatted_simulated_numbers = [
-            validate_and_format_phone_number(number) for number in current_app.config['SIMULATED_SMS_NUMBERS']
-        ]
-        return to_address in formatted_simulated_numbers
+        return to_address in simulated_recipients.sms_numbers
     else:
-        return to_address in current_app.config['SIMULATED_EMAIL_ADDRESSES']
+        return to_address in simulated_recipients.email_addresses
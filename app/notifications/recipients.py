@@ -0,0 +1,44 @@
+from collections import namedtuple
+
+from notifications_utils.recipients import (
+    get_international_phone_info,
+    validate_and_format_email_address,
+    validate_and_format_phone_number,
+)
+
+
+class NormalisedRecipient(namedtuple('NormalisedRecipient', [
+    'normalised_to',
+    'international',
+    'crown_dependency',
+    'phone_prefix',
+    'rate_multiplier',
+])):
+    """
+    A phone number or email address that's been validated and formatted, along with everything that's worked out
+    from doing so. It's made once when a notification is requested and then passed to whatever needs it, rather than
+    each step parsing the recipient again.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_phone_number(cls, phone_number):
+        normalised_to = validate_and_format_phone_number(phone_number, international=True)
+        phone_info = get_international_phone_info(normalised_to)
+        return cls(
+            normalised_to=normalised_to,
+            international=phone_info.international,
+            crown_dependency=phone_info.crown_dependency,
+            phone_prefix=phone_info.country_prefix,
+            rate_multiplier=phone_info.billable_units,
+        )
+
+    @classmethod
+    def from_email_address(cls, email_address):
+        return cls(
+            normalised_to=validate_and_format_email_address(email_address),
+            international=False,
+            crown_dependency=False,
+            phone_prefix=None,
+            rate_multiplier=None,
+        )
@@ -0,0 +1,20 @@
+from notifications_utils.recipients import validate_and_format_phone_number
+
+
+class SimulatedRecipients:
+    """
+    The phone numbers and email addresses that notifications can be sent to without anything being sent or saved.
+
+    They're formatted once when the app starts, the same way a recipient is formatted before it's looked for among
+    them, rather than on every request.
+    """
+
+    def __init__(self):
+        self.sms_numbers = frozenset()
+        self.email_addresses = frozenset()
+
+    def init_app(self, app):
+        self.sms_numbers = frozenset(
+            validate_and_format_phone_number(number) for number in app.config['SIMULATED_SMS_NUMBERS']
+        )
+        self.email_addresses = frozenset(app.config['SIMULATED_EMAIL_ADDRESSES'])
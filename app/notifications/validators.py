@@ -2,14 +2,9 @@ from notifications_utils.postal_address import PostalAddress
 from sqlalchemy.orm.exc import NoResultFound
 from flask import current_app
 from notifications_utils import SMS_CHAR_COUNT_LIMIT
-from notifications_utils.recipients import (
-    validate_and_format_phone_number,
-    validate_and_format_email_address,
-    get_international_phone_info
-)
-from notifications_utils.clients.redis import rate_limit_cache_key, daily_limit_cache_key
+from notifications_utils.recipients import get_international_phone_info
+from notifications_utils.clients.redis import rate_limit_cache_key
 
-from app.dao import services_dao
 from app.dao.service_sms_sender_dao import dao_get_service_sms_senders_by_id
 from app.models import (
     INTERNATIONAL_SMS_TYPE, SMS_TYPE, EMAIL_TYPE, LETTER_TYPE,
@@ -19,7 +14,9 @@ from app.models import (
 from app.service.utils import service_allowed_to_send_to
 from app.v2.errors import TooManyRequestsError, BadRequestError, RateLimitError, ValidationError
 from app import redis_store
+from app.daily_limit import reserve_daily_limit_for_request
 from app.notifications.process_notifications import create_content_for_notification
+from app.notifications.recipients import NormalisedRecipient
 from app.utils import get_public_notify_type_text
 from app.dao.service_email_reply_to_dao import dao_get_reply_to_by_id
 from app.dao.service_letter_contact_dao import dao_get_letter_contact_by_id
@@ -46,23 +43,18 @@ def check_service_over_api_rate_limit(service, api_key):
 
 def check_service_over_daily_message_limit(key_type, service):
     if key_type != KEY_TYPE_TEST and current_app.config['REDIS_ENABLED']:
-        cache_key = daily_limit_cache_key(service.id)
-        service_stats = redis_store.get(cache_key)
-        if not service_stats:
-            service_stats = services_dao.fetch_todays_total_message_count(service.id)
-            redis_store.set(cache_key, service_stats, ex=3600)
-        if int(service_stats) >= service.message_limit:
+        reserved, sent_today = reserve_daily_limit_for_request(service)
+        if reserved is False:
             current_app.logger.info(
                 "service {} has been rate limited for daily use sent {} limit {}".format(
-                    service.id, int(service_stats), service.message_limit)
+                    service.id, sent_today, service.message_limit)
             )
             raise TooManyRequestsError(service.message_limit)
 
 
 def check_rate_limiting(service, api_key):
     check_service_over_api_rate_limit(service, api_key)
-    # Reduce queries to the notifications table
-    # check_service_over_daily_message_limit(api_key.key_type, service)
+    check_service_over_daily_message_limit(api_key.key_type, service)
 
 
 def check_template_is_for_notification_type(notification_type, template_type):
@@ -110,25 +102,41 @@ def check_if_service_can_send_files_by_email(service_contact_link, service_id):
 
 
 def validate_and_format_recipient(send_to, key_type, service, notification_type, allow_guest_list_recipients=True):
+    recipient = validate_and_normalise_recipient(
+        send_to, key_type, service, notification_type, allow_guest_list_recipients
+    )
+    return recipient.normalised_to if recipient else None
+
+
+def validate_and_normalise_recipient(
+    send_to, key_type, service, notification_type, allow_guest_list_recipients=True
+):
+    """
+    Like validate_and_format_recipient, but returns the NormalisedRecipient for an SMS or email, to be passed on to
+    persist_notification.
+    """
     if send_to is None:
         raise BadRequestError(message="Recipient can't be empty")
 
     service_can_send_to_recipient(send_to, key_type, service, allow_guest_list_recipients)
 
     if notification_type == SMS_TYPE:
-        international_phone_info = check_if_service_can_send_to_number(service, send_to)
-
-        return validate_and_format_phone_number(
-            number=send_to,
-            international=international_phone_info.international
-        )
+        recipient = NormalisedRecipient.from_phone_number(send_to)
+        check_service_can_send_to_phone_info(service, recipient)
+        return recipient
     elif notification_type == EMAIL_TYPE:
-        return validate_and_format_email_address(email_address=send_to)
+        return NormalisedRecipient.from_email_address(send_to)
 
 
 def check_if_service_can_send_to_number(service, number):
-    international_phone_info = get_international_phone_info(number)
+    return check_service_can_send_to_phone_info(service, get_international_phone_info(number))
+
 
+def check_service_can_send_to_phone_info(service, international_phone_info):
+    """
+    :param international_phone_info: anything with `international` and `crown_dependency`, like the result of
+        get_international_phone_info or a NormalisedRecipient
+    """
     if service.permissions and isinstance(service.permissions[0], ServicePermission):
         permissions = [p.permission for p in service.permissions]
     else:
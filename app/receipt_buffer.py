@@ -0,0 +1,105 @@
+"""
+Lists in redis that delivery receipts are pushed onto as they arrive, so that a beat task can apply them in bulk rather
+than queueing a task for each one.
+
+A batch is taken off a buffer by moving it, in one step, onto a list of its own that is recorded along with the time it
+was taken. Once the batch has been applied its list is deleted. If applying it fails the batch goes straight back on the
+buffer, and if the worker dies part way through, a later run puts the batch back once it has been processing for
+STALE_BATCH_SECONDS. Receipts can therefore be applied more than once, so whatever applies them has to ignore receipts
+it has already applied.
+"""
+import uuid
+from time import monotonic, time
+
+from app import redis_store
+
+STALE_BATCH_SECONDS = 300
+
+# KEYS[1]: the buffer
+# KEYS[2]: the batches being processed, a sorted set of their lists scored by when they were taken
+# KEYS[3]: the list to move the batch onto
+# ARGV[1]: how many items to take
+# ARGV[2]: the time now, in seconds
+# Returns the items taken.
+TAKE_BATCH_SCRIPT = """
+local items = redis.call('LRANGE', KEYS[1], 0, ARGV[1] - 1)
+if #items == 0 then
+    return items
+end
+redis.call('LTRIM', KEYS[1], #items, -1)
+redis.call('RPUSH', KEYS[3], unpack(items))
+redis.call('ZADD', KEYS[2], ARGV[2], KEYS[3])
+return items
+"""
+
+# KEYS[1]: the buffer
+# KEYS[2]: the batches being processed
+# ARGV: the lists of the batches to put back on the buffer
+# Returns how many items were put back. A batch that has already been put back or finished has no list left, so
+# nothing is put back twice.
+RETURN_BATCHES_SCRIPT = """
+local returned = 0
+for _, batch in ipairs(ARGV) do
+    local items = redis.call('LRANGE', batch, 0, -1)
+    if #items > 0 then
+        redis.call('RPUSH', KEYS[1], unpack(items))
+        returned = returned + #items
+    end
+    redis.call('DEL', batch)
+    redis.call('ZREM', KEYS[2], batch)
+end
+return returned
+"""
+
+
+def processing_key(buffer_key):
+    return '{}-processing'.format(buffer_key)
+
+
+def push(buffer_key, item):
+    redis_store.redis_store.rpush(buffer_key, item)
+
+
+def drain(buffer_key, batch_size, time_budget_seconds, apply_batch):
+    """
+    Take batches of up to `batch_size` items off a buffer and pass each to `apply_batch`, until the buffer is empty or
+    `time_budget_seconds` have passed. Batches left behind by workers that died are put back on the buffer first.
+
+    :raises: whatever `apply_batch` raised, once its batch is back on the buffer
+    """
+    _return_stale_batches(buffer_key)
+
+    deadline = monotonic() + time_budget_seconds
+    while monotonic() < deadline:
+        batch_key = '{}-batch-{}'.format(buffer_key, uuid.uuid4())
+        take_batch = redis_store.redis_store.register_script(TAKE_BATCH_SCRIPT)
+        items = take_batch(keys=[buffer_key, processing_key(buffer_key), batch_key], args=[batch_size, time()])
+        if not items:
+            return
+
+        try:
+            apply_batch(items)
+        except Exception:
+            _return_batches(buffer_key, [batch_key])
+            raise
+
+        pipe = redis_store.redis_store.pipeline()
+        pipe.delete(batch_key)
+        pipe.zrem(processing_key(buffer_key), batch_key)
+        pipe.execute()
+
+        if len(items) < batch_size:
+            return
+
+
+def _return_stale_batches(buffer_key):
+    stale_batches = redis_store.redis_store.zrangebyscore(
+        processing_key(buffer_key), '-inf', time() - STALE_BATCH_SECONDS
+    )
+    if stale_batches:
+        _return_batches(buffer_key, stale_batches)
+
+
+def _return_batches(buffer_key, batch_keys):
+    return_batches = redis_store.redis_store.register_script(RETURN_BATCHES_SCRIPT)
+    return return_batches(keys=[buffer_key, processing_key(buffer_key)], args=batch_keys)
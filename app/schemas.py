@@ -479,6 +479,8 @@ class JobSchema(BaseSchema):
             'notifications_delivered',
             'notifications_failed',
             'notifications_sent',
+            'shard_count',
+            'completed_shards',
         )
         strict = True
 
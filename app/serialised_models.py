@@ -4,6 +4,7 @@ from threading import RLock
 
 import cachetools
 from notifications_utils.clients.redis import RequestCache
+from notifications_utils.recipients import format_recipient
 from notifications_utils.serialised_model import (
     SerialisedModel,
     SerialisedModelCollection,
@@ -126,3 +127,55 @@ class SerialisedAPIKeyCollection(SerialisedModelCollection):
         ]
         db.session.commit()
         return cls(keys)
+
+
+class SerialisedAllowedRecipients:
+    """
+    The phone numbers and email addresses a restricted service, or a team key, can send to: its team members' and
+    those on its guest list. They're formatted the same way as a recipient is before it's looked for among them.
+    """
+
+    def __init__(self, team_members, guest_list):
+        self.team_members = frozenset(team_members)
+        self.guest_list = frozenset(guest_list)
+
+    def allows(self, recipient, allow_guest_list_recipients=True):
+        recipient = format_recipient(recipient)
+        return recipient in self.team_members or (allow_guest_list_recipients and recipient in self.guest_list)
+
+    @classmethod
+    @memory_cache
+    def from_service_id(cls, service_id):
+        return cls(**cls.get_dict(service_id)['data'])
+
+    @staticmethod
+    @redis_cache.set('service-{service_id}-allowed-recipients')
+    def get_dict(service_id):
+        service = dao_fetch_service_by_id(service_id)
+        allowed_recipients = {
+            'team_members': sorted({
+                format_recipient(recipient)
+                for user in service.users
+                for recipient in (user.mobile_number, user.email_address)
+                if recipient
+            }),
+            'guest_list': sorted({format_recipient(member.recipient) for member in service.guest_list}),
+        }
+        db.session.commit()
+
+        return {'data': allowed_recipients}
+
+    @classmethod
+    def remove_from_cache(cls, *service_ids):
+        """
+        Call after a service's team members or guest list change. Other processes will see the change once their own
+        cached copy expires.
+        """
+        qualname = '{}.from_service_id'.format(cls.__qualname__)
+        with locks[qualname]:
+            for service_id in service_ids:
+                caches[qualname].pop(cachetools.keys.hashkey(str(service_id)), None)
+        if service_ids:
+            redis_store.delete(*(
+                'service-{}-allowed-recipients'.format(service_id) for service_id in service_ids
+            ))
@@ -106,6 +106,7 @@ from app.models import (
 )
 from app.notifications.process_notifications import persist_notification, send_notification_to_queue
 from app.schema_validation import validate
+from app.serialised_models import SerialisedAllowedRecipients
 from app.service import statistics
 from app.service.send_pdf_letter_schema import send_pdf_letter_request
 from app.service.service_contact_list_schema import create_service_contact_list_schema
@@ -390,7 +391,8 @@ def get_all_notifications_for_service(service_id):
         return search_for_notification_by_to_field(service_id=service_id,
                                                    search_term=data['to'],
                                                    statuses=data.get('status'),
-                                                   notification_type=notification_type)
+                                                   notification_type=notification_type,
+                                                   limit_days=data.get('limit_days'))
     page = data['page'] if 'page' in data else 1
     page_size = data['page_size'] if 'page_size' in data else current_app.config.get('PAGE_SIZE')
     limit_days = data.get('limit_days')
@@ -409,7 +411,8 @@ def get_all_notifications_for_service(service_id):
         limit_days=limit_days,
         include_jobs=include_jobs,
         include_from_test_key=include_from_test_key,
-        include_one_off=include_one_off
+        include_one_off=include_one_off,
+        with_relationships=True
     )
 
     kwargs = request.args.to_dict()
@@ -469,7 +472,7 @@ def cancel_notification_for_service(service_id, notification_id):
     ), 200
 
 
-def search_for_notification_by_to_field(service_id, search_term, statuses, notification_type):
+def search_for_notification_by_to_field(service_id, search_term, statuses, notification_type, limit_days=None):
     results = notifications_dao.dao_get_notifications_by_recipient_or_reference(
         service_id=service_id,
         search_term=search_term,
@@ -477,6 +480,7 @@ def search_for_notification_by_to_field(service_id, search_term, statuses, notif
         notification_type=notification_type,
         page=1,
         page_size=current_app.config['PAGE_SIZE'],
+        limit_days=limit_days,
     )
     return jsonify(
         notifications=notification_with_template_schema.dump(results.items, many=True).data,
@@ -589,6 +593,7 @@ def update_guest_list(service_id):
         raise InvalidRequest(msg, 400)
     else:
         dao_add_and_commit_guest_list_contacts(guest_list_objects)
+        SerialisedAllowedRecipients.remove_from_cache(service_id)
         return '', 204
 
 
@@ -13,6 +13,7 @@ from app.notifications.validators import (
     check_service_has_permission,
     check_service_over_daily_message_limit,
     validate_and_format_recipient,
+    validate_and_normalise_recipient,
     validate_template,
     validate_address)
 from app.notifications.process_notifications import (
@@ -68,7 +69,7 @@ def send_one_off_notification(service_id, post_data):
 
     check_service_over_daily_message_limit(KEY_TYPE_NORMAL, service)
 
-    validate_and_format_recipient(
+    recipient = validate_and_normalise_recipient(
         send_to=post_data['to'],
         key_type=KEY_TYPE_NORMAL,
         service=service,
@@ -103,7 +104,8 @@ def send_one_off_notification(service_id, post_data):
         created_by_id=post_data['created_by'],
         reply_to_text=reply_to,
         reference=create_one_off_reference(template.template_type),
-        postage=postage
+        postage=postage,
+        normalised_recipient=recipient,
     )
 
     queue_name = QueueNames.PRIORITY if template.process_type == PRIORITY else None
@@ -0,0 +1,255 @@
+"""
+Sends service callbacks so that one slow or broken endpoint can't hold up callbacks to everyone else.
+
+Each worker process POSTs over a pooled session that keeps connections to each callback host open between callbacks,
+with short connect and read timeouts. Before a callback is sent a slot is taken from its service's allowance of
+callbacks in flight across all workers, and the service's circuit breaker is checked: once a service's endpoint has
+failed too often within a short window the circuit opens and its callbacks are put back on the queue for a while
+without being attempted. When the circuit closes again a single failure is enough to open it again, until a callback
+gets through.
+
+The allowance and the circuit breaker live in redis. If redis is disabled or unavailable callbacks are sent anyway.
+"""
+import json
+import os
+import uuid
+from time import monotonic, time
+from urllib.parse import urlparse
+
+from flask import current_app
+from requests import HTTPError, Session
+from requests.adapters import HTTPAdapter
+
+from app import redis_store, statsd_client
+
+SENDING = 1
+CIRCUIT_OPEN = 0
+TOO_MANY_IN_FLIGHT = -1
+
+# how long to wait before trying again a callback that was held back because its service had too many in flight
+IN_FLIGHT_RETRY_SECONDS = 5
+
+# KEYS[1]: the service's circuit breaker
+# KEYS[2]: the service's callbacks in flight, a sorted set of slots scored by when they were taken
+# ARGV[1]: how many callbacks the service can have in flight
+# ARGV[2]: the time now, in seconds
+# ARGV[3]: how long a slot lasts, in case a worker dies without giving it back
+# ARGV[4]: the id of the slot to take
+# Returns {1, in flight} if a slot was taken, {0, seconds until the circuit closes} if the circuit is open, or
+# {-1, in flight} if the service already has too many callbacks in flight. Each slot expires on its own, so slots
+# that were never given back stop counting however busy the service is.
+ACQUIRE_SCRIPT = """
+local open_for = redis.call('TTL', KEYS[1])
+if open_for > 0 then
+    return {0, open_for}
+end
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', ARGV[2] - ARGV[3])
+local in_flight = redis.call('ZCARD', KEYS[2])
+if in_flight >= tonumber(ARGV[1]) then
+    return {-1, in_flight}
+end
+redis.call('ZADD', KEYS[2], ARGV[2], ARGV[4])
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+return {1, in_flight + 1}
+"""
+
+# KEYS[1]: the service's count of recent failures
+# KEYS[2]: the service's circuit breaker
+# ARGV[1]: how many failures open the circuit
+# ARGV[2]: how long failures are counted for
+# ARGV[3]: how long the circuit stays open
+# Returns 1 if this failure opened the circuit, otherwise 0. When the circuit opens the failure count is left one
+# short of opening it again, so the first callback after the circuit closes decides whether it opens again.
+FAILURE_SCRIPT = """
+local failures = redis.call('INCR', KEYS[1])
+if failures == 1 then
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+if failures >= tonumber(ARGV[1]) then
+    redis.call('SET', KEYS[2], 1, 'EX', ARGV[3])
+    redis.call('SET', KEYS[1], tonumber(ARGV[1]) - 1, 'EX', ARGV[2] + ARGV[3])
+    return 1
+end
+return 0
+"""
+
+
+class CallbackDeferred(Exception):
+    """
+    The callback wasn't attempted and should be tried again in `countdown` seconds
+    """
+
+    def __init__(self, reason, countdown):
+        self.reason = reason
+        self.countdown = countdown
+
+    def __str__(self):
+        return "{}, try again in {} seconds".format(self.reason, self.countdown)
+
+
+class CircuitOpen(CallbackDeferred):
+    pass
+
+
+class TooManyInFlight(CallbackDeferred):
+    pass
+
+
+def in_flight_key(service_key):
+    return 'service-callback-in-flight-{}'.format(service_key)
+
+
+def failures_key(service_key):
+    return 'service-callback-failures-{}'.format(service_key)
+
+
+def circuit_open_key(service_key):
+    return 'service-callback-circuit-open-{}'.format(service_key)
+
+
+def counts_as_failure(exception):
+    # a 4xx means the endpoint is up and answering, it just doesn't want this callback
+    return not isinstance(exception, HTTPError) or exception.response.status_code >= 500
+
+
+class ServiceCallbackDispatcher:
+
+    def __init__(self):
+        self._session = None
+        self._session_pid = None
+
+    @property
+    def session(self):
+        # connections can't be shared with forked processes, so each celery worker has its own session
+        if self._session is None or self._session_pid != os.getpid():
+            adapter = HTTPAdapter(
+                pool_connections=current_app.config['SERVICE_CALLBACK_POOL_HOSTS'],
+                pool_maxsize=current_app.config['SERVICE_CALLBACK_POOL_SIZE'],
+                max_retries=0,
+            )
+            session = Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            self._session, self._session_pid = session, os.getpid()
+        return self._session
+
+    def send(self, service_key, url, token, data):
+        """
+        POST `data` as JSON to a service's callback url.
+
+        :param service_key: what the service's allowance and circuit breaker are kept under, normally its id
+        :raises CallbackDeferred: if the callback wasn't attempted
+        :raises RequestException: if the callback failed, including if the endpoint returned an error status
+        :return: the response
+        """
+        destination = self._destination(url)
+        slot = self._acquire(service_key, destination)
+        start_time = monotonic()
+        try:
+            response = self.session.post(
+                url,
+                data=json.dumps(data),
+                headers={
+                    'Content-Type': 'application/json',
+                    'Authorization': 'Bearer {}'.format(token)
+                },
+                timeout=(
+                    current_app.config['SERVICE_CALLBACK_CONNECT_TIMEOUT'],
+                    current_app.config['SERVICE_CALLBACK_READ_TIMEOUT'],
+                ),
+            )
+            response.raise_for_status()
+        except Exception as e:
+            statsd_client.incr('service-callback.{}.failure'.format(destination))
+            if counts_as_failure(e):
+                self._record_failure(service_key)
+            raise
+        else:
+            statsd_client.incr('service-callback.{}.success'.format(destination))
+            self._record_success(service_key)
+            return response
+        finally:
+            statsd_client.timing('service-callback.{}.request-time'.format(destination), monotonic() - start_time)
+            if slot:
+                self._release(service_key, slot)
+
+    def _acquire(self, service_key, destination):
+        """
+        :return: the id of the slot taken, or None if no slot was needed because redis isn't available
+        """
+        if not current_app.config['REDIS_ENABLED']:
+            return None
+
+        config = current_app.config
+        slot = str(uuid.uuid4())
+        try:
+            acquire = redis_store.redis_store.register_script(ACQUIRE_SCRIPT)
+            result, value = acquire(
+                keys=[circuit_open_key(service_key), in_flight_key(service_key)],
+                args=[
+                    config['SERVICE_CALLBACK_MAX_IN_FLIGHT'],
+                    time(),
+                    int(config['SERVICE_CALLBACK_CONNECT_TIMEOUT'] + config['SERVICE_CALLBACK_READ_TIMEOUT']) + 60,
+                    slot,
+                ],
+            )
+        except Exception:
+            current_app.logger.exception('Could not check callback allowance for {}'.format(service_key))
+            return None
+
+        if result == CIRCUIT_OPEN:
+            statsd_client.incr('service-callback.{}.circuit-open'.format(destination))
+            raise CircuitOpen('circuit open for {}'.format(service_key), int(value))
+        if result == TOO_MANY_IN_FLIGHT:
+            statsd_client.incr('service-callback.{}.too-many-in-flight'.format(destination))
+            raise TooManyInFlight(
+                '{} callbacks already in flight for {}'.format(value, service_key), IN_FLIGHT_RETRY_SECONDS
+            )
+        return slot
+
+    def _release(self, service_key, slot):
+        try:
+            redis_store.redis_store.zrem(in_flight_key(service_key), slot)
+        except Exception:
+            current_app.logger.exception('Could not release callback allowance for {}'.format(service_key))
+
+    def _record_failure(self, service_key):
+        if not current_app.config['REDIS_ENABLED']:
+            return
+
+        config = current_app.config
+        try:
+            record_failure = redis_store.redis_store.register_script(FAILURE_SCRIPT)
+            opened = record_failure(
+                keys=[failures_key(service_key), circuit_open_key(service_key)],
+                args=[
+                    config['SERVICE_CALLBACK_FAILURE_THRESHOLD'],
+                    config['SERVICE_CALLBACK_FAILURE_WINDOW_SECONDS'],
+                    config['SERVICE_CALLBACK_CIRCUIT_OPEN_SECONDS'],
+                ],
+            )
+        except Exception:
+            current_app.logger.exception('Could not record callback failure for {}'.format(service_key))
+            return
+
+        if opened:
+            current_app.logger.warning('Circuit opened for service callbacks to {} for {} seconds'.format(
+                service_key, config['SERVICE_CALLBACK_CIRCUIT_OPEN_SECONDS']
+            ))
+
+    def _record_success(self, service_key):
+        if not current_app.config['REDIS_ENABLED']:
+            return
+
+        try:
+            redis_store.redis_store.delete(failures_key(service_key))
+        except Exception:
+            current_app.logger.exception('Could not record callback success for {}'.format(service_key))
+
+    @staticmethod
+    def _destination(url):
+        # statsd uses dots to separate parts of a metric name
+        return (urlparse(url).hostname or 'unknown').replace('.', '_')
+
+
+callback_dispatcher = ServiceCallbackDispatcher()
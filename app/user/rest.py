@@ -34,6 +34,7 @@ from app.notifications.process_notifications import (
     persist_notification,
     send_notification_to_queue
 )
+from app.serialised_models import SerialisedAllowedRecipients
 from app.schemas import (
     email_data_request_schema,
     partial_email_data_request_schema,
@@ -132,7 +133,9 @@ def update_user_attribute(user_id):
 @user_blueprint.route('/<uuid:user_id>/archive', methods=['POST'])
 def archive_user(user_id):
     user = get_user_by_id(user_id)
+    service_ids = [service.id for service in user.services]
     dao_archive_user(user)
+    SerialisedAllowedRecipients.remove_from_cache(*service_ids)
 
     return '', 204
 
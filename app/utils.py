@@ -141,6 +141,32 @@ def get_notification_table_to_use(service, notification_type, process_day, has_d
     return Notification if days_ago <= timedelta(days=days_of_retention) else NotificationHistory
 
 
+def get_services_using_notification_table(table, notification_type, process_day, has_delete_task_run):
+    """
+    Query for the id and crown status of every service whose notifications of this type for process_day are in
+    `table`. This makes the same decision as get_notification_table_to_use, but for all services in one query.
+    """
+    from app import db
+    from app.models import Notification, Service, ServiceDataRetention
+
+    todays_bst_date = convert_utc_to_bst(datetime.utcnow()).date()
+    days_ago = (todays_bst_date - process_day).days
+
+    days_of_retention = func.coalesce(ServiceDataRetention.days_of_retention, 7)
+    if not has_delete_task_run:
+        days_of_retention += 1
+
+    return db.session.query(
+        Service.id,
+        Service.crown,
+    ).outerjoin(
+        ServiceDataRetention,
+        (ServiceDataRetention.service_id == Service.id) & (ServiceDataRetention.notification_type == notification_type)
+    ).filter(
+        days_of_retention >= days_ago if table == Notification else days_of_retention < days_ago
+    )
+
+
 def get_archived_db_column_value(column):
     date = datetime.utcnow().strftime("%Y-%m-%d")
     return f'_archived_{date}_{column}'
@@ -1,3 +1,6 @@
+import uuid
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
 from io import BytesIO
 
 from flask import jsonify, request, url_for, current_app, send_file
@@ -5,6 +8,7 @@ from flask import jsonify, request, url_for, current_app, send_file
 from app import api_user, authenticated_service
 from app.dao import notifications_dao
 from app.letters.utils import get_letter_pdf_and_metadata
+from app.notifications.notification_list import serialize_notification_rows
 from app.schema_validation import validate
 from app.v2.errors import BadRequestError, PDFNotReadyError
 from app.v2.notifications import v2_notification_blueprint
@@ -16,6 +20,8 @@ from app.models import (
     LETTER_TYPE,
 )
 
+CURSOR_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
 
 @v2_notification_blueprint.route("/<notification_id>", methods=['GET'])
 def get_notification_by_id(notification_id):
@@ -63,6 +69,10 @@ def get_notifications():
     if 'older_than' in _data:
         _data['older_than'] = _data['older_than'][0]
 
+    # and cursor
+    if 'cursor' in _data:
+        _data['cursor'] = _data['cursor'][0]
+
     # and client reference
     if 'reference' in _data:
         _data['reference'] = _data['reference'][0]
@@ -72,14 +82,19 @@ def get_notifications():
 
     data = validate(_data, get_notifications_request)
 
-    paginated_notifications = notifications_dao.get_notifications_for_service(
+    if 'cursor' in data:
+        before_created_at, before_id = _decode_cursor(data['cursor'])
+    else:
+        before_created_at, before_id = None, data.get('older_than')
+
+    notifications = notifications_dao.get_notification_rows_for_service_before(
         str(authenticated_service.id),
+        page_size=current_app.config.get('API_PAGE_SIZE'),
+        before_created_at=before_created_at,
+        before_id=before_id,
         filter_dict=data,
         key_type=api_user.key_type,
-        personalisation=True,
-        older_than=data.get('older_than'),
         client_reference=data.get('reference'),
-        page_size=current_app.config.get('API_PAGE_SIZE'),
         include_jobs=data.get('include_jobs')
     )
 
@@ -89,12 +104,28 @@ def get_notifications():
         }
 
         if len(notifications):
-            next_query_params = dict(data, older_than=notifications[-1].id)
+            next_query_params = {key: value for key, value in data.items() if key != 'older_than'}
+            next_query_params['cursor'] = _encode_cursor(notifications[-1])
             _links['next'] = url_for(".get_notifications", _external=True, **next_query_params)
 
         return _links
 
     return jsonify(
-        notifications=[notification.serialize() for notification in paginated_notifications.items],
-        links=_build_links(paginated_notifications.items)
+        notifications=serialize_notification_rows(notifications),
+        links=_build_links(notifications)
     ), 200
+
+
+def _encode_cursor(notification):
+    cursor = '{}|{}'.format(notification.created_at.strftime(CURSOR_DATETIME_FORMAT), notification.id)
+    return urlsafe_b64encode(cursor.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def _decode_cursor(cursor):
+    try:
+        created_at, notification_id = urlsafe_b64decode(
+            cursor + '=' * (-len(cursor) % 4)
+        ).decode('utf-8').split('|')
+        return datetime.strptime(created_at, CURSOR_DATETIME_FORMAT), uuid.UUID(notification_id)
+    except ValueError:
+        raise BadRequestError(message="cursor is not valid")
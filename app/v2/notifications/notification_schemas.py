@@ -87,7 +87,8 @@ get_notifications_request = {
             }
         },
         "include_jobs": {"enum": ["true", "True"]},
-        "older_than": uuid
+        "older_than": uuid,
+        "cursor": {"type": "string"}
     },
     "additionalProperties": False,
 }
@@ -49,7 +49,7 @@ from app.notifications.validators import (
     check_service_has_permission,
     check_service_sms_sender_id,
     validate_address,
-    validate_and_format_recipient,
+    validate_and_normalise_recipient,
     validate_template,
     check_is_message_too_long)
 from app.schema_validation import validate
@@ -173,13 +173,13 @@ def process_sms_or_email_notification(
     notification_id = uuid.uuid4()
     form_send_to = form['email_address'] if notification_type == EMAIL_TYPE else form['phone_number']
 
-    send_to = validate_and_format_recipient(send_to=form_send_to,
-                                            key_type=api_user.key_type,
-                                            service=service,
-                                            notification_type=notification_type)
+    recipient = validate_and_normalise_recipient(send_to=form_send_to,
+                                                 key_type=api_user.key_type,
+                                                 service=service,
+                                                 notification_type=notification_type)
 
     # Do not persist or send notification to the queue if it is a simulated recipient
-    simulated = simulated_recipient(send_to, notification_type)
+    simulated = simulated_recipient(recipient.normalised_to, notification_type)
 
     personalisation, document_download_count = process_document_uploads(
         form.get('personalisation'),
@@ -245,7 +245,8 @@ def process_sms_or_email_notification(
         client_reference=form.get('reference', None),
         simulated=simulated,
         reply_to_text=reply_to_text,
-        document_download_count=document_download_count
+        document_download_count=document_download_count,
+        normalised_recipient=recipient,
     )
 
     if not simulated:
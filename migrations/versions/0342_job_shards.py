@@ -0,0 +1,25 @@
+"""
+
+Revision ID: 0342_job_shards
+Revises: 0341_new_letter_rates
+Create Date: 2021-02-03 10:12:41.204815
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+revision = '0342_job_shards'
+down_revision = '0341_new_letter_rates'
+
+
+def upgrade():
+    op.add_column('jobs', sa.Column('shard_count', sa.Integer(), nullable=True))
+    # record which shards have finished rather than how many, so a shard that runs twice isn't counted twice
+    op.add_column('jobs', sa.Column('completed_shards', postgresql.ARRAY(sa.Integer()), nullable=True))
+
+
+def downgrade():
+    op.drop_column('jobs', 'completed_shards')
+    op.drop_column('jobs', 'shard_count')
@@ -0,0 +1,25 @@
+"""
+
+Revision ID: 0343_notifications_keyset_index
+Revises: 0342_job_shards
+Create Date: 2021-02-10 14:02:37.518244
+
+"""
+from alembic import op
+
+revision = '0343_notifications_keyset_index'
+down_revision = '0342_job_shards'
+
+
+def upgrade():
+    # backs paging through a service's notifications by (created_at, id) for GET /v2/notifications
+    with op.get_context().autocommit_block():
+        op.execute("""
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_notifications_service_id_created_at_id
+            ON notifications (service_id, created_at DESC, id DESC)
+        """)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_notifications_service_id_created_at_id')
@@ -0,0 +1,27 @@
+"""
+
+Revision ID: 0344_notifications_autovacuum
+Revises: 0343_notifications_keyset_index
+Create Date: 2021-02-15 10:12:48.203561
+
+"""
+from alembic import op
+
+revision = '0344_notifications_autovacuum'
+down_revision = '0343_notifications_keyset_index'
+
+
+def upgrade():
+    # the nightly retention task deletes millions of rows from notifications. By default autovacuum waits until a fifth
+    # of a table is dead before cleaning it up, which for notifications can be days of deletes, so vacuum it (and
+    # update its statistics) once 1% has changed so the space is reused rather than the table growing
+    op.execute("""
+        ALTER TABLE notifications SET (
+            autovacuum_vacuum_scale_factor = 0.01,
+            autovacuum_analyze_scale_factor = 0.01
+        )
+    """)
+
+
+def downgrade():
+    op.execute('ALTER TABLE notifications RESET (autovacuum_vacuum_scale_factor, autovacuum_analyze_scale_factor)')
@@ -0,0 +1,26 @@
+"""
+
+Revision ID: 0345_notifications_purge_index
+Revises: 0344_notifications_autovacuum
+Create Date: 2021-02-17 09:41:05.117392
+
+"""
+from alembic import op
+
+revision = '0345_notifications_purge_index'
+down_revision = '0344_notifications_autovacuum'
+
+
+def upgrade():
+    # backs the nightly purge of notifications past their retention, which works through a group of services'
+    # notifications of one type by created_at
+    with op.get_context().autocommit_block():
+        op.execute("""
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_notifications_service_id_notification_type_created_at
+            ON notifications (service_id, notification_type, created_at)
+        """)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_notifications_service_id_notification_type_created_at')
@@ -0,0 +1,32 @@
+"""
+
+Revision ID: 0346_notifications_search_index
+Revises: 0345_notifications_purge_index
+Create Date: 2021-02-22 10:12:37.508213
+
+"""
+from alembic import op
+
+revision = '0346_notifications_search_index'
+down_revision = '0345_notifications_purge_index'
+
+
+def upgrade():
+    # searching a service's notifications by recipient or reference matches anywhere in the value, which a b-tree
+    # can't help with - trigram indexes can, for LIKE and ILIKE both
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    with op.get_context().autocommit_block():
+        op.execute("""
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_notifications_normalised_to_trgm
+            ON notifications USING gin (normalised_to gin_trgm_ops)
+        """)
+        op.execute("""
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_notifications_client_reference_trgm
+            ON notifications USING gin (client_reference gin_trgm_ops)
+        """)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_notifications_client_reference_trgm')
+        op.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_notifications_normalised_to_trgm')
@@ -1,14 +1,19 @@
+from io import BytesIO
 from unittest.mock import call
 from datetime import datetime, timedelta
 import pytest
 import pytz
+from botocore.exceptions import ClientError
 
 from freezegun import freeze_time
 
 from app.aws.s3 import (
+    get_job_metadata_from_s3,
+    get_job_stream_and_metadata_from_s3,
     get_s3_bucket_objects,
     get_s3_file,
     get_list_of_files_by_suffix,
+    remove_s3_objects_by_prefix,
 )
 from tests.app.conftest import datetime_in_past
 
@@ -31,6 +36,31 @@ def test_get_s3_file_makes_correct_call(notify_api, mocker):
     )
 
 
+def test_get_job_stream_and_metadata_from_s3_makes_a_single_request(notify_api, mocker):
+    get_s3_mock = mocker.patch('app.aws.s3.get_s3_object')
+    get_s3_mock.return_value.get.return_value = {
+        'Body': BytesIO('phone number,name\n07700900001,Zoë\n'.encode('utf-8')),
+        'Metadata': {'sender_id': 'abc'},
+    }
+
+    csv_stream, metadata = get_job_stream_and_metadata_from_s3('service-id', 'job-id')
+
+    assert csv_stream.read() == 'phone number,name\n07700900001,Zoë\n'
+    assert metadata == {'sender_id': 'abc'}
+    get_s3_mock.assert_called_once_with('test-notifications-csv-upload', 'service-service-id-notify/job-id.csv')
+    get_s3_mock.return_value.get.assert_called_once_with()
+
+
+def test_get_job_metadata_from_s3_uses_head_request(notify_api, mocker):
+    head_mock = mocker.patch('app.aws.s3.head_s3_object', return_value={'Metadata': {'sender_id': 'abc'}})
+    get_s3_mock = mocker.patch('app.aws.s3.get_s3_object')
+
+    assert get_job_metadata_from_s3('service-id', 'job-id') == {'sender_id': 'abc'}
+
+    head_mock.assert_called_once_with('test-notifications-csv-upload', 'service-service-id-notify/job-id.csv')
+    assert not get_s3_mock.called
+
+
 def test_get_s3_bucket_objects_make_correct_pagination_call(notify_api, mocker):
     paginator_mock = mocker.patch('app.aws.s3.client')
 
@@ -111,3 +141,46 @@ def test_get_list_of_files_by_suffix_empty_contents_return_with_no_error(notify_
     key = get_list_of_files_by_suffix('foo-bucket', subfolder='bar', suffix='.pdf')
 
     assert sum(1 for x in key) == 0
+
+
+def _list_objects_pages(Bucket, Prefix):
+    return [{'Contents': [single_s3_object_stub('{}-{}'.format(Prefix, i)) for i in range(2)]}]
+
+
+def test_remove_s3_objects_by_prefix_deletes_everything_listed_in_batches(notify_api, mocker):
+    client_mock = mocker.patch('app.aws.s3.client')
+    client_mock.return_value.get_paginator.return_value.paginate.side_effect = _list_objects_pages
+    client_mock.return_value.delete_objects.return_value = {}
+
+    failures = remove_s3_objects_by_prefix('foo-bucket', ('letter-{}'.format(i) for i in range(501)))
+
+    assert failures == []
+    client_mock.assert_called_once_with('s3', 'eu-west-1')
+    deletes = client_mock.return_value.delete_objects.call_args_list
+    assert [len(delete[1]['Delete']['Objects']) for delete in deletes] == [1000, 2]
+    assert deletes[0][1]['Bucket'] == 'foo-bucket'
+    assert deletes[0][1]['Delete']['Objects'][:3] == [
+        {'Key': 'letter-0-0'}, {'Key': 'letter-0-1'}, {'Key': 'letter-1-0'}
+    ]
+    assert deletes[0][1]['Delete']['Quiet'] is True
+
+
+def test_remove_s3_objects_by_prefix_reports_failures_for_each_key(notify_api, mocker):
+    client_mock = mocker.patch('app.aws.s3.client')
+
+    def paginate(Bucket, Prefix):
+        if Prefix == 'unlistable':
+            raise ClientError({'Error': {'Code': 'AccessDenied', 'Message': 'Access Denied'}}, 'ListObjectsV2')
+        return _list_objects_pages(Bucket, Prefix)
+
+    client_mock.return_value.get_paginator.return_value.paginate.side_effect = paginate
+    client_mock.return_value.delete_objects.return_value = {
+        'Errors': [{'Key': 'letter-1', 'Code': 'AccessDenied', 'Message': 'Access Denied'}]
+    }
+
+    failures = remove_s3_objects_by_prefix('foo-bucket', ['letter', 'unlistable'])
+
+    assert failures == [
+        ('unlistable', 'An error occurred (AccessDenied) when calling the ListObjectsV2 operation: Access Denied'),
+        ('letter-1', 'Access Denied'),
+    ]
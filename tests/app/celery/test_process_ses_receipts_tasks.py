@@ -1,19 +1,25 @@
 import json
+import uuid
 from datetime import datetime
 
 from freezegun import freeze_time
+from notifications_utils.timezones import convert_utc_to_bst
 
 
 from app import statsd_client, encryption
-from app.celery.process_ses_receipts_tasks import process_ses_results
+from app.celery.process_ses_receipts_tasks import (
+    process_buffered_ses_results,
+    process_ses_results,
+    process_ses_results_batch,
+)
 from app.celery.research_mode_tasks import (
     ses_hard_bounce_callback,
     ses_soft_bounce_callback,
     ses_notification_callback
 )
 from app.celery.service_callback_tasks import create_delivery_status_callback_data
-from app.dao.notifications_dao import get_notification_by_id
-from app.models import Complaint, Notification
+from app.dao.notifications_dao import dao_update_notification_statuses_by_reference, get_notification_by_id
+from app.models import Complaint, Notification, NotificationHistory
 from app.notifications.notifications_ses_callback import (
     remove_emails_from_complaint,
     remove_emails_from_bounce
@@ -21,9 +27,11 @@ from app.notifications.notifications_ses_callback import (
 
 from tests.app.db import (
     create_notification,
+    create_notification_history,
     ses_complaint_callback,
     create_service_callback_api,
 )
+from tests.conftest import set_config, set_config_values
 
 
 def test_process_ses_results(sample_email_template):
@@ -32,6 +40,22 @@ def test_process_ses_results(sample_email_template):
     assert process_ses_results(response=ses_notification_callback(reference='ref1'))
 
 
+def test_process_ses_results_moves_notification_counts_to_new_status(notify_api, sample_email_template, mocker):
+    mock_redis = mocker.patch('app.notification_counts.redis_store.redis_store')
+    pipe = mock_redis.pipeline.return_value
+    notification = create_notification(sample_email_template, reference='ref1', status='sending')
+
+    with set_config(notify_api, 'REDIS_ENABLED', True):
+        assert process_ses_results(response=ses_notification_callback(reference='ref1'))
+
+    service_key = 'notification-counts-{}-{}'.format(
+        notification.service_id, convert_utc_to_bst(notification.created_at).date().isoformat()
+    )
+    field = 'email:{{}}:{}:normal'.format(notification.template_id)
+    pipe.hincrby.assert_any_call(service_key, field.format('sending'), -1)
+    pipe.hincrby.assert_any_call(service_key, field.format('delivered'), 1)
+
+
 def test_process_ses_results_retry_called(sample_email_template, notify_db, mocker):
     create_notification(sample_email_template, reference='ref1', sent_at=datetime.utcnow(), status='sending')
 
@@ -258,5 +282,132 @@ def test_ses_callback_should_send_on_complaint_to_user_callback_api(sample_email
         'reference': None,
         'service_callback_api_bearer_token': 'some_super_secret',
         'service_callback_api_url': 'https://original_url.com',
+        'service_id': str(sample_email_template.service_id),
         'to': 'recipient1@example.com'
     }
+
+
+def test_process_ses_results_batch_updates_notifications_grouped_by_status(sample_email_template, mocker):
+    mocker.patch('app.statsd_client.incr')
+    send_mock = mocker.patch('app.celery.service_callback_tasks.send_delivery_status_to_service.apply_async')
+    mock_update = mocker.patch(
+        'app.celery.process_ses_receipts_tasks.notifications_dao.dao_update_notification_statuses_by_reference',
+        wraps=dao_update_notification_statuses_by_reference,
+    )
+    callback_api = create_service_callback_api(service=sample_email_template.service, url="https://original_url.com")
+    delivered_1 = create_notification(sample_email_template, reference='ref1', status='sending')
+    delivered_2 = create_notification(sample_email_template, reference='ref2', status='sending')
+    failed = create_notification(sample_email_template, reference='ref3', status='pending')
+    already_delivered = create_notification(sample_email_template, reference='ref4', status='delivered')
+
+    assert process_ses_results_batch([
+        ses_notification_callback(reference='ref1'),
+        ses_notification_callback(reference='ref2'),
+        ses_hard_bounce_callback(reference='ref3'),
+        ses_hard_bounce_callback(reference='ref4'),
+        ses_hard_bounce_callback(reference='ref1'),
+    ])
+
+    assert get_notification_by_id(delivered_1.id).status == 'delivered'
+    assert get_notification_by_id(delivered_2.id).status == 'delivered'
+    assert get_notification_by_id(failed.id).status == 'permanent-failure'
+    assert get_notification_by_id(already_delivered.id).status == 'delivered'
+    mock_update.assert_called_once_with({'delivered': ['ref1', 'ref2'], 'permanent-failure': ['ref3']})
+    statsd_client.incr.assert_any_call('callback.ses.delivered', count=2)
+    statsd_client.incr.assert_any_call('callback.ses.permanent-failure', count=1)
+    assert send_mock.call_count == 3
+    send_mock.assert_any_call(
+        [str(failed.id), create_delivery_status_callback_data(failed, callback_api)],
+        queue="service-callbacks"
+    )
+
+
+def test_process_ses_results_batch_falls_back_to_notification_history(sample_email_template):
+    notification = create_notification(sample_email_template, reference='ref1', status='sending')
+    create_notification_history(id=uuid.uuid4(), template=sample_email_template, reference='ref2', status='sending')
+
+    assert process_ses_results_batch([
+        ses_notification_callback(reference='ref1'),
+        ses_notification_callback(reference='ref2'),
+    ])
+
+    assert get_notification_by_id(notification.id).status == 'delivered'
+    assert NotificationHistory.query.filter_by(reference='ref2').one().status == 'delivered'
+
+
+def test_process_ses_results_batch_retries_only_new_missing_notifications(sample_email_template, mocker):
+    mock_retry = mocker.patch('app.celery.process_ses_receipts_tasks.process_ses_results_batch.retry')
+    notification = create_notification(sample_email_template, reference='ref1', status='sending')
+    missing_response = ses_notification_callback(reference='ref2')
+
+    with freeze_time('2017-11-17T12:14:03.646Z'):
+        assert process_ses_results_batch([ses_notification_callback(reference='ref1'), missing_response])
+
+    assert get_notification_by_id(notification.id).status == 'delivered'
+    mock_retry.assert_called_once_with(args=[[missing_response]], queue='retry-tasks')
+
+
+def test_process_ses_results_batch_does_not_retry_complaints_it_has_recorded(sample_email_template, mocker):
+    mock_retry = mocker.patch('app.celery.process_ses_receipts_tasks.process_ses_results_batch.retry')
+    mocker.patch(
+        'app.celery.process_ses_receipts_tasks.notifications_dao.dao_update_notification_statuses_by_reference',
+        side_effect=Exception('EXPECTED'),
+    )
+    create_notification(sample_email_template, reference='ref1', status='sending')
+    delivery_response = ses_notification_callback(reference='ref1')
+
+    process_ses_results_batch([ses_complaint_callback(), delivery_response])
+
+    assert Complaint.query.count() == 1
+    mock_retry.assert_called_once_with(args=[[delivery_response]], queue='retry-tasks')
+
+
+def test_process_ses_results_buffers_result_if_enabled(notify_api, mocker):
+    mock_push = mocker.patch('app.celery.process_ses_receipts_tasks.receipt_buffer.push')
+    mock_update = mocker.patch('app.dao.notifications_dao.dao_update_notifications_by_reference')
+    response = ses_notification_callback(reference='ref1')
+
+    with set_config_values(notify_api, {'REDIS_ENABLED': True, 'SES_CALLBACK_BUFFER_ENABLED': True}):
+        assert process_ses_results(response=response)
+
+    buffer_key, buffered_response = mock_push.call_args[0]
+    assert buffer_key == 'ses-results'
+    assert json.loads(buffered_response) == response
+    assert not mock_update.called
+
+
+def test_process_ses_results_processes_result_if_it_cannot_be_buffered(notify_api, sample_email_template, mocker):
+    mocker.patch('app.celery.process_ses_receipts_tasks.receipt_buffer.push', side_effect=ConnectionError)
+    notification = create_notification(sample_email_template, reference='ref1', status='sending')
+
+    with set_config_values(notify_api, {'REDIS_ENABLED': True, 'SES_CALLBACK_BUFFER_ENABLED': True}):
+        assert process_ses_results(response=ses_notification_callback(reference='ref1'))
+
+    assert get_notification_by_id(notification.id).status == 'delivered'
+
+
+def test_process_buffered_ses_results_queues_batches_of_results(notify_api, mocker):
+    mock_drain = mocker.patch('app.celery.process_ses_receipts_tasks.receipt_buffer.drain')
+    mock_apply_async = mocker.patch('app.celery.process_ses_receipts_tasks.process_ses_results_batch.apply_async')
+    responses = [ses_notification_callback(reference='ref1'), ses_hard_bounce_callback(reference='ref2')]
+
+    with set_config_values(notify_api, {
+        'REDIS_ENABLED': True,
+        'SES_CALLBACK_BUFFER_ENABLED': True,
+        'SES_CALLBACK_BUFFER_BATCH_SIZE': 2,
+    }):
+        process_buffered_ses_results()
+
+    buffer_key, batch_size, time_budget, apply_batch = mock_drain.call_args[0]
+    assert (buffer_key, batch_size, time_budget) == ('ses-results', 2, 8)
+    apply_batch([json.dumps(response) for response in responses])
+    mock_apply_async.assert_called_once_with([responses], queue='notify-internal-tasks')
+
+
+def test_process_buffered_ses_results_does_nothing_if_buffer_disabled(notify_api, mocker):
+    mock_drain = mocker.patch('app.celery.process_ses_receipts_tasks.receipt_buffer.drain')
+
+    with set_config_values(notify_api, {'REDIS_ENABLED': True, 'SES_CALLBACK_BUFFER_ENABLED': False}):
+        process_buffered_ses_results()
+
+    assert not mock_drain.called
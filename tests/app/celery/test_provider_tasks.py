@@ -1,14 +1,18 @@
+import uuid
+from unittest.mock import call
+
 import pytest
 from botocore.exceptions import ClientError
 from celery.exceptions import MaxRetriesExceededError
 
 import app
 from app.celery import provider_tasks
-from app.celery.provider_tasks import deliver_sms, deliver_email
+from app.celery.provider_tasks import deliver_sms, deliver_email, deliver_sms_batch, deliver_email_batch
 from app.clients.sms import SmsClientResponseException
 from app.clients.email import EmailClientNonRetryableException
 from app.clients.email.aws_ses import AwsSesClientException, AwsSesClientThrottlingSendRateException
 from app.exceptions import NotificationTechnicalFailureException
+from tests.app.db import create_notification
 
 
 def test_should_have_decorated_tasks_functions():
@@ -197,3 +201,48 @@ def test_if_ses_send_rate_throttle_then_should_retry_and_log_warning(sample_noti
     assert sample_notification.status == 'created'
     assert not mock_logger_exception.called
     assert mock_logger_warning.called
+
+
+def test_deliver_sms_batch_puts_notifications_that_were_not_sent_on_retry_queue(sample_template, mocker):
+    sent = create_notification(template=sample_template)
+    failed = create_notification(template=sample_template)
+    missing_id = str(uuid.uuid4())
+    mock_send_batch = mocker.patch(
+        'app.delivery.send_to_providers.send_sms_batch_to_provider',
+        return_value=[(failed, SmsClientResponseException('error'))],
+    )
+    mock_deliver_sms = mocker.patch('app.celery.provider_tasks.deliver_sms.apply_async')
+
+    deliver_sms_batch([str(sent.id), str(failed.id), missing_id])
+
+    assert {notification.id for notification in mock_send_batch.call_args[0][0]} == {sent.id, failed.id}
+    assert mock_deliver_sms.call_args_list == [
+        call([missing_id], queue='retry-tasks'),
+        call([str(failed.id)], queue='retry-tasks'),
+    ]
+
+
+def test_deliver_email_batch_marks_non_retryable_failures_as_technical_failure(sample_email_template, mocker):
+    failed = create_notification(template=sample_email_template)
+    mocker.patch(
+        'app.delivery.send_to_providers.send_email_batch_to_provider',
+        return_value=[(failed, EmailClientNonRetryableException('bad email'))],
+    )
+    mock_deliver_email = mocker.patch('app.celery.provider_tasks.deliver_email.apply_async')
+
+    deliver_email_batch([str(failed.id)])
+
+    assert failed.status == 'technical-failure'
+    assert not mock_deliver_email.called
+
+
+def test_deliver_sms_batch_sends_notifications_one_at_a_time_if_batch_fails(mocker):
+    notification_ids = [str(uuid.uuid4()), str(uuid.uuid4())]
+    mocker.patch('app.celery.provider_tasks.notifications_dao.dao_get_notifications_by_ids', side_effect=Exception)
+    mock_deliver_sms = mocker.patch('app.celery.provider_tasks.deliver_sms.apply_async')
+
+    deliver_sms_batch(notification_ids)
+
+    assert mock_deliver_sms.call_args_list == [
+        call([notification_id], queue='retry-tasks') for notification_id in notification_ids
+    ]
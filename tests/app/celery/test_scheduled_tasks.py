@@ -1,5 +1,5 @@
 import uuid
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from unittest.mock import call
 
 import pytest
@@ -18,6 +18,7 @@ from app.celery.scheduled_tasks import (
     check_templated_letter_state,
     check_for_missing_rows_in_completed_jobs,
     check_for_services_with_high_failure_rates_or_sending_to_tv_numbers,
+    reconcile_notification_counts,
     switch_current_sms_provider_on_slow_delivery,
     trigger_link_tests,
 )
@@ -619,3 +620,30 @@ def test_trigger_link_does_nothing_if_cbc_proxy_disabled(
         trigger_link_tests()
 
     assert mock_trigger_link_test.called is False
+
+
+@freeze_time('2020-06-01 23:30')
+def test_reconcile_notification_counts_sets_todays_counts_from_the_database(notify_api, sample_template, mocker):
+    mock_set_counts = mocker.patch('app.celery.scheduled_tasks.set_notification_counts_for_day')
+    create_notification(template=sample_template, status='delivered')
+    create_notification(template=sample_template, status='delivered')
+    create_notification(template=sample_template, status='sending', created_at=datetime(2020, 5, 31, 12, 0))
+
+    with set_config(notify_api, 'REDIS_ENABLED', True):
+        reconcile_notification_counts()
+
+    bst_date, counts = mock_set_counts.call_args[0]
+    assert bst_date == date(2020, 6, 2)
+    assert [(row.service_id, row.notification_type, row.status, row.template_id, row.key_type, row.count)
+            for row in counts] == [
+        (sample_template.service_id, 'sms', 'delivered', sample_template.id, 'normal', 2)
+    ]
+
+
+def test_reconcile_notification_counts_does_nothing_if_redis_disabled(notify_api, mocker):
+    mock_set_counts = mocker.patch('app.celery.scheduled_tasks.set_notification_counts_for_day')
+
+    with set_config(notify_api, 'REDIS_ENABLED', False):
+        reconcile_notification_counts()
+
+    mock_set_counts.assert_not_called()
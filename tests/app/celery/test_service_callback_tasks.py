@@ -1,12 +1,21 @@
 import json
 from datetime import datetime
+from unittest.mock import Mock
 
 import pytest
 import requests_mock
 from freezegun import freeze_time
+from requests import ConnectTimeout, HTTPError
 
 from app import encryption
-from app.celery.service_callback_tasks import send_delivery_status_to_service, send_complaint_to_service
+from app.celery.service_callback_tasks import (
+    MAX_CALLBACK_DEFERRALS,
+    create_delivery_status_callback_data,
+    send_batched_delivery_statuses,
+    send_complaint_to_service,
+    send_delivery_status_to_service,
+)
+from app.service_callback_dispatcher import CircuitOpen, TooManyInFlight
 from app.utils import DATETIME_FORMAT
 from tests.app.db import (
     create_complaint,
@@ -15,6 +24,7 @@ from tests.app.db import (
     create_service,
     create_template
 )
+from tests.conftest import set_config_values
 
 
 @pytest.mark.parametrize("notification_type",
@@ -161,6 +171,155 @@ def test_send_delivery_status_to_service_succeeds_if_sent_at_is_none(
     assert mocked.call_count == 0
 
 
+def test_send_delivery_status_to_service_requeues_if_service_has_too_many_callbacks_in_flight(
+    notify_db_session, mocker
+):
+    callback_api, template = _set_up_test_data('email', "delivery_status")
+    notification = create_notification(template=template, status='delivered')
+    encrypted_data = create_delivery_status_callback_data(notification, callback_api)
+    mocker.patch(
+        'app.celery.service_callback_tasks.callback_dispatcher.send',
+        side_effect=TooManyInFlight('too many', 5),
+    )
+    mock_retry = mocker.patch('app.celery.service_callback_tasks.send_delivery_status_to_service.retry')
+    mock_apply_async = mocker.patch(
+        'app.celery.service_callback_tasks.send_delivery_status_to_service.apply_async'
+    )
+
+    send_delivery_status_to_service(notification.id, encrypted_status_update=encrypted_data)
+
+    mock_apply_async.assert_called_once_with(
+        [notification.id, encrypted_data], {'deferrals': 1}, queue='service-callbacks', countdown=5
+    )
+    assert not mock_retry.called
+
+
+def test_send_delivery_status_to_service_requeues_until_circuit_closes(notify_db_session, mocker):
+    callback_api, template = _set_up_test_data('email', "delivery_status")
+    notification = create_notification(template=template, status='delivered')
+    encrypted_data = create_delivery_status_callback_data(notification, callback_api)
+    mock_send = mocker.patch(
+        'app.celery.service_callback_tasks.callback_dispatcher.send',
+        side_effect=CircuitOpen('circuit open', 42),
+    )
+    mock_retry = mocker.patch('app.celery.service_callback_tasks.send_delivery_status_to_service.retry')
+    mock_apply_async = mocker.patch(
+        'app.celery.service_callback_tasks.send_delivery_status_to_service.apply_async'
+    )
+
+    send_delivery_status_to_service(notification.id, encrypted_status_update=encrypted_data, deferrals=3)
+
+    assert mock_send.call_args[0][0] == str(template.service_id)
+    mock_apply_async.assert_called_once_with(
+        [notification.id, encrypted_data], {'deferrals': 4}, queue='service-callbacks', countdown=42
+    )
+    assert not mock_retry.called
+
+
+def test_send_delivery_status_to_service_uses_retries_once_it_has_been_deferred_too_often(notify_db_session, mocker):
+    callback_api, template = _set_up_test_data('email', "delivery_status")
+    notification = create_notification(template=template, status='delivered')
+    encrypted_data = create_delivery_status_callback_data(notification, callback_api)
+    mocker.patch(
+        'app.celery.service_callback_tasks.callback_dispatcher.send',
+        side_effect=TooManyInFlight('too many', 5),
+    )
+    mock_retry = mocker.patch('app.celery.service_callback_tasks.send_delivery_status_to_service.retry')
+    mock_apply_async = mocker.patch(
+        'app.celery.service_callback_tasks.send_delivery_status_to_service.apply_async'
+    )
+
+    send_delivery_status_to_service(
+        notification.id, encrypted_status_update=encrypted_data, deferrals=MAX_CALLBACK_DEFERRALS
+    )
+
+    assert not mock_apply_async.called
+    mock_retry.assert_called_once_with(queue='retry-tasks', countdown=5)
+
+
+def test_send_delivery_status_to_service_adds_to_batch_if_service_has_opted_in(notify_api, notify_db_session, mocker):
+    callback_api, template = _set_up_test_data('email', "delivery_status")
+    notification = create_notification(template=template, status='delivered')
+    encrypted_data = create_delivery_status_callback_data(notification, callback_api)
+    mock_redis = mocker.patch('app.celery.service_callback_tasks.redis_store.redis_store')
+    mock_send = mocker.patch('app.celery.service_callback_tasks.callback_dispatcher.send')
+
+    with set_config_values(notify_api, {
+        'REDIS_ENABLED': True,
+        'SERVICE_CALLBACK_BATCH_SERVICES': [str(template.service_id)],
+    }):
+        send_delivery_status_to_service(notification.id, encrypted_status_update=encrypted_data)
+
+    mock_redis.rpush.assert_called_once_with(f'service-callback-batch-{template.service_id}', encrypted_data)
+    assert not mock_send.called
+
+
+def test_send_batched_delivery_statuses_posts_list_of_statuses(notify_api, notify_db_session, mocker):
+    callback_api, template = _set_up_test_data('sms', "delivery_status")
+    first = create_notification(template=template, status='delivered')
+    second = create_notification(template=template, status='permanent-failure')
+    batch = [
+        create_delivery_status_callback_data(first, callback_api),
+        create_delivery_status_callback_data(second, callback_api),
+    ]
+    mock_redis = mocker.patch('app.celery.service_callback_tasks.redis_store.redis_store')
+    mock_redis.pipeline.return_value.execute.return_value = [batch, True]
+    mock_send = mocker.patch('app.celery.service_callback_tasks.callback_dispatcher.send')
+    service_id = str(template.service_id)
+
+    with set_config_values(notify_api, {'REDIS_ENABLED': True, 'SERVICE_CALLBACK_BATCH_SERVICES': [service_id]}):
+        send_batched_delivery_statuses()
+
+    mock_redis.pipeline.return_value.lrange.assert_called_once_with(f'service-callback-batch-{service_id}', 0, 99)
+    mock_send.assert_called_once_with(service_id, callback_api.url, callback_api.bearer_token, [
+        {
+            "id": str(notification.id),
+            "reference": notification.client_reference,
+            "to": notification.to,
+            "status": notification.status,
+            "created_at": notification.created_at.strftime(DATETIME_FORMAT),
+            "completed_at": notification.updated_at.strftime(DATETIME_FORMAT) if notification.updated_at else None,
+            "sent_at": notification.sent_at.strftime(DATETIME_FORMAT) if notification.sent_at else None,
+            "notification_type": 'sms',
+        }
+        for notification in [first, second]
+    ])
+    assert not mock_redis.lpush.called
+
+
+@pytest.mark.parametrize('exception, put_back', [
+    (CircuitOpen('circuit open', 42), True),
+    (ConnectTimeout(), True),
+    (HTTPError(response=Mock(status_code=400)), False),
+])
+def test_send_batched_delivery_statuses_puts_batch_back_if_it_can_be_retried(
+    notify_api, notify_db_session, mocker, exception, put_back
+):
+    mock_redis = mocker.patch('app.celery.service_callback_tasks.redis_store.redis_store')
+    mock_redis.pipeline.return_value.execute.return_value = [['first', 'second'], True]
+    mocker.patch('app.celery.service_callback_tasks.encryption.decrypt', return_value={
+        'notification_id': '1',
+        'notification_client_reference': None,
+        'notification_to': 'to',
+        'notification_status': 'delivered',
+        'notification_created_at': None,
+        'notification_updated_at': None,
+        'notification_sent_at': None,
+        'notification_type': 'sms',
+        'service_callback_api_url': 'https://example.com',
+        'service_callback_api_bearer_token': 'token',
+    })
+    mocker.patch('app.celery.service_callback_tasks.callback_dispatcher.send', side_effect=exception)
+
+    with set_config_values(notify_api, {'REDIS_ENABLED': True, 'SERVICE_CALLBACK_BATCH_SERVICES': ['abc']}):
+        send_batched_delivery_statuses()
+
+    if put_back:
+        mock_redis.lpush.assert_called_once_with('service-callback-batch-abc', 'second', 'first')
+    else:
+        assert not mock_redis.lpush.called
+
+
 def _set_up_test_data(notification_type, callback_type):
     service = create_service(restricted=True)
     template = create_template(service=service, template_type=notification_type, subject='Hello')
@@ -1,5 +1,6 @@
 import json
 import uuid
+from io import StringIO
 from datetime import datetime, timedelta
 from unittest.mock import Mock, call
 
@@ -15,6 +16,7 @@ from notifications_utils.template import (
     SMSMessageTemplate,
 )
 from notifications_utils.columns import Row
+from notifications_utils.recipients import RecipientCSV
 
 from app import encryption
 from app.celery import provider_tasks
@@ -32,7 +34,8 @@ from app.celery.tasks import (
     process_returned_letters_list,
     get_recipient_csv_and_template_and_sender_id,
     save_api_email,
-    save_api_sms
+    save_api_sms,
+    stream_recipient_rows,
 )
 from app.config import QueueNames
 from app.dao import jobs_dao, service_email_reply_to_dao, service_sms_sender_dao
@@ -67,7 +70,7 @@ from tests.app.db import (
     create_service_with_defined_sms_sender,
     create_notification_history,
     create_api_key)
-from tests.conftest import set_config_values
+from tests.conftest import set_config, set_config_values
 
 
 class AnyStringWith(str):
@@ -106,14 +109,14 @@ def email_job_with_placeholders(notify_db, notify_db_session, sample_email_templ
 
 
 def test_should_process_sms_job(sample_job, mocker):
-    mocker.patch('app.celery.tasks.s3.get_job_and_metadata_from_s3',
-                 return_value=(load_example_csv('sms'), {'sender_id': None}))
+    mocker.patch('app.celery.tasks.s3.get_job_stream_and_metadata_from_s3',
+                 return_value=(StringIO(load_example_csv('sms')), {'sender_id': None}))
     mocker.patch('app.celery.tasks.save_sms.apply_async')
     mocker.patch('app.encryption.encrypt', return_value="something_encrypted")
     mocker.patch('app.celery.tasks.create_uuid', return_value="uuid")
 
     process_job(sample_job.id)
-    s3.get_job_and_metadata_from_s3.assert_called_once_with(
+    s3.get_job_stream_and_metadata_from_s3.assert_called_once_with(
         service_id=str(sample_job.service.id),
         job_id=str(sample_job.id)
     )
@@ -134,8 +137,8 @@ def test_should_process_sms_job(sample_job, mocker):
 
 
 def test_should_process_sms_job_with_sender_id(sample_job, mocker, fake_uuid):
-    mocker.patch('app.celery.tasks.s3.get_job_and_metadata_from_s3',
-                 return_value=(load_example_csv('sms'), {'sender_id': fake_uuid}))
+    mocker.patch('app.celery.tasks.s3.get_job_stream_and_metadata_from_s3',
+                 return_value=(StringIO(load_example_csv('sms')), {'sender_id': fake_uuid}))
     mocker.patch('app.celery.tasks.save_sms.apply_async')
     mocker.patch('app.encryption.encrypt', return_value="something_encrypted")
     mocker.patch('app.celery.tasks.create_uuid', return_value="uuid")
@@ -158,15 +161,15 @@ def test_should_not_process_sms_job_if_would_exceed_send_limits(
     service = create_service(message_limit=9)
     template = create_template(service=service)
     job = create_job(template=template, notification_count=10, original_file_name='multiple_sms.csv')
-    mocker.patch('app.celery.tasks.s3.get_job_and_metadata_from_s3',
-                 return_value=(load_example_csv('multiple_sms'), {'sender_id': None}))
+    mocker.patch('app.celery.tasks.s3.get_job_stream_and_metadata_from_s3',
+                 return_value=(StringIO(load_example_csv('multiple_sms')), {'sender_id': None}))
     mocker.patch('app.celery.tasks.process_row')
 
     process_job(job.id)
 
     job = jobs_dao.dao_get_job_by_id(job.id)
     assert job.job_status == 'sending limits exceeded'
-    assert s3.get_job_and_metadata_from_s3.called is False
+    assert s3.get_job_stream_and_metadata_from_s3.called is False
     assert tasks.process_row.called is False
 
 
@@ -179,15 +182,15 @@ def test_should_not_process_sms_job_if_would_exceed_send_limits_inc_today(
 
     create_notification(template=template, job=job)
 
-    mocker.patch('app.celery.tasks.s3.get_job_and_metadata_from_s3',
-                 return_value=(load_example_csv('sms'), {'sender_id': None}))
+    mocker.patch('app.celery.tasks.s3.get_job_stream_and_metadata_from_s3',
+                 return_value=(StringIO(load_example_csv('sms')), {'sender_id': None}))
     mocker.patch('app.celery.tasks.process_row')
 
     process_job(job.id)
 
     job = jobs_dao.dao_get_job_by_id(job.id)
     assert job.job_status == 'sending limits exceeded'
-    assert s3.get_job_and_metadata_from_s3.called is False
+    assert s3.get_job_stream_and_metadata_from_s3.called is False
     assert tasks.process_row.called is False
 
 
@@ -199,26 +202,43 @@ def test_should_not_process_email_job_if_would_exceed_send_limits_inc_today(noti
 
     create_notification(template=template, job=job)
 
-    mocker.patch('app.celery.tasks.s3.get_job_and_metadata_from_s3')
+    mocker.patch('app.celery.tasks.s3.get_job_stream_and_metadata_from_s3')
     mocker.patch('app.celery.tasks.process_row')
 
     process_job(job.id)
 
     job = jobs_dao.dao_get_job_by_id(job.id)
     assert job.job_status == 'sending limits exceeded'
-    assert s3.get_job_and_metadata_from_s3.called is False
+    assert s3.get_job_stream_and_metadata_from_s3.called is False
+    assert tasks.process_row.called is False
+
+
+def test_process_job_reserves_whole_job_against_daily_limit(notify_db_session, mocker):
+    service = create_service(message_limit=10)
+    template = create_template(service=service)
+    job = create_job(template=template, notification_count=10)
+    mock_reserve = mocker.patch('app.celery.tasks.reserve_daily_limit', return_value=(False, 3))
+    mock_count = mocker.patch('app.celery.tasks.fetch_todays_total_message_count')
+    mocker.patch('app.celery.tasks.s3.get_job_stream_and_metadata_from_s3')
+    mocker.patch('app.celery.tasks.process_row')
+
+    process_job(job.id)
+
+    mock_reserve.assert_called_once_with(service, 10)
+    assert not mock_count.called
+    assert jobs_dao.dao_get_job_by_id(job.id).job_status == 'sending limits exceeded'
     assert tasks.process_row.called is False
 
 
 def test_should_not_process_job_if_already_pending(sample_template, mocker):
     job = create_job(template=sample_template, job_status='scheduled')
 
-    mocker.patch('app.celery.tasks.s3.get_job_and_metadata_from_s3')
+    mocker.patch('app.celery.tasks.s3.get_job_stream_and_metadata_from_s3')
     mocker.patch('app.celery.tasks.process_row')
 
     process_job(job.id)
 
-    assert s3.get_job_and_metadata_from_s3.called is False
+    assert s3.get_job_stream_and_metadata_from_s3.called is False
     assert tasks.process_row.called is False
 
 
@@ -228,15 +248,15 @@ def test_should_process_email_job_if_exactly_on_send_limits(notify_db_session,
     template = create_template(service=service, template_type='email')
     job = create_job(template=template, notification_count=10)
 
-    mocker.patch('app.celery.tasks.s3.get_job_and_metadata_from_s3',
-                 return_value=(load_example_csv('multiple_email'), {"sender_id": None}))
+    mocker.patch('app.celery.tasks.s3.get_job_stream_and_metadata_from_s3',
+                 return_value=(StringIO(load_example_csv('multiple_email')), {"sender_id": None}))
     mocker.patch('app.celery.tasks.save_email.apply_async')
     mocker.patch('app.encryption.encrypt', return_value="something_encrypted")
     mocker.patch('app.celery.tasks.create_uuid', return_value="uuid")
 
     process_job(job.id)
 
-    s3.get_job_and_metadata_from_s3.assert_called_once_with(
+    s3.get_job_stream_and_metadata_from_s3.assert_called_once_with(
         service_id=str(job.service.id),
         job_id=str(job.id)
     )
@@ -254,13 +274,13 @@ def test_should_process_email_job_if_exactly_on_send_limits(notify_db_session,
 
 
 def test_should_not_create_save_task_for_empty_file(sample_job, mocker):
-    mocker.patch('app.celery.tasks.s3.get_job_and_metadata_from_s3',
-                 return_value=(load_example_csv('empty'), {"sender_id": None}))
+    mocker.patch('app.celery.tasks.s3.get_job_stream_and_metadata_from_s3',
+                 return_value=(StringIO(load_example_csv('empty')), {"sender_id": None}))
     mocker.patch('app.celery.tasks.save_sms.apply_async')
 
     process_job(sample_job.id)
 
-    s3.get_job_and_metadata_from_s3.assert_called_once_with(
+    s3.get_job_stream_and_metadata_from_s3.assert_called_once_with(
         service_id=str(sample_job.service.id),
         job_id=str(sample_job.id)
     )
@@ -273,14 +293,15 @@ def test_should_process_email_job(email_job_with_placeholders, mocker):
     email_csv = """email_address,name
     test@test.com,foo
     """
-    mocker.patch('app.celery.tasks.s3.get_job_and_metadata_from_s3', return_value=(email_csv, {"sender_id": None}))
+    mocker.patch('app.celery.tasks.s3.get_job_stream_and_metadata_from_s3',
+                 return_value=(StringIO(email_csv), {"sender_id": None}))
     mocker.patch('app.celery.tasks.save_email.apply_async')
     mocker.patch('app.encryption.encrypt', return_value="something_encrypted")
     mocker.patch('app.celery.tasks.create_uuid', return_value="uuid")
 
     process_job(email_job_with_placeholders.id)
 
-    s3.get_job_and_metadata_from_s3.assert_called_once_with(
+    s3.get_job_stream_and_metadata_from_s3.assert_called_once_with(
         service_id=str(email_job_with_placeholders.service.id),
         job_id=str(email_job_with_placeholders.id)
     )
@@ -305,7 +326,8 @@ def test_should_process_email_job_with_sender_id(email_job_with_placeholders, mo
     email_csv = """email_address,name
     test@test.com,foo
     """
-    mocker.patch('app.celery.tasks.s3.get_job_and_metadata_from_s3', return_value=(email_csv, {"sender_id": fake_uuid}))
+    mocker.patch('app.celery.tasks.s3.get_job_stream_and_metadata_from_s3',
+                 return_value=(StringIO(email_csv), {"sender_id": fake_uuid}))
     mocker.patch('app.celery.tasks.save_email.apply_async')
     mocker.patch('app.encryption.encrypt', return_value="something_encrypted")
     mocker.patch('app.celery.tasks.create_uuid', return_value="uuid")
@@ -326,8 +348,8 @@ def test_should_process_letter_job(sample_letter_job, mocker):
     csv = """address_line_1,address_line_2,address_line_3,address_line_4,postcode,name
     A1,A2,A3,A4,A_POST,Alice
     """
-    s3_mock = mocker.patch('app.celery.tasks.s3.get_job_and_metadata_from_s3',
-                           return_value=(csv, {"sender_id": None}))
+    s3_mock = mocker.patch('app.celery.tasks.s3.get_job_stream_and_metadata_from_s3',
+                           return_value=(StringIO(csv), {"sender_id": None}))
     process_row_mock = mocker.patch('app.celery.tasks.process_row')
     mocker.patch('app.celery.tasks.create_uuid', return_value="uuid")
 
@@ -358,15 +380,15 @@ def test_should_process_letter_job(sample_letter_job, mocker):
 
 def test_should_process_all_sms_job(sample_job_with_placeholdered_template,
                                     mocker):
-    mocker.patch('app.celery.tasks.s3.get_job_and_metadata_from_s3',
-                 return_value=(load_example_csv('multiple_sms'), {"sender_id": None}))
+    mocker.patch('app.celery.tasks.s3.get_job_stream_and_metadata_from_s3',
+                 return_value=(StringIO(load_example_csv('multiple_sms')), {"sender_id": None}))
     mocker.patch('app.celery.tasks.save_sms.apply_async')
     mocker.patch('app.encryption.encrypt', return_value="something_encrypted")
     mocker.patch('app.celery.tasks.create_uuid', return_value="uuid")
 
     process_job(sample_job_with_placeholdered_template.id)
 
-    s3.get_job_and_metadata_from_s3.assert_called_once_with(
+    s3.get_job_stream_and_metadata_from_s3.assert_called_once_with(
         service_id=str(sample_job_with_placeholdered_template.service.id),
         job_id=str(sample_job_with_placeholdered_template.id)
     )
@@ -380,6 +402,124 @@ def test_should_process_all_sms_job(sample_job_with_placeholdered_template,
     assert job.job_status == 'finished'
 
 
+def test_should_process_sms_job_in_batches(notify_api, sample_job_with_placeholdered_template, mocker):
+    mocker.patch('app.celery.tasks.s3.get_job_stream_and_metadata_from_s3',
+                 return_value=(StringIO(load_example_csv('multiple_sms')), {"sender_id": None}))
+    mocker.patch('app.celery.tasks.save_sms.apply_async')
+    mocker.patch('app.celery.tasks.save_notifications_batch.apply_async')
+    mocker.patch('app.encryption.encrypt', return_value="something_encrypted")
+
+    with set_config(notify_api, 'SAVE_NOTIFICATIONS_BATCH_SIZE', 4):
+        process_job(sample_job_with_placeholdered_template.id)
+
+    assert not tasks.save_sms.apply_async.called
+    assert tasks.save_notifications_batch.apply_async.call_count == 3
+    tasks.save_notifications_batch.apply_async.assert_called_with(
+        (str(sample_job_with_placeholdered_template.service_id), "something_encrypted"),
+        {},
+        queue="database-tasks"
+    )
+
+    batches = [call[0][0] for call in encryption.encrypt.call_args_list]
+    assert [len(batch['rows']) for batch in batches] == [4, 4, 2]
+    assert [row['row_number'] for batch in batches for row in batch['rows']] == list(range(10))
+    assert batches[-1]['notification_type'] == SMS_TYPE
+    assert batches[-1]['job'] == str(sample_job_with_placeholdered_template.id)
+    assert batches[-1]['rows'][-1]['to'] == '+441234123120'
+    assert batches[-1]['rows'][-1]['personalisation'] == {'phonenumber': '+441234123120', 'name': 'chris'}
+
+    job = jobs_dao.dao_get_job_by_id(sample_job_with_placeholdered_template.id)
+    assert job.job_status == 'finished'
+
+
+def test_should_not_batch_letter_jobs(notify_api, sample_letter_job, mocker):
+    csv = """address_line_1,address_line_2,address_line_3,address_line_4,postcode,name
+    A1,A2,A3,A4,A_POST,Alice
+    """
+    mocker.patch('app.celery.tasks.s3.get_job_stream_and_metadata_from_s3',
+                 return_value=(StringIO(csv), {"sender_id": None}))
+    process_row_mock = mocker.patch('app.celery.tasks.process_row')
+    batch_mock = mocker.patch('app.celery.tasks.save_notifications_batch.apply_async')
+
+    with set_config(notify_api, 'SAVE_NOTIFICATIONS_BATCH_SIZE', 4):
+        process_job(sample_letter_job.id)
+
+    assert process_row_mock.call_count == 1
+    assert not batch_mock.called
+
+
+def test_process_job_splits_large_job_into_shards(notify_api, sample_template, mocker):
+    job = create_job(template=sample_template, notification_count=10)
+    s3_mock = mocker.patch('app.celery.tasks.s3.get_job_stream_and_metadata_from_s3')
+    shard_mock = mocker.patch('app.celery.tasks.process_job_shard.apply_async')
+
+    with set_config(notify_api, 'JOB_ROWS_PER_SHARD', 4):
+        process_job(job.id)
+
+    assert not s3_mock.called
+    assert shard_mock.call_args_list == [
+        call([str(job.id), 0], queue="job-tasks"),
+        call([str(job.id), 1], queue="job-tasks"),
+        call([str(job.id), 2], queue="job-tasks"),
+    ]
+    job = jobs_dao.dao_get_job_by_id(job.id)
+    assert job.job_status == JOB_STATUS_IN_PROGRESS
+    assert job.shard_count == 3
+    assert job.completed_shards == []
+
+
+def test_process_job_does_not_shard_job_with_fewer_rows_than_shard_size(notify_api, sample_job, mocker):
+    mocker.patch('app.celery.tasks.s3.get_job_stream_and_metadata_from_s3',
+                 return_value=(StringIO(load_example_csv('sms')), {'sender_id': None}))
+    mocker.patch('app.celery.tasks.save_sms.apply_async')
+    shard_mock = mocker.patch('app.celery.tasks.process_job_shard.apply_async')
+
+    with set_config(notify_api, 'JOB_ROWS_PER_SHARD', 4):
+        process_job(sample_job.id)
+
+    assert not shard_mock.called
+    assert tasks.save_sms.apply_async.call_count == 1
+    assert jobs_dao.dao_get_job_by_id(sample_job.id).shard_count is None
+
+
+@pytest.mark.parametrize('shard_number, expected_rows, completed_shards_before, expected_status', [
+    (0, [0, 1, 2, 3], [], JOB_STATUS_IN_PROGRESS),
+    (1, [4, 5, 6, 7], [0], JOB_STATUS_IN_PROGRESS),
+    (2, [8, 9], [0, 1], JOB_STATUS_FINISHED),
+    (1, [4, 5, 6, 7], [0, 1], JOB_STATUS_IN_PROGRESS),
+])
+def test_process_job_shard_processes_its_rows(
+    sample_template, mocker, shard_number, expected_rows, completed_shards_before, expected_status
+):
+    job = create_job(template=sample_template, notification_count=10, job_status=JOB_STATUS_IN_PROGRESS)
+    job.shard_count = 3
+    job.completed_shards = completed_shards_before
+    jobs_dao.dao_update_job(job)
+    mocker.patch('app.celery.tasks.s3.get_job_stream_and_metadata_from_s3',
+                 return_value=(StringIO(load_example_csv('multiple_sms')), {'sender_id': None}))
+    process_row_mock = mocker.patch('app.celery.tasks.process_row')
+
+    tasks.process_job_shard(str(job.id), shard_number)
+
+    assert [row_call[1][0].index for row_call in process_row_mock.mock_calls] == expected_rows
+    job = jobs_dao.dao_get_job_by_id(job.id)
+    assert sorted(job.completed_shards) == sorted(set(completed_shards_before) | {shard_number})
+    assert job.job_status == expected_status
+
+
+def test_process_job_shard_does_nothing_if_job_is_not_in_progress(sample_template, mocker):
+    job = create_job(template=sample_template, notification_count=10, job_status=JOB_STATUS_ERROR)
+    job.shard_count = 3
+    job.completed_shards = []
+    jobs_dao.dao_update_job(job)
+    s3_mock = mocker.patch('app.celery.tasks.s3.get_job_stream_and_metadata_from_s3')
+
+    tasks.process_job_shard(str(job.id), 0)
+
+    assert not s3_mock.called
+    assert jobs_dao.dao_get_job_by_id(job.id).completed_shards == []
+
+
 # -------------- process_row tests -------------- #
 
 
@@ -918,6 +1058,115 @@ def test_save_email_should_go_to_retry_queue_if_database_errors(sample_email_tem
     assert Notification.query.count() == 0
 
 
+def _notification_batch_json(template, rows, job_id=None):
+    return {
+        "template": str(template.id),
+        "template_version": template.version,
+        "job": job_id and str(job_id),
+        "notification_type": template.template_type,
+        "rows": [
+            {"id": str(uuid.uuid4()), "to": to, "row_number": row_number, "personalisation": {}}
+            for row_number, to in enumerate(rows)
+        ]
+    }
+
+
+@pytest.mark.parametrize('research_mode, expected_queue', [
+    (False, 'send-sms-tasks'),
+    (True, 'research-mode-tasks'),
+])
+def test_save_notifications_batch_saves_sms_and_sends_them_for_delivery(
+    notify_db_session, mocker, research_mode, expected_queue
+):
+    service = create_service(research_mode=research_mode)
+    template = create_template(service=service)
+    job = create_job(template=template)
+    batch = _notification_batch_json(template, ['07700 900001', '07700 900002'], job_id=job.id)
+    mocked_deliver_sms = mocker.patch('app.celery.provider_tasks.deliver_sms.apply_async')
+
+    tasks.save_notifications_batch(service.id, encryption.encrypt(batch))
+
+    persisted_notifications = Notification.query.order_by(Notification.job_row_number).all()
+    assert [n.id for n in persisted_notifications] == [uuid.UUID(row['id']) for row in batch['rows']]
+    assert [n.normalised_to for n in persisted_notifications] == ['447700900001', '447700900002']
+    assert all(n.job_id == job.id for n in persisted_notifications)
+    assert all(n.status == 'created' for n in persisted_notifications)
+    assert all(n.billable_units == 0 for n in persisted_notifications)
+    assert mocked_deliver_sms.call_args_list == [
+        call([row['id']], queue=expected_queue) for row in batch['rows']
+    ]
+
+
+def test_save_notifications_batch_saves_emails_with_reply_to(notify_db_session, mocker):
+    service = create_service()
+    reply_to = create_reply_to_email(service=service, email_address='reply_to@digital.gov.uk', is_default=False)
+    template = create_template(service=service, template_type=EMAIL_TYPE, subject='Hello')
+    batch = _notification_batch_json(template, ['Test@Example.com'])
+    mocked_deliver_email = mocker.patch('app.celery.provider_tasks.deliver_email.apply_async')
+
+    tasks.save_notifications_batch(service.id, encryption.encrypt(batch), sender_id=reply_to.id)
+
+    persisted_notification = Notification.query.one()
+    assert persisted_notification.normalised_to == 'test@example.com'
+    assert persisted_notification.reply_to_text == 'reply_to@digital.gov.uk'
+    mocked_deliver_email.assert_called_once_with([str(persisted_notification.id)], queue='send-email-tasks')
+
+
+def test_save_notifications_batch_does_not_send_rows_already_saved(sample_template, mocker):
+    batch = _notification_batch_json(sample_template, ['07700 900001', '07700 900002'])
+    already_saved = create_notification(template=sample_template)
+    batch['rows'][0]['id'] = str(already_saved.id)
+    mocked_deliver_sms = mocker.patch('app.celery.provider_tasks.deliver_sms.apply_async')
+
+    tasks.save_notifications_batch(sample_template.service_id, encryption.encrypt(batch))
+
+    assert Notification.query.count() == 2
+    mocked_deliver_sms.assert_called_once_with([batch['rows'][1]['id']], queue='send-sms-tasks')
+
+
+def test_save_notifications_batch_sends_notifications_for_delivery_in_batches(notify_api, sample_template, mocker):
+    batch = _notification_batch_json(sample_template, ['07700 900001', '07700 900002', '07700 900003'])
+    mocked_deliver_sms = mocker.patch('app.celery.provider_tasks.deliver_sms.apply_async')
+    mocked_deliver_sms_batch = mocker.patch('app.celery.provider_tasks.deliver_sms_batch.apply_async')
+
+    with set_config(notify_api, 'DELIVERY_BATCH_SIZE', 2):
+        tasks.save_notifications_batch(sample_template.service_id, encryption.encrypt(batch))
+
+    ids = [row['id'] for row in batch['rows']]
+    assert mocked_deliver_sms_batch.call_args_list == [
+        call([ids[:2]], queue='send-sms-tasks'),
+        call([ids[2:]], queue='send-sms-tasks'),
+    ]
+    assert not mocked_deliver_sms.called
+
+
+def test_save_notifications_batch_skips_rows_restricted_service_cannot_send_to(notify_db_session, mocker):
+    user = create_user(mobile_number="07700 900205")
+    service = create_service(user=user, restricted=True)
+    template = create_template(service=service)
+    batch = _notification_batch_json(template, ['07700 900205', '07700 900849'])
+    mocker.patch('app.celery.provider_tasks.deliver_sms.apply_async')
+
+    tasks.save_notifications_batch(service.id, encryption.encrypt(batch))
+
+    assert Notification.query.one().to == '07700 900205'
+
+
+def test_save_notifications_batch_should_go_to_retry_queue_if_database_errors(sample_template, mocker):
+    batch = _notification_batch_json(sample_template, ['07700 900001'])
+    expected_exception = SQLAlchemyError()
+    mocked_deliver_sms = mocker.patch('app.celery.provider_tasks.deliver_sms.apply_async')
+    mocker.patch('app.celery.tasks.save_notifications_batch.retry', side_effect=Retry)
+    mocker.patch('app.notifications.process_notifications.dao_create_notifications', side_effect=expected_exception)
+
+    with pytest.raises(Retry):
+        tasks.save_notifications_batch(sample_template.service_id, encryption.encrypt(batch))
+
+    assert not mocked_deliver_sms.called
+    tasks.save_notifications_batch.retry.assert_called_with(exc=expected_exception, queue="retry-tasks")
+    assert Notification.query.count() == 0
+
+
 def test_save_email_does_not_send_duplicate_and_does_not_put_in_retry_queue(sample_notification, mocker):
     json = _notification_json(sample_notification.template, sample_notification.to, job_id=uuid.uuid4(), row_number=1)
     deliver_email = mocker.patch('app.celery.provider_tasks.deliver_email.apply_async')
@@ -1389,6 +1638,75 @@ def test_get_sms_template_instance(mocker, sample_template, sample_job):
     ]
 
 
+@pytest.mark.parametrize('rows_per_chunk', [1, 3, 1000])
+def test_stream_recipient_rows_gives_same_rows_as_whole_file(sample_job, rows_per_chunk):
+    template = sample_job.template._as_utils_template()
+    csv_file = load_example_csv('multiple_sms')
+
+    streamed_rows = list(stream_recipient_rows(StringIO(csv_file), template, rows_per_chunk=rows_per_chunk))
+    whole_file_rows = list(RecipientCSV(csv_file, template=template).get_rows())
+
+    assert len(streamed_rows) == 10
+    assert [
+        (row.index, row.recipient, dict(row.personalisation)) for row in streamed_rows
+    ] == [
+        (row.index, row.recipient, dict(row.personalisation)) for row in whole_file_rows
+    ]
+
+
+@pytest.mark.parametrize('rows_per_chunk', [1, 2, 3, 1000])
+def test_stream_recipient_rows_keeps_whole_file_indexes_across_blank_and_quoted_lines(sample_job, rows_per_chunk):
+    template = sample_job.template._as_utils_template()
+    csv_file = (
+        '\n'
+        'phone number, name\n'
+        '07700 900001, "Smith, Jo"\n'
+        '\n'
+        '\n'
+        '07700 900002,"Jones,\nSam"\n'
+        '07700 900003, Alex\n'
+        '\n'
+        '07700 900004,"Lee"\n'
+        '\n'
+    )
+
+    streamed_rows = list(stream_recipient_rows(StringIO(csv_file), template, rows_per_chunk=rows_per_chunk))
+    whole_file_rows = list(RecipientCSV(csv_file, template=template).get_rows())
+
+    assert [
+        (row.index, row.recipient, dict(row.personalisation)) for row in streamed_rows if row.recipient
+    ] == [
+        (row.index, row.recipient, dict(row.personalisation)) for row in whole_file_rows if row.recipient
+    ]
+    assert [row.index for row in streamed_rows if row.recipient] == [0, 3, 4, 6]
+
+
+@pytest.mark.parametrize('start_row, end_row, expected_rows', [
+    (0, None, [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]),
+    (4, 8, [4, 5, 6, 7]),
+    (8, None, [8, 9]),
+    (12, None, []),
+])
+def test_stream_recipient_rows_gives_only_rows_in_range(sample_job, start_row, end_row, expected_rows):
+    template = sample_job.template._as_utils_template()
+    csv_file = load_example_csv('multiple_sms')
+
+    streamed_rows = list(stream_recipient_rows(
+        StringIO(csv_file), template, rows_per_chunk=3, start_row=start_row, end_row=end_row
+    ))
+    whole_file_rows = list(RecipientCSV(csv_file, template=template).get_rows())
+
+    assert [row.index for row in streamed_rows] == expected_rows
+    assert [row.recipient for row in streamed_rows] == [whole_file_rows[index].recipient for index in expected_rows]
+
+
+@pytest.mark.parametrize('csv_file', ['', '\n\n', 'phone number\n'])
+def test_stream_recipient_rows_gives_no_rows_for_empty_file(sample_job, csv_file):
+    template = sample_job.template._as_utils_template()
+
+    assert list(stream_recipient_rows(StringIO(csv_file), template)) == []
+
+
 def test_get_letter_template_instance(mocker, sample_job):
     mocker.patch(
         'app.celery.tasks.s3.get_job_and_metadata_from_s3',
@@ -1531,8 +1849,8 @@ def test_send_inbound_sms_to_service_does_not_retries_if_request_returns_404(not
 
 def test_process_incomplete_job_sms(mocker, sample_template):
 
-    mocker.patch('app.celery.tasks.s3.get_job_and_metadata_from_s3',
-                 return_value=(load_example_csv('multiple_sms'), {'sender_id': None}))
+    mocker.patch('app.celery.tasks.s3.get_job_stream_and_metadata_from_s3',
+                 return_value=(StringIO(load_example_csv('multiple_sms')), {'sender_id': None}))
     save_sms = mocker.patch('app.celery.tasks.save_sms.apply_async')
 
     job = create_job(template=sample_template, notification_count=10,
@@ -1557,8 +1875,8 @@ def test_process_incomplete_job_sms(mocker, sample_template):
 
 def test_process_incomplete_job_with_notifications_all_sent(mocker, sample_template):
 
-    mocker.patch('app.celery.tasks.s3.get_job_and_metadata_from_s3',
-                 return_value=(load_example_csv('multiple_sms'), {'sender_id': None}))
+    mocker.patch('app.celery.tasks.s3.get_job_stream_and_metadata_from_s3',
+                 return_value=(StringIO(load_example_csv('multiple_sms')), {'sender_id': None}))
     mock_save_sms = mocker.patch('app.celery.tasks.save_sms.apply_async')
 
     job = create_job(template=sample_template, notification_count=10,
@@ -1591,8 +1909,10 @@ def test_process_incomplete_job_with_notifications_all_sent(mocker, sample_templ
 
 def test_process_incomplete_jobs_sms(mocker, sample_template):
 
-    mocker.patch('app.celery.tasks.s3.get_job_and_metadata_from_s3',
-                 return_value=(load_example_csv('multiple_sms'), {'sender_id': None}))
+    mocker.patch('app.celery.tasks.s3.get_job_stream_and_metadata_from_s3', side_effect=[
+        (StringIO(load_example_csv('multiple_sms')), {'sender_id': None}),
+        (StringIO(load_example_csv('multiple_sms')), {'sender_id': None}),
+    ])
     mock_save_sms = mocker.patch('app.celery.tasks.save_sms.apply_async')
 
     job = create_job(template=sample_template, notification_count=10,
@@ -1634,8 +1954,8 @@ def test_process_incomplete_jobs_sms(mocker, sample_template):
 
 
 def test_process_incomplete_jobs_no_notifications_added(mocker, sample_template):
-    mocker.patch('app.celery.tasks.s3.get_job_and_metadata_from_s3',
-                 return_value=(load_example_csv('multiple_sms'), {'sender_id': None}))
+    mocker.patch('app.celery.tasks.s3.get_job_stream_and_metadata_from_s3',
+                 return_value=(StringIO(load_example_csv('multiple_sms')), {'sender_id': None}))
     mock_save_sms = mocker.patch('app.celery.tasks.save_sms.apply_async')
 
     job = create_job(template=sample_template, notification_count=10,
@@ -1657,8 +1977,8 @@ def test_process_incomplete_jobs_no_notifications_added(mocker, sample_template)
 
 def test_process_incomplete_jobs(mocker):
 
-    mocker.patch('app.celery.tasks.s3.get_job_and_metadata_from_s3',
-                 return_value=(load_example_csv('multiple_sms'), {'sender_id': None}))
+    mocker.patch('app.celery.tasks.s3.get_job_stream_and_metadata_from_s3',
+                 return_value=(StringIO(load_example_csv('multiple_sms')), {'sender_id': None}))
     mock_save_sms = mocker.patch('app.celery.tasks.save_sms.apply_async')
 
     jobs = []
@@ -1669,8 +1989,8 @@ def test_process_incomplete_jobs(mocker):
 
 def test_process_incomplete_job_no_job_in_database(mocker, fake_uuid):
 
-    mocker.patch('app.celery.tasks.s3.get_job_and_metadata_from_s3',
-                 return_value=(load_example_csv('multiple_sms'), {'sender_id': None}))
+    mocker.patch('app.celery.tasks.s3.get_job_stream_and_metadata_from_s3',
+                 return_value=(StringIO(load_example_csv('multiple_sms')), {'sender_id': None}))
     mock_save_sms = mocker.patch('app.celery.tasks.save_sms.apply_async')
 
     with pytest.raises(expected_exception=Exception):
@@ -1679,10 +1999,84 @@ def test_process_incomplete_job_no_job_in_database(mocker, fake_uuid):
     assert mock_save_sms.call_count == 0  # There is no job in the db it will not have been called
 
 
+def test_process_incomplete_job_resumes_only_unfinished_shards(mocker, sample_template):
+    shard_mock = mocker.patch('app.celery.tasks.process_job_shard.apply_async')
+    job = create_job(template=sample_template, notification_count=10, job_status=JOB_STATUS_IN_PROGRESS)
+    job.shard_count = 3
+    job.completed_shards = []
+    jobs_dao.dao_update_job(job)
+
+    # shard 0 (rows 0 to 3) is finished, shard 1 (rows 4 to 7) stopped part way and shard 2 never started
+    for row_number in [0, 1, 2, 3, 4, 5]:
+        create_notification(sample_template, job, row_number)
+
+    process_incomplete_job(str(job.id))
+
+    assert shard_mock.call_args_list == [
+        call([str(job.id), 1], {'resume_from_row': 5}, queue="job-tasks"),
+        call([str(job.id), 2], {'resume_from_row': 7}, queue="job-tasks"),
+    ]
+    job = jobs_dao.dao_get_job_by_id(job.id)
+    assert job.completed_shards == [0]
+    assert job.job_status == JOB_STATUS_IN_PROGRESS
+
+
+def test_process_incomplete_job_does_not_resume_shards_that_have_finished(mocker, sample_template):
+    shard_mock = mocker.patch('app.celery.tasks.process_job_shard.apply_async')
+    job = create_job(template=sample_template, notification_count=10, job_status=JOB_STATUS_IN_PROGRESS)
+    job.shard_count = 3
+    job.completed_shards = [1]
+    jobs_dao.dao_update_job(job)
+
+    # shard 1 has finished even though some of its notifications haven't been saved yet
+    for row_number in [0, 1, 2, 3, 4]:
+        create_notification(sample_template, job, row_number)
+
+    process_incomplete_job(str(job.id))
+
+    assert shard_mock.call_args_list == [
+        call([str(job.id), 2], {'resume_from_row': 7}, queue="job-tasks"),
+    ]
+    job = jobs_dao.dao_get_job_by_id(job.id)
+    assert job.completed_shards == [1, 0]
+    assert job.job_status == JOB_STATUS_IN_PROGRESS
+
+
+def test_process_incomplete_job_completes_sharded_job_if_all_rows_added(mocker, sample_template):
+    shard_mock = mocker.patch('app.celery.tasks.process_job_shard.apply_async')
+    job = create_job(template=sample_template, notification_count=10, job_status=JOB_STATUS_IN_PROGRESS)
+    job.shard_count = 3
+    job.completed_shards = [0, 1]
+    jobs_dao.dao_update_job(job)
+    for row_number in range(10):
+        create_notification(sample_template, job, row_number)
+
+    process_incomplete_job(str(job.id))
+
+    assert not shard_mock.called
+    job = jobs_dao.dao_get_job_by_id(job.id)
+    assert job.completed_shards == [0, 1, 2]
+    assert job.job_status == JOB_STATUS_FINISHED
+
+
+def test_process_job_shard_resumes_after_last_row_added(sample_template, mocker):
+    job = create_job(template=sample_template, notification_count=10, job_status=JOB_STATUS_IN_PROGRESS)
+    job.shard_count = 3
+    job.completed_shards = [0]
+    jobs_dao.dao_update_job(job)
+    mocker.patch('app.celery.tasks.s3.get_job_stream_and_metadata_from_s3',
+                 return_value=(StringIO(load_example_csv('multiple_sms')), {'sender_id': None}))
+    process_row_mock = mocker.patch('app.celery.tasks.process_row')
+
+    tasks.process_job_shard(str(job.id), 1, resume_from_row=5)
+
+    assert [row_call[1][0].index for row_call in process_row_mock.mock_calls] == [6, 7]
+
+
 def test_process_incomplete_job_email(mocker, sample_email_template):
 
-    mocker.patch('app.celery.tasks.s3.get_job_and_metadata_from_s3',
-                 return_value=(load_example_csv('multiple_email'), {'sender_id': None}))
+    mocker.patch('app.celery.tasks.s3.get_job_stream_and_metadata_from_s3',
+                 return_value=(StringIO(load_example_csv('multiple_email')), {'sender_id': None}))
     mock_email_saver = mocker.patch('app.celery.tasks.save_email.apply_async')
 
     job = create_job(template=sample_email_template, notification_count=10,
@@ -1706,8 +2100,8 @@ def test_process_incomplete_job_email(mocker, sample_email_template):
 
 
 def test_process_incomplete_job_letter(mocker, sample_letter_template):
-    mocker.patch('app.celery.tasks.s3.get_job_and_metadata_from_s3',
-                 return_value=(load_example_csv('multiple_letter'), {'sender_id': None}))
+    mocker.patch('app.celery.tasks.s3.get_job_stream_and_metadata_from_s3',
+                 return_value=(StringIO(load_example_csv('multiple_letter')), {'sender_id': None}))
     mock_letter_saver = mocker.patch('app.celery.tasks.save_letter.apply_async')
 
     job = create_job(template=sample_letter_template, notification_count=10,
@@ -1,3 +1,5 @@
+import json
+
 import botocore
 import pytest
 from unittest.mock import Mock, ANY
@@ -5,6 +7,7 @@ from unittest.mock import Mock, ANY
 from app import aws_ses_client
 from app.clients.email import EmailClientNonRetryableException
 from app.clients.email.aws_ses import get_aws_responses, AwsSesClientException, AwsSesClientThrottlingSendRateException
+from app.clients.email.send_rate_limiter import SendRateExceeded
 
 
 def test_should_return_correct_details_for_delivery():
@@ -179,3 +182,91 @@ def test_send_email_raises_other_errs_as_AwsSesClientException(mocker):
         )
 
     assert 'some error message from amazon' in str(excinfo.value)
+
+
+@pytest.mark.parametrize('subject, body, expected', [
+    ('Hello', 'Some content', True),
+    ('Hello', 'Use {{ braces }} for this', True),
+    ('Hello', 'x' * 300 * 1024, False),
+    # escaping non-ASCII characters for JSON takes the template data over the limit, though the content is under it
+    ('Hello', '\u2019' * 50 * 1024, False),
+    ('Hello', '"\n' * 100 * 1024, False),
+])
+def test_can_send_bulk_email(subject, body, expected):
+    assert aws_ses_client.can_send_bulk_email(subject, body, html_body='<p>Some content</p>') is expected
+
+
+def test_send_bulk_email_creates_template_once_and_returns_result_for_each_address(notify_api, mocker):
+    boto_mock = mocker.patch.object(aws_ses_client, '_client', create=True)
+    mocker.patch.object(aws_ses_client, 'statsd_client', create=True)
+    mocker.patch.object(aws_ses_client, '_bulk_templates', set())
+    boto_mock.send_bulk_templated_email.return_value = {'Status': [
+        {'Status': 'Success', 'MessageId': 'first-id'},
+        {'Status': 'MessageRejected', 'Error': 'Email address is on the suppression list'},
+        {'Status': 'InvalidParameterValue', 'Error': 'Invalid address'},
+    ]}
+
+    with notify_api.app_context():
+        for _ in range(2):
+            results = aws_ses_client.send_bulk_email(
+                'from@notify.gov.uk',
+                ['first@example.com', 'second@example.com', 'føøøø@bååååår.com'],
+                'Subject',
+                'Use {{ braces }} & more',
+                html_body='<p>Use {{ braces }} &amp; more</p>',
+                reply_to_address='reply@example.com',
+            )
+
+    boto_mock.create_template.assert_called_once_with(Template={
+        'TemplateName': 'notify-bulk-email-html',
+        'SubjectPart': '{{{subject}}}',
+        'TextPart': '{{{body}}}',
+        'HtmlPart': '{{{html_body}}}',
+    })
+    boto_mock.send_bulk_templated_email.assert_called_with(
+        Source='from@notify.gov.uk',
+        Template='notify-bulk-email-html',
+        DefaultTemplateData=json.dumps({
+            'subject': 'Subject',
+            'body': 'Use {{ braces }} & more',
+            'html_body': '<p>Use {{ braces }} &amp; more</p>',
+        }),
+        Destinations=[
+            {'Destination': {'ToAddresses': ['first@example.com']}, 'ReplacementTemplateData': '{}'},
+            {'Destination': {'ToAddresses': ['second@example.com']}, 'ReplacementTemplateData': '{}'},
+            {'Destination': {'ToAddresses': ['føøøø@xn--br-yiaaaaa.com']}, 'ReplacementTemplateData': '{}'},
+        ],
+        ReplyToAddresses=['reply@example.com'],
+    )
+    assert results[0] == 'first-id'
+    assert isinstance(results[1], AwsSesClientException)
+    assert isinstance(results[2], EmailClientNonRetryableException)
+
+
+def test_send_bulk_email_uses_existing_template(notify_api, mocker):
+    boto_mock = mocker.patch.object(aws_ses_client, '_client', create=True)
+    mocker.patch.object(aws_ses_client, 'statsd_client', create=True)
+    mocker.patch.object(aws_ses_client, '_bulk_templates', set())
+    boto_mock.create_template.side_effect = botocore.exceptions.ClientError(
+        {'Error': {'Code': 'AlreadyExists', 'Message': 'Template already exists'}}, 'CreateTemplate'
+    )
+    boto_mock.send_bulk_templated_email.return_value = {'Status': [{'Status': 'Success', 'MessageId': 'id'}]}
+
+    with notify_api.app_context():
+        assert aws_ses_client.send_bulk_email('from@notify.gov.uk', ['to@example.com'], 'Subject', 'Body') == ['id']
+
+    assert boto_mock.send_bulk_templated_email.call_args[1]['Template'] == 'notify-bulk-email'
+    assert json.loads(boto_mock.send_bulk_templated_email.call_args[1]['DefaultTemplateData']) == {
+        'subject': 'Subject', 'body': 'Body'
+    }
+
+
+def test_send_email_raises_AwsSesClientThrottlingSendRateException_if_send_rate_limiter_gives_up(mocker):
+    boto_mock = mocker.patch.object(aws_ses_client, '_client', create=True)
+    mocker.patch.object(aws_ses_client, 'statsd_client', create=True)
+    mocker.patch.object(aws_ses_client.send_rate_limiter, 'take', side_effect=SendRateExceeded('too fast'))
+
+    with pytest.raises(AwsSesClientThrottlingSendRateException):
+        aws_ses_client.send_email(source=Mock(), to_addresses='foo@bar.com', subject=Mock(), body=Mock())
+
+    assert not boto_mock.send_email.called
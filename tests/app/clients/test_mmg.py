@@ -140,3 +140,49 @@ def test_send_sms_raises_if_mmg_rejects_with_read_timeout(rmock):
 
     assert exc.value.status_code == 504
     assert exc.value.text == 'Gateway Time-out'
+
+
+def test_send_sms_reuses_session_within_a_process(notify_api, mocker):
+    mmg_client._session = None
+    mocker.patch('app.clients.sms.os.getpid', return_value=1)
+
+    with requests_mock.Mocker() as request_mock:
+        request_mock.post('https://example.com/mmg', json={'Reference': 12345678}, status_code=200)
+        mmg_client.send_sms('foo', 'foo', 'foo')
+        session = mmg_client.session
+        mmg_client.send_sms('foo', 'foo', 'foo')
+
+    assert mmg_client.session is session
+    assert request_mock.request_history[0].timeout == (5, 60)
+
+    adapter = session.get_adapter('https://example.com/mmg')
+    assert adapter._pool_maxsize == 10
+    assert adapter.max_retries.connect == 2
+    assert adapter.max_retries.read == 0
+
+
+def test_session_is_recreated_after_fork(notify_api, mocker):
+    mock_getpid = mocker.patch('app.clients.sms.os.getpid', return_value=1)
+    session = mmg_client.session
+
+    mock_getpid.return_value = 2
+
+    assert mmg_client.session is not session
+
+
+@pytest.mark.parametrize('connections_after, expected_stat', [
+    (3, 'clients.mmg.request-time.reused-connection'),
+    (4, 'clients.mmg.request-time.new-connection'),
+])
+def test_post_records_whether_connection_was_reused(notify_api, mocker, connections_after, expected_stat):
+    pool = mocker.Mock(num_connections=3)
+    mocker.patch.object(mmg_client, '_connection_pool', return_value=pool)
+    mock_timing = mocker.patch.object(mmg_client.statsd_client, 'timing')
+
+    def open_connection(*args, **kwargs):
+        pool.num_connections = connections_after
+
+    mocker.patch.object(mmg_client.session, 'post', side_effect=open_connection)
+    mmg_client.post('https://example.com/mmg', data='{}')
+
+    mock_timing.assert_any_call(expected_stat, mocker.ANY)
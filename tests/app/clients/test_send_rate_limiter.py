@@ -0,0 +1,69 @@
+from unittest.mock import Mock
+
+import pytest
+
+from app.clients.email.send_rate_limiter import (
+    MAX_WAIT_SECONDS,
+    TAKE_SCRIPT,
+    SendRateExceeded,
+    SendRateLimiter,
+)
+
+
+@pytest.fixture
+def redis_client():
+    return Mock(active=True)
+
+
+@pytest.fixture
+def mock_sleep(mocker):
+    return mocker.patch('app.clients.email.send_rate_limiter.sleep')
+
+
+def test_take_sleeps_until_tokens_have_been_earned(redis_client, mock_sleep, mocker):
+    mocker.patch('app.clients.email.send_rate_limiter.time', return_value=1000.5)
+    take = redis_client.redis_store.register_script.return_value
+    take.return_value = b'0.25'
+
+    SendRateLimiter(redis_client, 'ses-send-rate', 14).take(3)
+
+    redis_client.redis_store.register_script.assert_called_once_with(TAKE_SCRIPT)
+    take.assert_called_once_with(keys=['ses-send-rate'], args=[14, 14, 3, 1000.5, MAX_WAIT_SECONDS])
+    mock_sleep.assert_called_once_with(0.25)
+
+
+def test_take_lets_bulk_sends_bigger_than_bucket_through(redis_client, mock_sleep):
+    take = redis_client.redis_store.register_script.return_value
+    take.return_value = b'0'
+
+    SendRateLimiter(redis_client, 'ses-send-rate', 14).take(50)
+
+    assert take.call_args[1]['args'][1] == 50
+    assert not mock_sleep.called
+
+
+def test_take_raises_if_wait_would_be_too_long(redis_client, mock_sleep):
+    redis_client.redis_store.register_script.return_value.return_value = b'-1'
+
+    with pytest.raises(SendRateExceeded):
+        SendRateLimiter(redis_client, 'ses-send-rate', 14).take()
+
+    assert not mock_sleep.called
+
+
+@pytest.mark.parametrize('max_send_rate, active', [(0, True), (14, False)])
+def test_take_does_nothing_if_limiter_is_off(redis_client, mock_sleep, max_send_rate, active):
+    redis_client.active = active
+
+    SendRateLimiter(redis_client, 'ses-send-rate', max_send_rate).take()
+
+    assert not redis_client.redis_store.register_script.called
+
+
+def test_take_lets_sends_through_if_redis_is_unavailable(notify_api, redis_client, mock_sleep):
+    redis_client.redis_store.register_script.side_effect = ConnectionError
+
+    with notify_api.app_context():
+        SendRateLimiter(redis_client, 'ses-send-rate', 14).take()
+
+    assert not mock_sleep.called
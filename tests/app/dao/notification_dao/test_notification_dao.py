@@ -10,18 +10,23 @@ from sqlalchemy.orm.exc import NoResultFound
 
 from app.dao.notifications_dao import (
     dao_create_notification,
+    dao_create_notifications,
     dao_delete_notifications_by_id,
     dao_get_last_notification_added_for_job_id,
+    dao_get_last_row_number_added_for_job_rows,
     dao_get_notifications_by_recipient_or_reference,
     dao_get_notification_count_for_job_id,
     dao_timeout_notifications,
     dao_update_notification,
+    dao_update_notification_statuses_by_id,
     dao_update_notifications_by_reference,
     get_notification_by_id,
     get_notification_for_job,
     get_notification_with_personalisation,
     get_notifications_for_job,
     get_notifications_for_service,
+    get_notifications_for_service_before,
+    get_notification_rows_for_service_before,
     is_delivery_slow_for_providers,
     update_notification_status_by_id,
     update_notification_status_by_reference,
@@ -252,6 +257,36 @@ def test_should_not_update_status_once_notification_status_is_delivered(
     assert Notification.query.get(notification.id).status == 'delivered'
 
 
+def test_dao_update_notification_statuses_by_id_updates_notifications(sample_template):
+    sending = create_notification(sample_template, status='sending')
+    pending = create_notification(sample_template, status='pending', sent_by='firetext')
+    pending_with_code = create_notification(sample_template, status='pending')
+    delivered = create_notification(sample_template, status='delivered')
+    no_receipts = create_notification(sample_template, status='sent', international=True, phone_prefix='249')
+
+    updated = dao_update_notification_statuses_by_id([
+        (sending.id, 'permanent-failure', 'mmg', None),
+        (pending.id, 'permanent-failure', 'mmg', None),
+        (pending_with_code.id, 'permanent-failure', 'firetext', '101'),
+        (delivered.id, 'permanent-failure', 'mmg', None),
+        (no_receipts.id, 'delivered', 'mmg', None),
+        (uuid.uuid4(), 'delivered', 'mmg', None),
+    ])
+
+    assert {n.id for n in updated} == {sending.id, pending.id, pending_with_code.id}
+    assert sending.status == 'permanent-failure'
+    assert sending.sent_by == 'mmg'
+    assert pending.status == 'temporary-failure'
+    assert pending.sent_by == 'firetext'
+    assert pending_with_code.status == 'permanent-failure'
+    assert delivered.status == 'delivered'
+    assert no_receipts.status == 'sent'
+
+
+def test_dao_update_notification_statuses_by_id_does_nothing_for_no_updates(notify_db_session):
+    assert dao_update_notification_statuses_by_id([]) == []
+
+
 def test_should_return_zero_count_if_no_notification_with_id():
     assert not update_notification_status_by_id(str(uuid.uuid4()), 'delivered')
 
@@ -423,6 +458,37 @@ def test_save_notification_and_increment_correct_job(notify_db, notify_db_sessio
     assert job_1.id != job_2.id
 
 
+def test_dao_create_notifications_inserts_all_notifications(sample_template, sample_job):
+    notifications = [
+        Notification(**_notification_json(sample_template, job_id=sample_job.id, id=uuid.uuid4()))
+        for _ in range(3)
+    ]
+    notifications[0].personalisation = {'name': 'Jo'}
+
+    inserted_ids = dao_create_notifications(notifications)
+
+    assert sorted(inserted_ids) == sorted(notification.id for notification in notifications)
+    assert Notification.query.count() == 3
+    notification_from_db = Notification.query.get(notifications[0].id)
+    assert notification_from_db.status == 'created'
+    assert notification_from_db.international is False
+    assert notification_from_db.billable_units == 1
+    assert notification_from_db.personalisation == {'name': 'Jo'}
+
+
+def test_dao_create_notifications_ignores_notifications_that_already_exist(sample_template):
+    existing = create_notification(template=sample_template)
+    notifications = [
+        Notification(**_notification_json(sample_template, id=existing.id)),
+        Notification(**_notification_json(sample_template, id=uuid.uuid4())),
+    ]
+
+    inserted_ids = dao_create_notifications(notifications)
+
+    assert inserted_ids == [notifications[1].id]
+    assert Notification.query.count() == 2
+
+
 def test_save_notification_with_no_job(sample_template, mmg_provider):
     assert Notification.query.count() == 0
     data = _notification_json(sample_template)
@@ -753,6 +819,58 @@ def test_should_not_count_pages_when_given_a_flag(sample_user, sample_template):
     assert pagination.items[0].id == notification.id
 
 
+def test_get_notifications_for_service_before_pages_by_created_at_and_id(sample_template):
+    created_at = datetime(2021, 2, 1, 12, 0)
+    older = create_notification(sample_template, created_at=created_at - timedelta(seconds=1))
+    same_time = sorted(
+        [create_notification(sample_template, created_at=created_at) for _ in range(3)],
+        key=lambda notification: notification.id,
+        reverse=True
+    )
+
+    first_page = get_notifications_for_service_before(sample_template.service_id, page_size=2)
+    assert first_page == same_time[:2]
+
+    second_page = get_notifications_for_service_before(
+        sample_template.service_id,
+        page_size=2,
+        before_created_at=first_page[-1].created_at,
+        before_id=first_page[-1].id,
+    )
+    assert second_page == [same_time[2], older]
+
+
+def test_get_notifications_for_service_before_looks_up_created_at_if_only_id_given(sample_template):
+    older = create_notification(sample_template, created_at=datetime(2021, 2, 1, 11, 0))
+    newer = create_notification(sample_template, created_at=datetime(2021, 2, 1, 12, 0))
+
+    assert get_notifications_for_service_before(
+        sample_template.service_id, page_size=10, before_id=newer.id
+    ) == [older]
+    assert get_notifications_for_service_before(
+        sample_template.service_id, page_size=10, before_id=uuid.uuid4()
+    ) == []
+
+
+def test_get_notification_rows_for_service_before_returns_columns_and_creator_name(sample_template, sample_user):
+    older = create_notification(sample_template, created_at=datetime(2021, 2, 1, 11, 0))
+    newer = create_notification(
+        sample_template, created_at=datetime(2021, 2, 1, 12, 0), created_by_id=sample_user.id
+    )
+
+    rows = get_notification_rows_for_service_before(sample_template.service_id, page_size=10)
+
+    assert [row.id for row in rows] == [newer.id, older.id]
+    assert rows[0].created_by_name == sample_user.name
+    assert rows[1].created_by_name is None
+    assert rows[0].template_version == sample_template.version
+    assert rows[0]._personalisation == newer._personalisation
+
+    assert get_notification_rows_for_service_before(
+        sample_template.service_id, page_size=10, before_id=newer.id
+    ) == rows[1:]
+
+
 def test_get_notifications_created_by_api_or_csv_are_returned_correctly_excluding_test_key_notifications(
         notify_db,
         notify_db_session,
@@ -1069,6 +1187,45 @@ def test_dao_get_notifications_by_recipient_is_limited_to_50_results(sample_temp
     assert results.has_next is True
 
 
+def test_dao_get_notifications_by_recipient_or_reference_pages_without_counting(sample_template, mocker):
+    for _ in range(3):
+        create_notification(template=sample_template, to_field='+447700900855', normalised_to='447700900855')
+    mock_count = mocker.patch('sqlalchemy.orm.Query.count')
+
+    first_page = dao_get_notifications_by_recipient_or_reference(
+        sample_template.service_id, '447700900855', notification_type='sms', page_size=2,
+    )
+    second_page = dao_get_notifications_by_recipient_or_reference(
+        sample_template.service_id, '447700900855', notification_type='sms', page=2, page_size=2,
+    )
+
+    assert len(first_page.items) == 2
+    assert first_page.has_next is True
+    assert first_page.has_prev is False
+    assert len(second_page.items) == 1
+    assert second_page.has_next is False
+    assert second_page.has_prev is True
+    assert not mock_count.called
+
+
+@freeze_time('2021-02-22 12:00')
+def test_dao_get_notifications_by_recipient_or_reference_limits_days(sample_template):
+    recent = create_notification(
+        template=sample_template, to_field='+447700900855', normalised_to='447700900855',
+        created_at=datetime(2021, 2, 21, 12, 0),
+    )
+    create_notification(
+        template=sample_template, to_field='+447700900855', normalised_to='447700900855',
+        created_at=datetime(2021, 2, 10, 12, 0),
+    )
+
+    results = dao_get_notifications_by_recipient_or_reference(
+        sample_template.service_id, '447700900855', notification_type='sms', limit_days=7,
+    )
+
+    assert [notification.id for notification in results.items] == [recent.id]
+
+
 @pytest.mark.parametrize("search_term",
                          ["JACK", "JACK@gmail.com", "jack@gmail.com"])
 def test_dao_get_notifications_by_recipient_is_not_case_sensitive(sample_email_template, search_term):
@@ -1494,6 +1651,20 @@ def test_dao_get_last_notification_added_for_job_id_no_job(sample_template, fake
     assert dao_get_last_notification_added_for_job_id(fake_uuid) is None
 
 
+@pytest.mark.parametrize('start_row, end_row, expected_last_row', [
+    (0, 4, 3),
+    (4, 8, 5),
+    (4, None, 5),
+    (8, None, None),
+])
+def test_dao_get_last_row_number_added_for_job_rows(sample_template, start_row, end_row, expected_last_row):
+    job = create_job(template=sample_template, notification_count=10)
+    for row_number in [0, 1, 2, 3, 4, 5]:
+        create_notification(sample_template, job, row_number)
+
+    assert dao_get_last_row_number_added_for_job_rows(job.id, start_row, end_row) == expected_last_row
+
+
 def test_dao_update_notifications_by_reference_updated_notifications(sample_template):
     notification_1 = create_notification(template=sample_template, reference='ref1')
     notification_2 = create_notification(template=sample_template, reference='ref2')
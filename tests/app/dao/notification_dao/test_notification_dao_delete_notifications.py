@@ -9,7 +9,7 @@ from freezegun import freeze_time
 
 from app.dao.notifications_dao import (
     delete_notifications_older_than_retention_by_type,
-    insert_notification_history_delete_notifications
+    move_notifications_to_notification_history,
 )
 from app.models import Notification, NotificationHistory
 from tests.app.db import (
@@ -47,6 +47,20 @@ def create_test_data(notification_type, sample_service, days_of_retention=3):
                                   days_of_retention=days_of_retention)
 
 
+def _mock_s3_delete(mocker):
+    """
+    Returns a list that (bucket name, prefix) is added to for each letter whose PDFs would be deleted from S3
+    """
+    deleted = []
+
+    def remove_s3_objects_by_prefix(bucket_name, prefixes, max_workers):
+        deleted.extend((bucket_name, prefix) for prefix in prefixes)
+        return []
+
+    mocker.patch('app.dao.notifications_dao.remove_s3_objects_by_prefix', side_effect=remove_s3_objects_by_prefix)
+    return deleted
+
+
 def _create_templates(sample_service):
     email_template = create_template(service=sample_service, template_type='email')
     sms_template = create_template(service=sample_service)
@@ -72,7 +86,7 @@ def test_should_delete_notifications_by_type_after_seven_days(
         expected_email_count,
         expected_letter_count
 ):
-    mocker.patch("app.dao.notifications_dao.get_s3_bucket_objects")
+    mocker.patch("app.dao.notifications_dao.remove_s3_objects_by_prefix", return_value=[])
     email_template, letter_template, sms_template = _create_templates(sample_service)
     # create one notification a day between 1st and 10th from 11:00 to 19:00 of each type
     for i in range(1, 11):
@@ -106,7 +120,7 @@ def test_should_delete_notifications_by_type_after_seven_days(
 
 @freeze_time("2016-01-10 12:00:00.000000")
 def test_should_not_delete_notification_history(sample_service, mocker):
-    mocker.patch("app.dao.notifications_dao.get_s3_bucket_objects")
+    mocker.patch("app.dao.notifications_dao.remove_s3_objects_by_prefix", return_value=[])
     with freeze_time('2016-01-01 12:00'):
         email_template, letter_template, sms_template = _create_templates(sample_service)
         create_notification(template=email_template, status='permanent-failure')
@@ -120,31 +134,33 @@ def test_should_not_delete_notification_history(sample_service, mocker):
 
 @pytest.mark.parametrize('notification_type', ['sms', 'email', 'letter'])
 def test_delete_notifications_for_days_of_retention(sample_service, notification_type, mocker):
-    mock_get_s3 = mocker.patch("app.dao.notifications_dao.get_s3_bucket_objects")
+    deleted_from_s3 = _mock_s3_delete(mocker)
     create_test_data(notification_type, sample_service)
     assert Notification.query.count() == 9
     delete_notifications_older_than_retention_by_type(notification_type)
     assert Notification.query.count() == 7
     assert Notification.query.filter_by(notification_type=notification_type).count() == 1
     if notification_type == 'letter':
-        assert mock_get_s3.call_count == 2
+        assert len(deleted_from_s3) == 2
     else:
-        mock_get_s3.assert_not_called()
+        assert deleted_from_s3 == []
 
 
 @freeze_time('2019-09-01 04:30')
 def test_delete_notifications_deletes_letters_from_s3(sample_letter_template, mocker):
-    mock_get_s3 = mocker.patch("app.dao.notifications_dao.get_s3_bucket_objects")
+    deleted_from_s3 = _mock_s3_delete(mocker)
     eight_days_ago = datetime.utcnow() - timedelta(days=8)
     create_notification(template=sample_letter_template, status='delivered',
                         reference='LETTER_REF', created_at=eight_days_ago, sent_at=eight_days_ago
                         )
     delete_notifications_older_than_retention_by_type(notification_type='letter')
-    mock_get_s3.assert_called_once_with(bucket_name=current_app.config['LETTERS_PDF_BUCKET_NAME'],
-                                        subfolder="{}/NOTIFY.LETTER_REF.D.2.C.C.{}.PDF".format(
-                                            str(eight_days_ago.date()),
-                                            eight_days_ago.strftime('%Y%m%d%H%M%S'))
-                                        )
+    assert deleted_from_s3 == [(
+        current_app.config['LETTERS_PDF_BUCKET_NAME'],
+        "{}/NOTIFY.LETTER_REF.D.2.C.C.{}.PDF".format(
+            str(eight_days_ago.date()),
+            eight_days_ago.strftime('%Y%m%d%H%M%S')
+        )
+    )]
 
 
 def test_delete_notifications_inserts_notification_history(sample_service):
@@ -159,7 +175,7 @@ def test_delete_notifications_inserts_notification_history(sample_service):
 def test_delete_notifications_does_nothing_if_notification_history_row_already_exists(
     sample_email_template, mocker
 ):
-    mocker.patch("app.dao.notifications_dao.get_s3_bucket_objects")
+    mocker.patch("app.dao.notifications_dao.remove_s3_objects_by_prefix", return_value=[])
     notification = create_notification(
         template=sample_email_template, created_at=datetime.utcnow() - timedelta(days=8),
         status='temporary-failure'
@@ -185,7 +201,7 @@ def test_delete_notifications_keep_data_for_days_of_retention_is_longer(sample_s
 
 
 def test_delete_notifications_with_test_keys(sample_template, mocker):
-    mocker.patch("app.dao.notifications_dao.get_s3_bucket_objects")
+    mocker.patch("app.dao.notifications_dao.remove_s3_objects_by_prefix", return_value=[])
     create_notification(template=sample_template, key_type='test', created_at=datetime.utcnow() - timedelta(days=8))
     delete_notifications_older_than_retention_by_type('sms')
     assert Notification.query.count() == 0
@@ -218,7 +234,7 @@ def test_delete_notifications_delete_notification_type_for_default_time_if_no_da
 def test_delete_notifications_deletes_letters_not_sent_and_in_final_state_from_table_but_not_s3(
     sample_service, mocker, notification_status
 ):
-    mock_get_s3 = mocker.patch("app.dao.notifications_dao.get_s3_bucket_objects")
+    deleted_from_s3 = _mock_s3_delete(mocker)
     letter_template = create_template(service=sample_service, template_type='letter')
     create_notification(
         template=letter_template,
@@ -233,7 +249,7 @@ def test_delete_notifications_deletes_letters_not_sent_and_in_final_state_from_t
 
     assert Notification.query.count() == 0
     assert NotificationHistory.query.count() == 1
-    mock_get_s3.assert_not_called()
+    assert deleted_from_s3 == []
 
 
 @freeze_time('2020-12-24 04:30')
@@ -241,7 +257,7 @@ def test_delete_notifications_deletes_letters_not_sent_and_in_final_state_from_t
 def test_delete_notifications_deletes_letters_sent_and_in_final_state_from_table_and_s3(
     sample_service, mocker, notification_status
 ):
-    mock_get_s3 = mocker.patch("app.dao.notifications_dao.get_s3_bucket_objects")
+    deleted_from_s3 = _mock_s3_delete(mocker)
     letter_template = create_template(service=sample_service, template_type='letter')
     eight_days_ago = datetime.utcnow() - timedelta(days=8)
     create_notification(
@@ -258,20 +274,20 @@ def test_delete_notifications_deletes_letters_sent_and_in_final_state_from_table
 
     assert Notification.query.count() == 0
     assert NotificationHistory.query.count() == 1
-    mock_get_s3.assert_called_once_with(
-        bucket_name=current_app.config['LETTERS_PDF_BUCKET_NAME'],
-        subfolder="{}/NOTIFY.LETTER_REF.D.2.C.C.{}.PDF".format(
+    assert deleted_from_s3 == [(
+        current_app.config['LETTERS_PDF_BUCKET_NAME'],
+        "{}/NOTIFY.LETTER_REF.D.2.C.C.{}.PDF".format(
             str(eight_days_ago.date()),
             eight_days_ago.strftime('%Y%m%d%H%M%S')
         )
-    )
+    )]
 
 
 @pytest.mark.parametrize('notification_status', ['pending-virus-check', 'created', 'sending'])
 def test_delete_notifications_does_not_delete_letters_not_yet_in_final_state(
     sample_service, mocker, notification_status
 ):
-    mock_get_s3 = mocker.patch("app.dao.notifications_dao.get_s3_bucket_objects")
+    deleted_from_s3 = _mock_s3_delete(mocker)
     letter_template = create_template(service=sample_service, template_type='letter')
     create_notification(
         template=letter_template,
@@ -286,7 +302,7 @@ def test_delete_notifications_does_not_delete_letters_not_yet_in_final_state(
 
     assert Notification.query.count() == 1
     assert NotificationHistory.query.count() == 0
-    mock_get_s3.assert_not_called()
+    assert deleted_from_s3 == []
 
 
 @freeze_time('2020-03-25 00:01')
@@ -316,117 +332,103 @@ def test_delete_notifications_returns_sum_correctly(sample_template):
     assert ret == 4
 
 
+def test_delete_notifications_purges_services_with_the_same_retention_together(sample_service, mocker):
+    mock_move = mocker.patch(
+        'app.dao.notifications_dao.move_notifications_to_notification_history',
+        wraps=move_notifications_to_notification_history,
+    )
+    other_service = create_service(service_name='other service')
+    for service in (sample_service, other_service):
+        create_service_data_retention(service=service, notification_type='sms', days_of_retention=3)
+        create_notification(template=create_template(service=service), created_at=datetime.utcnow() - timedelta(days=4))
+
+    assert delete_notifications_older_than_retention_by_type('sms') == 2
+
+    assert Notification.query.count() == 0
+    assert NotificationHistory.query.count() == 2
+    # one batch that moves both, and one that finds nothing left
+    assert mock_move.call_count == 2
+
+
 @freeze_time('2020-03-20 14:00')
-def test_insert_notification_history_delete_notifications(sample_email_template):
-    # should be deleted
-    n1 = create_notification(template=sample_email_template,
-                             created_at=datetime.utcnow() - timedelta(days=1, minutes=4), status='delivered')
-    n2 = create_notification(template=sample_email_template,
-                             created_at=datetime.utcnow() - timedelta(days=1, minutes=20), status='permanent-failure')
-    n3 = create_notification(template=sample_email_template,
-                             created_at=datetime.utcnow() - timedelta(days=1, minutes=30), status='temporary-failure')
-    n4 = create_notification(template=sample_email_template,
-                             created_at=datetime.utcnow() - timedelta(days=1, minutes=59), status='temporary-failure')
-    n5 = create_notification(template=sample_email_template,
-                             created_at=datetime.utcnow() - timedelta(days=1, hours=1), status='sending')
-    n6 = create_notification(template=sample_email_template,
-                             created_at=datetime.utcnow() - timedelta(days=1, minutes=61), status='pending')
-    n7 = create_notification(template=sample_email_template,
-                             created_at=datetime.utcnow() - timedelta(days=1, hours=1, seconds=1),
-                             status='validation-failed')
-    n8 = create_notification(template=sample_email_template,
-                             created_at=datetime.utcnow() - timedelta(days=1, minutes=20), status='created')
-    # should NOT be deleted - wrong status
-    n9 = create_notification(template=sample_email_template,
-                             created_at=datetime.utcnow() - timedelta(hours=1), status='delivered')
-    n10 = create_notification(template=sample_email_template,
-                              created_at=datetime.utcnow() - timedelta(hours=1), status='technical-failure')
-    n11 = create_notification(template=sample_email_template,
-                              created_at=datetime.utcnow() - timedelta(hours=23, minutes=59), status='created')
-
-    ids_to_move = sorted([n1.id, n2.id, n3.id, n4.id, n5.id, n6.id, n7.id, n8.id])
-    ids_to_keep = sorted([n9.id, n10.id, n11.id])
-    del_count = insert_notification_history_delete_notifications(
-        notification_type=sample_email_template.template_type,
-        service_id=sample_email_template.service_id,
-        timestamp_to_delete_backwards_from=datetime.utcnow() - timedelta(days=1))
-    assert del_count == 8
-    notifications = Notification.query.all()
-    history_rows = NotificationHistory.query.all()
-    assert len(history_rows) == 8
-    assert ids_to_move == sorted([x.id for x in history_rows])
-    assert len(notifications) == 3
-    assert ids_to_keep == sorted([x.id for x in notifications])
-
-
-def test_insert_notification_history_delete_notifications_more_notifications_than_query_limit(sample_template):
-    create_notification(template=sample_template,
-                        created_at=datetime.utcnow() + timedelta(minutes=4), status='delivered')
-    create_notification(template=sample_template,
-                        created_at=datetime.utcnow() + timedelta(minutes=20), status='permanent-failure')
-    create_notification(template=sample_template,
-                        created_at=datetime.utcnow() + timedelta(minutes=30), status='temporary-failure')
-
-    del_count = insert_notification_history_delete_notifications(
-        notification_type=sample_template.template_type,
-        service_id=sample_template.service_id,
-        timestamp_to_delete_backwards_from=datetime.utcnow() + timedelta(hours=1),
-        qry_limit=1
+def test_delete_notifications_skips_windows_without_notifications_for_the_group(sample_service, mocker):
+    mock_move = mocker.patch(
+        'app.dao.notifications_dao.move_notifications_to_notification_history',
+        wraps=move_notifications_to_notification_history,
     )
+    create_service_data_retention(service=sample_service, notification_type='sms', days_of_retention=3)
+    create_notification(template=create_template(service=sample_service), created_at=datetime(2020, 3, 16, 12, 30))
+    # other services' notifications in the days before shouldn't be searched through an hour at a time
+    other_template = create_template(service=create_service(service_name='other service'))
+    for day in range(10, 16):
+        create_notification(template=other_template, created_at=datetime(2020, 3, day, 12, 30))
+
+    assert delete_notifications_older_than_retention_by_type('sms') == 4
+
+    three_day_calls = [move_call for move_call in mock_move.call_args_list if 'service_ids' in move_call[0][4]]
+    # one batch that moves the notification, and one that finds nothing left
+    assert len(three_day_calls) == 2
+
+
+@freeze_time('2020-03-20 14:00')
+def test_delete_notifications_saves_its_progress(sample_template, mocker):
+    mock_redis = mocker.patch('app.dao.notifications_dao.redis_store')
+    mock_redis.get.return_value = None
+    create_notification(template=sample_template, created_at=datetime(2020, 3, 10, 12, 30))
 
-    assert del_count == 1
-    notifications = Notification.query.all()
-    history_rows = NotificationHistory.query.all()
-    assert len(history_rows) == 1
-    assert len(notifications) == 2
-
-
-def test_insert_notification_history_delete_notifications_only_insert_delete_for_given_service(sample_email_template):
-    notification_to_move = create_notification(template=sample_email_template,
-                                               created_at=datetime.utcnow() + timedelta(minutes=4), status='delivered')
-    another_service = create_service(service_name='Another service')
-    another_template = create_template(service=another_service, template_type='email')
-    notification_to_stay = create_notification(template=another_template,
-                                               created_at=datetime.utcnow() + timedelta(minutes=4), status='delivered')
-
-    del_count = insert_notification_history_delete_notifications(
-        notification_type=sample_email_template.template_type,
-        service_id=sample_email_template.service_id,
-        timestamp_to_delete_backwards_from=datetime.utcnow() + timedelta(hours=1)
+    delete_notifications_older_than_retention_by_type('sms')
+
+    mock_redis.get.assert_called_once_with('notification-purge-cursor-sms-default-2020-03-13 00:00:00.000000')
+    mock_redis.set.assert_called_once_with(
+        'notification-purge-cursor-sms-default-2020-03-13 00:00:00.000000',
+        '2020-03-10 13:30:00.000000',
+        ex=86400,
     )
 
-    assert del_count == 1
-    notifications = Notification.query.all()
-    history_rows = NotificationHistory.query.all()
-    assert len(notifications) == 1
-    assert len(history_rows) == 1
-    assert notifications[0].id == notification_to_stay.id
-    assert history_rows[0], id == notification_to_move.id
-
-
-def test_insert_notification_history_delete_notifications_insert_for_key_type(sample_template):
-    create_notification(template=sample_template,
-                        created_at=datetime.utcnow() - timedelta(hours=4),
-                        status='delivered',
-                        key_type='normal')
-    create_notification(template=sample_template,
-                        created_at=datetime.utcnow() - timedelta(hours=4),
-                        status='delivered',
-                        key_type='team')
-    with_test_key = create_notification(template=sample_template,
-                                        created_at=datetime.utcnow() - timedelta(hours=4),
-                                        status='delivered',
-                                        key_type='test')
-
-    del_count = insert_notification_history_delete_notifications(
-        notification_type=sample_template.template_type,
-        service_id=sample_template.service_id,
-        timestamp_to_delete_backwards_from=datetime.utcnow()
+
+@freeze_time('2020-03-20 14:00')
+def test_delete_notifications_carries_on_from_saved_progress(sample_template, mocker):
+    mock_redis = mocker.patch('app.dao.notifications_dao.redis_store')
+    mock_redis.get.return_value = b'2020-03-10 00:00:00.000000'
+    left_behind = create_notification(template=sample_template, created_at=datetime(2020, 3, 9, 12, 30))
+    create_notification(template=sample_template, created_at=datetime(2020, 3, 10, 12, 30))
+
+    assert delete_notifications_older_than_retention_by_type('sms') == 1
+
+    assert Notification.query.one().id == left_behind.id
+
+
+def test_move_notifications_to_notification_history_deletes_but_does_not_copy_test_notifications(
+    sample_template
+):
+    create_notification(template=sample_template, created_at=datetime.utcnow() - timedelta(hours=4))
+    create_notification(template=sample_template, created_at=datetime.utcnow() - timedelta(hours=4), key_type='test')
+
+    deleted, moved = move_notifications_to_notification_history(
+        'sms',
+        created_from=datetime.utcnow() - timedelta(days=1),
+        created_before=datetime.utcnow(),
+        service_filter='service_id = :service_id',
+        params={'service_id': sample_template.service_id},
     )
 
-    assert del_count == 2
-    notifications = Notification.query.all()
-    history_rows = NotificationHistory.query.all()
-    assert len(notifications) == 1
-    assert with_test_key.id == notifications[0].id
-    assert len(history_rows) == 2
+    assert (deleted, moved) == (2, 1)
+    assert Notification.query.count() == 0
+    assert NotificationHistory.query.one().key_type == 'normal'
+
+
+@freeze_time('2020-12-24 04:30')
+def test_delete_notifications_logs_letters_that_could_not_be_deleted_from_s3(sample_letter_template, mocker):
+    mocker.patch(
+        'app.dao.notifications_dao.remove_s3_objects_by_prefix',
+        return_value=[('2020-12-16/NOTIFY.REF.D.2.C.C.20201216043000.PDF', 'Access Denied')]
+    )
+    mock_logger = mocker.patch('app.dao.notifications_dao.current_app.logger.error')
+    create_notification(template=sample_letter_template, status='delivered', reference='REF',
+                        created_at=datetime.utcnow() - timedelta(days=8))
+
+    delete_notifications_older_than_retention_by_type('letter')
+
+    mock_logger.assert_called_once_with(
+        'Could not delete S3 object with filename: 2020-12-16/NOTIFY.REF.D.2.C.C.20201216043000.PDF: Access Denied'
+    )
@@ -5,9 +5,8 @@ import pytest
 import mock
 
 from app.dao.fact_notification_status_dao import (
-    update_fact_notification_status,
+    rebuild_fact_notification_status_for_day,
     fetch_monthly_notification_statuses_per_service,
-    fetch_notification_status_for_day,
     fetch_notification_status_for_service_by_month,
     fetch_notification_status_for_service_for_day,
     fetch_notification_status_for_service_for_today_and_7_previous_days,
@@ -33,6 +32,7 @@ from app.models import (
     NOTIFICATION_TECHNICAL_FAILURE,
     NOTIFICATION_TEMPORARY_FAILURE,
 )
+from app.notification_counts import NotificationCount, NotificationTotal
 from freezegun import freeze_time
 
 from tests.app.db import (
@@ -42,7 +42,7 @@ from tests.app.db import (
 )
 
 
-def test_update_fact_notification_status(notify_db_session):
+def test_rebuild_fact_notification_status_for_day_for_each_notification_type(notify_db_session):
     first_service = create_service(service_name='First Service')
     first_template = create_template(service=first_service)
     second_service = create_service(service_name='second Service')
@@ -68,8 +68,7 @@ def test_update_fact_notification_status(notify_db_session):
         create_notification(template=third_template)
 
     for notification_type in ('letter', 'sms', 'email'):
-        data = fetch_notification_status_for_day(process_day=process_day, notification_type=notification_type)
-        update_fact_notification_status(data=data, process_day=process_day, notification_type=notification_type)
+        rebuild_fact_notification_status_for_day(process_day=process_day, notification_type=notification_type)
 
     new_fact_data = FactNotificationStatus.query.order_by(FactNotificationStatus.bst_date,
                                                           FactNotificationStatus.notification_type
@@ -101,14 +100,46 @@ def test_update_fact_notification_status(notify_db_session):
     assert new_fact_data[2].notification_count == 1
 
 
-def test__update_fact_notification_status_updates_row(notify_db_session):
+def test_rebuild_fact_notification_status_for_day(notify_db_session):
+    first_service = create_service(service_name='First Service')
+    first_template = create_template(service=first_service, template_type='email')
+    second_service = create_service(service_name='second Service')
+    second_template = create_template(service=second_service, template_type='email')
+    create_service_data_retention(second_service, 'email', days_of_retention=3)
+
+    process_day = date.today() - timedelta(days=5)
+    with freeze_time(datetime.combine(process_day, time.min)):
+        create_notification(template=first_template, status='delivered')
+        create_notification(template=first_template, status='delivered')
+        # 2nd service email has 3 day data retention - only what's in history should be counted
+        create_notification_history(template=second_template, status='temporary-failure')
+        create_notification(template=second_template, status='delivered')
+        create_notification(template=first_template, status='delivered', key_type='test')
+
+    # an existing row for the day that no longer matches the data is replaced
+    create_ft_notification_status(
+        bst_date=process_day, notification_type='email', service=first_service, template=first_template, count=10
+    )
+
+    assert rebuild_fact_notification_status_for_day(process_day=process_day, notification_type='email') == 2
+
+    new_fact_data = FactNotificationStatus.query.order_by(FactNotificationStatus.notification_status).all()
+    assert [
+        (row.service_id, row.template_id, row.notification_status, row.notification_count, row.bst_date)
+        for row in new_fact_data
+    ] == [
+        (first_service.id, first_template.id, 'delivered', 2, process_day),
+        (second_service.id, second_template.id, 'temporary-failure', 1, process_day),
+    ]
+
+
+def test_rebuild_fact_notification_status_for_day_updates_row(notify_db_session):
     first_service = create_service(service_name='First Service')
     first_template = create_template(service=first_service)
     create_notification(template=first_template, status='delivered')
 
     process_day = date.today()
-    data = fetch_notification_status_for_day(process_day=process_day, notification_type='sms')
-    update_fact_notification_status(data=data, process_day=process_day, notification_type='sms')
+    rebuild_fact_notification_status_for_day(process_day=process_day, notification_type='sms')
 
     new_fact_data = FactNotificationStatus.query.order_by(FactNotificationStatus.bst_date,
                                                           FactNotificationStatus.notification_type
@@ -118,8 +149,7 @@ def test__update_fact_notification_status_updates_row(notify_db_session):
 
     create_notification(template=first_template, status='delivered')
 
-    data = fetch_notification_status_for_day(process_day=process_day, notification_type='sms')
-    update_fact_notification_status(data=data, process_day=process_day, notification_type='sms')
+    rebuild_fact_notification_status_for_day(process_day=process_day, notification_type='sms')
 
     updated_fact_data = FactNotificationStatus.query.order_by(FactNotificationStatus.bst_date,
                                                               FactNotificationStatus.notification_type
@@ -218,6 +248,81 @@ def test_fetch_notification_status_for_service_for_day(notify_db_session):
     assert results[1].count == 1
 
 
+@freeze_time('2018-10-31T18:00:00')
+def test_fetch_notification_status_for_service_for_today_and_7_previous_days_uses_todays_counts(
+    notify_db_session, mocker
+):
+    service = create_service()
+    sms_template = create_template(service=service, template_type=SMS_TYPE)
+    create_ft_notification_status(date(2018, 10, 29), template=sms_template, count=10)
+    # not counted, as today's counts come from redis
+    create_notification(sms_template, created_at=datetime(2018, 10, 31, 11, 0, 0), status='delivered')
+    mocker.patch(
+        'app.dao.fact_notification_status_dao.get_todays_notification_counts_for_service',
+        return_value=[
+            NotificationCount('sms', 'delivered', str(sms_template.id), 'normal', 4),
+            NotificationCount('sms', 'delivered', str(sms_template.id), 'test', 7),
+            NotificationCount('sms', 'sending', str(sms_template.id), 'team', 2),
+        ]
+    )
+
+    results = sorted(
+        fetch_notification_status_for_service_for_today_and_7_previous_days(service.id, by_template=True),
+        key=lambda x: x.status
+    )
+
+    assert [(x.template_id, x.status, x.count) for x in results] == [
+        (sms_template.id, 'delivered', 14),
+        (sms_template.id, 'sending', 2),
+    ]
+
+
+@freeze_time('2018-10-31T18:00:00')
+def test_fetch_notification_status_for_service_for_today_and_7_previous_days_adds_todays_counts_by_status(
+    notify_db_session, mocker
+):
+    service = create_service()
+    sms_template = create_template(service=service, template_type=SMS_TYPE)
+    email_template = create_template(service=service, template_type=EMAIL_TYPE)
+    create_ft_notification_status(date(2018, 10, 29), template=sms_template, count=10)
+    mocker.patch(
+        'app.dao.fact_notification_status_dao.get_todays_notification_counts_for_service',
+        return_value=[
+            NotificationCount('sms', 'delivered', str(sms_template.id), 'normal', 4),
+            NotificationCount('email', 'delivered', str(email_template.id), 'normal', 3),
+            NotificationCount('email', 'delivered', str(email_template.id), 'test', 5),
+        ]
+    )
+
+    results = sorted(
+        fetch_notification_status_for_service_for_today_and_7_previous_days(service.id),
+        key=lambda x: x.notification_type
+    )
+
+    assert [(x.notification_type, x.status, x.count) for x in results] == [
+        ('email', 'delivered', 3),
+        ('sms', 'delivered', 14),
+    ]
+
+
+@freeze_time('2018-10-31T18:00:00')
+def test_fetch_notification_status_for_service_for_today_and_7_previous_days_looks_up_templates_only_used_today(
+    notify_db_session, mocker
+):
+    service = create_service()
+    email_template = create_template(service=service, template_type=EMAIL_TYPE, template_name='only today')
+    mocker.patch(
+        'app.dao.fact_notification_status_dao.get_todays_notification_counts_for_service',
+        return_value=[NotificationCount('email', 'delivered', str(email_template.id), 'normal', 3)]
+    )
+
+    results = fetch_notification_status_for_service_for_today_and_7_previous_days(service.id, by_template=True)
+
+    assert [(x.template_name, x.is_precompiled_letter, x.template_id, x.status, x.count) for x in results] == [
+        ('only today', False, email_template.id, 'delivered', 3),
+    ]
+
+
 @freeze_time('2018-10-31T18:00:00')
 def test_fetch_notification_status_for_service_for_today_and_7_previous_days(notify_db_session):
     service_1 = create_service(service_name='service_1')
@@ -385,6 +490,30 @@ def test_fetch_notification_status_totals_for_all_services_works_in_bst(
     assert results[2].count == 1
 
 
+@freeze_time('2018-10-31 14:00')
+def test_fetch_notification_status_totals_for_all_services_adds_todays_totals(notify_db_session, mocker):
+    service = create_service()
+    create_ft_notification_status(date(2018, 10, 29), 'sms', service, count=10)
+    create_ft_notification_status(date(2018, 10, 29), 'email', service, count=3)
+    mocker.patch(
+        'app.dao.fact_notification_status_dao.get_todays_notification_totals',
+        return_value=[
+            NotificationTotal('sms', 'delivered', 'normal', 4),
+            NotificationTotal('letter', 'created', 'normal', 2),
+        ]
+    )
+
+    results = fetch_notification_status_totals_for_all_services(
+        start_date=date(2018, 10, 29), end_date=date(2018, 10, 31)
+    )
+
+    assert [(x.notification_type, x.status, x.key_type, x.count) for x in results] == [
+        ('email', 'delivered', 'normal', 3),
+        ('letter', 'created', 'normal', 2),
+        ('sms', 'delivered', 'normal', 14),
+    ]
+
+
 def set_up_data():
     service_2 = create_service(service_name='service_2')
     create_template(service=service_2, template_type=LETTER_TYPE)
@@ -20,7 +20,8 @@ from app.dao.fact_billing_dao import (
     fetch_sms_billing_for_all_services,
     fetch_letter_costs_for_all_services,
     fetch_letter_line_items_for_all_services,
-    fetch_usage_year_for_organisation
+    fetch_usage_year_for_organisation,
+    update_fact_billing_for_day,
 )
 from app.dao.organisation_dao import dao_add_service_to_organisation
 from app.models import (
@@ -289,6 +290,28 @@ def test_fetch_billing_data_for_day_uses_correct_table(notify_db_session):
     assert results[1].notifications_sent == 1
 
 
+def test_fetch_billing_data_for_day_uses_correct_table_for_each_service(notify_db_session):
+    long_retention_service = create_service(service_name='long retention')
+    create_service_data_retention(long_retention_service, notification_type='sms', days_of_retention=10)
+    default_retention_service = create_service(service_name='default retention')
+    long_retention_template = create_template(service=long_retention_service)
+    default_retention_template = create_template(service=default_retention_service)
+
+    nine_days_ago = datetime.utcnow() - timedelta(days=9)
+    create_notification(template=long_retention_template, status='delivered', created_at=nine_days_ago)
+    create_notification_history(template=long_retention_template, status='delivered', created_at=nine_days_ago)
+    create_notification_history(template=default_retention_template, status='delivered', created_at=nine_days_ago)
+    create_notification(template=default_retention_template, status='delivered', created_at=nine_days_ago)
+
+    results = fetch_billing_data_for_day(process_day=nine_days_ago.date())
+
+    assert len(results) == 2
+    assert {(x.service_id, x.notifications_sent) for x in results} == {
+        (long_retention_service.id, 1),
+        (default_retention_service.id, 1),
+    }
+
+
 def test_fetch_billing_data_for_day_returns_list_for_given_service(notify_db_session):
     service = create_service()
     service_2 = create_service(service_name='Service 2')
@@ -724,3 +747,36 @@ def test_fetch_usage_year_for_organisation_only_returns_data_for_live_services(n
     assert len(results) == 1
     assert results[str(live_service.id)]['sms_billable_units'] == 19
     assert results[str(live_service.id)]['emails_sent'] == 0
+
+
+def test_update_fact_billing_for_day_upserts_all_rows(notify_db_session):
+    service = create_service()
+    sms_template = create_template(service=service, template_type='sms')
+    email_template = create_template(service=service, template_type='email')
+    letter_template = create_template(service=service, template_type='letter')
+    create_rate(start_date=datetime(2016, 1, 1), value=0.0158, notification_type='sms')
+    create_letter_rate(crown=True, sheet_count=1, rate=0.35)
+    create_letter_rate(crown=True, sheet_count=2, rate=0.35)
+    for i in range(2):
+        create_notification(template=sms_template, status='delivered', billable_units=2)
+        create_notification(template=email_template, status='delivered')
+    create_notification(template=letter_template, status='delivered', billable_units=1, postage='second')
+    create_notification(template=letter_template, status='delivered', billable_units=2, postage='second')
+    today = convert_utc_to_bst(datetime.utcnow()).date()
+
+    update_fact_billing_for_day(fetch_billing_data_for_day(today), today)
+
+    records = FactBilling.query.order_by(FactBilling.notification_type).all()
+    assert [(r.notification_type, r.rate, r.billable_units, r.notifications_sent) for r in records] == [
+        ('email', 0, 0, 2),
+        # letters with one and two pages have the same rate, so share a row
+        ('letter', Decimal('0.35'), 3, 2),
+        ('sms', Decimal('0.0158'), 4, 2),
+    ]
+
+    create_notification(template=sms_template, status='delivered', billable_units=2)
+    update_fact_billing_for_day(fetch_billing_data_for_day(today), today)
+
+    sms_record = FactBilling.query.filter_by(notification_type='sms').one()
+    assert sms_record.notifications_sent == 3
+    assert sms_record.updated_at
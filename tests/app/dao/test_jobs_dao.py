@@ -15,6 +15,7 @@ from app.dao.jobs_dao import (
     dao_get_jobs_by_service_id,
     dao_get_jobs_older_than_data_retention,
     dao_get_notification_outcomes_for_job,
+    dao_record_job_shard_completed,
     dao_set_scheduled_jobs_to_pending,
     dao_update_job,
     find_jobs_with_missing_rows,
@@ -196,6 +197,26 @@ def test_update_job(sample_job):
     assert job_from_db.job_status == 'in progress'
 
 
+def test_dao_record_job_shard_completed_counts_finished_shards(sample_job):
+    sample_job.shard_count = 2
+    sample_job.completed_shards = []
+    dao_update_job(sample_job)
+
+    assert dao_record_job_shard_completed(sample_job.id, 1) == 1
+    assert dao_record_job_shard_completed(sample_job.id, 0) == 2
+    assert Job.query.get(sample_job.id).completed_shards == [1, 0]
+
+
+def test_dao_record_job_shard_completed_does_not_count_a_shard_twice(sample_job):
+    sample_job.shard_count = 2
+    sample_job.completed_shards = []
+    dao_update_job(sample_job)
+
+    assert dao_record_job_shard_completed(sample_job.id, 0) == 1
+    assert dao_record_job_shard_completed(sample_job.id, 0) is None
+    assert Job.query.get(sample_job.id).completed_shards == [0]
+
+
 def test_set_scheduled_jobs_to_pending_gets_all_jobs_in_scheduled_state_before_now(sample_template):
     one_minute_ago = datetime.utcnow() - timedelta(minutes=1)
     one_hour_ago = datetime.utcnow() - timedelta(minutes=60)
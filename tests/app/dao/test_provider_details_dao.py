@@ -119,6 +119,36 @@ def test_update_sms_provider_to_inactive_sets_inactive(restore_provider_details)
     assert not mmg.active
 
 
+def test_update_provider_details_publishes_update(notify_api, mocker, restore_provider_details):
+    mock_redis = mocker.patch('app.dao.provider_details_dao.redis_store.redis_store')
+    mmg = get_provider_details_by_identifier('mmg')
+    mmg.priority = 20
+
+    with set_config(notify_api, 'REDIS_ENABLED', True):
+        dao_update_provider_details(mmg)
+
+    mock_redis.publish.assert_called_once_with('provider-details-updated', 'dao_update_provider_details')
+
+
+def test_update_provider_details_does_not_publish_update_if_redis_disabled(mocker, restore_provider_details):
+    mock_redis = mocker.patch('app.dao.provider_details_dao.redis_store.redis_store')
+    mmg = get_provider_details_by_identifier('mmg')
+
+    dao_update_provider_details(mmg)
+
+    assert not mock_redis.publish.called
+
+
+def test_update_provider_details_does_not_publish_update_if_update_fails(notify_api, mocker):
+    mock_redis = mocker.patch('app.dao.provider_details_dao.redis_store.redis_store')
+    mocker.patch('app.dao.provider_details_dao._update_provider_details_without_commit', side_effect=ValueError)
+
+    with set_config(notify_api, 'REDIS_ENABLED', True), pytest.raises(ValueError):
+        dao_update_provider_details(object())
+
+    assert not mock_redis.publish.called
+
+
 @pytest.mark.parametrize('identifier, expected', [
     ('firetext', 'mmg'),
     ('mmg', 'firetext'),
@@ -1,3 +1,4 @@
+import itertools
 import uuid
 from datetime import datetime, timedelta
 from unittest import mock
@@ -43,6 +44,7 @@ from app.models import (EMAIL_TYPE, INTERNATIONAL_SMS_TYPE, KEY_TYPE_NORMAL,
                         ServicePermission, ServiceUser, Template,
                         TemplateHistory, User, VerifyCode,
                         user_folder_permissions, INTERNATIONAL_LETTERS)
+from app.notification_counts import NotificationCount
 from tests.app.db import (create_annual_billing, create_api_key,
                           create_email_branding, create_ft_billing,
                           create_inbound_number, create_invited_user,
@@ -52,6 +54,7 @@ from tests.app.db import (create_annual_billing, create_api_key,
                           create_service_with_defined_sms_sender,
                           create_service_with_inbound_number, create_template,
                           create_template_folder, create_user)
+from tests.conftest import set_config
 
 
 def test_create_service(notify_db_session):
@@ -864,6 +867,20 @@ def test_dao_fetch_todays_total_message_count_returns_count_for_today(notify_db_
     assert fetch_todays_total_message_count(notification.service.id) == 1
 
 
+@freeze_time('2020-06-01 12:00')
+def test_dao_fetch_todays_total_message_count_counts_every_type_and_status(notify_db_session):
+    service = create_service()
+    sms_template = create_template(service=service)
+    email_template = create_template(service=service, template_type='email')
+    create_notification(template=sms_template, status='delivered')
+    create_notification(template=sms_template, status='sending')
+    create_notification(template=email_template, status='created', created_at=datetime(2020, 5, 31, 23, 30))
+    create_notification(template=email_template, key_type='test')
+    create_notification(template=sms_template, created_at=datetime(2020, 5, 31, 22, 59))
+
+    assert fetch_todays_total_message_count(service.id) == 3
+
+
 def test_dao_fetch_todays_total_message_count_returns_0_when_no_messages_for_today(notify_db,
                                                                                    notify_db_session):
     assert fetch_todays_total_message_count(uuid.uuid4()) == 0
@@ -889,6 +906,37 @@ def test_dao_fetch_todays_stats_for_all_services_includes_all_services(notify_db
     assert stats == sorted(stats, key=lambda x: x.service_id)
 
 
+@freeze_time('2018-10-31T18:00:00')
+def test_dao_fetch_todays_stats_for_all_services_uses_todays_counts(notify_api, notify_db_session, mocker):
+    service_1 = create_service(service_name='service 1')
+    service_2 = create_service(service_name='service 2')
+    template = create_template(service=service_1)
+    mock_counts = mocker.patch(
+        'app.dao.services_dao.get_todays_notification_counts_for_services',
+        return_value={
+            service_1.id: [
+                NotificationCount('sms', 'delivered', str(template.id), 'normal', 2),
+                NotificationCount('sms', 'delivered', str(uuid.uuid4()), 'team', 1),
+                NotificationCount('sms', 'created', str(template.id), 'test', 5),
+            ],
+            service_2.id: [],
+        }
+    )
+
+    with set_config(notify_api, 'REDIS_ENABLED', True):
+        stats = dao_fetch_todays_stats_for_all_services(include_from_test_key=False)
+
+    mock_counts.assert_called_once_with(sorted([service_1.id, service_2.id]))
+    stats_by_service = {
+        service_id: [(row.notification_type, row.status, row.count) for row in rows]
+        for service_id, rows in itertools.groupby(stats, lambda x: x.service_id)
+    }
+    assert stats_by_service == {
+        service_1.id: [('sms', 'delivered', 3)],
+        service_2.id: [(None, None, None)],
+    }
+
+
 def test_dao_fetch_todays_stats_for_all_services_only_includes_today(notify_db_session):
     template = create_template(service=create_service())
     with freeze_time('2001-01-01T23:59:00'):
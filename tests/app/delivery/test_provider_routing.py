@@ -0,0 +1,109 @@
+import random
+from collections import Counter
+from unittest.mock import Mock
+
+import pytest
+
+from app.delivery.provider_routing import AliasTable, ProviderRoutingTable
+from tests.conftest import set_config
+
+
+@pytest.mark.parametrize('weights', [
+    [25, 75],
+    [60, 40, 0],
+    [1, 2, 3, 4],
+    [100],
+])
+def test_alias_table_gives_each_item_its_share(weights):
+    items = list(range(len(weights)))
+    table = AliasTable(items, weights)
+
+    # every (index, coin flip) pair is equally likely, so the chance of each item is exact
+    shares = Counter()
+    for index, probability in enumerate(table.probabilities):
+        shares[items[index]] += probability / len(items)
+        shares[items[table.aliases[index]]] += (1 - probability) / len(items)
+
+    for item, weight in zip(items, weights):
+        assert shares[item] == pytest.approx(weight / sum(weights))
+
+
+def test_alias_table_chooses_evenly_if_all_weights_are_zero():
+    table = AliasTable(['mmg', 'firetext'], [0, 0])
+
+    assert table.probabilities == [1, 1]
+    assert table.choose(rng=Mock(randrange=Mock(return_value=1), random=Mock(return_value=0.5))) == 'firetext'
+
+
+def test_alias_table_choose_uses_alias_for_high_draws():
+    table = AliasTable(['mmg', 'firetext'], [25, 75])
+
+    assert table.probabilities[0] == 0.5
+    assert table.choose(rng=Mock(randrange=Mock(return_value=0), random=Mock(return_value=0.4))) == 'mmg'
+    assert table.choose(rng=Mock(randrange=Mock(return_value=0), random=Mock(return_value=0.6))) == 'firetext'
+
+
+def test_alias_table_choices_follow_weights():
+    table = AliasTable(['mmg', 'firetext'], [30, 70])
+    rng = random.Random(1)
+
+    counts = Counter(table.choose(rng=rng) for _ in range(10000))
+
+    assert counts['mmg'] / 10000 == pytest.approx(0.3, abs=0.02)
+
+
+def test_alias_table_needs_items():
+    with pytest.raises(ValueError):
+        AliasTable([], [])
+
+
+def test_routing_table_is_cleared_by_provider_details_update(notify_api, mocker):
+    mock_redis = mocker.patch('app.delivery.provider_routing.redis_store.redis_store')
+    mock_get_providers = mocker.patch(
+        'app.delivery.provider_routing.get_provider_details_by_notification_type',
+        return_value=[Mock(identifier='ses', priority=10, active=True)],
+    )
+    routing_table = ProviderRoutingTable()
+
+    with set_config(notify_api, 'REDIS_ENABLED', True):
+        assert routing_table.choose_provider('email') == 'ses'
+        assert routing_table.choose_provider('email') == 'ses'
+        assert mock_get_providers.call_count == 1
+
+        pubsub = mock_redis.pubsub.return_value
+        handler = pubsub.subscribe.call_args[1]['provider-details-updated']
+        handler({'type': 'message', 'data': b'dao_update_provider_details'})
+
+        assert routing_table.choose_provider('email') == 'ses'
+        assert mock_get_providers.call_count == 2
+
+    mock_redis.pubsub.assert_called_once_with(ignore_subscribe_messages=True)
+    pubsub.run_in_thread.assert_called_once_with(sleep_time=1, daemon=True)
+
+
+def test_routing_table_does_not_subscribe_if_redis_disabled(notify_api, mocker):
+    mock_redis = mocker.patch('app.delivery.provider_routing.redis_store.redis_store')
+    mocker.patch(
+        'app.delivery.provider_routing.get_provider_details_by_notification_type',
+        return_value=[Mock(identifier='ses', priority=10, active=True)],
+    )
+
+    with set_config(notify_api, 'REDIS_ENABLED', False):
+        assert ProviderRoutingTable().choose_provider('email') == 'ses'
+
+    assert not mock_redis.pubsub.called
+
+
+def test_routing_table_expires_sooner_if_not_subscribed(notify_api, mocker):
+    mocker.patch('app.delivery.provider_routing.monotonic', side_effect=[100, 111, 111])
+    mock_get_providers = mocker.patch(
+        'app.delivery.provider_routing.get_provider_details_by_notification_type',
+        return_value=[Mock(identifier='ses', priority=10, active=True)],
+    )
+    routing_table = ProviderRoutingTable()
+
+    with set_config(notify_api, 'REDIS_ENABLED', False):
+        routing_table.choose_provider('email')
+        routing_table.choose_provider('email')
+
+    assert mock_get_providers.call_count == 2
@@ -12,7 +12,8 @@ import app
 from app import notification_provider_clients, mmg_client, firetext_client
 from app.dao import notifications_dao
 from app.dao.provider_details_dao import get_provider_details_by_identifier
-from app.delivery import send_to_providers
+from app.delivery import provider_routing, send_to_providers, template_cache
+from app.clients.email import EmailClientNonRetryableException
 from app.exceptions import NotificationTechnicalFailureException
 from app.models import (
     Notification,
@@ -37,7 +38,10 @@ from tests.app.db import (
 def setup_function(_function):
     # pytest will run this function before each test. It makes sure the
     # state of the cache is not shared between tests.
-    send_to_providers.provider_cache.clear()
+    provider_routing.routing_table.clear()
+    send_to_providers.html_email_options_cache.clear()
+    template_cache.template_version_cache.clear()
+    template_cache.rendered_email_cache.clear()
 
 
 def test_provider_to_use_should_return_random_provider(mocker, notify_db_session):
@@ -45,48 +49,51 @@ def test_provider_to_use_should_return_random_provider(mocker, notify_db_session
     firetext = get_provider_details_by_identifier('firetext')
     mmg.priority = 25
     firetext.priority = 75
-    mock_choices = mocker.patch('app.delivery.send_to_providers.random.choices', return_value=[mmg])
+    mock_alias_table = mocker.patch('app.delivery.provider_routing.AliasTable')
+    mock_alias_table.return_value.choose.return_value = 'mmg'
 
     ret = send_to_providers.provider_to_use('sms', international=False)
 
-    mock_choices.assert_called_once_with([mmg, firetext], weights=[25, 75])
+    mock_alias_table.assert_called_once_with(['mmg', 'firetext'], [25, 75])
     assert ret.get_name() == 'mmg'
 
 
-def test_provider_to_use_should_cache_repeated_calls(mocker, notify_db_session):
-    mock_choices = mocker.patch(
-        'app.delivery.send_to_providers.random.choices',
-        wraps=send_to_providers.random.choices,
+def test_provider_to_use_should_draw_for_every_call_but_only_query_once(mocker, notify_db_session):
+    mock_get_providers = mocker.patch(
+        'app.delivery.provider_routing.get_provider_details_by_notification_type',
+        wraps=provider_routing.get_provider_details_by_notification_type,
     )
+    mock_choose = mocker.patch('app.delivery.provider_routing.AliasTable.choose', side_effect=['mmg', 'firetext'] * 5)
 
     results = [
-        send_to_providers.provider_to_use('sms', international=False)
+        send_to_providers.provider_to_use('sms', international=False).get_name()
         for _ in range(10)
     ]
 
-    assert all(result == results[0] for result in results)
-    assert len(mock_choices.call_args_list) == 1
+    assert results == ['mmg', 'firetext'] * 5
+    assert mock_choose.call_count == 10
+    assert mock_get_providers.call_count == 1
 
 
 def test_provider_to_use_should_only_return_mmg_for_international(mocker, notify_db_session):
-    mmg = get_provider_details_by_identifier('mmg')
-    mock_choices = mocker.patch('app.delivery.send_to_providers.random.choices', return_value=[mmg])
+    mock_alias_table = mocker.patch('app.delivery.provider_routing.AliasTable')
+    mock_alias_table.return_value.choose.return_value = 'mmg'
 
     ret = send_to_providers.provider_to_use('sms', international=True)
 
-    mock_choices.assert_called_once_with([mmg], weights=[100])
+    mock_alias_table.assert_called_once_with(['mmg'], [100])
     assert ret.get_name() == 'mmg'
 
 
 def test_provider_to_use_should_only_return_active_providers(mocker, restore_provider_details):
     mmg = get_provider_details_by_identifier('mmg')
-    firetext = get_provider_details_by_identifier('firetext')
     mmg.active = False
-    mock_choices = mocker.patch('app.delivery.send_to_providers.random.choices', return_value=[firetext])
+    mock_alias_table = mocker.patch('app.delivery.provider_routing.AliasTable')
+    mock_alias_table.return_value.choose.return_value = 'firetext'
 
     ret = send_to_providers.provider_to_use('sms')
 
-    mock_choices.assert_called_once_with([firetext], weights=[0])
+    mock_alias_table.assert_called_once_with(['firetext'], [0])
     assert ret.get_name() == 'firetext'
 
 
@@ -129,6 +136,18 @@ def test_should_send_personalised_template_to_correct_sms_provider_and_persist(
     assert notification.personalisation == {"name": "Jo"}
 
 
+def test_send_sms_to_provider_sends_to_normalised_number_without_formatting_it_again(sample_template, mocker):
+    db_notification = create_notification(template=sample_template, to_field='07234 123 123',
+                                          normalised_to='447234123123')
+    mocker.patch('app.mmg_client.send_sms')
+    mock_format = mocker.patch('app.delivery.send_to_providers.validate_and_format_phone_number')
+
+    send_to_providers.send_sms_to_provider(db_notification)
+
+    assert mmg_client.send_sms.call_args[1]['to'] == '447234123123'
+    assert not mock_format.called
+
+
 def test_should_send_personalised_template_to_correct_email_provider_and_persist(
     sample_email_template_with_html,
     mocker
@@ -772,3 +791,112 @@ def test_send_email_to_provider_should_format_email_address(sample_email_notific
         html_body=ANY,
         reply_to_address=ANY,
     )
+
+
+def test_send_sms_batch_to_provider_sends_concurrently_and_saves_results(sample_template, mocker):
+    sent = create_notification(template=sample_template, to_field='07700 900001', status='created')
+    failed = create_notification(template=sample_template, to_field='07700 900002', status='created')
+    test_key = create_notification(template=sample_template, key_type=KEY_TYPE_TEST, status='created')
+    mocker.patch('app.delivery.send_to_providers.provider_to_use', return_value=mmg_client)
+    error = Exception('mmg is down')
+
+    def send_sms(to, **kwargs):
+        if to == '447700900002':
+            raise error
+
+    send_mock = mocker.patch('app.mmg_client.send_sms', side_effect=send_sms)
+    mocker.patch('app.delivery.send_to_providers.send_sms_response')
+    mock_reduce_priority = mocker.patch('app.delivery.send_to_providers.dao_reduce_sms_provider_priority')
+
+    failures = send_to_providers.send_sms_batch_to_provider([sent, failed, test_key])
+
+    assert failures == [(failed, error)]
+    assert send_mock.call_count == 2
+    assert Notification.query.get(sent.id).status == 'sending'
+    assert Notification.query.get(sent.id).sent_by == 'mmg'
+    assert Notification.query.get(test_key.id).status == 'sending'
+    assert Notification.query.get(failed.id).status == 'created'
+    assert Notification.query.get(failed.id).billable_units == 1
+    mock_reduce_priority.assert_called_once_with('mmg', time_threshold=timedelta(minutes=1))
+
+
+def test_send_email_batch_to_provider_saves_references(sample_email_template, mocker):
+    first = create_notification(template=sample_email_template, to_field='first@example.com')
+    second = create_notification(template=sample_email_template, to_field='second@example.com')
+    mocker.patch(
+        'app.aws_ses_client.send_email',
+        side_effect=lambda from_address, to, *args, **kwargs: 'ref-{}'.format(to.split('@')[0])
+    )
+    mocker.patch('app.aws_ses_client.can_send_bulk_email', return_value=False)
+
+    assert send_to_providers.send_email_batch_to_provider([first, second]) == []
+
+    assert Notification.query.get(first.id).reference == 'ref-first'
+    assert Notification.query.get(second.id).reference == 'ref-second'
+    assert Notification.query.get(second.id).status == 'sending'
+    assert Notification.query.get(second.id).sent_by == 'ses'
+
+
+def test_send_sms_batch_to_provider_saves_notifications_one_at_a_time_if_batch_cannot_be_saved(
+    sample_template, mocker
+):
+    first = create_notification(template=sample_template, to_field='07700 900001', status='created')
+    second = create_notification(template=sample_template, to_field='07700 900002', status='created')
+    mocker.patch('app.delivery.send_to_providers.provider_to_use', return_value=mmg_client)
+    send_mock = mocker.patch('app.mmg_client.send_sms')
+    mocker.patch('app.delivery.send_to_providers.dao_update_notifications', side_effect=Exception('db error'))
+    error = Exception('db error')
+    dao_update_notification = send_to_providers.dao_update_notification
+
+    def update_notification(notification):
+        if notification.id == second.id:
+            raise error
+        dao_update_notification(notification)
+
+    mocker.patch('app.delivery.send_to_providers.dao_update_notification', side_effect=update_notification)
+
+    failures = send_to_providers.send_sms_batch_to_provider([first, second])
+
+    assert send_mock.call_count == 2
+    assert failures == [(second, error)]
+    assert Notification.query.get(first.id).status == 'sending'
+    assert Notification.query.get(first.id).sent_by == 'mmg'
+    assert Notification.query.get(first.id).billable_units == 1
+
+
+def test_send_batch_to_provider_reports_notifications_it_could_not_prepare(sample_template, mocker):
+    notification = create_notification(template=sample_template, to_field='not a phone number', status='created')
+    mocker.patch('app.delivery.send_to_providers.provider_to_use', return_value=mmg_client)
+    send_mock = mocker.patch('app.mmg_client.send_sms')
+
+    failures = send_to_providers.send_sms_batch_to_provider([notification])
+
+    assert [failed for failed, _ in failures] == [notification]
+    assert not send_mock.called
+
+
+def test_send_email_batch_to_provider_sends_identical_emails_in_bulk(sample_service, mocker):
+    template = create_template(sample_service, template_type='email', subject='Hi ((name))', content='Dear ((name))')
+    jo_1 = create_notification(template=template, to_field='jo.1@example.com', personalisation={'name': 'Jo'})
+    jo_2 = create_notification(template=template, to_field='jo.2@example.com', personalisation={'name': 'Jo'})
+    sam = create_notification(template=template, to_field='sam@example.com', personalisation={'name': 'Sam'})
+    mock_send_bulk = mocker.patch(
+        'app.aws_ses_client.send_bulk_email', return_value=['ref-1', EmailClientNonRetryableException('bad')]
+    )
+    mock_send = mocker.patch('app.aws_ses_client.send_email', return_value='ref-sam')
+
+    failures = send_to_providers.send_email_batch_to_provider([jo_1, sam, jo_2])
+
+    assert [(notification, str(exception)) for notification, exception in failures] == [(jo_2, 'bad')]
+    mock_send_bulk.assert_called_once_with(
+        '"Sample service" <sample.service@test.notify.com>',
+        ['jo.1@example.com', 'jo.2@example.com'],
+        'Hi Jo',
+        body='Dear Jo\n',
+        html_body=ANY,
+        reply_to_address=None,
+    )
+    assert mock_send.call_args[0][1] == 'sam@example.com'
+    assert (jo_1.reference, jo_1.status) == ('ref-1', 'sending')
+    assert (sam.reference, sam.status) == ('ref-sam', 'sending')
+    assert jo_2.status == 'created'
@@ -0,0 +1,92 @@
+import pytest
+
+from app.delivery import template_cache
+from app.delivery.template_cache import get_template_dict, render_content, render_email
+from tests.app.db import create_template
+
+BRANDING = {'govuk_banner': True, 'brand_banner': False}
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    template_cache.template_version_cache.clear()
+    template_cache.rendered_email_cache.clear()
+    template_cache.rendered_content_cache.clear()
+
+
+def test_get_template_dict_only_fetches_each_version_once(sample_email_template, mocker):
+    mock_get_template = mocker.patch(
+        'app.delivery.template_cache.dao_get_template_by_id', wraps=template_cache.dao_get_template_by_id
+    )
+
+    first = get_template_dict(sample_email_template.id, sample_email_template.version)
+    second = get_template_dict(str(sample_email_template.id), sample_email_template.version)
+
+    assert first is second
+    assert first['content'] == 'This is a template'
+    assert first['subject'] == 'Email Subject'
+    assert first['template_type'] == 'email'
+    assert '_sa_instance_state' not in first
+    mock_get_template.assert_called_once_with(str(sample_email_template.id), sample_email_template.version)
+
+
+def test_get_template_dict_does_not_cache_latest_version(sample_email_template, mocker):
+    mock_get_template = mocker.patch(
+        'app.delivery.template_cache.dao_get_template_by_id', wraps=template_cache.dao_get_template_by_id
+    )
+
+    get_template_dict(sample_email_template.id, None)
+    get_template_dict(sample_email_template.id, None)
+
+    assert mock_get_template.call_count == 2
+
+
+def test_render_email_reuses_emails_without_placeholders(sample_email_template, mocker):
+    mock_html_template = mocker.patch(
+        'app.delivery.template_cache.HTMLEmailTemplate', wraps=template_cache.HTMLEmailTemplate
+    )
+    template_dict = get_template_dict(sample_email_template.id, sample_email_template.version)
+
+    first = render_email(template_dict, {'unused': 'value'}, BRANDING)
+    second = render_email(template_dict, {}, BRANDING)
+    rebranded = render_email(template_dict, {}, dict(BRANDING, govuk_banner=False))
+
+    assert first is second
+    assert first.subject == 'Email Subject'
+    assert first.plain_text_body == 'This is a template\n'
+    assert '<!DOCTYPE html' in first.html_body
+    assert rebranded is not first
+    assert mock_html_template.call_count == 2
+
+
+def test_render_email_renders_personalised_emails_every_time(sample_service):
+    template = create_template(
+        sample_service, template_type='email', subject='Hi ((name))', content='Dear ((name))'
+    )
+    template_dict = get_template_dict(template.id, template.version)
+
+    jo = render_email(template_dict, {'name': 'Jo'}, BRANDING)
+    sam = render_email(template_dict, {'name': 'Sam'}, BRANDING)
+
+    assert (jo.subject, sam.subject) == ('Hi Jo', 'Hi Sam')
+    assert 'Dear Sam' in sam.html_body
+    assert len(template_cache.rendered_email_cache) == 0
+
+
+def test_render_content_reuses_content_without_placeholders(sample_email_template):
+    template_dict = get_template_dict(sample_email_template.id, sample_email_template.version)
+
+    first = render_content(template_dict, {})
+    second = render_content(template_dict, {'unused': 'value'})
+
+    assert first is second
+    assert first == ('This is a template', 'Email Subject')
+
+
+def test_render_content_fills_in_placeholders_every_time(sample_service):
+    template = create_template(sample_service, template_type='sms', content='Hello ((name))')
+    template_dict = get_template_dict(template.id, template.version)
+
+    assert render_content(template_dict, {'name': 'Jo'}) == ('Hello Jo', None)
+    assert render_content(template_dict, {'name': 'Sam'}) == ('Hello Sam', None)
+    assert len(template_cache.rendered_content_cache) == 0
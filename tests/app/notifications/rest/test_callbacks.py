@@ -2,6 +2,7 @@ import pytest
 from flask import json
 
 from app.notifications.notifications_sms_callback import validate_callback_data
+from tests.conftest import set_config_values
 
 
 def firetext_post(client, data):
@@ -168,6 +169,34 @@ def test_firetext_callback_including_a_code_should_return_200_and_call_task_with
     )
 
 
+@pytest.mark.parametrize('redis_enabled, buffer_enabled, expect_buffered', [
+    (True, True, True),
+    (False, True, False),
+    (True, False, False),
+])
+def test_firetext_callback_buffers_response_in_redis_if_enabled(
+    notify_api, client, mocker, redis_enabled, buffer_enabled, expect_buffered
+):
+    mock_buffer = mocker.patch('app.notifications.notifications_sms_callback.buffer_sms_client_response')
+    mock_celery = mocker.patch(
+        'app.notifications.notifications_sms_callback.process_sms_client_response.apply_async')
+
+    data = 'mobile=441234123123&status=1&code=101&time=2016-03-10 14:17:00&reference=notification_id'
+    with set_config_values(notify_api, {
+        'REDIS_ENABLED': redis_enabled,
+        'SMS_CALLBACK_BUFFER_ENABLED': buffer_enabled,
+    }):
+        response = firetext_post(client, data)
+
+    assert response.status_code == 200
+    if expect_buffered:
+        mock_buffer.assert_called_once_with('1', 'notification_id', 'Firetext', '101')
+        mock_celery.assert_not_called()
+    else:
+        mock_buffer.assert_not_called()
+        mock_celery.assert_called_once_with(['1', 'notification_id', 'Firetext', '101'], queue='sms-callbacks')
+
+
 def test_mmg_callback_should_not_need_auth(client, mocker, sample_notification):
     mocker.patch('app.notifications.notifications_sms_callback.process_sms_client_response')
     data = json.dumps({"reference": "mmg_reference",
@@ -0,0 +1,50 @@
+import pytest
+
+from app.dao.notifications_dao import get_notification_rows_for_service_before
+from app.delivery import template_cache
+from app.notifications.notification_list import serialize_notification_rows
+from tests.app.db import create_notification, create_template
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    template_cache.template_version_cache.clear()
+    template_cache.rendered_content_cache.clear()
+
+
+@pytest.mark.parametrize('template_type, personalisation', [
+    ('sms', {'name': 'Jo'}),
+    ('email', {'name': 'Jo'}),
+    ('letter', {'name': 'Jo', 'address_line_1': 'Jo', 'address_line_2': '1 Street', 'postcode': 'SW1 1AA'}),
+])
+def test_serialize_notification_rows_matches_notification_serialize(
+    client, sample_service, sample_user, template_type, personalisation
+):
+    template = create_template(
+        sample_service, template_type=template_type, subject='Hi ((name))', content='Dear ((name))'
+    )
+    notification = create_notification(
+        template=template, personalisation=personalisation, created_by_id=sample_user.id, status='delivered'
+    )
+
+    serialized = serialize_notification_rows(
+        get_notification_rows_for_service_before(sample_service.id, page_size=10)
+    )
+
+    assert serialized == [notification.serialize()]
+
+
+def test_serialize_notification_rows_fetches_each_template_version_once(client, sample_template, mocker):
+    notifications = [create_notification(template=sample_template) for _ in range(3)]
+    mock_get_template = mocker.patch(
+        'app.delivery.template_cache.dao_get_template_by_id', wraps=template_cache.dao_get_template_by_id
+    )
+
+    serialized = serialize_notification_rows(
+        get_notification_rows_for_service_before(sample_template.service_id, page_size=10)
+    )
+
+    assert [notification['body'] for notification in serialized] == [
+        notification.content for notification in notifications
+    ]
+    mock_get_template.assert_called_once_with(str(sample_template.id), sample_template.version)
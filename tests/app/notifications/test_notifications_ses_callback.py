@@ -28,6 +28,14 @@ def test_process_ses_results_in_complaint(sample_email_template):
     assert complaints[0].notification_id == notification.id
 
 
+def test_handle_complaint_does_not_record_the_same_complaint_twice(sample_email_template):
+    create_notification(template=sample_email_template, reference='ref1')
+    assert handle_complaint(json.loads(ses_complaint_callback()['Message']))
+
+    assert handle_complaint(json.loads(ses_complaint_callback()['Message'])) is None
+    assert Complaint.query.count() == 1
+
+
 def test_handle_complaint_does_not_raise_exception_if_reference_is_missing(notify_api):
     response = json.loads(ses_complaint_callback_malformed_message_id()['Message'])
     handle_complaint(response)
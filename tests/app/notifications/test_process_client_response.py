@@ -1,3 +1,4 @@
+import json
 import uuid
 from datetime import datetime
 
@@ -6,10 +7,15 @@ from freezegun import freeze_time
 
 from app import statsd_client
 from app.clients import ClientException
-from app.celery.process_sms_client_response_tasks import process_sms_client_response
+from app.celery.process_sms_client_response_tasks import (
+    process_buffered_sms_client_responses,
+    process_sms_client_response,
+    process_sms_client_responses,
+)
 from app.celery.service_callback_tasks import create_delivery_status_callback_data
 from app.models import NOTIFICATION_TECHNICAL_FAILURE
-from tests.app.db import create_service_callback_api
+from tests.app.db import create_notification, create_service_callback_api
+from tests.conftest import set_config_values
 
 
 def test_process_sms_client_response_raises_error_if_reference_is_not_a_valid_uuid(client):
@@ -179,3 +185,67 @@ def test_process_sms_updates_sent_by_with_client_name_if_not_in_noti(sample_noti
     process_sms_client_response('3', str(sample_notification.id), 'MMG')
 
     assert sample_notification.sent_by == 'mmg'
+
+
+def test_process_sms_client_responses_updates_notifications_in_order_received(sample_template, mocker):
+    send_mock = mocker.patch('app.celery.service_callback_tasks.send_delivery_status_to_service.apply_async')
+    callback_api = create_service_callback_api(service=sample_template.service, url="https://original_url.com")
+    first = create_notification(template=sample_template, status='sending', sent_by=None)
+    second = create_notification(template=sample_template, status='sending')
+
+    process_sms_client_responses([
+        {'status': '2', 'provider_reference': str(first.id), 'client_name': 'Firetext', 'detailed_status_code': None},
+        {'status': '3', 'provider_reference': str(second.id), 'client_name': 'MMG', 'detailed_status_code': '2'},
+        {'status': '1', 'provider_reference': str(first.id), 'client_name': 'Firetext', 'detailed_status_code': None},
+    ])
+
+    assert first.status == 'temporary-failure'
+    assert first.sent_by == 'firetext'
+    assert second.status == 'delivered'
+    assert send_mock.call_count == 2
+    send_mock.assert_any_call(
+        [str(second.id), create_delivery_status_callback_data(second, callback_api)],
+        queue="service-callbacks"
+    )
+
+
+def test_process_sms_client_responses_skips_invalid_references_and_fails_unknown_statuses(
+    sample_notification, mocker
+):
+    mock_logger = mocker.patch('app.celery.process_sms_client_response_tasks.current_app.logger.exception')
+
+    process_sms_client_responses([
+        {'status': '0', 'provider_reference': 'something-bad', 'client_name': 'Firetext', 'detailed_status_code': None},
+        {'status': '000', 'provider_reference': str(sample_notification.id), 'client_name': 'MMG',
+         'detailed_status_code': None},
+    ])
+
+    assert sample_notification.status == NOTIFICATION_TECHNICAL_FAILURE
+    mock_logger.assert_any_call('Firetext callback with invalid reference something-bad')
+    mock_logger.assert_any_call('MMG callback failed: status 000 not found.')
+
+
+def test_process_buffered_sms_client_responses_drains_buffer_in_batches(notify_api, mocker):
+    mock_drain = mocker.patch('app.celery.process_sms_client_response_tasks.receipt_buffer.drain')
+    mock_process = mocker.patch('app.celery.process_sms_client_response_tasks.process_sms_client_responses')
+
+    with set_config_values(notify_api, {
+        'REDIS_ENABLED': True,
+        'SMS_CALLBACK_BUFFER_ENABLED': True,
+        'SMS_CALLBACK_BUFFER_BATCH_SIZE': 2,
+    }):
+        process_buffered_sms_client_responses()
+
+    buffer_key, batch_size, time_budget, apply_batch = mock_drain.call_args[0]
+    assert (buffer_key, batch_size, time_budget) == ('sms-client-responses', 2, 8)
+    apply_batch([json.dumps({'status': str(i)}).encode() for i in range(2)])
+    mock_process.assert_called_once_with([{'status': '0'}, {'status': '1'}])
+
+
+def test_process_buffered_sms_client_responses_does_nothing_if_buffer_disabled(notify_api, mocker):
+    mock_drain = mocker.patch('app.celery.process_sms_client_response_tasks.receipt_buffer.drain')
+
+    with set_config_values(notify_api, {'REDIS_ENABLED': True, 'SMS_CALLBACK_BUFFER_ENABLED': False}):
+        process_buffered_sms_client_responses()
+
+    assert not mock_drain.called
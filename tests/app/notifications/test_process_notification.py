@@ -18,6 +18,8 @@ from app.notifications.process_notifications import (
     send_notification_to_queue,
     simulated_recipient
 )
+from app.notifications.recipients import NormalisedRecipient
+from app.notifications.simulated_recipients import SimulatedRecipients
 from app.serialised_models import SerialisedTemplate
 from notifications_utils.recipients import validate_and_format_phone_number, validate_and_format_email_address
 from app.v2.errors import BadRequestError
@@ -132,10 +134,10 @@ def test_cache_is_not_incremented_on_failure_to_persist_notification(sample_api_
 def test_persist_notification_does_not_increment_cache_if_test_key(
         sample_template, sample_job, mocker, sample_test_api_key
 ):
-    mocker.patch('app.notifications.process_notifications.redis_store.get', return_value="cache")
-    mocker.patch('app.notifications.process_notifications.redis_store.get_all_from_hash', return_value="cache")
-    daily_limit_cache = mocker.patch('app.notifications.process_notifications.redis_store.incr')
-    template_usage_cache = mocker.patch('app.notifications.process_notifications.redis_store.increment_hash_value')
+    mocker.patch('app.redis_store.get', return_value="cache")
+    mocker.patch('app.redis_store.get_all_from_hash', return_value="cache")
+    daily_limit_cache = mocker.patch('app.redis_store.incr')
+    template_usage_cache = mocker.patch('app.redis_store.increment_hash_value')
 
     assert Notification.query.count() == 0
     assert NotificationHistory.query.count() == 0
@@ -198,65 +200,13 @@ def test_persist_notification_with_optionals(sample_job, sample_api_key):
     assert not persisted_notification.reply_to_text
 
 
-@freeze_time("2016-01-01 11:09:00.061258")
-def test_persist_notification_doesnt_touch_cache_for_old_keys_that_dont_exist(notify_db_session, mocker):
-    service = create_service(restricted=True)
-    template = create_template(service=service)
-    api_key = create_api_key(service=service)
-    mock_incr = mocker.patch('app.notifications.process_notifications.redis_store.incr')
-    mocker.patch('app.notifications.process_notifications.redis_store.get', return_value=None)
-    mocker.patch('app.notifications.process_notifications.redis_store.get_all_from_hash', return_value=None)
-
-    persist_notification(
-        template_id=template.id,
-        template_version=template.version,
-        recipient='+447111111111',
-        service=template.service,
-        personalisation={},
-        notification_type='sms',
-        api_key_id=api_key.id,
-        key_type=api_key.key_type,
-        reference="ref"
-    )
-    mock_incr.assert_not_called()
-
-
-@freeze_time("2016-01-01 11:09:00.061258")
-def test_persist_notification_increments_cache_if_key_exists_and_for_trial_service(
-    notify_db_session, mocker
-):
-    service = create_service(restricted=True)
-    template = create_template(service=service)
-    api_key = create_api_key(service=service)
-    mock_incr = mocker.patch('app.notifications.process_notifications.redis_store.incr')
-    mocker.patch('app.notifications.process_notifications.redis_store.get', return_value=1)
-    mocker.patch('app.notifications.process_notifications.redis_store.get_all_from_hash',
-                 return_value={template.id, 1})
-
-    persist_notification(
-        template_id=template.id,
-        template_version=template.version,
-        recipient='+447111111122',
-        service=template.service,
-        personalisation={},
-        notification_type='sms',
-        api_key_id=api_key.id,
-        key_type=api_key.key_type,
-        reference="ref2")
-
-    mock_incr.assert_called_once_with(str(service.id) + "-2016-01-01-count", )
-
-
-def test_persist_notification_does_not_increments_cache_live_service(
-    notify_db_session, mocker
-):
-    service = create_service(restricted=False)
+@pytest.mark.parametrize('restricted', [True, False])
+def test_persist_notification_does_not_count_towards_daily_limit(notify_db_session, mocker, restricted):
+    # messages are counted when they are reserved by check_service_over_daily_message_limit or process_job
+    service = create_service(restricted=restricted)
     template = create_template(service=service)
     api_key = create_api_key(service=service)
-    mock_incr = mocker.patch('app.notifications.process_notifications.redis_store.incr')
-    mocker.patch('app.notifications.process_notifications.redis_store.get', return_value=1)
-    mocker.patch('app.notifications.process_notifications.redis_store.get_all_from_hash',
-                 return_value={template.id, 1})
+    mock_incr = mocker.patch('app.redis_store.incr')
 
     persist_notification(
         template_id=template.id,
@@ -396,6 +346,38 @@ def test_persist_notification_with_international_info_stores_correct_info(
     assert persisted_notification.rate_multiplier == expected_units
 
 
+def test_persist_notification_uses_recipient_already_normalised(sample_template, sample_api_key, mocker):
+    mock_from_phone_number = mocker.patch(
+        'app.notifications.process_notifications.NormalisedRecipient.from_phone_number'
+    )
+
+    persist_notification(
+        template_id=sample_template.id,
+        template_version=sample_template.version,
+        recipient='+36 0623 400400',
+        service=sample_template.service,
+        personalisation=None,
+        notification_type='sms',
+        api_key_id=sample_api_key.id,
+        key_type=sample_api_key.key_type,
+        normalised_recipient=NormalisedRecipient(
+            normalised_to='360623400400',
+            international=True,
+            crown_dependency=False,
+            phone_prefix='36',
+            rate_multiplier=3,
+        ),
+    )
+
+    persisted_notification = Notification.query.one()
+    assert persisted_notification.to == '+36 0623 400400'
+    assert persisted_notification.normalised_to == '360623400400'
+    assert persisted_notification.international is True
+    assert persisted_notification.phone_prefix == '36'
+    assert persisted_notification.rate_multiplier == 3
+    assert not mock_from_phone_number.called
+
+
 def test_persist_notification_with_international_info_does_not_store_for_email(
     sample_job,
     sample_api_key,
@@ -558,3 +540,15 @@ def test_persist_notification_for_international_letter(sample_letter_template, p
     persisted_notification = Notification.query.get(notification.id)
     assert persisted_notification.postage == postage
     assert persisted_notification.international
+
+
+def test_simulated_recipients_are_formatted_when_the_app_starts(notify_api):
+    simulated_recipients = SimulatedRecipients()
+    simulated_recipients.init_app(notify_api)
+
+    assert simulated_recipients.sms_numbers == {'447700900000', '447700900111', '447700900222'}
+    assert simulated_recipients.email_addresses == {
+        'simulate-delivered@notifications.service.gov.uk',
+        'simulate-delivered-2@notifications.service.gov.uk',
+        'simulate-delivered-3@notifications.service.gov.uk',
+    }
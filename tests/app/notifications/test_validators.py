@@ -27,6 +27,7 @@ from app.notifications.validators import (
     service_can_send_to_recipient,
     validate_address,
     validate_and_format_recipient,
+    validate_and_normalise_recipient,
     validate_template,
 )
 from app.serialised_models import SerialisedService, SerialisedTemplate, SerialisedAPIKeyCollection
@@ -41,14 +42,12 @@ from tests.conftest import set_config
 from tests.app.db import (
     create_api_key,
     create_letter_contact,
-    create_notification,
     create_reply_to_email,
     create_service,
     create_service_sms_sender,
     create_service_guest_list,
     create_template,
 )
-from unittest.mock import ANY
 
 
 # all of these tests should have redis enabled (except where we specifically disable it)
@@ -58,135 +57,55 @@ def enable_redis(notify_api):
         yield
 
 
-@pytest.mark.parametrize('key_type', ['test', 'team', 'normal'])
-def test_check_service_message_limit_in_cache_with_unrestricted_service_is_allowed(
-        key_type,
-        sample_service,
-        mocker):
-    mocker.patch('app.notifications.validators.redis_store.get', side_effect=[
-        None,  # The serialised service
-        1,  # The rolling count
-    ])
-    mocker.patch('app.notifications.validators.redis_store.set')
-    mocker.patch('app.notifications.validators.services_dao')
+@pytest.mark.parametrize('key_type', ['team', 'normal'])
+def test_check_service_message_limit_reserves_a_message(key_type, sample_service, mocker):
+    mock_reserve = mocker.patch(
+        'app.notifications.validators.reserve_daily_limit_for_request', return_value=(True, 1)
+    )
     serialised_service = SerialisedService.from_id(sample_service.id)
 
     check_service_over_daily_message_limit(key_type, serialised_service)
-    app.notifications.validators.redis_store.set.assert_called_once_with(
-        f'service-{serialised_service.id}',
-        ANY,
-        ex=ANY,
-    )
-    assert not app.notifications.validators.services_dao.mock_calls
-
 
-@pytest.mark.parametrize('key_type', ['test', 'team', 'normal'])
-def test_check_service_message_limit_in_cache_under_message_limit_passes(
-        key_type,
-        sample_service,
-        mocker):
-    mocker.patch('app.notifications.validators.redis_store.get', side_effect=[
-        None,  # The serialised service
-        1,  # The rolling count
-    ])
-    mocker.patch('app.notifications.validators.redis_store.set')
-    mocker.patch('app.notifications.validators.services_dao')
-    serialised_service = SerialisedService.from_id(sample_service.id)
-    check_service_over_daily_message_limit(key_type, serialised_service)
-    app.notifications.validators.redis_store.set.assert_called_once_with(
-        f'service-{serialised_service.id}',
-        ANY,
-        ex=ANY,
-    )
-    assert not app.notifications.validators.services_dao.mock_calls
+    mock_reserve.assert_called_once_with(serialised_service)
 
 
-def test_should_not_interact_with_cache_for_test_key(sample_service, mocker):
-    mocker.patch('app.notifications.validators.redis_store')
-    mocker.patch('app.notifications.validators.redis_store.get', side_effect=[None])
+def test_check_service_message_limit_does_not_reserve_for_test_key(sample_service, mocker):
+    mock_reserve = mocker.patch('app.notifications.validators.reserve_daily_limit_for_request')
     serialised_service = SerialisedService.from_id(sample_service.id)
-    check_service_over_daily_message_limit('test', serialised_service)
-    assert not app.notifications.validators.redis_store.mock_calls
 
+    check_service_over_daily_message_limit('test', serialised_service)
 
-@pytest.mark.parametrize('key_type', ['team', 'normal'])
-def test_should_set_cache_value_as_value_from_database_if_cache_not_set(
-        key_type,
-        sample_template,
-        sample_service,
-        mocker
-):
-    serialised_service = SerialisedService.from_id(sample_service.id)
-    with freeze_time("2016-01-01 12:00:00.000000"):
-        for _ in range(5):
-            create_notification(sample_template)
-        mocker.patch('app.notifications.validators.redis_store.get', return_value=None)
-        mocker.patch('app.notifications.validators.redis_store.set')
-        check_service_over_daily_message_limit(key_type, serialised_service)
-        app.notifications.validators.redis_store.set.assert_called_with(
-            str(sample_service.id) + "-2016-01-01-count", 5, ex=3600
-        )
+    assert not mock_reserve.called
 
 
-def test_should_not_access_database_if_redis_disabled(notify_api, sample_service, mocker):
+def test_check_service_message_limit_does_not_reserve_if_redis_disabled(notify_api, sample_service, mocker):
+    mock_reserve = mocker.patch('app.notifications.validators.reserve_daily_limit_for_request')
     serialised_service = SerialisedService.from_id(sample_service.id)
-    with set_config(notify_api, 'REDIS_ENABLED', False):
-        db_mock = mocker.patch('app.notifications.validators.services_dao')
 
+    with set_config(notify_api, 'REDIS_ENABLED', False):
         check_service_over_daily_message_limit('normal', serialised_service)
 
-        assert db_mock.method_calls == []
+    assert not mock_reserve.called
 
 
-@pytest.mark.parametrize('key_type', ['team', 'normal'])
-def test_check_service_message_limit_over_message_limit_fails(key_type, sample_service, mocker):
-    with freeze_time("2016-01-01 12:00:00.000000"):
-        mocker.patch('app.redis_store.get', return_value=None)
-        mocker.patch('app.notifications.validators.redis_store.set')
-
-        sample_service.restricted = True
-        sample_service.message_limit = 4
-        template = create_template(sample_service)
-        serialised_service = SerialisedService.from_id(sample_service.id)
+def test_check_service_message_limit_passes_if_counter_unavailable(sample_service, mocker):
+    mocker.patch('app.notifications.validators.reserve_daily_limit_for_request', return_value=(None, None))
+    serialised_service = SerialisedService.from_id(sample_service.id)
 
-        for _ in range(5):
-            create_notification(template)
-        with pytest.raises(TooManyRequestsError) as e:
-            check_service_over_daily_message_limit(key_type, serialised_service)
-        assert e.value.status_code == 429
-        assert e.value.message == 'Exceeded send limits (4) for today'
-        assert e.value.fields == []
-        app.notifications.validators.redis_store.set.assert_called_with(
-            str(sample_service.id) + "-2016-01-01-count", 5, ex=3600
-        )
+    check_service_over_daily_message_limit('normal', serialised_service)
 
 
 @pytest.mark.parametrize('key_type', ['team', 'normal'])
-def test_check_service_message_limit_in_cache_over_message_limit_fails(
-        notify_db_session,
-        key_type,
-        mocker):
-    with freeze_time("2016-01-01 12:00:00.000000"):
-        mocker.patch('app.redis_store.get', side_effect=[
-            None,  # The serialised service
-            5,  # The rolling count
-        ])
-        mocker.patch('app.notifications.validators.redis_store.set')
-        mocker.patch('app.notifications.validators.services_dao')
+def test_check_service_message_limit_over_message_limit_fails(key_type, notify_db_session, mocker):
+    mocker.patch('app.notifications.validators.reserve_daily_limit_for_request', return_value=(False, 4))
+    service = create_service(restricted=True, message_limit=4)
+    serialised_service = SerialisedService.from_id(service.id)
 
-        service = create_service(restricted=True, message_limit=4)
-        serialised_service = SerialisedService.from_id(service.id)
-        with pytest.raises(TooManyRequestsError) as e:
-            check_service_over_daily_message_limit(key_type, serialised_service)
-        assert e.value.status_code == 429
-        assert e.value.message == 'Exceeded send limits (4) for today'
-        assert e.value.fields == []
-        app.notifications.validators.redis_store.set.assert_called_once_with(
-            f'service-{serialised_service.id}',
-            ANY,
-            ex=ANY,
-        )
-        assert not app.notifications.validators.services_dao.mock_calls
+    with pytest.raises(TooManyRequestsError) as e:
+        check_service_over_daily_message_limit(key_type, serialised_service)
+    assert e.value.status_code == 429
+    assert e.value.message == 'Exceeded send limits (4) for today'
+    assert e.value.fields == []
 
 
 @pytest.mark.parametrize('template_type, notification_type',
@@ -253,10 +172,10 @@ def test_service_can_send_to_recipient_passes_for_live_service_non_team_member(k
 
 def test_service_can_send_to_recipient_passes_for_guest_list_recipient_passes(sample_service):
     create_service_guest_list(sample_service, email_address="some_other_email@test.com")
+    create_service_guest_list(sample_service, mobile_number='07513332413')
     assert service_can_send_to_recipient("some_other_email@test.com",
                                          'team',
                                          sample_service) is None
-    create_service_guest_list(sample_service, mobile_number='07513332413')
     assert service_can_send_to_recipient('07513332413',
                                          'team',
                                          sample_service) is None
@@ -536,6 +455,29 @@ def test_allows_api_calls_with_international_numbers_if_service_does_allow_int_s
     assert result == '201212341234'
 
 
+def test_validate_and_normalise_recipient_returns_everything_worked_out_from_a_phone_number(
+    sample_service_full_permissions
+):
+    service_model = SerialisedService.from_id(sample_service_full_permissions.id)
+
+    recipient = validate_and_normalise_recipient('+360623400400', 'normal', service_model, SMS_TYPE)
+
+    assert recipient.normalised_to == '360623400400'
+    assert recipient.international is True
+    assert recipient.crown_dependency is False
+    assert recipient.phone_prefix == '36'
+    assert recipient.rate_multiplier == 3
+
+
+def test_validate_and_normalise_recipient_formats_email_addresses(sample_service):
+    service_model = SerialisedService.from_id(sample_service.id)
+
+    recipient = validate_and_normalise_recipient(' Someone@Example.com', 'normal', service_model, EMAIL_TYPE)
+
+    assert recipient.normalised_to == 'someone@example.com'
+    assert recipient.international is False
+
+
 def test_rejects_api_calls_with_no_recipient():
     with pytest.raises(BadRequestError) as e:
         validate_and_format_recipient(None, 'key_type', 'service', 'SMS_TYPE')
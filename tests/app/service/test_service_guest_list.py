@@ -73,6 +73,19 @@ def test_update_guest_list_replaces_old_guest_list(client, sample_service_guest_
     assert guest_list[1].recipient == 'foo@bar.com'
 
 
+def test_update_guest_list_removes_allowed_recipients_from_cache(client, sample_service, mocker):
+    mock_remove_from_cache = mocker.patch('app.service.rest.SerialisedAllowedRecipients.remove_from_cache')
+
+    response = client.put(
+        f'service/{sample_service.id}/guest-list',
+        data=json.dumps({'email_addresses': ['foo@bar.com'], 'phone_numbers': []}),
+        headers=[('Content-Type', 'application/json'), create_authorization_header()]
+    )
+
+    assert response.status_code == 204
+    mock_remove_from_cache.assert_called_once_with(sample_service.id)
+
+
 def test_update_guest_list_doesnt_remove_old_guest_list_if_error(client, sample_service_guest_list):
 
     data = {
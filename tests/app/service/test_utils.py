@@ -1,6 +1,13 @@
-from app.dao.date_util import get_current_financial_year_start_year
+import pytest
 from freezegun import freeze_time
 
+from app import serialised_models
+from app.dao.date_util import get_current_financial_year_start_year
+from app.dao.services_dao import dao_add_user_to_service
+from app.serialised_models import SerialisedAllowedRecipients
+from app.service.utils import service_allowed_to_send_to
+from tests.app.db import create_service, create_service_guest_list, create_user
+
 
 # see get_financial_year for conversion of financial years.
 @freeze_time("2017-03-31 22:59:59.999999")
@@ -13,3 +20,53 @@ def test_get_current_financial_year_start_year_before_march():
 def test_get_current_financial_year_start_year_after_april():
     current_fy = get_current_financial_year_start_year()
     assert current_fy == 2017
+
+
+@pytest.mark.parametrize('recipient, key_type, allow_guest_list_recipients, expected', [
+    ('07700 900986', 'normal', True, True),
+    ('team.member@EXAMPLE.gov.uk', 'team', True, True),
+    ('guest@example.gov.uk', 'normal', True, True),
+    ('+44 7700 900111', 'team', True, True),
+    ('guest@example.gov.uk', 'team', False, False),
+    ('stranger@example.gov.uk', 'normal', True, False),
+    ('07700 900222', 'test', True, True),
+])
+def test_service_allowed_to_send_to_restricted_service(
+    notify_db_session, recipient, key_type, allow_guest_list_recipients, expected
+):
+    service = create_service(restricted=True, user=create_user(email='Team.Member@example.gov.uk'))
+    create_service_guest_list(service, email_address='Guest@example.gov.uk')
+    create_service_guest_list(service, mobile_number='07700900111')
+
+    assert service_allowed_to_send_to(recipient, service, key_type, allow_guest_list_recipients) is expected
+
+
+def test_service_allowed_to_send_to_only_fetches_the_service_once(notify_db_session, mocker):
+    mock_fetch_service = mocker.patch(
+        'app.serialised_models.dao_fetch_service_by_id', wraps=serialised_models.dao_fetch_service_by_id
+    )
+    service = create_service(restricted=True)
+
+    assert service_allowed_to_send_to('07700900986', service, 'normal') is True
+    assert service_allowed_to_send_to('07700900111', service, 'normal') is False
+
+    mock_fetch_service.assert_called_once_with(str(service.id))
+
+
+def test_service_allowed_to_send_to_new_team_members(notify_db_session, mocker):
+    mock_redis = mocker.patch('app.serialised_models.redis_store')
+    service = create_service(restricted=True)
+    assert service_allowed_to_send_to('new.member@example.gov.uk', service, 'normal') is False
+
+    dao_add_user_to_service(service, create_user(email='new.member@example.gov.uk'))
+
+    assert service_allowed_to_send_to('new.member@example.gov.uk', service, 'normal') is True
+    mock_redis.delete.assert_called_once_with('service-{}-allowed-recipients'.format(service.id))
+
+
+def test_remove_allowed_recipients_from_cache_does_nothing_without_services(mocker):
+    mock_redis = mocker.patch('app.serialised_models.redis_store')
+
+    SerialisedAllowedRecipients.remove_from_cache()
+
+    assert not mock_redis.delete.called
@@ -0,0 +1,139 @@
+import uuid
+from types import SimpleNamespace
+from unittest.mock import call
+
+import pytest
+from flask import g
+from freezegun import freeze_time
+
+from app.daily_limit import (
+    RELEASE_SCRIPT,
+    RESERVE_SCRIPT,
+    release_daily_limit,
+    release_daily_limit_for_failed_request,
+    reserve_daily_limit,
+    reserve_daily_limit_for_request,
+)
+from app.notification_counts import NotificationCount
+from tests.conftest import set_config
+
+SERVICE = SimpleNamespace(id=uuid.UUID('2f2b9e3a-4a3f-4a3f-8a3f-4a3f4a3f4a3f'), message_limit=10)
+# midnight BST at the end of 2020-06-01
+EXPIRE_AT = 1591052400
+
+
+@pytest.fixture
+def mock_redis(mocker):
+    return mocker.patch('app.daily_limit.redis_store.redis_store')
+
+
+@pytest.fixture
+def mock_script(mock_redis):
+    return mock_redis.register_script.return_value
+
+
+def test_reserve_daily_limit_does_nothing_if_redis_disabled(notify_api, mock_script):
+    with set_config(notify_api, 'REDIS_ENABLED', False):
+        assert reserve_daily_limit(SERVICE) == (None, None)
+
+    assert not mock_script.called
+
+
+@freeze_time('2020-06-01 23:30')
+@pytest.mark.parametrize('script_result, expected', [
+    ([1, 5], (True, 5)),
+    ([0, 10], (False, 10)),
+])
+def test_reserve_daily_limit_uses_counter_for_bst_day(
+    notify_api, mocker, mock_redis, mock_script, script_result, expected
+):
+    mock_script.return_value = script_result
+    mock_count = mocker.patch('app.daily_limit._count_messages_sent_today')
+
+    with set_config(notify_api, 'REDIS_ENABLED', True):
+        assert reserve_daily_limit(SERVICE, 3) == expected
+
+    mock_redis.register_script.assert_called_once_with(RESERVE_SCRIPT)
+    mock_script.assert_called_once_with(
+        keys=[f'daily-limit-{SERVICE.id}-2020-06-02'], args=[3, 10, EXPIRE_AT + 86400, '']
+    )
+    assert not mock_count.called
+
+
+@freeze_time('2020-06-01 12:00')
+def test_reserve_daily_limit_seeds_counter_from_notification_counts(notify_api, mocker, mock_script):
+    mock_script.side_effect = [[-1, 0], [1, 4]]
+    mocker.patch('app.daily_limit.get_todays_notification_counts_for_service', return_value=[
+        NotificationCount('sms', 'delivered', 'template', 'normal', 2),
+        NotificationCount('email', 'sending', 'template', 'team', 1),
+        NotificationCount('sms', 'delivered', 'template', 'test', 7),
+    ])
+    mock_db_count = mocker.patch('app.daily_limit.services_dao.fetch_todays_total_message_count')
+
+    with set_config(notify_api, 'REDIS_ENABLED', True):
+        assert reserve_daily_limit(SERVICE) == (True, 4)
+
+    key = f'daily-limit-{SERVICE.id}-2020-06-01'
+    assert mock_script.call_args_list == [
+        call(keys=[key], args=[1, 10, EXPIRE_AT, '']),
+        call(keys=[key], args=[1, 10, EXPIRE_AT, 3]),
+    ]
+    assert not mock_db_count.called
+
+
+@freeze_time('2020-06-01 12:00')
+def test_reserve_daily_limit_seeds_counter_from_database_if_notification_counts_unavailable(
+    notify_api, mocker, mock_script
+):
+    mock_script.side_effect = [[-1, 0], [0, 10]]
+    mocker.patch('app.daily_limit.get_todays_notification_counts_for_service', return_value=None)
+    mocker.patch('app.daily_limit.services_dao.fetch_todays_total_message_count', return_value=10)
+
+    with set_config(notify_api, 'REDIS_ENABLED', True):
+        assert reserve_daily_limit(SERVICE) == (False, 10)
+
+    assert mock_script.call_args[1]['args'][3] == 10
+
+
+def test_reserve_daily_limit_returns_none_if_redis_fails(notify_api, mocker, mock_script):
+    mock_script.side_effect = ConnectionError
+    mock_logger = mocker.patch('app.daily_limit.current_app.logger.exception')
+
+    with set_config(notify_api, 'REDIS_ENABLED', True):
+        assert reserve_daily_limit(SERVICE) == (None, None)
+
+    mock_logger.assert_called_once_with(f'Could not reserve daily limit for service {SERVICE.id}')
+
+
+@freeze_time('2020-06-01 12:00')
+def test_release_daily_limit(notify_api, mock_redis, mock_script):
+    with set_config(notify_api, 'REDIS_ENABLED', True):
+        release_daily_limit(SERVICE.id, 2)
+
+    mock_redis.register_script.assert_called_once_with(RELEASE_SCRIPT)
+    mock_script.assert_called_once_with(keys=[f'daily-limit-{SERVICE.id}-2020-06-01'], args=[2])
+
+
+@pytest.mark.parametrize('status_code, expected_releases', [
+    (201, []),
+    (400, [call(SERVICE.id, 1)]),
+    (429, [call(SERVICE.id, 1)]),
+])
+def test_reservations_are_released_if_request_fails(notify_api, mocker, status_code, expected_releases):
+    mocker.patch('app.daily_limit.reserve_daily_limit', return_value=(True, 1))
+    mock_release = mocker.patch('app.daily_limit.release_daily_limit')
+
+    with notify_api.test_request_context():
+        reserve_daily_limit_for_request(SERVICE)
+        release_daily_limit_for_failed_request(SimpleNamespace(status_code=status_code))
+
+        assert mock_release.call_args_list == expected_releases
+        assert g.daily_limit_reservations == []
+
+
+def test_reservations_are_not_recorded_if_not_reserved(notify_api, mocker):
+    mocker.patch('app.daily_limit.reserve_daily_limit', return_value=(False, 10))
+
+    with notify_api.test_request_context():
+        assert reserve_daily_limit_for_request(SERVICE) == (False, 10)
+        assert g.get('daily_limit_reservations') is None
@@ -172,6 +172,32 @@ def test_notification_personalisation_setter_always_sets_empty_dict(input_value)
     assert noti._personalisation == encryption.encrypt({})
 
 
+def test_notification_personalisation_is_only_decrypted_once(sample_service, mocker):
+    template = create_template(
+        service=sample_service, template_type=EMAIL_TYPE, subject='((name))', content='Dear ((name))'
+    )
+    notification = create_notification(template=template, personalisation={'name': 'Jo'})
+    mock_decrypt = mocker.patch('app.models.encryption.decrypt', wraps=encryption.decrypt)
+
+    notification.serialize()
+    assert notification.personalisation == {'name': 'Jo'}
+    assert mock_decrypt.call_count == 1
+
+    notification.personalisation = {'name': 'Sam'}
+    assert notification.subject == 'Sam'
+    assert notification.content == 'Dear Sam'
+    assert mock_decrypt.call_count == 2
+
+
+def test_notification_personalisation_follows_changes_to_encrypted_value():
+    noti = Notification()
+    noti._personalisation = encryption.encrypt({'name': 'Jo'})
+    assert noti.personalisation == {'name': 'Jo'}
+
+    noti._personalisation = encryption.encrypt({'name': 'Sam'})
+    assert noti.personalisation == {'name': 'Sam'}
+
+
 def test_notification_subject_is_none_for_sms(sample_service):
     template = create_template(service=sample_service, template_type=SMS_TYPE)
     notification = create_notification(template=template)
@@ -0,0 +1,153 @@
+import uuid
+from datetime import date, datetime
+from types import SimpleNamespace
+from unittest.mock import call
+
+from freezegun import freeze_time
+
+from app.notification_counts import (
+    NotificationCount,
+    NotificationTotal,
+    get_todays_notification_counts_for_services,
+    get_todays_notification_totals,
+    increment_notification_counts,
+    record_notification_status_changes,
+    set_notification_counts_for_day,
+)
+from tests.conftest import set_config
+
+SERVICE_ID = uuid.UUID('2f2b9e3a-4a3f-4a3f-8a3f-4a3f4a3f4a3f')
+TEMPLATE_ID = uuid.UUID('7c1f3e2a-1b2c-4d3e-8f4a-5b6c7d8e9f0a')
+
+
+def _notification(status='created', created_at=datetime(2020, 6, 1, 23, 30)):
+    return SimpleNamespace(
+        service_id=SERVICE_ID,
+        template_id=TEMPLATE_ID,
+        notification_type='sms',
+        key_type='normal',
+        status=status,
+        created_at=created_at,
+    )
+
+
+def test_increment_notification_counts_does_nothing_if_redis_disabled(notify_api, mocker):
+    mock_redis = mocker.patch('app.notification_counts.redis_store.redis_store')
+
+    with set_config(notify_api, 'REDIS_ENABLED', False):
+        increment_notification_counts([_notification()])
+
+    mock_redis.pipeline.assert_not_called()
+
+
+def test_increment_notification_counts_uses_bst_date(notify_api, mocker):
+    mock_redis = mocker.patch('app.notification_counts.redis_store.redis_store')
+    pipe = mock_redis.pipeline.return_value
+
+    with set_config(notify_api, 'REDIS_ENABLED', True):
+        increment_notification_counts([_notification()])
+
+    assert pipe.hincrby.call_args_list == [
+        call(f'notification-counts-{SERVICE_ID}-2020-06-02', f'sms:created:{TEMPLATE_ID}:normal', 1),
+        call('notification-counts-all-2020-06-02', 'sms:created:normal', 1),
+    ]
+    pipe.execute.assert_called_once_with()
+
+
+def test_record_notification_status_changes_moves_counts_between_statuses(notify_api, mocker):
+    mock_redis = mocker.patch('app.notification_counts.redis_store.redis_store')
+    pipe = mock_redis.pipeline.return_value
+
+    with set_config(notify_api, 'REDIS_ENABLED', True):
+        record_notification_status_changes([
+            (_notification(status='delivered'), 'sending'),
+            (_notification(status='sending'), 'sending'),
+        ])
+
+    assert pipe.hincrby.call_args_list == [
+        call(f'notification-counts-{SERVICE_ID}-2020-06-02', f'sms:sending:{TEMPLATE_ID}:normal', -1),
+        call('notification-counts-all-2020-06-02', 'sms:sending:normal', -1),
+        call(f'notification-counts-{SERVICE_ID}-2020-06-02', f'sms:delivered:{TEMPLATE_ID}:normal', 1),
+        call('notification-counts-all-2020-06-02', 'sms:delivered:normal', 1),
+    ]
+
+
+def test_record_notification_status_changes_does_not_raise_if_redis_fails(notify_api, mocker):
+    mock_redis = mocker.patch('app.notification_counts.redis_store.redis_store')
+    mock_redis.pipeline.return_value.execute.side_effect = ConnectionError
+    mock_logger = mocker.patch('app.notification_counts.current_app.logger.exception')
+
+    with set_config(notify_api, 'REDIS_ENABLED', True):
+        record_notification_status_changes([(_notification(status='delivered'), 'sending')])
+
+    mock_logger.assert_called_once_with('Could not update notification counts in redis')
+
+
+@freeze_time('2020-06-01 12:00')
+def test_get_todays_notification_counts_returns_none_until_counts_are_reconciled(notify_api, mocker):
+    mock_redis = mocker.patch('app.notification_counts.redis_store.redis_store')
+    mock_redis.exists.return_value = 0
+
+    with set_config(notify_api, 'REDIS_ENABLED', True):
+        assert get_todays_notification_counts_for_services([SERVICE_ID]) is None
+        assert get_todays_notification_totals() is None
+
+    mock_redis.exists.assert_called_with('notification-counts-synced-2020-06-01')
+
+
+@freeze_time('2020-06-01 12:00')
+def test_get_todays_notification_counts_for_services(notify_api, mocker):
+    other_service_id = uuid.uuid4()
+    mock_redis = mocker.patch('app.notification_counts.redis_store.redis_store')
+    mock_redis.exists.return_value = 1
+    mock_redis.pipeline.return_value.execute.return_value = [
+        {f'sms:delivered:{TEMPLATE_ID}:normal'.encode(): b'3', f'sms:sending:{TEMPLATE_ID}:test'.encode(): b'0'},
+        {},
+    ]
+
+    with set_config(notify_api, 'REDIS_ENABLED', True):
+        counts = get_todays_notification_counts_for_services([SERVICE_ID, other_service_id])
+
+    assert counts == {
+        SERVICE_ID: [NotificationCount('sms', 'delivered', str(TEMPLATE_ID), 'normal', 3)],
+        other_service_id: [],
+    }
+
+
+@freeze_time('2020-06-01 12:00')
+def test_get_todays_notification_totals(notify_api, mocker):
+    mock_redis = mocker.patch('app.notification_counts.redis_store.redis_store')
+    mock_redis.exists.return_value = 1
+    mock_redis.hgetall.return_value = {b'email:delivered:team': b'2'}
+
+    with set_config(notify_api, 'REDIS_ENABLED', True):
+        assert get_todays_notification_totals() == [NotificationTotal('email', 'delivered', 'team', 2)]
+
+    mock_redis.hgetall.assert_called_once_with('notification-counts-all-2020-06-01')
+
+
+def test_set_notification_counts_for_day_replaces_counts(mocker):
+    mock_redis = mocker.patch('app.notification_counts.redis_store.redis_store')
+    mock_redis.scan_iter.return_value = ['notification-counts-old-service-2020-06-01']
+    pipe = mock_redis.pipeline.return_value
+    rows = [
+        SimpleNamespace(service_id=SERVICE_ID, notification_type='sms', status='delivered', template_id=TEMPLATE_ID,
+                        key_type='normal', count=2),
+        SimpleNamespace(service_id=SERVICE_ID, notification_type='sms', status='delivered', template_id=TEMPLATE_ID,
+                        key_type='team', count=1),
+    ]
+
+    set_notification_counts_for_day(date(2020, 6, 1), rows)
+
+    mock_redis.pipeline.assert_called_once_with(transaction=True)
+    pipe.delete.assert_any_call('notification-counts-old-service-2020-06-01')
+    pipe.hset.assert_any_call(f'notification-counts-{SERVICE_ID}-2020-06-01', mapping={
+        f'sms:delivered:{TEMPLATE_ID}:normal': 2,
+        f'sms:delivered:{TEMPLATE_ID}:team': 1,
+    })
+    pipe.hset.assert_any_call('notification-counts-all-2020-06-01', mapping={
+        'sms:delivered:normal': 2,
+        'sms:delivered:team': 1,
+    })
+    pipe.set.assert_called_once_with('notification-counts-synced-2020-06-01', 1, ex=172800)
+    pipe.execute.assert_called_once_with()
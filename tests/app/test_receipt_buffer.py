@@ -0,0 +1,89 @@
+from unittest.mock import call
+
+import pytest
+
+from app import receipt_buffer
+from app.receipt_buffer import RETURN_BATCHES_SCRIPT, TAKE_BATCH_SCRIPT
+
+
+@pytest.fixture
+def mock_redis(mocker):
+    mock_redis = mocker.patch('app.receipt_buffer.redis_store.redis_store')
+    mock_redis.zrangebyscore.return_value = []
+    return mock_redis
+
+
+@pytest.fixture
+def scripts(mock_redis, mocker):
+    scripts = {
+        TAKE_BATCH_SCRIPT: mocker.Mock(return_value=[]),
+        RETURN_BATCHES_SCRIPT: mocker.Mock(return_value=0),
+    }
+    mock_redis.register_script.side_effect = scripts.get
+    return scripts
+
+
+@pytest.fixture(autouse=True)
+def batch_ids(mocker):
+    mocker.patch('app.receipt_buffer.time', return_value=1000.0)
+    mocker.patch('app.receipt_buffer.uuid.uuid4', side_effect=['first', 'second', 'third'])
+
+
+def test_push_adds_to_end_of_buffer(mock_redis):
+    receipt_buffer.push('receipts', 'receipt')
+
+    mock_redis.rpush.assert_called_once_with('receipts', 'receipt')
+
+
+def test_drain_applies_batches_until_buffer_is_empty(mock_redis, scripts, mocker):
+    scripts[TAKE_BATCH_SCRIPT].side_effect = [['a', 'b'], ['c']]
+    apply_batch = mocker.Mock()
+
+    receipt_buffer.drain('receipts', 2, 10, apply_batch)
+
+    assert apply_batch.call_args_list == [call(['a', 'b']), call(['c'])]
+    assert scripts[TAKE_BATCH_SCRIPT].call_args_list == [
+        call(keys=['receipts', 'receipts-processing', 'receipts-batch-first'], args=[2, 1000.0]),
+        call(keys=['receipts', 'receipts-processing', 'receipts-batch-second'], args=[2, 1000.0]),
+    ]
+    pipe = mock_redis.pipeline.return_value
+    assert pipe.delete.call_args_list == [call('receipts-batch-first'), call('receipts-batch-second')]
+    assert pipe.zrem.call_args_list == [
+        call('receipts-processing', 'receipts-batch-first'),
+        call('receipts-processing', 'receipts-batch-second'),
+    ]
+    assert not scripts[RETURN_BATCHES_SCRIPT].called
+
+
+def test_drain_stops_once_time_budget_is_used_up(mock_redis, scripts, mocker):
+    mocker.patch('app.receipt_buffer.monotonic', side_effect=[0, 1, 11])
+    scripts[TAKE_BATCH_SCRIPT].return_value = ['a', 'b']
+    apply_batch = mocker.Mock()
+
+    receipt_buffer.drain('receipts', 2, 10, apply_batch)
+
+    assert apply_batch.call_count == 1
+
+
+def test_drain_puts_batch_back_if_it_cannot_be_applied(mock_redis, scripts, mocker):
+    scripts[TAKE_BATCH_SCRIPT].return_value = ['a', 'b']
+    apply_batch = mocker.Mock(side_effect=ValueError)
+
+    with pytest.raises(ValueError):
+        receipt_buffer.drain('receipts', 2, 10, apply_batch)
+
+    scripts[RETURN_BATCHES_SCRIPT].assert_called_once_with(
+        keys=['receipts', 'receipts-processing'], args=['receipts-batch-first']
+    )
+    assert not mock_redis.pipeline.called
+
+
+def test_drain_first_puts_back_batches_left_by_workers_that_died(mock_redis, scripts, mocker):
+    mock_redis.zrangebyscore.return_value = [b'receipts-batch-old']
+
+    receipt_buffer.drain('receipts', 2, 10, mocker.Mock())
+
+    mock_redis.zrangebyscore.assert_called_once_with('receipts-processing', '-inf', 700.0)
+    scripts[RETURN_BATCHES_SCRIPT].assert_called_once_with(
+        keys=['receipts', 'receipts-processing'], args=[b'receipts-batch-old']
+    )
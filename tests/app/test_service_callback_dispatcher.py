@@ -0,0 +1,132 @@
+import pytest
+import requests_mock
+from requests import ConnectTimeout, HTTPError
+
+from app.service_callback_dispatcher import (
+    ACQUIRE_SCRIPT,
+    FAILURE_SCRIPT,
+    CircuitOpen,
+    ServiceCallbackDispatcher,
+    TooManyInFlight,
+)
+from tests.conftest import set_config
+
+URL = 'https://callbacks.example.gov.uk/status'
+SERVICE_ID = 'a5ec3d79-1d6c-4bb6-8e0b-cdcfb3f9e6c4'
+
+
+@pytest.fixture
+def mock_redis(mocker):
+    return mocker.patch('app.service_callback_dispatcher.redis_store.redis_store')
+
+
+@pytest.fixture
+def scripts(mock_redis, mocker):
+    scripts = {
+        ACQUIRE_SCRIPT: mocker.Mock(return_value=[1, 1]),
+        FAILURE_SCRIPT: mocker.Mock(return_value=0),
+    }
+    mock_redis.register_script.side_effect = scripts.get
+    return scripts
+
+
+@pytest.fixture(autouse=True)
+def slot(mocker):
+    mocker.patch('app.service_callback_dispatcher.time', return_value=1000.0)
+    mocker.patch('app.service_callback_dispatcher.uuid.uuid4', return_value='slot-id')
+    return 'slot-id'
+
+
+@pytest.fixture
+def mock_statsd(mocker):
+    return mocker.patch('app.service_callback_dispatcher.statsd_client')
+
+
+def test_send_posts_json_and_gives_slot_back(notify_api, mock_redis, scripts, mock_statsd):
+    with set_config(notify_api, 'REDIS_ENABLED', True), requests_mock.Mocker() as request_mock:
+        request_mock.post(URL, status_code=200)
+        ServiceCallbackDispatcher().send(SERVICE_ID, URL, 'token', {'id': '1'})
+
+    assert request_mock.request_history[0].text == '{"id": "1"}'
+    assert request_mock.request_history[0].headers['Authorization'] == 'Bearer token'
+    scripts[ACQUIRE_SCRIPT].assert_called_once_with(
+        keys=[f'service-callback-circuit-open-{SERVICE_ID}', f'service-callback-in-flight-{SERVICE_ID}'],
+        args=[10, 1000.0, 67, 'slot-id'],
+    )
+    mock_redis.zrem.assert_called_once_with(f'service-callback-in-flight-{SERVICE_ID}', 'slot-id')
+    mock_redis.delete.assert_called_once_with(f'service-callback-failures-{SERVICE_ID}')
+    mock_statsd.incr.assert_called_once_with('service-callback.callbacks_example_gov_uk.success')
+    assert mock_statsd.timing.call_args[0][0] == 'service-callback.callbacks_example_gov_uk.request-time'
+
+
+def test_send_sends_without_redis_if_it_is_disabled(notify_api, mock_redis, mock_statsd):
+    with set_config(notify_api, 'REDIS_ENABLED', False), requests_mock.Mocker() as request_mock:
+        request_mock.post(URL, status_code=200)
+        ServiceCallbackDispatcher().send(SERVICE_ID, URL, 'token', {'id': '1'})
+
+    assert request_mock.call_count == 1
+    assert not mock_redis.register_script.called
+    assert not mock_redis.delete.called
+
+
+def test_send_does_not_post_if_circuit_is_open(notify_api, mock_redis, scripts, mock_statsd):
+    scripts[ACQUIRE_SCRIPT].return_value = [0, 42]
+
+    with set_config(notify_api, 'REDIS_ENABLED', True), requests_mock.Mocker() as request_mock:
+        with pytest.raises(CircuitOpen) as e:
+            ServiceCallbackDispatcher().send(SERVICE_ID, URL, 'token', {'id': '1'})
+
+    assert e.value.countdown == 42
+    assert request_mock.call_count == 0
+    assert not mock_redis.zrem.called
+    mock_statsd.incr.assert_called_once_with('service-callback.callbacks_example_gov_uk.circuit-open')
+
+
+def test_send_does_not_post_if_service_has_too_many_callbacks_in_flight(notify_api, mock_redis, scripts, mock_statsd):
+    scripts[ACQUIRE_SCRIPT].return_value = [-1, 10]
+
+    with set_config(notify_api, 'REDIS_ENABLED', True), requests_mock.Mocker() as request_mock:
+        with pytest.raises(TooManyInFlight) as e:
+            ServiceCallbackDispatcher().send(SERVICE_ID, URL, 'token', {'id': '1'})
+
+    assert e.value.countdown == 5
+    assert request_mock.call_count == 0
+    assert not mock_redis.zrem.called
+
+
+@pytest.mark.parametrize('response_kwargs, expected_exception', [
+    ({'status_code': 500}, HTTPError),
+    ({'exc': ConnectTimeout}, ConnectTimeout),
+])
+def test_send_records_failures(notify_api, mock_redis, scripts, mock_statsd, response_kwargs, expected_exception):
+    with set_config(notify_api, 'REDIS_ENABLED', True), requests_mock.Mocker() as request_mock:
+        request_mock.post(URL, **response_kwargs)
+        with pytest.raises(expected_exception):
+            ServiceCallbackDispatcher().send(SERVICE_ID, URL, 'token', {'id': '1'})
+
+    scripts[FAILURE_SCRIPT].assert_called_once_with(
+        keys=[f'service-callback-failures-{SERVICE_ID}', f'service-callback-circuit-open-{SERVICE_ID}'],
+        args=[10, 60, 60],
+    )
+    mock_redis.zrem.assert_called_once_with(f'service-callback-in-flight-{SERVICE_ID}', 'slot-id')
+    mock_statsd.incr.assert_called_once_with('service-callback.callbacks_example_gov_uk.failure')
+
+
+def test_send_does_not_count_client_errors_towards_circuit(notify_api, mock_redis, scripts, mock_statsd):
+    with set_config(notify_api, 'REDIS_ENABLED', True), requests_mock.Mocker() as request_mock:
+        request_mock.post(URL, status_code=404)
+        with pytest.raises(HTTPError):
+            ServiceCallbackDispatcher().send(SERVICE_ID, URL, 'token', {'id': '1'})
+
+    assert not scripts[FAILURE_SCRIPT].called
+    assert not mock_redis.delete.called
+
+
+def test_send_still_posts_if_redis_is_unavailable(notify_api, mock_redis, mock_statsd):
+    mock_redis.register_script.side_effect = ConnectionError
+
+    with set_config(notify_api, 'REDIS_ENABLED', True), requests_mock.Mocker() as request_mock:
+        request_mock.post(URL, status_code=200)
+        ServiceCallbackDispatcher().send(SERVICE_ID, URL, 'token', {'id': '1'})
+
+    assert request_mock.call_count == 1
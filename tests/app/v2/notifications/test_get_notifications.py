@@ -4,6 +4,7 @@ from flask import json, url_for
 
 from app.utils import DATETIME_FORMAT
 from tests import create_authorization_header
+from tests.conftest import set_config
 from tests.app.db import (
     create_notification,
     create_template,
@@ -542,6 +543,59 @@ def test_get_all_notifications_filter_by_id_no_notifications_if_last_notificatio
     assert len(json_response['notifications']) == 0
 
 
+def test_get_all_notifications_next_link_pages_with_cursor(client, notify_api, sample_template):
+    created_at = datetime.datetime(2021, 2, 1, 12, 0)
+    notifications = [create_notification(template=sample_template, created_at=created_at) for _ in range(3)]
+    expected_ids = [str(notification.id) for notification in sorted(notifications, key=lambda n: n.id, reverse=True)]
+
+    auth_header = create_authorization_header(service_id=sample_template.service_id)
+    returned_ids = []
+    next_links = []
+    path = '/v2/notifications?template_type=sms'
+    with set_config(notify_api, 'API_PAGE_SIZE', 2):
+        while path:
+            response = client.get(path=path, headers=[('Content-Type', 'application/json'), auth_header])
+            assert response.status_code == 200
+            json_response = json.loads(response.get_data(as_text=True))
+            returned_ids += [notification['id'] for notification in json_response['notifications']]
+            next_link = json_response['links'].get('next')
+            next_links.append(next_link)
+            path = next_link[next_link.index('/v2/'):] if next_link else None
+
+    assert returned_ids == expected_ids
+    # the last page has a next link because it isn't empty, and the page after it is
+    assert len(next_links) == 3
+    assert all('template_type=sms' in link and 'cursor=' in link for link in next_links[:2])
+    assert next_links[2] is None
+
+
+def test_get_all_notifications_next_link_uses_cursor_instead_of_older_than(client, sample_template):
+    older_notification = create_notification(template=sample_template)
+    newer_notification = create_notification(template=sample_template)
+
+    auth_header = create_authorization_header(service_id=sample_template.service_id)
+    response = client.get(
+        path='/v2/notifications?older_than={}'.format(newer_notification.id),
+        headers=[('Content-Type', 'application/json'), auth_header])
+
+    json_response = json.loads(response.get_data(as_text=True))
+    assert [n['id'] for n in json_response['notifications']] == [str(older_notification.id)]
+    assert 'older_than' not in json_response['links']['next']
+    assert 'cursor=' in json_response['links']['next']
+
+
+def test_get_all_notifications_with_invalid_cursor(client, sample_notification):
+    auth_header = create_authorization_header(service_id=sample_notification.service_id)
+    response = client.get(
+        path='/v2/notifications?cursor=not-a-cursor',
+        headers=[('Content-Type', 'application/json'), auth_header])
+
+    json_response = json.loads(response.get_data(as_text=True))
+
+    assert response.status_code == 400
+    assert json_response['errors'][0]['message'] == "cursor is not valid"
+
+
 def test_get_all_notifications_filter_multiple_query_parameters(client, sample_email_template):
     # this is the notification we are looking for
     older_notification = create_notification(